@@ -0,0 +1,131 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import ROOT
+from .HeaderCache import declareHeaders
+
+# Registers the layouts used by ::correction::CachedCorrection (cachedCorrection.h).
+# A correction gets a layout only if it consists exclusively of binnings with explicit edges,
+# categories and constant values. Corrections with formulas, transforms, hashprng or uniform
+# binnings are neither cached nor flattened, because their value is not constant within a cell.
+
+class CorrectionCache:
+    enabled = False
+    flatten = False
+    shared_dir = None
+    initialized = False
+
+    @staticmethod
+    def initialize():
+        if not CorrectionCache.initialized:
+            headers_dir = os.path.dirname(os.path.abspath(__file__))
+            declareHeaders(os.path.join(headers_dir, "cachedCorrection.h"))
+            CorrectionCache.initialized = True
+
+    @staticmethod
+    def enable(enabled=True, max_entries=None):
+        CorrectionCache.initialize()
+        ROOT.correction.CachedCorrection.setCacheEnabled(enabled)
+        if enabled and max_entries is not None:
+            ROOT.correction.CachedCorrection.setMaxEntries(max_entries)
+        CorrectionCache.enabled = enabled
+
+    @staticmethod
+    def enableFlatten(enabled=True, max_cells=None, shared_dir=None):
+        CorrectionCache.initialize()
+        if max_cells is None:
+            max_cells = ROOT.correction.CachedCorrection.maxCells()
+        ROOT.correction.CachedCorrection.setFlatten(enabled, max_cells)
+        CorrectionCache.flatten = enabled
+        CorrectionCache.shared_dir = None
+        if enabled and shared_dir is not None:
+            CorrectionCache.shared_dir = os.path.abspath(shared_dir)
+            os.makedirs(CorrectionCache.shared_dir, exist_ok=True)
+
+# Flattened tables are shared between the processes of a node through files in shared_dir (e.g. /dev/shm).
+# The file name contains a hash of the path, modification time and size of the JSON file and of the correction name,
+# so tables built from a modified payload are never reused.
+def getSharedTablePath(json_file, correction_name):
+    if CorrectionCache.shared_dir is None:
+        return ''
+    json_file = os.path.realpath(json_file)
+    stat = os.stat(json_file)
+    h = hashlib.sha256(f'{json_file}:{stat.st_mtime_ns}:{stat.st_size}:{correction_name}'.encode())
+    safe_name = re.sub(r'[^\w.-]', '_', correction_name)
+    return os.path.join(CorrectionCache.shared_dir, f'{safe_name}_{h.hexdigest()[:16]}.tbl')
+
+def loadCorrectionSet(json_file):
+    opener = gzip.open if json_file.endswith('.gz') else open
+    with opener(json_file, 'rt') as f:
+        return json.load(f)
+
+class _NotCacheable(Exception):
+    pass
+
+def _collectInputs(node, edges, categories):
+    if not isinstance(node, dict):
+        return
+    node_type = node.get('nodetype')
+    if node_type == 'binning':
+        if not isinstance(node['edges'], list):
+            raise _NotCacheable()
+        edges.setdefault(node['input'], set()).update(node['edges'])
+        for content in node['content']:
+            _collectInputs(content, edges, categories)
+        _collectInputs(node['flow'], edges, categories)
+    elif node_type == 'multibinning':
+        for var_name, var_edges in zip(node['inputs'], node['edges']):
+            if not isinstance(var_edges, list):
+                raise _NotCacheable()
+            edges.setdefault(var_name, set()).update(var_edges)
+        for content in node['content']:
+            _collectInputs(content, edges, categories)
+        _collectInputs(node['flow'], edges, categories)
+    elif node_type == 'category':
+        keys = categories.setdefault(node['input'], set())
+        for item in node['content']:
+            keys.add(item['key'])
+            _collectInputs(item['value'], edges, categories)
+        _collectInputs(node.get('default'), edges, categories)
+    else:
+        raise _NotCacheable()
+
+def getCorrectionLayout(correction):
+    edges = {}
+    categories = {}
+    try:
+        _collectInputs(correction['data'], edges, categories)
+    except _NotCacheable:
+        return None
+    layout = ROOT.correction.CorrectionLayout()
+    for var in correction['inputs']:
+        name = var['name']
+        if name in edges and name in categories:
+            return None
+        if name in edges:
+            layout.addBinned(ROOT.std.vector['double'](sorted(float(edge) for edge in edges[name])))
+        elif name in categories:
+            string_keys = [ key for key in categories[name] if isinstance(key, str) ]
+            int_keys = [ key for key in categories[name] if isinstance(key, int) ]
+            layout.addCategory(ROOT.std.vector['std::string'](sorted(string_keys)), ROOT.std.vector['int'](sorted(int_keys)))
+        else:
+            layout.addUnused()
+    return layout
+
+def registerCorrectionLayouts(json_file, names=None):
+    if not (CorrectionCache.enabled or CorrectionCache.flatten):
+        return []
+    registered = []
+    for correction in loadCorrectionSet(json_file)['corrections']:
+        if names is not None and correction['name'] not in names:
+            continue
+        if len(correction['inputs']) > ROOT.correction.CorrectionLayout.MaxInputs:
+            continue
+        layout = getCorrectionLayout(correction)
+        if layout is not None:
+            table_path = getSharedTablePath(json_file, correction['name']) if CorrectionCache.flatten else ''
+            ROOT.correction.CachedCorrection.registerLayout(correction['name'], layout, table_path)
+            registered.append(correction['name'])
+    return registered
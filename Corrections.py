@@ -1,8 +1,8 @@
 import os
-import yaml
 import itertools
 
 from .CorrectionsCore import *
+from .CrossSections import CrossSectionTable, NormalisationService
 from RunKit.run_tools import ps_call
 
 period_names = {
@@ -12,18 +12,6 @@ period_names = {
     'Run2_2018': '2018_UL',
 }
 
-def findRefSample(config, sample_type):
-    refSample = []
-    for sample, sampleDef in config.items():
-        #if sampleDef.get('sampleType', None) == sample_type:
-        #    print(sample, sampleDef)
-        if sampleDef.get('sampleType', None) == sample_type and sampleDef.get('isReference', False):
-            refSample.append(sample)
-    if len(refSample) != 1:
-        print(refSample)
-        raise RuntimeError(f'multiple refSamples for {sample_type}: {refSample}')
-    return refSample[0]
-
 def getBranches(syst_name, all_branches):
     final_branches = []
     for branches in all_branches:
@@ -67,6 +55,25 @@ class Corrections:
         self.period = config['era']
         self.to_apply = config.get('corrections', [])
         self.config = config
+        self.xs_binary_cache = config.get('crossSectionsCache', False)
+        self.lazy_systematics = config.get('lazySystematics', False)
+        self.normalisation_services = {}
+        if config.get('precompiledDefines', False):
+            PrecompiledDefines.enable()
+        header_cache = config.get('headerCache', None)
+        if header_cache is not None:
+            HeaderCache.configure(header_cache['dir'], header_cache.get('prelude', []), header_cache.get('build', True))
+        correction_cache = config.get('correctionCache', None)
+        if correction_cache:
+            max_entries = correction_cache.get('maxEntries', None) if isinstance(correction_cache, dict) else None
+            CorrectionCache.enable(True, max_entries)
+        flatten_corrections = config.get('flattenCorrections', None)
+        if flatten_corrections:
+            max_cells, shared_dir = None, None
+            if isinstance(flatten_corrections, dict):
+                max_cells = flatten_corrections.get('maxCells', None)
+                shared_dir = flatten_corrections.get('sharedDir', None)
+            CorrectionCache.enableFlatten(True, max_cells, shared_dir)
 
         self.tau_ = None
         self.met_ = None
@@ -97,7 +104,7 @@ class Corrections:
     def jet(self):
         if self.jet_ is None:
             from .jet import JetCorrProducer
-            self.jet_ = JetCorrProducer(period_names[self.period], self.isData)
+            self.jet_ = JetCorrProducer(period_names[self.period], self.isData, self.config.get('jetSmearingRNG', 'mt19937'))
         return self.jet_
 
     @property
@@ -150,12 +157,21 @@ class Corrections:
         return self.trg_
 
     def applyScaleUncertainties(self, df, ana_reco_objects):
+        # With lazySystematics, the returned dataframe is a LazyDataFrame: the shifted p4 columns are defined
+        # only if they, or columns that depend on them, are read by the downstream actions.
+        if self.lazy_systematics and not isinstance(df, LazyDataFrame):
+            df = LazyDataFrame(df)
         source_dict = { central : [] }
         if 'tauES' in self.to_apply:
             df, source_dict = self.tau.getES(df, source_dict)
         if 'JEC_JER' in self.to_apply:
-            df, source_dict = self.jet.getP4Variations(df, source_dict)
-            df, source_dict = self.fatjet.getP4Variations(df, source_dict)
+            # optional preselection of the (fat) jets for which the JME variations are evaluated, e.g.
+            # { 'event': 'nJet >= 2', 'Jet': 'Jet_pt > 20', 'FatJet': 'FatJet_pt > 200' }
+            jet_preselection = self.config.get('jetPreselection', {})
+            event_mask = jet_preselection.get('event', None)
+            df, source_dict = self.jet.getP4Variations(df, source_dict, event_mask, jet_preselection.get('Jet', None))
+            df, source_dict = self.fatjet.getP4Variations(df, source_dict, event_mask,
+                                                          jet_preselection.get('FatJet', None))
         if 'tauES' in self.to_apply or 'JEC_JER' in self.to_apply:
             df, source_dict = self.met.getPFMET(df, source_dict)
         syst_dict = { }
@@ -171,36 +187,48 @@ class Corrections:
                         df = df.Define(f'{obj}_p4_{syst_name}', f'{obj}_p4_{suffix}')
         return df, syst_dict
 
+    def getNormalisationService(self, global_params, samples):
+        xsFile = global_params['crossSectionsFile']
+        xsFilePath = os.path.join(os.environ['ANALYSIS_PATH'], xsFile)
+        xs_table = CrossSectionTable.load(xsFilePath, self.xs_binary_cache)
+        use_stitching = global_params.get('use_stitching', True)
+        key = (xs_table.path, id(samples), use_stitching)
+        service = self.normalisation_services.get(key)
+        if service is None or service.samples is not samples or service.xs_table is not xs_table:
+            service = NormalisationService(xs_table, samples, use_stitching)
+            self.normalisation_services[key] = service
+        return service
+
     def getNormalisationCorrections(self, df, global_params, samples, sample, lepton_legs, ana_cache=None,
                                     return_variations=True, isCentral=True):
         lumi = global_params['luminosity']
-        sampleType = samples[sample]['sampleType']
-        xsFile = global_params['crossSectionsFile']
-        xsFilePath = os.path.join(os.environ['ANALYSIS_PATH'], xsFile)
-        with open(xsFilePath, 'r') as xs_file:
-            xs_dict = yaml.safe_load(xs_file)
-        xs_stitching = 1.
-        xs_stitching_incl = 1.
-        xs_inclusive = 1.
+        normalisation = self.getNormalisationService(global_params, samples).getSampleNormalisation(sample)
+        sampleType = normalisation.sample_type
+        xs_stitching = normalisation.xs_stitching
+        xs_stitching_incl = normalisation.xs_stitching_incl
+        xs_inclusive = normalisation.xs_inclusive
         stitch_str = '1.f'
+        stitch_columns = []
 
-        if sampleType in [ 'DY', 'W' ] and global_params.get('use_stitching', True):
-            xs_stitching_name = samples[sample]['crossSectionStitch']
-            inclusive_sample_name = findRefSample(samples, sampleType)
-            xs_name = samples[inclusive_sample_name]['crossSection']
-            xs_stitching = xs_dict[xs_stitching_name]['crossSec']
-            xs_stitching_incl = xs_dict[samples[inclusive_sample_name]['crossSectionStitch']]['crossSec']
+        if normalisation.stitching:
             if sampleType == 'DY':
                 stitch_str = 'if(LHE_Vpt==0.) return 1/2.f; return 1/3.f;'
+                stitch_columns = [ 'LHE_Vpt' ]
             elif sampleType == 'W':
                 stitch_str= "if(LHE_Njets==0) return 1.f; if(LHE_HT < 70) return 1/2.f; return 1/3.f;"
+                stitch_columns = [ 'LHE_Njets', 'LHE_HT' ]
+        if PrecompiledDefines.enabled:
+            if len(stitch_columns) > 0:
+                functor_class = getattr(ROOT.correction, f'{sampleType}StitchingWeight')
+                functor = functor_class[tuple(df.GetColumnType(c) for c in stitch_columns)]()
+            else:
+                functor = ROOT.correction.ConstantWeight(1.)
+            df = defineColumn(df, "stitching_weight", functor, stitch_columns)
         else:
-            xs_name = samples[sample]['crossSection']
-        df = df.Define("stitching_weight", stitch_str)
-        xs_inclusive = xs_dict[xs_name]['crossSec']
+            df = df.Define("stitching_weight", stitch_str)
 
         stitching_weight_string = f' {xs_stitching} * stitching_weight * ({xs_inclusive}/{xs_stitching_incl})'
-        df = df.Define('genWeightD', 'std::copysign<double>(1., genWeight)')
+        df = self.defineGenWeightD(df)
         all_branches = []
         if 'pu' in self.to_apply:
             df, pu_SF_branches = self.pu.getWeight(df)
@@ -224,12 +252,23 @@ class Corrections:
             weight_rel_name = f'weight_MC_Lumi_{syst_name}_rel'
             weight_out_name = weight_name if syst_name == central else weight_rel_name
             weight_formula = f'genWeightD * {lumi} * {stitching_weight_string} {product} {denom}'
-            df = df.Define(weight_name, f'static_cast<float>({weight_formula})')
+            if PrecompiledDefines.enabled and len(branches) <= 1:
+                denom_value = 1.
+                if ana_cache is not None:
+                    denom_value = ana_cache["denominator"][central][central]
+                    for scale in ['Up', 'Down']:
+                        if syst_name == f'pu{scale}':
+                            denom_value = ana_cache["denominator"]["pu"][scale]
+                functor_class = ROOT.correction.NormalisationWeightWithPU if len(branches) > 0 else ROOT.correction.NormalisationWeight
+                functor = functor_class(float(lumi), float(xs_stitching), float(xs_inclusive) / float(xs_stitching_incl), float(denom_value))
+                df = defineColumn(df, weight_name, functor, [ 'genWeightD', 'stitching_weight' ] + branches)
+            else:
+                df = df.Define(weight_name, f'static_cast<float>({weight_formula})')
 
             if syst_name==central:
                 all_weights.append(weight_out_name)
             else:
-                df = df.Define(weight_out_name, f'static_cast<float>(weight_{syst_name}/weight_MC_Lumi_pu)')
+                df = defineRelative(df, weight_out_name, weight_name, 'weight_MC_Lumi_pu')
                 for scale in ['Up','Down']:
                     if syst_name == f'pu{scale}' and return_variations:
                         all_weights.append(weight_out_name)
@@ -280,17 +319,31 @@ class Corrections:
             all_weights.extend(bTag_SF_branches)
         return df, all_weights
 
+    def defineGenWeightD(self, df):
+        if PrecompiledDefines.enabled:
+            functor = ROOT.correction.GenWeightSign[df.GetColumnType('genWeight')]()
+            return defineColumn(df, 'genWeightD', functor, [ 'genWeight' ])
+        return df.Define('genWeightD', 'std::copysign<double>(1., genWeight)')
+
     def getDenominator(self, df, sources):
         if 'pu' in self.to_apply:
             df, pu_SF_branches = self.pu.getWeight(df)
-        df = df.Define('genWeightD', 'std::copysign<double>(1., genWeight)')
+        df = self.defineGenWeightD(df)
         syst_names =[]
         for source in sources:
             for scale in getScales(source):
                 syst_name = getSystName(source, scale)
-                weight_formula = 'genWeightD'
-                if 'pu' in self.to_apply:
-                    weight_formula += f' * puWeight_{scale}'
-                df = df.Define(f'weight_denom_{syst_name}', weight_formula)
+                if PrecompiledDefines.enabled:
+                    if 'pu' in self.to_apply:
+                        df = defineColumn(df, f'weight_denom_{syst_name}', ROOT.correction.WeightProduct(),
+                                          [ 'genWeightD', f'puWeight_{scale}' ])
+                    else:
+                        df = defineColumn(df, f'weight_denom_{syst_name}', ROOT.correction.Identity['double'](),
+                                          [ 'genWeightD' ])
+                else:
+                    weight_formula = 'genWeightD'
+                    if 'pu' in self.to_apply:
+                        weight_formula += f' * puWeight_{scale}'
+                    df = df.Define(f'weight_denom_{syst_name}', weight_formula)
                 syst_names.append(syst_name)
         return df, syst_names
\ No newline at end of file
@@ -1,5 +1,9 @@
-
+import os
+import ROOT
 from Common.Utilities import *
+from .HeaderCache import HeaderCache, declareHeaders, common_headers, jme_common_headers
+from .CorrectionCache import CorrectionCache, registerCorrectionLayouts
+from .LazyDataFrame import LazyDataFrame
 
 central = 'Central'
 up = 'Up'
@@ -60,3 +64,80 @@ def createTauSFTypeMap(map_sf_python):
     map_sf_cpp += '})'
     return map_sf_cpp
 
+def createUncSourceList(provider, sources):
+    sources_cpp = [ f'::correction::{provider}::UncSource::{source}' for source in sources ]
+    return '{' + ', '.join(sources_cpp) + '}'
+
+def createUncSourceVector(provider, sources):
+    provider_class = getattr(ROOT.correction, provider)
+    sources_cpp = ROOT.std.vector[f'::correction::{provider}::UncSource']()
+    for source in sources:
+        sources_cpp.push_back(getattr(provider_class.UncSource, source))
+    return sources_cpp
+
+def getLegSelection(leg_idx, leg_type=None):
+    leg_type_value = int(getattr(ROOT.Leg, leg_type)) if leg_type is not None else -1
+    return ROOT.correction.LegSelection(leg_idx, leg_type_value)
+
+class PrecompiledDefines:
+    enabled = False
+    initialized = False
+
+    @staticmethod
+    def enable(enabled=True):
+        if enabled and not PrecompiledDefines.initialized:
+            headers_dir = os.path.dirname(os.path.abspath(__file__))
+            header_path = os.path.join(headers_dir, "defines.h")
+            declareHeaders(header_path, dependencies=[ common_headers ])
+            PrecompiledDefines.initialized = True
+        PrecompiledDefines.enabled = enabled
+
+def defineColumn(df, name, functor, columns):
+    columns_cpp = ROOT.std.vector['std::string'](columns)
+    if isinstance(df, LazyDataFrame):
+        return df.DefineLazy(name, columns,
+                             lambda node: ROOT.correction.DefineColumn(ROOT.RDF.AsRNode(node), name, functor, columns_cpp))
+    return ROOT.correction.DefineColumn(ROOT.RDF.AsRNode(df), name, functor, columns_cpp)
+
+def defineCandidateLegs(df):
+    if 'HttCandidate_legs' in df.GetColumnNames():
+        return df
+    # the gen-match fields of the legs are filled only if the gen-match columns exist (not in data)
+    gen_columns = [ 'Tau_genMatch', 'Electron_genMatch' ]
+    column_names = df.GetColumnNames()
+    has_gen_match = all(column in column_names for column in gen_columns)
+    columns = [ 'HttCandidate', 'Tau_decayMode' ] + (gen_columns if has_gen_match else [])
+    if PrecompiledDefines.enabled:
+        functor_class = ROOT.correction.CandidateLegsFunctor if has_gen_match else ROOT.correction.RecoCandidateLegsFunctor
+        functor = functor_class[df.GetColumnType('HttCandidate')]()
+        return defineColumn(df, 'HttCandidate_legs', functor, columns)
+    return df.Define('HttCandidate_legs', f'::correction::makeCandidateLegs({", ".join(columns)})')
+
+def defineSFVariation(df, name, variations_column, provider, source, scale):
+    if PrecompiledDefines.enabled:
+        source_cpp = getattr(getattr(ROOT.correction, provider).UncSource, source)
+        scale_cpp = getattr(ROOT.correction.UncScale, scale)
+        functor = ROOT.correction.SFVariationElement[f'::correction::{provider}::SFVariations'](source_cpp, scale_cpp)
+        return defineColumn(df, name, functor, [ variations_column ])
+    return df.Define(name, f'''{variations_column}.get(::correction::{provider}::UncSource::{source}, ::correction::UncScale::{scale})''')
+
+def defineSFVariationRelative(df, name, variations_column, provider, source, scale):
+    if PrecompiledDefines.enabled:
+        source_cpp = getattr(getattr(ROOT.correction, provider).UncSource, source)
+        scale_cpp = getattr(ROOT.correction.UncScale, scale)
+        functor = ROOT.correction.SFVariationRelative[f'::correction::{provider}::SFVariations'](source_cpp, scale_cpp)
+        return defineColumn(df, name, functor, [ variations_column ])
+    source_cpp = f'::correction::{provider}::UncSource::{source}'
+    return df.Define(name, f"static_cast<float>({variations_column}.get({source_cpp}, ::correction::UncScale::{scale})"
+                           f" / {variations_column}.get({source_cpp}, ::correction::UncScale::{central}))")
+
+def defineRelative(df, name, column, central_column):
+    if PrecompiledDefines.enabled:
+        return defineColumn(df, name, ROOT.correction.RelativeWeight(), [ column, central_column ])
+    return df.Define(name, f"static_cast<float>({column}/{central_column})")
+
+def defineFloat(df, name, column):
+    if PrecompiledDefines.enabled:
+        functor = ROOT.correction.ToFloat[df.GetColumnType(column)]()
+        return defineColumn(df, name, functor, [ column ])
+    return df.Define(name, f"static_cast<float>({column})")
@@ -0,0 +1,109 @@
+import os
+import pickle
+import yaml
+
+# Cross-section table and per-sample normalisation constants.
+# The YAML file with the cross sections is parsed once per process. If binary caching is enabled,
+# the parsed table is also stored next to the YAML file and reused by later processes
+# as long as the modification time and the size of the YAML file are unchanged.
+
+class CrossSectionTable:
+    _tables = {}
+
+    @staticmethod
+    def load(xs_file_path, use_binary_cache=False):
+        xs_file_path = os.path.abspath(xs_file_path)
+        stat = os.stat(xs_file_path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        table = CrossSectionTable._tables.get(xs_file_path)
+        if table is None or table.signature != signature:
+            table = CrossSectionTable(xs_file_path, signature, use_binary_cache)
+            CrossSectionTable._tables[xs_file_path] = table
+        return table
+
+    def __init__(self, xs_file_path, signature, use_binary_cache):
+        self.path = xs_file_path
+        self.signature = signature
+        self.xs_dict = None
+        cache_path = xs_file_path + '.pkl'
+        if use_binary_cache:
+            self.xs_dict = self._readBinaryCache(cache_path)
+        if self.xs_dict is None:
+            with open(xs_file_path, 'r') as xs_file:
+                self.xs_dict = yaml.safe_load(xs_file)
+            if use_binary_cache:
+                self._writeBinaryCache(cache_path)
+
+    def crossSection(self, name):
+        return self.xs_dict[name]['crossSec']
+
+    def _readBinaryCache(self, cache_path):
+        try:
+            with open(cache_path, 'rb') as cache_file:
+                signature, xs_dict = pickle.load(cache_file)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            return None
+        return xs_dict if signature == self.signature else None
+
+    def _writeBinaryCache(self, cache_path):
+        tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as cache_file:
+                pickle.dump((self.signature, self.xs_dict), cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+class SampleNormalisation:
+    def __init__(self, sample_type, xs_stitching, xs_stitching_incl, xs_inclusive, stitching):
+        self.sample_type = sample_type
+        self.xs_stitching = xs_stitching
+        self.xs_stitching_incl = xs_stitching_incl
+        self.xs_inclusive = xs_inclusive
+        self.stitching = stitching
+
+class NormalisationService:
+    def __init__(self, xs_table, samples, use_stitching=True):
+        self.xs_table = xs_table
+        self.samples = samples
+        self.use_stitching = use_stitching
+        self.ref_samples = NormalisationService.indexRefSamples(samples)
+        self.normalisations = {}
+
+    @staticmethod
+    def indexRefSamples(samples):
+        ref_samples = {}
+        for sample, sampleDef in samples.items():
+            if sampleDef.get('isReference', False):
+                ref_samples.setdefault(sampleDef.get('sampleType', None), []).append(sample)
+        return ref_samples
+
+    def findRefSample(self, sample_type):
+        refSample = self.ref_samples.get(sample_type, [])
+        if len(refSample) != 1:
+            raise RuntimeError(f'multiple refSamples for {sample_type}: {refSample}')
+        return refSample[0]
+
+    def getSampleNormalisation(self, sample):
+        normalisation = self.normalisations.get(sample)
+        if normalisation is None:
+            normalisation = self._computeSampleNormalisation(sample)
+            self.normalisations[sample] = normalisation
+        return normalisation
+
+    def _computeSampleNormalisation(self, sample):
+        sampleType = self.samples[sample]['sampleType']
+        xs_stitching = 1.
+        xs_stitching_incl = 1.
+        stitching = sampleType in [ 'DY', 'W' ] and self.use_stitching
+        if stitching:
+            xs_stitching_name = self.samples[sample]['crossSectionStitch']
+            inclusive_sample_name = self.findRefSample(sampleType)
+            xs_name = self.samples[inclusive_sample_name]['crossSection']
+            xs_stitching = self.xs_table.crossSection(xs_stitching_name)
+            xs_stitching_incl = self.xs_table.crossSection(self.samples[inclusive_sample_name]['crossSectionStitch'])
+        else:
+            xs_name = self.samples[sample]['crossSection']
+        xs_inclusive = self.xs_table.crossSection(xs_name)
+        return SampleNormalisation(sampleType, xs_stitching, xs_stitching_incl, xs_inclusive, stitching)
@@ -71,19 +71,64 @@ FatJetVariationsCalculator::result_t FatJetVariationsCalculator::produce(
     const p4compv_t& genjet_pt, const p4compv_t& genjet_eta, const p4compv_t& genjet_phi, const p4compv_t& genjet_mass,
     const p4compv_t& gensubjet_pt, const p4compv_t& gensubjet_eta, const p4compv_t& gensubjet_phi, const p4compv_t& gensubjet_mass , int event) const
 {
-  const auto nVariations = 1+( m_doSmearing ? 2*( m_splitJER ? 6 : 1 ) : 0 )+2*m_jesUncSources.size()+( m_addHEM2018Issue ? 2 : 0 ); // 1(nom)+2(JER)+2*len(JES)[+2(HEM)]
+  flat_result_t flat;
+  produce(jet_pt, jet_eta, jet_phi, jet_mass, jet_rawcorr, jet_area,
+      jet_msoftdrop, jet_subJetIdx1, jet_subJetIdx2, subjet_pt, subjet_eta, subjet_phi, subjet_mass,
+      jet_jetId, rho, seed, genjet_pt, genjet_eta, genjet_phi, genjet_mass,
+      gensubjet_pt, gensubjet_eta, gensubjet_phi, gensubjet_mass, event, flat);
+  const auto nJets = flat.nJets();
+  result_t out{flat.size(), p4compv_t(nJets), flat.sizeM(), p4compv_t(nJets), p4compv_t(nJets)};
+  for ( std::size_t i{0}; i != flat.sizeM(); ++i ) {
+    p4compv_t mass(flat.massRow(i), flat.massRow(i)+nJets), msd(flat.msoftdropRow(i), flat.msoftdropRow(i)+nJets);
+    if ( i < flat.size() ) {
+      out.set(i, p4compv_t(flat.ptRow(i), flat.ptRow(i)+nJets), std::move(mass), std::move(msd));
+    } else {
+      out.setM(i, std::move(mass), std::move(msd));
+    }
+  }
+  return out;
+}
+
+void FatJetVariationsCalculator::produce(
+    const p4compv_t& jet_pt, const p4compv_t& jet_eta, const p4compv_t& jet_phi, const p4compv_t& jet_mass,
+    const p4compv_t& jet_rawcorr, const p4compv_t& jet_area,
+    const p4compv_t& jet_msoftdrop, const ROOT::VecOps::RVec<int>& jet_subJetIdx1, const ROOT::VecOps::RVec<int>& jet_subJetIdx2,
+    const p4compv_t& subjet_pt, const p4compv_t& subjet_eta, const p4compv_t& subjet_phi, const p4compv_t& subjet_mass,
+    const ROOT::VecOps::RVec<int>& jet_jetId, const float rho,
+    const std::uint32_t seed,
+    const p4compv_t& genjet_pt, const p4compv_t& genjet_eta, const p4compv_t& genjet_phi, const p4compv_t& genjet_mass,
+    const p4compv_t& gensubjet_pt, const p4compv_t& gensubjet_eta, const p4compv_t& gensubjet_phi, const p4compv_t& gensubjet_mass, int event,
+    flat_result_t& out) const
+{
+  const std::size_t nJER = m_doSmearing ? 2*( m_splitJER ? 6 : 1 ) : 0;
+  const auto nVariations = 1+nJER+2*m_jesUncSources.size()+( m_addHEM2018Issue ? 2 : 0 ); // 1(nom)+2(JER)+2*len(JES)[+2(HEM)]
   const bool doJMSVars = m_jmsVals[1] != 1.;
   const auto nVariationsM = nVariations + ( m_doSmearing ? 2 : 0 ) + ( doJMSVars ? 2 : 0 ); // 2(JMR)+2(JMS), both optional
+  // rows of the variations, in the order of available()
+  const std::size_t iHEM = 1+nJER;
+  const std::size_t iJES = iHEM+( m_addHEM2018Issue ? 2 : 0 );
+  const std::size_t iJMS = nVariations;
+  const std::size_t iJMR = nVariationsM-2;
   const auto nJets = jet_pt.size();
   LogDebug_JME << "JME:: hello from FatJetVariations produce. Got " << nJets << " jets" << std::endl;
   LogDebug_JME << "JME:: variations for PT: " << nVariations << " and for M, Msd: " << nVariationsM << std::endl;
-  result_t out{nVariations, jet_pt, nVariationsM, jet_mass, jet_msoftdrop};
+  out.reset(nVariations, nVariationsM, nJets);
 
-  ROOT::VecOps::RVec<double> pt_nom{jet_pt}, mass_raw{jet_mass};
-  if ( m_jetCorrector ) {
-    LogDebug_JME << "JME:: reapplying JEC" << std::endl;
-    FactorizedJetCorrectorCalculator::VariableValues vals;
-    for ( std::size_t i{0}; i != nJets; ++i ) {
+  using LVectorM = ROOT::Math::LorentzVector<ROOT::Math::PtEtaPhiM4D<double>>;
+  const GenJetGrid* genGrid{nullptr};
+  TRandom3* rg{nullptr};
+  if ( m_doSmearing ) {
+    LogDebug_JME << "JME:: Smearing (seed=" << seed << ")" << std::endl;
+    genGrid = m_smearDoGenMatch ? &buildGenJetGrid(genjet_eta, genjet_phi) : nullptr;
+    rg = &getTRandom3(seed);
+  } else {
+    LogDebug_JME << "JME:: No smearing" << std::endl;
+  }
+  // all corrections and variations of a jet are evaluated together; the random numbers are drawn in the same order as jet by jet passes
+  FactorizedJetCorrectorCalculator::VariableValues vals;
+  for ( std::size_t i{0}; i != nJets; ++i ) {
+    double pt_nom{jet_pt[i]}, mass_raw{jet_mass[i]};
+    if ( m_jetCorrector ) {
       vals.setJetEta(jet_eta[i]);
       vals.setJetPt(jet_pt[i]*(1.-jet_rawcorr[i]));
       vals.setJetA(jet_area[i]);
@@ -91,132 +136,95 @@ FatJetVariationsCalculator::result_t FatJetVariationsCalculator::produce(
       const auto corr = m_jetCorrector->getCorrection(vals);
       if ( corr > 0. ) {
         const double newc = (1.-jet_rawcorr[i])*corr;
-        pt_nom[i]   *= newc;
-        mass_raw[i] *= newc;
+        pt_nom   *= newc;
+        mass_raw *= newc;
       }
+      LogDebug_JME << "JME:: with reapplied JEC: (PT=" << pt_nom << ", ETA=" << jet_eta[i] << ", PHI=" << jet_phi[i] << ", M=" << mass_raw << ")" << std::endl;
     }
-#ifdef BAMBOO_JME_DEBUG
-    LogDebug_JME << "JME:: with reapplied JEC: ";
-    for ( std::size_t i{0}; i != nJets; ++i ) {
-      LogDebug_JME << "(PT=" << pt_nom[i] << ", ETA=" << jet_eta[i] << ", PHI=" << jet_phi[i] << ", M=" << mass_raw[i] << ") ";
-    }
-    LogDebug_JME << std::endl;
-#endif
-  } else {
-    LogDebug_JME << "JME:: Not reapplying JEC" << std::endl;
-  }
-  // calculate groomed P4 (and mass)
-  using LVectorM = ROOT::Math::LorentzVector<ROOT::Math::PtEtaPhiM4D<double>>;
-  //std::cout << "0 " << std::endl;
-  auto jet_groomedP4 = std::vector<LVectorM>{nJets};
-  //std::cout << "1 " << std::endl;
-  ROOT::VecOps::RVec<double> msd_nom(nJets, 0.); // ?
-  //std::cout << "2 " << std::endl;
-  for ( std::size_t j{0}; j != nJets; ++j ) {
-    //std::cout << "3 " << j << std::endl;
-    //std::cout << jet_subJetIdx1[j] << std::endl;
-    //std::cout << jet_subJetIdx2[j] << std::endl;
-    if ( jet_subJetIdx1[j] >= 0 && jet_subJetIdx2[j] >= 0 ) {
-      jet_groomedP4[j] = (
-          LVectorM(subjet_pt[jet_subJetIdx1[j]], subjet_eta[jet_subJetIdx1[j]], subjet_phi[jet_subJetIdx1[j]], subjet_mass[jet_subJetIdx1[j]])
-        + LVectorM(subjet_pt[jet_subJetIdx2[j]], subjet_eta[jet_subJetIdx2[j]], subjet_phi[jet_subJetIdx2[j]], subjet_mass[jet_subJetIdx2[j]]));
-      //std::cout << jet_groomedP4[j] << std::endl;
+    // calculate groomed P4 (and mass)
+    LVectorM groomedP4{};
+    double msd_nom{0.};
+    if ( jet_subJetIdx1[i] >= 0 && jet_subJetIdx2[i] >= 0 ) {
+      groomedP4 = (
+          LVectorM(subjet_pt[jet_subJetIdx1[i]], subjet_eta[jet_subJetIdx1[i]], subjet_phi[jet_subJetIdx1[i]], subjet_mass[jet_subJetIdx1[i]])
+        + LVectorM(subjet_pt[jet_subJetIdx2[i]], subjet_eta[jet_subJetIdx2[i]], subjet_phi[jet_subJetIdx2[i]], subjet_mass[jet_subJetIdx2[i]]));
       // PUPPI SD mass correction https://github.com/cms-jet/PuppiSoftdropMassCorr/
-       // WHich formula?? for creating m_puppiCorrGen
       if ( m_puppiCorrGen->numberOfVariables() ) {
         const auto puppisd_corr = (
-              m_puppiCorrGen->evaluate(std::array<double,1>{{ pt_nom[j] }}, std::array<double,0>{{}})
-            * m_puppiPoly5->evaluate(std::array<double,1>{{ pt_nom[j] }},
-               ( std::abs(jet_eta[j]) <= 1.3 ? m_puppiCorrRecoParam_cen : m_puppiCorrRecoParam_for ) ));
+              m_puppiCorrGen->evaluate(std::array<double,1>{{ pt_nom }}, std::array<double,0>{{}})
+            * m_puppiPoly5->evaluate(std::array<double,1>{{ pt_nom }},
+               ( std::abs(jet_eta[i]) <= 1.3 ? m_puppiCorrRecoParam_cen : m_puppiCorrRecoParam_for ) ));
         LogDebug_JME << "JME:: PUPPI gen mass correction: " << puppisd_corr << std::endl;
-        jet_groomedP4[j].SetM(puppisd_corr*jet_groomedP4[j].M());
+        groomedP4.SetM(puppisd_corr*groomedP4.M());
       }
-      msd_nom[j] = jet_groomedP4[j].M();
-      if ( msd_nom[j] < 0.0) {
-        msd_nom[j] *= -1.;
+      msd_nom = groomedP4.M();
+      if ( msd_nom < 0.0) {
+        msd_nom *= -1.;
       }
+      LogDebug_JME << "JME:: Groomed momentum: (PT=" << groomedP4.Pt() << ", ETA=" << groomedP4.Eta() << ", PHI=" << groomedP4.Phi() << ", M=" << msd_nom << ")" << std::endl;
     }
-  }
-#ifdef BAMBOO_JME_DEBUG
-  LogDebug_JME << "JME:: Groomed momenta: ";
-  for ( std::size_t i{0}; i != nJets; ++i ) {
-    const auto& p4_g = jet_groomedP4[i];
-    LogDebug_JME << "(PT=" << p4_g.Pt() << ", ETA=" << p4_g.Eta() << ", PHI=" << p4_g.Phi() << ", M=" << msd_nom[i] << ") ";
-  }
-  LogDebug_JME << std::endl;
-#endif
-  // apply nominal JMS (JMS variations by storing (up|down)/nom)
-  auto mass_nom = mass_raw*m_jmsVals[0];
-  msd_nom *= m_gmsVals[0];
-  std::size_t iVar = 1; // after nominal
-  // smearing and JER
-  if ( m_doSmearing ) {
-    p4compv_t pt_jerUp{pt_nom}, pt_jerDown{pt_nom};
-    p4compv_t mass_jerUp{mass_nom}, mass_jerDown{mass_nom}, mass_jmrUp{mass_nom}, mass_jmrDown{mass_nom};
-    p4compv_t msd_jerUp{msd_nom}, msd_jerDown{msd_nom}, msd_jmrUp{msd_nom}, msd_jmrDown{msd_nom};
-    LogDebug_JME << "JME:: Smearing (seed=" << seed << ")" << std::endl;
-    auto& rg = getTRandom3(seed);
-    for ( std::size_t i{0}; i != nJets; ++i ) {
+    // apply nominal JMS (JMS variations by storing (up|down)/nom)
+    double mass_nom = mass_raw*m_jmsVals[0];
+    msd_nom *= m_gmsVals[0];
+    // smearing and JER
+    if ( m_doSmearing ) {
       double jer_nom{1.}, jer_up{1.}, jer_down{1.}, jmr_nom{1.}, jmr_up{1.}, jmr_down{1.}, gmr_nom{1.}, gmr_up{1.}, gmr_down{1.};
-      if ( pt_nom[i] > 0. || mass_raw[i] > 0. ) {
-        const auto eOrig = ROOT::Math::LorentzVector<ROOT::Math::PtEtaPhiM4D<double>>(pt_nom[i], jet_phi[i], jet_eta[i], mass_raw[i]).E();
+      if ( pt_nom > 0. || mass_raw > 0. ) {
+        const auto eOrig = LVectorM(pt_nom, jet_phi[i], jet_eta[i], mass_raw).E();
         JME::JetParameters jPar{
-            {JME::Binning::JetPt , pt_nom[i]},
+            {JME::Binning::JetPt , pt_nom},
             {JME::Binning::JetEta, jet_eta[i]},
             {JME::Binning::Rho   , rho} };
         const auto ptRes  = m_jetPtRes.getResolution(jPar);
-        LogDebug_JME << "JME:: JetParameters: pt=" << pt_nom[i] << ", eta=" << jet_eta[i] << ", rho=" << rho << "; ptRes=" << ptRes << std::endl;
+        LogDebug_JME << "JME:: JetParameters: pt=" << pt_nom << ", eta=" << jet_eta[i] << ", rho=" << rho << "; ptRes=" << ptRes << std::endl;
         LogDebug_JME << "JME:: ";
         float genPt{-1}, genM{-1.};
         if ( m_smearDoGenMatch ) {
-          const auto iGen = findGenMatch(pt_nom[i], jet_eta[i], jet_phi[i], genjet_pt, genjet_eta, genjet_phi, ptRes*pt_nom[i]);
+          const auto iGen = findGenMatch(pt_nom, jet_eta[i], jet_phi[i], genjet_pt, genjet_eta, genjet_phi, ptRes*pt_nom, *genGrid);
           if ( iGen != genjet_pt.size() ) {
             genPt = genjet_pt[iGen];
             genM  = genjet_mass[iGen];
             LogDebug_JME << "genPt=" << genPt << " genM=" << genM << " ";
           }
         }
-        if ( pt_nom[i] > 0. ) {
-          //const auto rand = ( genPt < 0. ) ? rg.Gaus(0, ptRes) : -1.;
-          const auto rand = ( genPt < 0. ) ? GetRandomNumber(event, pt_nom[i], jet_eta[i], jet_phi[i], ptRes) : -1.;
-          LogDebug_JME << "jet_pt_resolution: " << ptRes << ", rand: " << rand << std::endl;
+        if ( pt_nom > 0. ) {
+          const auto rand = ( genPt < 0. ) ? GetRandomNumber(event, pt_nom, jet_eta[i], jet_phi[i], ptRes) : -1.;
           LogDebug_JME << "jet_pt_resolution: " << ptRes << ", rand: " << rand << std::endl;
-          jer_nom  = jetESmearFactor(pt_nom[i], eOrig, genPt, ptRes, m_jetEResSF.getScaleFactor(jPar, Variation::NOMINAL), rand);
-          jer_down = jetESmearFactor(pt_nom[i], eOrig, genPt, ptRes, m_jetEResSF.getScaleFactor(jPar, Variation::DOWN   ), rand);
-          jer_up   = jetESmearFactor(pt_nom[i], eOrig, genPt, ptRes, m_jetEResSF.getScaleFactor(jPar, Variation::UP     ), rand);
+          const auto sf = getScaleFactors(m_jetEResSF, jPar); // NOMINAL, DOWN, UP
+          jer_nom  = jetESmearFactor(pt_nom, eOrig, genPt, ptRes, sf[0], rand);
+          jer_down = jetESmearFactor(pt_nom, eOrig, genPt, ptRes, sf[1], rand);
+          jer_up   = jetESmearFactor(pt_nom, eOrig, genPt, ptRes, sf[2], rand);
         }
-        // LogDebug_JME << "  scalefactors are NOMINAL=" << m_jetEResSF.getScaleFactor(jPar, Variation::NOMINAL) << ", DOWN=" << m_jetEResSF.getScaleFactor(jPar, Variation::DOWN) << ", UP=" << m_jetEResSF.getScaleFactor(jPar, Variation::UP) << std::endl;
-        // LogDebug_JME << "  smearfactors are NOMINAL=" << jer_nom[i] << ", DOWN=" << jer_down[i] << ", UP=" << jer_up[i] << std::endl;
         // JMR
-        if ( mass_raw[i] > 0. ) {
+        if ( mass_raw > 0. ) {
           if ( genM != -1. ) {
-            LogDebug_JME << "JME:: JMR with genM=" << genM << " and raw " << mass_raw[i];
-            const auto dMoM = 1.-(genM/mass_raw[i]);
+            LogDebug_JME << "JME:: JMR with genM=" << genM << " and raw " << mass_raw;
+            const auto dMoM = 1.-(genM/mass_raw);
             jmr_nom  = 1.+(m_jmrVals[0]-1.)*dMoM;
             jmr_up   = 1.+(m_jmrVals[1]-1.)*dMoM;
             jmr_down = 1.+(m_jmrVals[2]-1.)*dMoM;
           } else {
-            const auto mRes = m_puppiPoly5->evaluate(std::array<double,1>{{ pt_nom[i] }},
+            const auto mRes = m_puppiPoly5->evaluate(std::array<double,1>{{ pt_nom }},
                ( std::abs(jet_eta[i]) <= 1.3 ? m_puppiResolParam_cen : m_puppiResolParam_for ) );
             LogDebug_JME << "JME:: JMR parametric with resolution " << mRes;
 
-            const auto rand = rg.Gaus(0, mRes);
+            const auto rand = rg->Gaus(0, mRes);
             jmr_nom  = ( m_jmrVals[0] <= 1. ? 1. : rand*std::sqrt(m_jmrVals[0]*m_jmrVals[0]-1));
             jmr_up   = ( m_jmrVals[1] <= 1. ? 1. : rand*std::sqrt(m_jmrVals[1]*m_jmrVals[1]-1));
             jmr_down = ( m_jmrVals[2] <= 1. ? 1. : rand*std::sqrt(m_jmrVals[2]*m_jmrVals[2]-1));
           }
-          if ( jmr_nom *mass_raw[i] < 1.e-2 ) { jmr_nom  = 1.e-2; }
-          if ( jmr_up  *mass_raw[i] < 1.e-2 ) { jmr_up   = 1.e-2; }
-          if ( jmr_down*mass_raw[i] < 1.e-2 ) { jmr_down = 1.e-2; }
+          if ( jmr_nom *mass_raw < 1.e-2 ) { jmr_nom  = 1.e-2; }
+          if ( jmr_up  *mass_raw < 1.e-2 ) { jmr_up   = 1.e-2; }
+          if ( jmr_down*mass_raw < 1.e-2 ) { jmr_down = 1.e-2; }
         }
         LogDebug_JME << "  mass smearfactors are NOMINAL=" << jmr_nom << ", DOWN=" << jmr_down << ", UP=" << jmr_up << std::endl;
       }
-      if ( msd_nom[i] > 0. ) { // JMR for groomed
+      if ( msd_nom > 0. ) { // JMR for groomed
         // genGroomedJet
         int igsj1{-1}, igsj2{-1};
         for ( int ig{0}; ig != int(gensubjet_eta.size()); ++ig ) {
-          const auto dphi = phi_mpi_pi(gensubjet_phi[ig]-jet_groomedP4[i].Phi());
-          const auto deta = (gensubjet_eta[ig]-jet_groomedP4[i].Eta());
+          const auto dphi = phi_mpi_pi(gensubjet_phi[ig]-groomedP4.Phi());
+          const auto deta = (gensubjet_eta[ig]-groomedP4.Eta());
           const auto dr2 = dphi*dphi + deta*deta;
           if ( dr2 < 0.64 ) { // dR < 0.8
             if ( igsj1 == -1 ) {
@@ -232,127 +240,96 @@ FatJetVariationsCalculator::result_t FatJetVariationsCalculator::produce(
           const auto genM = (
               LVectorM{gensubjet_pt[igsj1], gensubjet_eta[igsj1], gensubjet_phi[igsj1], gensubjet_mass[igsj1]}
             + LVectorM{gensubjet_pt[igsj2], gensubjet_eta[igsj2], gensubjet_phi[igsj2], gensubjet_mass[igsj2]}).M();
-          const auto dMoM = 1.-(genM/jet_groomedP4[i].M()); // raw
+          const auto dMoM = 1.-(genM/groomedP4.M()); // raw
           gmr_nom  = 1.+(m_gmrVals[0]-1.)*dMoM;
           gmr_up   = 1.+(m_gmrVals[1]-1.)*dMoM;
           gmr_down = 1.+(m_gmrVals[2]-1.)*dMoM;
         } else {
-          const auto mRes = m_puppiPoly5->evaluate(std::array<double,1>{{ jet_groomedP4[i].Pt() }},
+          const auto mRes = m_puppiPoly5->evaluate(std::array<double,1>{{ groomedP4.Pt() }},
              ( std::abs(jet_eta[i]) <= 1.3 ? m_puppiResolParam_cen : m_puppiResolParam_for ) );
-          const auto rand = rg.Gaus(0, mRes);
+          const auto rand = rg->Gaus(0, mRes);
           gmr_nom  = ( m_gmrVals[0] <= 1. ? 1. : rand*std::sqrt(m_gmrVals[0]*m_gmrVals[0]-1));
           gmr_up   = ( m_gmrVals[1] <= 1. ? 1. : rand*std::sqrt(m_gmrVals[1]*m_gmrVals[1]-1));
           gmr_down = ( m_gmrVals[2] <= 1. ? 1. : rand*std::sqrt(m_gmrVals[2]*m_gmrVals[2]-1));
         }
-        if ( gmr_nom *msd_nom[i] < 1.e-2 ) { gmr_nom  = 1.e-2; }
-        if ( gmr_up  *msd_nom[i] < 1.e-2 ) { gmr_up   = 1.e-2; }
-        if ( gmr_down*msd_nom[i] < 1.e-2 ) { gmr_down = 1.e-2; }
+        if ( gmr_nom *msd_nom < 1.e-2 ) { gmr_nom  = 1.e-2; }
+        if ( gmr_up  *msd_nom < 1.e-2 ) { gmr_up   = 1.e-2; }
+        if ( gmr_down*msd_nom < 1.e-2 ) { gmr_down = 1.e-2; }
       }
       LogDebug_JME << "  groomed mass smearfactors are NOMINAL=" << gmr_nom << ", DOWN=" << gmr_down << ", UP=" << gmr_up << std::endl;
-      // fill variation arrays
-      pt_jerDown  [i] *= jer_down;
-      pt_jerUp    [i] *= jer_up;
-      mass_jerUp  [i] *= jer_up  *jmr_nom;
-      mass_jerDown[i] *= jer_down*jmr_nom;
-      mass_jmrUp  [i] *= jer_nom *jmr_up  ;
-      mass_jmrDown[i] *= jer_nom *jmr_down;
-      msd_jerUp   [i] *= jer_up  *gmr_nom;
-      msd_jerDown [i] *= jer_down*gmr_nom;
-      msd_jmrUp   [i] *= jer_nom *gmr_up  ;
-      msd_jmrDown [i] *= jer_nom *gmr_down;
+      // the variations are stored in single precision before the factors are applied, as in the column-wise calculation
+      const float pt_f{static_cast<float>(pt_nom)}, mass_f{static_cast<float>(mass_nom)}, msd_f{static_cast<float>(msd_nom)};
+      const float pt_jerUp     = pt_f  *jer_up;
+      const float pt_jerDown   = pt_f  *jer_down;
+      const float mass_jerUp   = mass_f*(jer_up  *jmr_nom);
+      const float mass_jerDown = mass_f*(jer_down*jmr_nom);
+      const float msd_jerUp    = msd_f *(jer_up  *gmr_nom);
+      const float msd_jerDown  = msd_f *(jer_down*gmr_nom);
+      out.mass     (iJMR  , i) = mass_f*(jer_nom *jmr_up  );
+      out.mass     (iJMR+1, i) = mass_f*(jer_nom *jmr_down);
+      out.msoftdrop(iJMR  , i) = msd_f *(jer_nom *gmr_up  );
+      out.msoftdrop(iJMR+1, i) = msd_f *(jer_nom *gmr_down);
       // finally apply JER and JMR to nominal
-      pt_nom[i]   *= jer_nom;
-      mass_nom[i] *= jer_nom*jmr_nom;
-      msd_nom[i]  *= jer_nom*gmr_nom;
-    }
-    if ( m_splitJER ) {
-      ROOT::VecOps::RVec<int> jerBin(pt_nom.size(), -1);
-      for ( std::size_t j{0}; j != nJets; ++j ) {
-        jerBin[j] = jerSplitID(pt_nom[j], jet_eta[j]);
+      pt_nom   *= jer_nom;
+      mass_nom *= jer_nom*jmr_nom;
+      msd_nom  *= jer_nom*gmr_nom;
+      // jets outside of the bin of a split JER variation keep the nominal values
+      const int jerBin = m_splitJER ? jerSplitID(pt_nom, jet_eta[i]) : 0;
+      for ( std::size_t k{0}; 2*k != nJER; ++k ) {
+        const bool inBin = ( jerBin == int(k) );
+        out.pt       (1+2*k, i) = inBin ? pt_jerUp     : static_cast<float>(pt_nom);
+        out.pt       (2+2*k, i) = inBin ? pt_jerDown   : static_cast<float>(pt_nom);
+        out.mass     (1+2*k, i) = inBin ? mass_jerUp   : static_cast<float>(mass_nom);
+        out.mass     (2+2*k, i) = inBin ? mass_jerDown : static_cast<float>(mass_nom);
+        out.msoftdrop(1+2*k, i) = inBin ? msd_jerUp    : static_cast<float>(msd_nom);
+        out.msoftdrop(2+2*k, i) = inBin ? msd_jerDown  : static_cast<float>(msd_nom);
       }
-      for ( int i{0}; i != 6; ++i ) {
-        p4compv_t pt_jeriUp{pt_nom}, mass_jeriUp{mass_nom}, msd_jeriUp{msd_nom};
-        p4compv_t pt_jeriDown{pt_nom}, mass_jeriDown{mass_nom}, msd_jeriDown{msd_nom};
-        for ( std::size_t j{0}; j != nJets; ++j ) {
-          if ( jerBin[j] == i ) {
-            pt_jeriUp[j] = pt_jerUp[j];
-            pt_jeriDown[j] = pt_jerDown[j];
-            mass_jeriUp[j] = mass_jerUp[j];
-            mass_jeriDown[j] = mass_jerDown[j];
-            msd_jeriUp[j] = msd_jerUp[j];
-            msd_jeriDown[j] = msd_jerDown[j];
-          }
-        }
-        out.set(iVar++, std::move(pt_jeriUp)  , std::move(mass_jeriUp)  , std::move(msd_jeriUp));
-        out.set(iVar++, std::move(pt_jeriDown), std::move(mass_jeriDown), std::move(msd_jeriDown));
-      }
-    } else {
-      out.set(iVar++, std::move(pt_jerUp)  , std::move(mass_jerUp)  , std::move(msd_jerUp));
-      out.set(iVar++, std::move(pt_jerDown), std::move(mass_jerDown), std::move(msd_jerDown));
     }
-    out.setM(nVariationsM-2, std::move(mass_jmrUp)  , std::move(msd_jmrUp));
-    out.setM(nVariationsM-1, std::move(mass_jmrDown), std::move(msd_jmrDown));
-    LogDebug_JME << "JME:: Done with smearing" << std::endl;
-  } else {
-    LogDebug_JME << "JME:: No smearing" << std::endl;
-  }
-  out.set(0, pt_nom, mass_nom, msd_nom);
-  if ( doJMSVars ) { // mass_nom has nominal JMS, jmsVals/gmsVals are divided by that
-    out.setM(nVariations  , mass_nom*m_jmsVals[1], msd_nom*m_gmsVals[1]); // UP
-    out.setM(nVariations+1, mass_nom*m_jmsVals[2], msd_nom*m_gmsVals[2]); // DOWN
-  }
-
-  // HEM issue 2018, see https://hypernews.cern.ch/HyperNews/CMS/get/JetMET/2000.html
-  if ( m_addHEM2018Issue ) {
-    p4compv_t pt_down(pt_nom.size(), 0.), mass_down(mass_nom.size(), 0.), msd_down(msd_nom.size(), 0.);
-    for ( std::size_t j{0}; j != nJets; ++j ) {
-      const auto delta = deltaHEM2018Issue(pt_nom[j], jet_jetId[j], jet_phi[j], jet_eta[j]);
-      pt_down[j] = pt_nom[j]*delta;
-      mass_down[j] = mass_nom[j]*delta;
-      msd_down[j] = msd_nom[j]*delta;
+    out.pt       (0, i) = pt_nom;
+    out.mass     (0, i) = mass_nom;
+    out.msoftdrop(0, i) = msd_nom;
+    if ( doJMSVars ) { // mass_nom has nominal JMS, jmsVals/gmsVals are divided by that
+      out.mass     (iJMS  , i) = mass_nom*m_jmsVals[1]; // UP
+      out.msoftdrop(iJMS  , i) = msd_nom *m_gmsVals[1];
+      out.mass     (iJMS+1, i) = mass_nom*m_jmsVals[2]; // DOWN
+      out.msoftdrop(iJMS+1, i) = msd_nom *m_gmsVals[2];
     }
-    out.set(iVar++, pt_nom, mass_nom, msd_nom);
-    out.set(iVar++, std::move(pt_down), std::move(mass_down), std::move(msd_down));
-  }
-  // JES uncertainties
-  for ( auto& jesUnc : m_jesUncSources ) {
-    LogDebug_JME << "JME:: evaluating JES uncertainty: " << jesUnc.first << std::endl;
-    p4compv_t pt_jesDown(pt_nom.size(), 0.), mass_jesDown(mass_nom.size(), 0.), msd_jesDown(msd_nom.size(), 0.);
-    p4compv_t pt_jesUp(pt_nom.size(), 0.), mass_jesUp(mass_nom.size(), 0.), msd_jesUp(msd_nom.size(), 0.);
-    for ( std::size_t i{0}; i != nJets; ++i ) {
-      const auto delta = getUncertainty(jesUnc.second, { {JME::Binning::JetPt, pt_nom[i]}, {JME::Binning::JetEta, jet_eta[i]} }, true);
-      pt_jesDown  [i] = pt_nom  [i]*(1.-delta);
-      mass_jesDown[i] = mass_nom[i]*(1.-delta);
-      msd_jesDown [i] = msd_nom [i]*(1.-delta);
-      pt_jesUp    [i] = pt_nom  [i]*(1.+delta);
-      mass_jesUp  [i] = mass_nom[i]*(1.+delta);
-      msd_jesUp   [i] = msd_nom [i]*(1.+delta);
+    // HEM issue 2018, see https://hypernews.cern.ch/HyperNews/CMS/get/JetMET/2000.html
+    if ( m_addHEM2018Issue ) {
+      const auto delta = deltaHEM2018Issue(pt_nom, jet_jetId[i], jet_phi[i], jet_eta[i]);
+      out.pt       (iHEM  , i) = pt_nom;
+      out.mass     (iHEM  , i) = mass_nom;
+      out.msoftdrop(iHEM  , i) = msd_nom;
+      out.pt       (iHEM+1, i) = pt_nom  *delta;
+      out.mass     (iHEM+1, i) = mass_nom*delta;
+      out.msoftdrop(iHEM+1, i) = msd_nom *delta;
+    }
+    // JES uncertainties
+    std::size_t iVar = iJES;
+    for ( auto& jesUnc : m_jesUncSources ) {
+      const auto delta = getUncertainty(jesUnc.second, pt_nom, jet_eta[i], true);
+      out.pt       (iVar  , i) = pt_nom  *(1.+delta);
+      out.mass     (iVar  , i) = mass_nom*(1.+delta);
+      out.msoftdrop(iVar  , i) = msd_nom *(1.+delta);
+      out.pt       (iVar+1, i) = pt_nom  *(1.-delta);
+      out.mass     (iVar+1, i) = mass_nom*(1.-delta);
+      out.msoftdrop(iVar+1, i) = msd_nom *(1.-delta);
+      iVar += 2;
     }
-    out.set(iVar++, std::move(pt_jesUp)  , std::move(mass_jesUp)  , std::move(msd_jesUp)  );
-    out.set(iVar++, std::move(pt_jesDown), std::move(mass_jesDown), std::move(msd_jesDown));
   }
 
 #ifdef BAMBOO_JME_DEBUG
-  assert(iVar == out.size());
-  LogDebug_JME << "JME:: returning " << out.size() << " modified jet collections" << std::endl;
+  LogDebug_JME << "JME:: returning " << out.sizeM() << " modified jet collections" << std::endl;
   const auto varNames = available("mass");
   assert(varNames.size() == nVariationsM);
-  for ( std::size_t i{0}; i != nVariations; ++i ) {
+  for ( std::size_t i{0}; i != nVariationsM; ++i ) {
     LogDebug_JME << "JME:: Jet_" << varNames[i] << ": ";
     for ( std::size_t j{0}; j != nJets; ++j ) {
-      LogDebug_JME << "(PT=" << out.pt(i)[j] << ", ETA=" << jet_eta[j] << ", PHI=" << jet_phi[j] << ", M=" << out.mass(i)[j] << ", Msd=" << out.msoftdrop(i)[j] << ") ";
-    }
-    LogDebug_JME << std::endl;
-  }
-  for ( std::size_t i{nVariations}; i != nVariationsM; ++i ) {
-    LogDebug_JME << "JME:: Jet_" << varNames[i] << ": ";
-    for ( std::size_t j{0}; j != nJets; ++j ) {
-      LogDebug_JME << "(PT=" << out.pt(0)[j] << ", ETA=" << jet_eta[j] << ", PHI=" << jet_phi[j] << ", M=" << out.mass(i)[j] << ", Msd=" << out.msoftdrop(i)[j] << ") ";
+      LogDebug_JME << "(PT=" << out.pt(i < nVariations ? i : 0, j) << ", ETA=" << jet_eta[j] << ", PHI=" << jet_phi[j] << ", M=" << out.mass(i, j) << ", Msd=" << out.msoftdrop(i, j) << ") ";
     }
     LogDebug_JME << std::endl;
   }
 #endif
-  return out;
 }
 ROOT::VecOps::RVec<float> FatJetVariationsCalculator::getResolution(const p4compv_t& jet_pt, const p4compv_t& jet_eta, const float rho) const {
   const auto nJets = jet_pt.size();
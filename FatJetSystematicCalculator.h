@@ -4,6 +4,7 @@
 class FatJetVariationsCalculator : public JetMETVariationsCalculatorBase {
 public:
   using result_t = rdfhelpers::ModifiedPtMMsdCollection;
+  using flat_result_t = rdfhelpers::FlatPtMMsdCollection;
 
   FatJetVariationsCalculator() = default;
 
@@ -47,6 +48,19 @@ public:
       const p4compv_t& genjet_pt, const p4compv_t& genjet_eta, const p4compv_t& genjet_phi, const p4compv_t& genjet_mass,
       const p4compv_t& gensubjet_pt, const p4compv_t& gensubjet_eta, const p4compv_t& gensubjet_phi, const p4compv_t& gensubjet_mass,int event
       ) const;
+  // same as above, filling all variations in a single loop over the jets
+  void produce(
+      const p4compv_t& jet_pt, const p4compv_t& jet_eta, const p4compv_t& jet_phi, const p4compv_t& jet_mass,
+      const p4compv_t& jet_rawcorr, const p4compv_t& jet_area,
+      const p4compv_t& jet_msoftdrop, const ROOT::VecOps::RVec<int>& jet_subJetIdx1, const ROOT::VecOps::RVec<int>& jet_subJetIdx2,
+      const p4compv_t& subjet_pt, const p4compv_t& subjet_eta, const p4compv_t& subjet_phi, const p4compv_t& subjet_mass,
+      const ROOT::VecOps::RVec<int>& jet_jetId, const float rho,
+      // MC-only
+      const std::uint32_t seed,
+      const p4compv_t& genjet_pt, const p4compv_t& genjet_eta, const p4compv_t& genjet_phi, const p4compv_t& genjet_mass,
+      const p4compv_t& gensubjet_pt, const p4compv_t& gensubjet_eta, const p4compv_t& gensubjet_phi, const p4compv_t& gensubjet_mass, int event,
+      flat_result_t& out
+      ) const;
 private:
   std::unique_ptr<reco::FormulaEvaluator> m_puppiCorrGen, m_puppiPoly5;
   std::array<double,6> m_puppiCorrRecoParam_cen, m_puppiCorrRecoParam_for, m_puppiResolParam_cen, m_puppiResolParam_for;
@@ -0,0 +1,120 @@
+import fcntl
+import hashlib
+import os
+import re
+import ROOT
+
+# Shared libraries with dictionaries compiled from the correction headers.
+# Each group of headers declared together is compiled into a library whose name contains a hash of
+# the content of all local files it includes, the prelude headers, the ROOT version and the include path.
+# Later runs load the library with gSystem.Load. If no library matches the hash (headers were modified),
+# the headers are declared from source and, if allowed, a new library is built for the next runs.
+# Sources shared by several groups are declared as a dependency: they are compiled once into their own library,
+# which is loaded before the libraries of the groups that depend on it.
+
+class HeaderCache:
+    cache_dir = None
+    prelude = []
+    build_missing = True
+
+    @staticmethod
+    def configure(cache_dir, prelude=None, build_missing=True):
+        if cache_dir is None:
+            HeaderCache.cache_dir = None
+            return
+        analysis_path = os.environ.get('ANALYSIS_PATH', '')
+        HeaderCache.cache_dir = os.path.abspath(os.path.join(analysis_path, cache_dir))
+        os.makedirs(HeaderCache.cache_dir, exist_ok=True)
+        HeaderCache.prelude = [ os.path.abspath(os.path.join(analysis_path, header)) for header in (prelude or []) ]
+        HeaderCache.build_missing = build_missing
+
+_headers_dir = os.path.dirname(os.path.abspath(__file__))
+common_headers = ( os.path.join(_headers_dir, 'corrections.h'), )
+jme_common_headers = ( os.path.join(_headers_dir, 'JMECalculatorBase.cc'), )
+
+_declared = set()
+
+_local_include = re.compile(r'^\s*#\s*include\s*"([^"]+)"', re.MULTILINE)
+
+def _collectLocalFiles(path, files):
+    path = os.path.realpath(path)
+    if path in files:
+        return
+    files.append(path)
+    with open(path, 'r', errors='replace') as f:
+        content = f.read()
+    for include in _local_include.findall(content):
+        include_path = os.path.join(os.path.dirname(path), include)
+        if os.path.exists(include_path):
+            _collectLocalFiles(include_path, files)
+
+def getHeadersHash(header_paths):
+    files = []
+    for path in HeaderCache.prelude + list(header_paths):
+        _collectLocalFiles(path, files)
+    h = hashlib.sha256()
+    h.update(str(ROOT.gROOT.GetVersion()).encode())
+    h.update(str(ROOT.gInterpreter.GetIncludePath()).encode())
+    for path in files:
+        h.update(path.encode())
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+class _FileLock:
+    # Exclusive flock on a lock file. The lock is released by the kernel if the process dies,
+    # so a crashed build does not block the next runs.
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_CREAT | os.O_WRONLY, 0o644)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+
+def _buildLibrary(header_paths, lib_name, lib_path):
+    wrapper_path = os.path.join(HeaderCache.cache_dir, f'{lib_name}.h')
+    with open(wrapper_path, 'w') as wrapper:
+        wrapper.write('#pragma once\n')
+        for path in HeaderCache.prelude + list(header_paths):
+            wrapper.write(f'#include "{os.path.abspath(path)}"\n')
+    ROOT.gSystem.AddIncludePath(str(ROOT.gInterpreter.GetIncludePath()))
+    library_name = os.path.join(HeaderCache.cache_dir, lib_name)
+    if ROOT.gSystem.CompileMacro(wrapper_path, 'kO', library_name, HeaderCache.cache_dir) == 1:
+        return True
+    # do not retry the build for the same hash in the next runs
+    open(lib_path + '.failed', 'w').close()
+    return False
+
+def _loadLibrary(header_paths):
+    name = os.path.splitext(os.path.basename(header_paths[-1]))[0]
+    lib_name = f'{name}_{getHeadersHash(header_paths)}'
+    lib_path = os.path.join(HeaderCache.cache_dir, f'{lib_name}.{ROOT.gSystem.GetSoExt()}')
+    failed_path = lib_path + '.failed'
+    if not os.path.exists(lib_path) and (not HeaderCache.build_missing or os.path.exists(failed_path)):
+        return False
+    # the library is built under the lock, so once the lock is taken it is either complete or missing;
+    # processes that need the library while it is being built wait for the build and then load it
+    with _FileLock(lib_path + '.lock'):
+        if not os.path.exists(lib_path):
+            if not HeaderCache.build_missing or os.path.exists(failed_path):
+                return False
+            return _buildLibrary(header_paths, lib_name, lib_path)
+    return ROOT.gSystem.Load(lib_path) >= 0
+
+def declareHeaders(*header_paths, dependencies=()):
+    # dependencies: groups of headers shared with other calls, declared before header_paths
+    for dependency in dependencies:
+        declareHeaders(*dependency)
+    key = tuple(os.path.realpath(path) for path in header_paths)
+    if key in _declared:
+        return
+    _declared.add(key)
+    if HeaderCache.cache_dir is not None and _loadLibrary(header_paths):
+        return
+    for path in header_paths:
+        ROOT.gInterpreter.Declare(f'#include "{path}"')
@@ -6,6 +6,7 @@
 #include <Math/GenVector/PtEtaPhiM4D.h>
 #include "Math/VectorUtil.h"
 #include "TRandom3.h"
+#include <array>
 #include <cassert>
 
 // #define BAMBOO_JME_DEBUG // uncomment to debug
@@ -26,15 +27,8 @@ void JetMETVariationsCalculatorBase::setJEC(const std::vector<JetCorrectorParame
 namespace {
 
   double GetRandomNumber(int event, double jet_pt, double jet_eta, double jet_phi, double sigma){
-    std::normal_distribution<> d(0, sigma);
-
     // Initialize random generator with seed dependent on the jet for future reproducibility and sync
-    size_t seed = event + size_t(jet_pt * 100) + size_t(std::abs(jet_eta) * 100) * 100 + size_t(std::abs(jet_phi) * 100) * 10000;
-    std::mt19937_64 random_generator_(seed);
-    double randomNumber = d(random_generator_);
-    //std::cout << "seed = " << seed << std::endl;
-    //std::cout << "random number = " << randomNumber << std::endl;
-    return randomNumber;
+    return jmerandom::mt19937Normal(jmerandom::jetSeed(event, jet_pt, jet_eta, jet_phi), sigma);
   }
   TRandom3& getTRandom3(uint32_t seed) {
     static thread_local TRandom3 rg{};
@@ -73,37 +67,54 @@ namespace {
     return angle;
   }
 
-  std::vector<float> fillVector(const std::vector<std::string>& names, const JME::JetParameters::value_type& jetParams)
+  // only the jet pt and eta are passed to the JES uncertainty tables
+  JME::Binning jesBinningFromString(const std::string& name)
   {
     static const std::unordered_map<std::string,JME::Binning> jmeBinningFromString = {
         {"JetEta", JME::Binning::JetEta},
-        {"JetPt" , JME::Binning::JetPt},
-        // TODO JetPhi, JetEMF, LepPx, LepPy, LepPz
-        {"JetE"  , JME::Binning::JetE}
+        {"JetPt" , JME::Binning::JetPt}
       };
-    std::vector<float> result;
-    result.reserve(names.size());
-    for ( const auto& nm : names ) {
-      const auto it_key = jmeBinningFromString.find(nm);
-      if ( std::end(jmeBinningFromString) == it_key ) {
-        throw std::runtime_error{"Unknown binning variable: "+nm};
-      } else {
-        const auto it_par = jetParams.find(it_key->second);
-        if ( std::end(jetParams) == it_par ) {
-          throw std::runtime_error{"Binning variable "+nm+" not found"};
-        } else {
-          result.push_back(it_par->second);
-        }
-      }
+    const auto it_key = jmeBinningFromString.find(name);
+    if ( std::end(jmeBinningFromString) == it_key ) {
+      throw std::runtime_error{"Unsupported binning variable for JES uncertainties: "+name};
+    }
+    return it_key->second;
+  }
+
+  void fillVector(std::vector<float>& result, const std::vector<JME::Binning>& vars, float pt, float eta)
+  {
+    result.clear();
+    for ( const auto var : vars ) {
+      result.push_back(var == JME::Binning::JetPt ? pt : eta);
     }
-    return result;
   }
 
-  float getUncertainty(const SimpleJetCorrectionUncertainty& uncert, const JME::JetParameters::value_type& jetParams, bool direction)
+  float getUncertainty(const JESUncertaintySource& source, float pt, float eta, bool direction)
   {
-    const auto vx = fillVector(uncert.parameters().definitions().binVar(), jetParams);
-    const auto vy = fillVector(uncert.parameters().definitions().parVar(), jetParams);
-    return uncert.uncertainty(vx, vy[0], direction);
+    // reused between calls, so the parameter vectors are not allocated per jet and source
+    static thread_local std::vector<float> vx, vy;
+    fillVector(vx, source.binVars, pt, eta);
+    fillVector(vy, source.parVars, pt, eta);
+    return source.uncertainty.uncertainty(vx, vy[0], direction);
+  }
+
+  // nominal, down and up scale factors with a single record lookup
+  std::array<float,3> getScaleFactors(const JME::JetResolutionScaleFactor& jetEResSF, const JME::JetParameters& jPar)
+  {
+    const auto& object = jetEResSF.getResolutionObject();
+    if ( object->getDefinition().nVariables() != 0 ) { // parametrized scale factors
+      return {{ jetEResSF.getScaleFactor(jPar, Variation::NOMINAL),
+                jetEResSF.getScaleFactor(jPar, Variation::DOWN),
+                jetEResSF.getScaleFactor(jPar, Variation::UP) }};
+    }
+    const auto record = object->getRecord(jPar);
+    if ( ! record ) {
+      return {{ 1., 1., 1. }};
+    }
+    const auto& values = record->getParametersValues();
+    return {{ values[static_cast<std::size_t>(Variation::NOMINAL)],
+              values[static_cast<std::size_t>(Variation::DOWN)],
+              values[static_cast<std::size_t>(Variation::UP)] }};
   }
 
   float deltaHEM2018Issue(float pt_nom, int jetId, float phi, float eta ) {
@@ -179,6 +190,28 @@ namespace {
   }
 }
 
+JESUncertaintySource::JESUncertaintySource(const std::string& name, const JetCorrectorParameters& params)
+  : uncertainty(params)
+{
+  for ( const auto& nm : params.definitions().binVar() ) {
+    binVars.push_back(jesBinningFromString(nm));
+  }
+  for ( const auto& nm : params.definitions().parVar() ) {
+    parVars.push_back(jesBinningFromString(nm));
+  }
+  static const std::unordered_map<std::string,std::pair<int,int>> flavourSelections = {
+      {"FlavorPureGluon" , {21, 21}},
+      {"FlavorPureQuark" , { 1,  3}},
+      {"FlavorPureCharm" , { 4,  4}},
+      {"FlavorPureBottom", { 5,  5}}
+    };
+  const auto it_flav = flavourSelections.find(name);
+  if ( std::end(flavourSelections) != it_flav ) {
+    m_flavourSelection = true;
+    m_flavourMin = it_flav->second.first;
+    m_flavourMax = it_flav->second.second;
+  }
+}
 
 // TODO with orig MET and jets (sumpx,sumpy): calc modif MET(sig), produce bigger results type
 
@@ -204,4 +237,91 @@ std::size_t JetMETVariationsCalculatorBase::findGenMatch(const double pt, const
   }
   LogDebug_JME << ")";
   return igBest;
-}
\ No newline at end of file
+}
+std::size_t JetMETVariationsCalculatorBase::findGenMatch(const double pt, const float eta, const float phi, const ROOT::VecOps::RVec<float>& gen_pt, const ROOT::VecOps::RVec<float>& gen_eta, const ROOT::VecOps::RVec<float>& gen_phi, const double resolution, const GenJetGrid& genGrid ) const
+{
+  auto dr2Min = std::numeric_limits<float>::max();
+  std::size_t igBest{gen_pt.size()};
+  std::array<std::size_t,9> cells;
+  const auto nCells = genGrid.neighbourCells(eta, phi, cells);
+  for ( std::size_t ic{0}; ic != nCells; ++ic ) {
+    for ( auto it = genGrid.cellBegin(cells[ic]); it != genGrid.cellEnd(cells[ic]); ++it ) {
+      const auto ig = *it;
+      const auto dphi = phi_mpi_pi(gen_phi[ig]-phi);
+      const auto deta = (gen_eta[ig]-eta);
+      const auto dr2 = dphi*dphi + deta*deta;
+      // the cells are not visited in index order: on equal distance, keep the first generator-level jet as the linear scan does
+      if ( ( dr2 < dr2Min || ( dr2 == dr2Min && ig < igBest ) ) && ( dr2 < m_genMatch_dR2max ) ) {
+        if ( std::abs(gen_pt[ig]-pt) < m_genMatch_dPtmax*resolution ) {
+          dr2Min = dr2;
+          igBest = ig;
+        }
+      }
+    }
+  }
+  LogDebug_JME << "(grid match: " << igBest << ")";
+  return igBest;
+}
+
+const GenJetGrid& JetMETVariationsCalculatorBase::buildGenJetGrid(const ROOT::VecOps::RVec<float>& gen_eta, const ROOT::VecOps::RVec<float>& gen_phi) const
+{
+  static thread_local GenJetGrid genGrid;
+  genGrid.build(gen_eta, gen_phi, std::sqrt(m_genMatch_dR2max));
+  return genGrid;
+}
+
+void GenJetGrid::build(const ROOT::VecOps::RVec<float>& gen_eta, const ROOT::VecOps::RVec<float>& gen_phi, float maxDR)
+{
+  // cells slightly larger than the cone, such that rounding cannot put matching jets two cells apart
+  const float cellSize = maxDR*1.001f;
+  m_nEta = std::max(std::size_t(1), static_cast<std::size_t>(2*s_etaMax/cellSize));
+  m_nPhi = std::max(std::size_t(1), static_cast<std::size_t>(2*M_PI/cellSize));
+  m_etaWidth = 2*s_etaMax/m_nEta;
+  m_phiWidth = 2*M_PI/m_nPhi;
+  const auto nGen = gen_eta.size();
+  m_cellStart.assign(m_nEta*m_nPhi+1, 0);
+  m_genCell.resize(nGen);
+  for ( std::size_t ig{0}; ig != nGen; ++ig ) {
+    m_genCell[ig] = etaCell(gen_eta[ig])*m_nPhi + phiCell(gen_phi[ig]);
+    ++m_cellStart[m_genCell[ig]+1];
+  }
+  for ( std::size_t ic{0}; ic != m_nEta*m_nPhi; ++ic ) {
+    m_cellStart[ic+1] += m_cellStart[ic];
+  }
+  m_cursor.assign(m_cellStart.begin(), m_cellStart.end()-1);
+  m_index.resize(nGen);
+  for ( std::size_t ig{0}; ig != nGen; ++ig ) {
+    m_index[m_cursor[m_genCell[ig]]++] = ig;
+  }
+}
+
+std::size_t GenJetGrid::etaCell(float eta) const
+{
+  const auto bin = std::floor((eta+s_etaMax)/m_etaWidth);
+  return static_cast<std::size_t>(std::min(std::max(bin, 0.f), static_cast<float>(m_nEta-1)));
+}
+
+std::size_t GenJetGrid::phiCell(float phi) const
+{
+  const auto bin = static_cast<std::size_t>(std::floor((phi_mpi_pi(phi)+M_PI)/m_phiWidth));
+  return bin < m_nPhi ? bin : m_nPhi-1; // phi = pi
+}
+
+std::size_t GenJetGrid::neighbourCells(float eta, float phi, std::array<std::size_t,9>& cells) const
+{
+  const auto iEta = etaCell(eta);
+  const auto iPhi = phiCell(phi);
+  std::size_t nCells{0};
+  for ( std::size_t jEta = ( iEta == 0 ? 0 : iEta-1 ); jEta != std::min(iEta+2, m_nEta); ++jEta ) {
+    if ( m_nPhi < 3 ) { // all phi cells are neighbours
+      for ( std::size_t jPhi{0}; jPhi != m_nPhi; ++jPhi ) {
+        cells[nCells++] = jEta*m_nPhi + jPhi;
+      }
+    } else {
+      cells[nCells++] = jEta*m_nPhi + ( iPhi == 0 ? m_nPhi-1 : iPhi-1 );
+      cells[nCells++] = jEta*m_nPhi + iPhi;
+      cells[nCells++] = jEta*m_nPhi + ( iPhi+1 == m_nPhi ? 0 : iPhi+1 );
+    }
+  }
+  return nCells;
+}
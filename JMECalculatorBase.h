@@ -1,6 +1,7 @@
 #ifndef CMSJMECalculators_JMESystematicsCalculators_H
 #define CMSJMECalculators_JMESystematicsCalculators_H
 
+#include <array>
 #include <map>
 #include <ROOT/RVec.hxx>
 #include "JetMETCorrections/Modules/interface/JetResolution.h"
@@ -8,6 +9,7 @@
 #include "CondFormats/JetMETObjects/interface/SimpleJetCorrectionUncertainty.h"
 #include "CondFormats/JetMETObjects/interface/FactorizedJetCorrectorCalculator.h"
 #include "CommonTools/Utils/interface/FormulaEvaluator.h"
+#include "JMERandom.h"
 
 class TRandom3;
 
@@ -20,6 +22,9 @@ public:
   ModifiedPtMCollection() = default;
   ModifiedPtMCollection(std::size_t n, const compv_t& pt, const compv_t& mass)
     : m_pt(n, pt), m_mass(n, mass) {}
+  // empty variations, to be filled with set
+  explicit ModifiedPtMCollection(std::size_t n)
+    : m_pt(n), m_mass(n) {}
 
   std::size_t size() const { return m_pt.size(); }
 
@@ -78,6 +83,41 @@ private:
   std::vector<compv_t> m_msd;
 };
 
+class FlatPtMMsdCollection { // for fat jets, all variations in contiguous (variation, jet) buffers
+public:
+  FlatPtMMsdCollection() = default;
+
+  // nPt rows for pt and nM rows for mass and msoftdrop, the allocated capacity is reused between events
+  void reset(std::size_t nPt, std::size_t nM, std::size_t nJets) {
+    m_nPt = nPt;
+    m_nM = nM;
+    m_nJets = nJets;
+    m_pt.resize(nPt*nJets);
+    m_mass.resize(nM*nJets);
+    m_msd.resize(nM*nJets);
+  }
+
+  std::size_t size() const { return m_nPt; }
+  std::size_t sizeM() const { return m_nM; }
+  std::size_t nJets() const { return m_nJets; }
+
+  float& pt(std::size_t i, std::size_t j) { return m_pt[i*m_nJets+j]; }
+  float& mass(std::size_t i, std::size_t j) { return m_mass[i*m_nJets+j]; }
+  float& msoftdrop(std::size_t i, std::size_t j) { return m_msd[i*m_nJets+j]; }
+  float pt(std::size_t i, std::size_t j) const { return m_pt[i*m_nJets+j]; }
+  float mass(std::size_t i, std::size_t j) const { return m_mass[i*m_nJets+j]; }
+  float msoftdrop(std::size_t i, std::size_t j) const { return m_msd[i*m_nJets+j]; }
+
+  const float* ptRow(std::size_t i) const { return m_pt.data()+i*m_nJets; }
+  const float* massRow(std::size_t i) const { return m_mass.data()+i*m_nJets; }
+  const float* msoftdropRow(std::size_t i) const { return m_msd.data()+i*m_nJets; }
+private:
+  std::size_t m_nPt{0}, m_nM{0}, m_nJets{0};
+  std::vector<float> m_pt;
+  std::vector<float> m_mass;
+  std::vector<float> m_msd;
+};
+
 class ModifiedMET {
 public:
   using compv_t = ROOT::VecOps::RVec<double>;
@@ -109,6 +149,43 @@ private:
 };
 }
 
+// JES uncertainty source, with the binning variables and the parton flavour selection resolved once
+struct JESUncertaintySource {
+  JESUncertaintySource(const std::string& name, const JetCorrectorParameters& params);
+
+  bool acceptsFlavour(int absPartonFlavour) const {
+    return ( ! m_flavourSelection ) || ( absPartonFlavour >= m_flavourMin && absPartonFlavour <= m_flavourMax );
+  }
+
+  SimpleJetCorrectionUncertainty uncertainty;
+  std::vector<JME::Binning> binVars;
+  std::vector<JME::Binning> parVars;
+private:
+  bool m_flavourSelection{false};
+  int m_flavourMin{0}, m_flavourMax{0};
+};
+
+// Index of the generator-level jets of an event in eta-phi cells at least as large as the matching cone,
+// so that the generator-level jets within the cone of a jet are in the 3x3 cells around it
+class GenJetGrid {
+public:
+  void build(const ROOT::VecOps::RVec<float>& gen_eta, const ROOT::VecOps::RVec<float>& gen_phi, float maxDR);
+  // fills the indices of the cells around (eta, phi), returns their number
+  std::size_t neighbourCells(float eta, float phi, std::array<std::size_t,9>& cells) const;
+  const std::size_t* cellBegin(std::size_t cell) const { return m_index.data()+m_cellStart[cell]; }
+  const std::size_t* cellEnd(std::size_t cell) const { return m_index.data()+m_cellStart[cell+1]; }
+private:
+  std::size_t etaCell(float eta) const;
+  std::size_t phiCell(float phi) const;
+
+  static constexpr float s_etaMax = 5.5; // jets beyond are put in the outermost cells
+  std::size_t m_nEta{1}, m_nPhi{1};
+  float m_etaWidth{2*s_etaMax}, m_phiWidth{2*M_PI};
+  std::vector<std::size_t> m_cellStart; // m_nEta*m_nPhi+1 offsets in m_index
+  std::vector<std::size_t> m_index;     // generator-level jet indices, sorted by cell
+  std::vector<std::size_t> m_genCell, m_cursor;
+};
+
 class JetMETVariationsCalculatorBase {
 public:
   using p4compv_t = ROOT::VecOps::RVec<float>;
@@ -129,24 +206,30 @@ public:
 
   void setJEC(const std::vector<JetCorrectorParameters>& jecParams);
   void setAddHEM2018Issue(bool enable) { m_addHEM2018Issue = enable; }
+  void setSmearingGenerator(jmerandom::Generator generator) { m_smearingGenerator = generator; }
 
   void addJESUncertainty(const std::string& name, const JetCorrectorParameters& params)
   {
     m_jesUncSources.emplace(std::piecewise_construct,
         std::forward_as_tuple(name),
-        std::forward_as_tuple(params));
+        std::forward_as_tuple(name, params));
   }
 protected:
   std::size_t findGenMatch(const double pt, const float eta, const float phi, const ROOT::VecOps::RVec<float>& gen_pt, const ROOT::VecOps::RVec<float>& gen_eta, const ROOT::VecOps::RVec<float>& gen_phi, const double resolution ) const;
+  // same as above, only considering the generator-level jets in the cells around the jet
+  std::size_t findGenMatch(const double pt, const float eta, const float phi, const ROOT::VecOps::RVec<float>& gen_pt, const ROOT::VecOps::RVec<float>& gen_eta, const ROOT::VecOps::RVec<float>& gen_phi, const double resolution, const GenJetGrid& genGrid ) const;
+  // grid of the generator-level jets of the current event, for the matching cone
+  const GenJetGrid& buildGenJetGrid(const ROOT::VecOps::RVec<float>& gen_eta, const ROOT::VecOps::RVec<float>& gen_phi) const;
 
   // config options
   bool m_doSmearing{false}, m_smearDoGenMatch;      // default: yes, yes
   bool m_addHEM2018Issue{false}, m_splitJER{false}; // default: no, no
   float m_genMatch_dR2max, m_genMatch_dPtmax;       // default: R/2 (0.2) and 3
+  jmerandom::Generator m_smearingGenerator{jmerandom::Generator::MT19937};
   // parameters and helpers
   JME::JetResolution m_jetPtRes;
   JME::JetResolutionScaleFactor m_jetEResSF;
   std::unique_ptr<FactorizedJetCorrectorCalculator> m_jetCorrector;
-  std::unordered_map<std::string,SimpleJetCorrectionUncertainty> m_jesUncSources;
+  std::unordered_map<std::string,JESUncertaintySource> m_jesUncSources;
 };
 #endif // CMSJMECalculators_JMESystematicsCalculators_H
\ No newline at end of file
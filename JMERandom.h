@@ -0,0 +1,70 @@
+#pragma once
+
+#include <array>
+#include <cmath>
+#include <cstdint>
+#include <random>
+#include <vector>
+
+// Random numbers for the stochastic jet smearing.
+// The random number of a jet only depends on the event number and on the jet pt, eta and phi,
+// so the smearing is reproducible independently of the processing order and of the number of threads.
+// Two generators are available for the same seed:
+// - MT19937: a std::mt19937_64 is seeded for each jet (reference, as used for the published results);
+// - Philox: counter-based Philox4x32-10 generator, keyed on the seed of the jet. Its state is the
+//   seed itself, so the numbers for all jets of an event are computed in one loop without any setup cost.
+namespace jmerandom {
+
+enum class Generator { MT19937, Philox };
+
+inline std::uint64_t jetSeed(int event, double jet_pt, double jet_eta, double jet_phi)
+{
+  const size_t seed = event + size_t(jet_pt * 100) + size_t(std::abs(jet_eta) * 100) * 100 + size_t(std::abs(jet_phi) * 100) * 10000;
+  return seed;
+}
+
+inline double mt19937Normal(std::uint64_t seed, double sigma)
+{
+  std::normal_distribution<> d(0, sigma);
+  std::mt19937_64 random_generator_(seed);
+  return d(random_generator_);
+}
+
+// Philox4x32 with 10 rounds (Salmon et al., "Parallel random numbers: as easy as 1, 2, 3", SC11)
+inline std::array<std::uint32_t,4> philox4x32(std::array<std::uint32_t,4> ctr, std::array<std::uint32_t,2> key)
+{
+  constexpr std::uint32_t M0 = 0xD2511F53, M1 = 0xCD9E8D57;
+  constexpr std::uint32_t W0 = 0x9E3779B9, W1 = 0xBB67AE85;
+  for ( int round{0}; round != 10; ++round ) {
+    const std::uint64_t p0 = static_cast<std::uint64_t>(M0) * ctr[0];
+    const std::uint64_t p1 = static_cast<std::uint64_t>(M1) * ctr[2];
+    ctr = {{ static_cast<std::uint32_t>(p1 >> 32) ^ ctr[1] ^ key[0], static_cast<std::uint32_t>(p1),
+             static_cast<std::uint32_t>(p0 >> 32) ^ ctr[3] ^ key[1], static_cast<std::uint32_t>(p0) }};
+    key[0] += W0;
+    key[1] += W1;
+  }
+  return ctr;
+}
+
+// standard normal number from the first Philox block of the seed (Box-Muller with two 53-bit uniforms)
+inline double philoxNormal(std::uint64_t seed)
+{
+  constexpr double inv2pow53 = 1./9007199254740992.;
+  const auto r = philox4x32({{ 0, 0, 0, 0 }}, {{ static_cast<std::uint32_t>(seed), static_cast<std::uint32_t>(seed >> 32) }});
+  const double u1 = ( ( ( static_cast<std::uint64_t>(r[0]) << 21 ) ^ ( r[1] >> 11 ) ) + 1 ) * inv2pow53; // (0, 1]
+  const double u2 = ( ( static_cast<std::uint64_t>(r[2]) << 21 ) ^ ( r[3] >> 11 ) ) * inv2pow53;       // [0, 1)
+  return std::sqrt(-2.*std::log(u1)) * std::cos(2.*M_PI*u2);
+}
+
+// standard normal numbers for all jets of an event
+template<typename PtV, typename EtaV, typename PhiV>
+void philoxNormals(int event, const PtV& jet_pt, const EtaV& jet_eta, const PhiV& jet_phi, std::vector<double>& normals)
+{
+  const std::size_t nJets = jet_pt.size();
+  normals.resize(nJets);
+  for ( std::size_t i{0}; i != nJets; ++i ) {
+    normals[i] = philoxNormal(jetSeed(event, jet_pt[i], jet_eta[i], jet_phi[i]));
+  }
+}
+
+} // namespace jmerandom
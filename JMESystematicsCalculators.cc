@@ -35,7 +35,7 @@ JetVariationsCalculator::result_t JetVariationsCalculator::produce(
   const auto nVariations = 1+( m_doSmearing ? 2*( m_splitJER ? 6 : 1 ) : 0 )+2*m_jesUncSources.size()+( m_addHEM2018Issue ? 2 : 0 ); // 1(nom)+2(JER)+2*len(JES)[+2(HEM)]
   LogDebug_JME << "JME:: hello from JetVariations produce. Got " << jet_pt.size() << " jets" << std::endl;
   const auto nJets = jet_pt.size();
-  result_t out{nVariations, jet_pt, jet_mass};
+  result_t out{nVariations}; // every variation is set below
   ROOT::VecOps::RVec<double> pt_nom{jet_pt}, mass_nom{jet_mass};
   if ( m_jetCorrector ) {
     LogDebug_JME << "JME:: reapplying JEC" << std::endl;
@@ -66,8 +66,14 @@ JetVariationsCalculator::result_t JetVariationsCalculator::produce(
   std::size_t iVar = 1; // after nominal
   if ( m_doSmearing ) {
     LogDebug_JME << "JME:: Smearing (seed=" << seed << ")" << std::endl;
+    const GenJetGrid* genGrid = m_smearDoGenMatch ? &buildGenJetGrid(genjet_eta, genjet_phi) : nullptr;
     p4compv_t pt_jerUp(pt_nom.size(), 0.), mass_jerUp(mass_nom.size(), 0.);
     p4compv_t pt_jerDown(pt_nom.size(), 0.), mass_jerDown(mass_nom.size(), 0.);
+    const bool counterBasedRNG = ( m_smearingGenerator == jmerandom::Generator::Philox );
+    static thread_local std::vector<double> normals;
+    if ( counterBasedRNG ) {
+      jmerandom::philoxNormals(event, pt_nom, jet_eta, jet_phi, normals);
+    }
     for ( std::size_t i{0}; i != nJets; ++i ) {
       const auto eOrig = ROOT::Math::LorentzVector<ROOT::Math::PtEtaPhiM4D<double>>(pt_nom[i], jet_eta[i], jet_phi[i], mass_nom[i]).E();
       double smearFactor_nom{1.}, smearFactor_down{1.}, smearFactor_up{1.};
@@ -81,7 +87,7 @@ JetVariationsCalculator::result_t JetVariationsCalculator::produce(
         LogDebug_JME << "JME:: ";
         float genPt = -1;
         if ( m_smearDoGenMatch ) {
-          const auto iGen = findGenMatch(pt_nom[i], jet_eta[i], jet_phi[i], genjet_pt, genjet_eta, genjet_phi, ptRes*pt_nom[i]);
+          const auto iGen = findGenMatch(pt_nom[i], jet_eta[i], jet_phi[i], genjet_pt, genjet_eta, genjet_phi, ptRes*pt_nom[i], *genGrid);
           if ( iGen != genjet_pt.size() ) {
             genPt = genjet_pt[iGen];
             LogDebug_JME << "genPt=" << genPt << " ";
@@ -90,15 +96,19 @@ JetVariationsCalculator::result_t JetVariationsCalculator::produce(
         //std::cout<<std::endl;
         //std::cout << "pt nom " << i << " = " << pt_nom[i] << std::endl;
         //const auto rand = ( genPt < 0. ) ? rg.Gaus(0, ptRes) : -1.;
-        const auto rand = ( genPt < 0. ) ? GetRandomNumber(event, pt_nom[i], jet_eta[i], jet_phi[i], ptRes) : -1.;
+        double rand = -1.;
+        if ( genPt < 0. ) {
+          rand = counterBasedRNG ? normals[i]*ptRes : GetRandomNumber(event, pt_nom[i], jet_eta[i], jet_phi[i], ptRes);
+        }
         LogDebug_JME << "jet_pt_resolution: " << ptRes << ", rand: " << rand << std::endl;
         //std::cout << " nominal " << std::endl;
-        smearFactor_nom  = jetESmearFactor(pt_nom[i], eOrig, genPt, ptRes, m_jetEResSF.getScaleFactor(jPar, Variation::NOMINAL), rand);
+        const auto sf = getScaleFactors(m_jetEResSF, jPar); // NOMINAL, DOWN, UP
+        smearFactor_nom  = jetESmearFactor(pt_nom[i], eOrig, genPt, ptRes, sf[0], rand);
         //std::cout << " nominal ended " << std::endl;
         //std::cout << std::endl;
-        smearFactor_down = jetESmearFactor(pt_nom[i], eOrig, genPt, ptRes, m_jetEResSF.getScaleFactor(jPar, Variation::DOWN   ), rand);
-        smearFactor_up   = jetESmearFactor(pt_nom[i], eOrig, genPt, ptRes, m_jetEResSF.getScaleFactor(jPar, Variation::UP     ), rand);
-        // LogDebug_JME << "  scalefactors are NOMINAL=" << m_jetEResSF.getScaleFactor(jPar, Variation::NOMINAL) << ", DOWN=" << m_jetEResSF.getScaleFactor(jPar, Variation::DOWN) << ", UP=" << m_jetEResSF.getScaleFactor(jPar, Variation::UP) << std::endl;
+        smearFactor_down = jetESmearFactor(pt_nom[i], eOrig, genPt, ptRes, sf[1], rand);
+        smearFactor_up   = jetESmearFactor(pt_nom[i], eOrig, genPt, ptRes, sf[2], rand);
+        // LogDebug_JME << "  scalefactors are NOMINAL=" << sf[0] << ", DOWN=" << sf[1] << ", UP=" << sf[2] << std::endl;
         // LogDebug_JME << "  smearfactors are NOMINAL=" << smearFactor_nom << ", DOWN=" << smearFactor_down << ", UP=" << smearFactor_up << std::endl;
       }
       pt_jerDown[i]   = pt_nom[i]*smearFactor_down;
@@ -116,15 +126,14 @@ JetVariationsCalculator::result_t JetVariationsCalculator::produce(
         jerBin[j] = jerSplitID(pt_nom[j], jet_eta[j]);
       }
       for ( int i{0}; i != 6; ++i ) {
-        p4compv_t pt_jeriUp{pt_nom}, mass_jeriUp{mass_nom};
-        p4compv_t pt_jeriDown{pt_nom}, mass_jeriDown{mass_nom};
+        p4compv_t pt_jeriUp(nJets), mass_jeriUp(nJets);
+        p4compv_t pt_jeriDown(nJets), mass_jeriDown(nJets);
         for ( std::size_t j{0}; j != nJets; ++j ) {
-          if ( jerBin[j] == i ) {
-            pt_jeriUp[j] = pt_jerUp[j];
-            pt_jeriDown[j] = pt_jerDown[j];
-            mass_jeriUp[j] = mass_jerUp[j];
-            mass_jeriDown[j] = mass_jerDown[j];
-          }
+          const bool inBin = ( jerBin[j] == i );
+          pt_jeriUp[j]     = inBin ? pt_jerUp[j]     : pt_nom[j];
+          pt_jeriDown[j]   = inBin ? pt_jerDown[j]   : pt_nom[j];
+          mass_jeriUp[j]   = inBin ? mass_jerUp[j]   : mass_nom[j];
+          mass_jeriDown[j] = inBin ? mass_jerDown[j] : mass_nom[j];
         }
         out.set(iVar++, std::move(pt_jeriUp)  , std::move(mass_jeriUp)  );
         out.set(iVar++, std::move(pt_jeriDown), std::move(mass_jeriDown));
@@ -151,20 +160,26 @@ JetVariationsCalculator::result_t JetVariationsCalculator::produce(
     out.set(iVar++, std::move(pt_down), std::move(mass_down));
   }
   // JES uncertainties
-  for ( auto& jesUnc : m_jesUncSources ) {
+  // jet inputs shared by all sources, converted once per event
+  static thread_local std::vector<float> jesPt, jesEta;
+  static thread_local std::vector<int> jesFlav;
+  jesPt.assign(std::begin(pt_nom), std::end(pt_nom));
+  jesEta.assign(std::begin(jet_eta), std::end(jet_eta));
+  jesFlav.resize(nJets);
+  for ( std::size_t i{0}; i != nJets; ++i ) {
+    jesFlav[i] = std::abs(jet_partonFlavour[i]);
+  }
+  for ( const auto& jesUnc : m_jesUncSources ) {
     LogDebug_JME << "JME:: evaluating JES uncertainty: " << jesUnc.first << std::endl;
+    const auto& source = jesUnc.second;
     p4compv_t pt_jesDown(pt_nom.size(), 0.), mass_jesDown(mass_nom.size(), 0.);
     p4compv_t pt_jesUp(pt_nom.size(), 0.), mass_jesUp(mass_nom.size(), 0.);
     for ( std::size_t i{0}; i != nJets; ++i ) {
       float delta = 0.;
-      const auto partonFlav = std::abs(jet_partonFlavour[i]);
-      if (!(jesUnc.first == "FlavorPureGluon" && partonFlav != 21) &&
-          !(jesUnc.first == "FlavorPureQuark" && !(partonFlav >= 1 && partonFlav <= 3)) &&
-          !(jesUnc.first == "FlavorPureCharm" && partonFlav != 4) &&
-          !(jesUnc.first == "FlavorPureBottom" && partonFlav != 5)) {
-          delta = getUncertainty(jesUnc.second, { {JME::Binning::JetPt, pt_nom[i]}, {JME::Binning::JetEta, jet_eta[i]} }, true);
+      if ( source.acceptsFlavour(jesFlav[i]) ) {
+        delta = getUncertainty(source, jesPt[i], jesEta[i], true);
       }
-      LogDebug_JME << "JME:: jet " << i << ", parton flavour = " << partonFlav << ", delta = " << delta << std::endl;
+      LogDebug_JME << "JME:: jet " << i << ", parton flavour = " << jesFlav[i] << ", delta = " << delta << std::endl;
       pt_jesDown[i]   = pt_nom[i]*(1.-delta);
       mass_jesDown[i] = mass_nom[i]*(1.-delta);
       pt_jesUp[i]     = pt_nom[i]*(1.+delta);
@@ -368,6 +383,7 @@ FatJetVariationsCalculator::result_t FatJetVariationsCalculator::produce(
     p4compv_t mass_jerUp{mass_nom}, mass_jerDown{mass_nom}, mass_jmrUp{mass_nom}, mass_jmrDown{mass_nom};
     p4compv_t msd_jerUp{msd_nom}, msd_jerDown{msd_nom}, msd_jmrUp{msd_nom}, msd_jmrDown{msd_nom};
     LogDebug_JME << "JME:: Smearing (seed=" << seed << ")" << std::endl;
+    const GenJetGrid* genGrid = m_smearDoGenMatch ? &buildGenJetGrid(genjet_eta, genjet_phi) : nullptr;
     auto& rg = getTRandom3(seed);
     for ( std::size_t i{0}; i != nJets; ++i ) {
       double jer_nom{1.}, jer_up{1.}, jer_down{1.}, jmr_nom{1.}, jmr_up{1.}, jmr_down{1.}, gmr_nom{1.}, gmr_up{1.}, gmr_down{1.};
@@ -382,7 +398,7 @@ FatJetVariationsCalculator::result_t FatJetVariationsCalculator::produce(
         LogDebug_JME << "JME:: ";
         float genPt{-1}, genM{-1.};
         if ( m_smearDoGenMatch ) {
-          const auto iGen = findGenMatch(pt_nom[i], jet_eta[i], jet_phi[i], genjet_pt, genjet_eta, genjet_phi, ptRes*pt_nom[i]);
+          const auto iGen = findGenMatch(pt_nom[i], jet_eta[i], jet_phi[i], genjet_pt, genjet_eta, genjet_phi, ptRes*pt_nom[i], *genGrid);
           if ( iGen != genjet_pt.size() ) {
             genPt = genjet_pt[iGen];
             genM  = genjet_mass[iGen];
@@ -394,9 +410,10 @@ FatJetVariationsCalculator::result_t FatJetVariationsCalculator::produce(
           const auto rand = ( genPt < 0. ) ? GetRandomNumber(event, pt_nom[i], jet_eta[i], jet_phi[i], ptRes) : -1.;
           LogDebug_JME << "jet_pt_resolution: " << ptRes << ", rand: " << rand << std::endl;
           LogDebug_JME << "jet_pt_resolution: " << ptRes << ", rand: " << rand << std::endl;
-          jer_nom  = jetESmearFactor(pt_nom[i], eOrig, genPt, ptRes, m_jetEResSF.getScaleFactor(jPar, Variation::NOMINAL), rand);
-          jer_down = jetESmearFactor(pt_nom[i], eOrig, genPt, ptRes, m_jetEResSF.getScaleFactor(jPar, Variation::DOWN   ), rand);
-          jer_up   = jetESmearFactor(pt_nom[i], eOrig, genPt, ptRes, m_jetEResSF.getScaleFactor(jPar, Variation::UP     ), rand);
+          const auto sf = getScaleFactors(m_jetEResSF, jPar); // NOMINAL, DOWN, UP
+          jer_nom  = jetESmearFactor(pt_nom[i], eOrig, genPt, ptRes, sf[0], rand);
+          jer_down = jetESmearFactor(pt_nom[i], eOrig, genPt, ptRes, sf[1], rand);
+          jer_up   = jetESmearFactor(pt_nom[i], eOrig, genPt, ptRes, sf[2], rand);
         }
         // LogDebug_JME << "  scalefactors are NOMINAL=" << m_jetEResSF.getScaleFactor(jPar, Variation::NOMINAL) << ", DOWN=" << m_jetEResSF.getScaleFactor(jPar, Variation::DOWN) << ", UP=" << m_jetEResSF.getScaleFactor(jPar, Variation::UP) << std::endl;
         // LogDebug_JME << "  smearfactors are NOMINAL=" << jer_nom[i] << ", DOWN=" << jer_down[i] << ", UP=" << jer_up[i] << std::endl;
@@ -533,7 +550,7 @@ FatJetVariationsCalculator::result_t FatJetVariationsCalculator::produce(
     p4compv_t pt_jesDown(pt_nom.size(), 0.), mass_jesDown(mass_nom.size(), 0.), msd_jesDown(msd_nom.size(), 0.);
     p4compv_t pt_jesUp(pt_nom.size(), 0.), mass_jesUp(mass_nom.size(), 0.), msd_jesUp(msd_nom.size(), 0.);
     for ( std::size_t i{0}; i != nJets; ++i ) {
-      const auto delta = getUncertainty(jesUnc.second, { {JME::Binning::JetPt, pt_nom[i]}, {JME::Binning::JetEta, jet_eta[i]} }, true);
+      const auto delta = getUncertainty(jesUnc.second, pt_nom[i], jet_eta[i], true);
       pt_jesDown  [i] = pt_nom  [i]*(1.-delta);
       mass_jesDown[i] = mass_nom[i]*(1.-delta);
       msd_jesDown [i] = msd_nom [i]*(1.-delta);
@@ -0,0 +1,152 @@
+import re
+import ROOT
+
+# Demand-driven wrapper around an RDataFrame node.
+# Define and Filter calls are recorded instead of being applied immediately. The columns are defined on the
+# underlying node only when an action or materialize() needs them, together with the recorded columns they
+# depend on, so that systematic variations that are never read are neither JIT-compiled nor computed.
+# Like RDataFrame nodes, LazyDataFrame objects are immutable: Define and Filter return a new object.
+# Dependencies of string expressions are found by matching the identifiers of the expression against the names
+# of the recorded columns; dependencies of functor-based definitions are the explicit input columns.
+# The underlying nodes are shared by all the objects derived from the same RDataFrame node: there is one node
+# per applied filter, on which the columns are defined at most once, so that actions booked on different
+# columns reuse the common Defines and Filters instead of applying them again.
+
+_identifier = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+def _expressionDeps(expression):
+    return set(_identifier.findall(expression))
+
+class _Node:
+    __slots__ = ('parent', 'name', 'deps', 'apply', 'is_filter')
+
+    def __init__(self, parent, name, deps, apply, is_filter):
+        self.parent = parent
+        self.name = name
+        self.deps = deps
+        self.apply = apply
+        self.is_filter = is_filter
+
+class _State:
+    __slots__ = ('df', 'defined')
+
+    def __init__(self, df, defined):
+        self.df = df
+        self.defined = defined # column name -> recorded node applied on df
+
+class LazyDataFrame:
+    def __init__(self, df, _tail=None, _states=None):
+        self.df = df
+        self._tail = _tail
+        # last applied filter node (None for the input node) -> _State
+        self._states = _states if _states is not None else { None: _State(df, {}) }
+
+    def _chain(self):
+        nodes = []
+        node = self._tail
+        while node is not None:
+            nodes.append(node)
+            node = node.parent
+        nodes.reverse()
+        return nodes
+
+    def _append(self, name, deps, apply, is_filter=False):
+        return LazyDataFrame(self.df, _Node(self._tail, name, deps, apply, is_filter), self._states)
+
+    def Define(self, name, *args):
+        if len(args) == 1 and isinstance(args[0], str):
+            expression = args[0]
+            return self._append(name, _expressionDeps(expression), lambda df: df.Define(name, expression))
+        if len(args) == 2 and not isinstance(args[0], str):
+            functor, columns = args
+            return self._append(name, set(columns), lambda df: df.Define(name, functor, columns))
+        raise RuntimeError(f'LazyDataFrame.Define: unsupported arguments for column {name}')
+
+    def DefineLazy(self, name, columns, define_fn):
+        return self._append(name, set(columns), define_fn)
+
+    def Filter(self, expression, *args):
+        return self._append(None, _expressionDeps(expression), lambda df: df.Filter(expression, *args), True)
+
+    def pendingColumns(self):
+        return [ node.name for node in self._chain() if not node.is_filter ]
+
+    def GetColumnNames(self):
+        return list(self.df.GetColumnNames()) + self.pendingColumns()
+
+    def HasColumn(self, name):
+        return name in self.pendingColumns() or self.df.HasColumn(name)
+
+    def GetColumnType(self, name):
+        return self.materialize([ name ]).GetColumnType(name)
+
+    def materialize(self, columns=None):
+        nodes = self._chain()
+        if columns is None:
+            needed_nodes = nodes
+        else:
+            needed = set(columns)
+            defined = set()
+            selected = []
+            for node in reversed(nodes):
+                if node.is_filter or (node.name in needed and node.name not in defined):
+                    if not node.is_filter:
+                        defined.add(node.name)
+                    needed.update(node.deps)
+                    selected.append(node)
+            needed_nodes = list(reversed(selected))
+        df = self._applyShared(needed_nodes)
+        if df is None:
+            # a column with the same name is recorded on another branch of the same filter node
+            df = self.df
+            for node in needed_nodes:
+                df = node.apply(df)
+        return df
+
+    def _applyShared(self, nodes):
+        state = self._states[None]
+        pending = []
+        for node in nodes:
+            if not node.is_filter:
+                pending.append(node)
+                continue
+            filter_state = self._states.get(node)
+            if filter_state is None:
+                if not self._define(state, pending):
+                    return None
+                pending = []
+                filter_state = _State(node.apply(state.df), dict(state.defined))
+                self._states[node] = filter_state
+            state = filter_state
+        if not self._define(state, pending):
+            return None
+        return state.df
+
+    @staticmethod
+    def _define(state, nodes):
+        nodes = [ node for node in nodes if state.defined.get(node.name) is not node ]
+        if any(node.name in state.defined for node in nodes):
+            return False
+        for node in nodes:
+            state.df = node.apply(state.df)
+            state.defined[node.name] = node
+        return True
+
+    def Snapshot(self, tree_name, file_name, columns, *args):
+        columns = list(columns)
+        return self.materialize(columns).Snapshot(tree_name, file_name, ROOT.std.vector['std::string'](columns), *args)
+
+    def AsNumpy(self, columns, *args):
+        return self.materialize(columns).AsNumpy(columns, *args)
+
+    def _action(self, method):
+        def action(*args):
+            column_args = [ arg for arg in args if isinstance(arg, str) ]
+            return getattr(self.materialize(column_args), method)(*args)
+        return action
+
+    def __getattr__(self, attr):
+        if attr in [ 'Histo1D', 'Histo2D', 'Histo3D', 'Sum', 'Mean', 'Max', 'Min', 'Take', 'Stats', 'StdDev' ]:
+            return self._action(attr)
+        # any other operation falls back to the fully materialized node
+        return getattr(self.materialize(), attr)
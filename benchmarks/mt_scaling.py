@@ -0,0 +1,82 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import yaml
+
+if __name__ == "__main__":
+    sys.path.append(os.environ['ANALYSIS_PATH'])
+
+import ROOT
+from Corrections.Corrections import Corrections
+
+# Runs a synthetic NanoAOD-like dataframe through Corrections.getNormalisationCorrections
+# with ImplicitMT enabled for different numbers of threads and reports the event rate.
+
+def makeSyntheticDataFrame(n_events):
+    df = ROOT.RDataFrame(n_events)
+    df = df.Define('genWeight', 'static_cast<float>(rdfentry_ % 10 == 0 ? -1.5 : 1.5)')
+    df = df.Define('Pileup_nTrueInt', 'static_cast<float>((rdfentry_ * 7919) % 7000) / 100.f')
+    df = df.Define('LHE_Vpt', 'static_cast<float>((rdfentry_ % 3) * 25.)')
+    df = df.Define('LHE_Njets', 'static_cast<UChar_t>(rdfentry_ % 4)')
+    df = df.Define('LHE_HT', 'static_cast<float>((rdfentry_ * 31) % 500)')
+    return df
+
+def makeSamples(sample_type):
+    samples = {
+        'bench': { 'sampleType': sample_type, 'crossSection': 'bench_xs', 'crossSectionStitch': 'bench_xs',
+                   'isReference': True },
+    }
+    xs = { 'bench_xs': { 'crossSec': 1234.5 } }
+    return samples, xs
+
+def runBenchmark(n_events, n_threads, global_params, samples, repeat):
+    if n_threads > 1:
+        ROOT.EnableImplicitMT(n_threads)
+    else:
+        ROOT.DisableImplicitMT()
+    best = None
+    for _ in range(repeat):
+        df = makeSyntheticDataFrame(n_events)
+        df, weights = Corrections.getGlobal().getNormalisationCorrections(df, global_params, samples, 'bench', [])
+        results = [ df.Sum(weight) for weight in weights ]
+        start = time.perf_counter()
+        ROOT.RDF.RunGraphs(results)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    ROOT.DisableImplicitMT()
+    return n_events / best
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Multi-threaded scaling of the normalisation corrections.')
+    parser.add_argument('--era', required=False, type=str, default='Run2_2018')
+    parser.add_argument('--nEvents', required=False, type=int, default=2000000)
+    parser.add_argument('--threads', required=False, type=str, default='1,2,4,8,16')
+    parser.add_argument('--repeat', required=False, type=int, default=3)
+    parser.add_argument('--sampleType', required=False, type=str, default='DY')
+    parser.add_argument('--corrections', required=False, type=str, default='pu')
+    parser.add_argument('--precompiledDefines', action='store_true')
+    args = parser.parse_args()
+
+    config = {
+        'era': args.era,
+        'corrections': [ c for c in args.corrections.split(',') if len(c) > 0 ],
+        'precompiledDefines': args.precompiledDefines,
+    }
+    Corrections.initializeGlobal(config, isData=False)
+    samples, xs = makeSamples(args.sampleType)
+    with tempfile.NamedTemporaryFile('w', suffix='.yaml', delete=False) as xs_file:
+        yaml.safe_dump(xs, xs_file)
+    global_params = { 'luminosity': 59830., 'crossSectionsFile': xs_file.name }
+
+    try:
+        rate_1 = None
+        print(f'{"threads":>8} {"events/s":>14} {"speedup":>8}')
+        for n_threads in [ int(n) for n in args.threads.split(',') ]:
+            rate = runBenchmark(args.nEvents, n_threads, global_params, samples, args.repeat)
+            if rate_1 is None:
+                rate_1 = rate
+            print(f'{n_threads:>8} {rate:>14.0f} {rate / rate_1:>8.2f}')
+    finally:
+        os.remove(xs_file.name)
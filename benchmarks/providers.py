@@ -0,0 +1,593 @@
+import argparse
+import gzip
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from array import array
+
+if __name__ == "__main__":
+    sys.path.append(os.environ['ANALYSIS_PATH'])
+
+import ROOT
+from Corrections.Corrections import Corrections, period_names
+from Corrections.CorrectionsCore import *
+
+# Throughput of each correction producer method on a synthetic NanoAOD-like input.
+# The correction payloads are replaced by stubs written to a local directory: they have the same
+# correction names, inputs and file layout as the real ones, so that the providers are initialised
+# without /cvmfs, but their content is made up. Each method runs in a separate process, so that the
+# JIT time and the peak RSS of one method are not affected by the others. The results are reported as JSON.
+# The JME methods (jet.*, fatjet.*) need the CMSSW JetMETCorrections libraries.
+
+lepton_legs = [ 'tau1', 'tau2' ]
+trigger_names = [ 'ditau', 'singleMu', 'singleMu50', 'singleEle', 'mutau', 'etau', 'singleTau' ]
+
+generator_code = '''
+namespace bench {
+using ROOT::VecOps::RVec;
+
+// uniform number in [0, 1) that only depends on the event, the object index and the salt (splitmix64)
+inline double uniform(ULong64_t event, size_t idx, unsigned salt)
+{
+    std::uint64_t z = event * 0x9E3779B97F4A7C15ULL + (idx + 1) * 0xBF58476D1CE4E5B9ULL + salt * 0x94D049BB133111EBULL;
+    z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9ULL;
+    z = (z ^ (z >> 27)) * 0x94D049BB133111EBULL;
+    z ^= z >> 31;
+    return (z >> 11) * (1. / 9007199254740992.);
+}
+
+inline int multiplicity(ULong64_t event, unsigned salt, int n_min, int n_max)
+{
+    return n_min + static_cast<int>(uniform(event, 0, salt) * (n_max - n_min + 1));
+}
+
+inline RVec<float> uniformVec(ULong64_t event, int n, unsigned salt, double min, double max)
+{
+    RVec<float> values(n);
+    for(int idx = 0; idx < n; ++idx)
+        values[idx] = min + (max - min) * uniform(event, idx, salt);
+    return values;
+}
+
+// exponentially falling spectrum, sorted by decreasing pt
+inline RVec<float> ptVec(ULong64_t event, int n, unsigned salt, double pt_min, double slope)
+{
+    RVec<float> pt(n);
+    for(int idx = 0; idx < n; ++idx)
+        pt[idx] = pt_min - slope * std::log(1. - uniform(event, idx, salt));
+    std::sort(pt.begin(), pt.end(), std::greater<float>());
+    return pt;
+}
+
+template <typename T>
+RVec<T> choiceVec(ULong64_t event, int n, unsigned salt, const std::vector<T>& values)
+{
+    RVec<T> result(n);
+    for(int idx = 0; idx < n; ++idx)
+        result[idx] = values[static_cast<size_t>(uniform(event, idx, salt) * values.size())];
+    return result;
+}
+
+inline RVec<bool> flagVec(ULong64_t event, int n, unsigned salt, double prob)
+{
+    RVec<bool> flags(n);
+    for(int idx = 0; idx < n; ++idx)
+        flags[idx] = uniform(event, idx, salt) < prob;
+    return flags;
+}
+
+// generator-level values close to the reconstructed ones
+inline RVec<float> smearVec(const RVec<float>& values, ULong64_t event, unsigned salt, double width, bool relative)
+{
+    RVec<float> result(values.size());
+    for(size_t idx = 0; idx < values.size(); ++idx) {
+        const double shift = width * (2 * uniform(event, idx, salt) - 1);
+        result[idx] = relative ? values[idx] * (1 + shift) : values[idx] + shift;
+    }
+    return result;
+}
+
+inline RVec<short> subJetIdx(int n_fat_jets, int offset)
+{
+    RVec<short> idx(n_fat_jets);
+    for(int fat_jet_idx = 0; fat_jet_idx < n_fat_jets; ++fat_jet_idx)
+        idx[fat_jet_idx] = 2 * fat_jet_idx + offset;
+    return idx;
+}
+} // namespace bench
+'''
+
+analysis_code = '''
+namespace bench {
+using namespace ::correction;
+
+inline RVecLV p4Vec(const RVecF& pt, const RVecF& eta, const RVecF& phi, const RVecF& mass)
+{
+    RVecLV p4(pt.size());
+    for(size_t idx = 0; idx < pt.size(); ++idx)
+        p4[idx] = LorentzVectorM(pt[idx], eta[idx], phi[idx], mass[idx]);
+    return p4;
+}
+
+inline RVecB leadingMask(const RVecF& score, size_t n_selected)
+{
+    RVecB mask(score.size(), false);
+    const auto order = ROOT::VecOps::Reverse(ROOT::VecOps::Argsort(score));
+    for(size_t idx = 0; idx < std::min(n_selected, order.size()); ++idx)
+        mask[order[idx]] = true;
+    return mask;
+}
+
+inline RVecLV p4Delta(const RVecLV& p4, ULong64_t event, unsigned salt)
+{
+    RVecLV delta(p4.size());
+    for(size_t idx = 0; idx < p4.size(); ++idx)
+        delta[idx] = p4[idx] * (0.02 * (2 * uniform(event, idx, salt) - 1));
+    return delta;
+}
+
+// minimal candidate with the members of HttCandidate read by the corrections
+struct Candidate {
+    std::array<Leg, 2> leg_type;
+    std::array<int, 2> leg_index;
+    std::array<LorentzVectorM, 2> leg_p4;
+    Channel channel_;
+
+    Channel channel() const { return channel_; }
+};
+
+// eTau, muTau and tauTau events in equal fractions
+inline Candidate makeCandidate(ULong64_t event, const RVecLV& Tau_p4, const RVecLV& Muon_p4, const RVecLV& Electron_p4)
+{
+    Candidate cand;
+    const int ch_idx = event % 3;
+    cand.channel_ = ch_idx == 0 ? Channel::eTau : ch_idx == 1 ? Channel::muTau : Channel::tauTau;
+    cand.leg_type = { ch_idx == 0 ? Leg::e : ch_idx == 1 ? Leg::mu : Leg::tau, Leg::tau };
+    cand.leg_index = { 0, ch_idx == 2 ? 1 : 0 };
+    cand.leg_p4 = { ch_idx == 0 ? Electron_p4[0] : ch_idx == 1 ? Muon_p4[0] : Tau_p4[0], Tau_p4[cand.leg_index[1]] };
+    return cand;
+}
+
+inline double checksum(float value) { return value; }
+inline double checksum(double value) { return value; }
+inline double checksum(const RVecF& values) { return ROOT::VecOps::Sum(values, 0.); }
+inline double checksum(const LorentzVectorM& p4) { return p4.pt(); }
+inline double checksum(const RVecLV& p4)
+{
+    double sum = 0;
+    for(const auto& p4_obj : p4)
+        sum += p4_obj.pt();
+    return sum;
+}
+} // namespace bench
+'''
+
+def writeCorrectionSet(path, corrections):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with gzip.open(path, 'wt') as f:
+        json.dump({ 'schema_version': 2, 'description': 'benchmark stub', 'corrections': corrections }, f)
+
+def makeCorrection(name, inputs, binned_input, edges):
+    # binned content behind a category node with only a default entry for each string input,
+    # so that a lookup goes through the same kind of nodes as the real payloads
+    content = [ round(0.95 + 0.01 * bin_idx, 4) for bin_idx in range(len(edges) - 1) ]
+    data = { 'nodetype': 'binning', 'input': binned_input, 'edges': edges, 'content': content, 'flow': 'clamp' }
+    for input_name, input_type in reversed(inputs):
+        if input_type == 'string':
+            data = { 'nodetype': 'category', 'input': input_name, 'content': [], 'default': data }
+    return {
+        'name': name, 'version': 1,
+        'inputs': [ { 'name': input_name, 'type': input_type } for input_name, input_type in inputs ],
+        'output': { 'name': 'weight', 'type': 'real' },
+        'data': data,
+    }
+
+pt_edges = [ 10., 20., 30., 40., 50., 60., 80., 100., 150., 200., 300., 500., 1000. ]
+eta_edges = [ -2.5, -2.0, -1.566, -1.444, -0.8, 0., 0.8, 1.444, 1.566, 2.0, 2.5 ]
+abs_eta_edges = [ 0., 0.9, 1.2, 2.1, 2.4 ]
+jet_eta_edges = [ -5.191, -3.139, -2.5, -1.305, 0., 1.305, 2.5, 3.139, 5.191 ]
+
+def writeJsonStubs(payload_dir, period):
+    real, integer, string = 'real', 'int', 'string'
+    tau_version = 'DeepTau2017v2p1'
+    writeCorrectionSet(os.path.join(payload_dir, 'POG', 'TAU', period, 'tau.json.gz'), [
+        makeCorrection('tau_energy_scale', [ ('pt', real), ('eta', real), ('dm', integer), ('genmatch', integer),
+                                             ('id', string), ('syst', string) ], 'pt', pt_edges),
+        makeCorrection(f'{tau_version}VSjet', [ ('pt', real), ('dm', integer), ('genmatch', integer), ('wp', string),
+                                                ('wp_VSe', string), ('syst', string), ('flag', string) ], 'pt', pt_edges),
+        makeCorrection(f'{tau_version}VSe', [ ('eta', real), ('genmatch', integer), ('wp', string), ('syst', string) ],
+                       'eta', eta_edges),
+        makeCorrection(f'{tau_version}VSmu', [ ('eta', real), ('genmatch', integer), ('wp', string), ('syst', string) ],
+                       'eta', eta_edges),
+        makeCorrection('tau_trigger', [ ('pt', real), ('dm', integer), ('trigtype', string), ('wp', string),
+                                        ('corrtype', string), ('syst', string) ], 'pt', pt_edges),
+    ])
+    writeCorrectionSet(os.path.join(payload_dir, 'POG', 'EGM', period, 'electron.json.gz'), [
+        makeCorrection('UL-Electron-ID-SF', [ ('year', string), ('ValType', string), ('WorkingPoint', string),
+                                              ('eta', real), ('pt', real) ], 'eta', eta_edges),
+    ])
+    writeCorrectionSet(os.path.join(payload_dir, 'Corrections', 'data', 'EGM', period, 'EGM_ScaleUnc.json.gz'), [
+        makeCorrection('UL-EGM_ScaleUnc', [ ('year', string), ('ValType', string), ('eta', real), ('gain', integer) ],
+                       'eta', eta_edges),
+    ])
+    muon_corrections = [ makeCorrection('NUM_TrackerMuons_DEN_genTracks', [ ('abseta', real), ('pt', real), ('ValType', string) ],
+                                        'abseta', abs_eta_edges) ]
+    for name in [ 'NUM_TightID_DEN_TrackerMuons', 'NUM_TightID_DEN_genTracks', 'NUM_HighPtID_DEN_TrackerMuons',
+                  'NUM_HighPtID_DEN_genTracks', 'NUM_TightRelIso_DEN_TightIDandIPCut', 'NUM_TightRelTkIso_DEN_TrkHighPtIDandIPCut',
+                  'NUM_IsoMu24_DEN_CutBasedIdTight_and_PFIsoTight', 'NUM_IsoMu27_DEN_CutBasedIdTight_and_PFIsoTight',
+                  'NUM_IsoMu24_or_IsoTkMu24_DEN_CutBasedIdTight_and_PFIsoTight' ]:
+        muon_corrections.append(makeCorrection(name, [ ('year', string), ('abseta', real), ('pt', real), ('ValType', string) ],
+                                               'abseta', abs_eta_edges))
+    writeCorrectionSet(os.path.join(payload_dir, 'POG', 'MUO', period, 'muon_Z.json.gz'), muon_corrections)
+    writeCorrectionSet(os.path.join(payload_dir, 'POG', 'MUO', period, 'muon_HighPt.json.gz'), [
+        makeCorrection(name, [ ('abseta', real), ('pt', real), ('ValType', string) ], 'abseta', abs_eta_edges)
+        for name in [ 'NUM_GlobalMuons_DEN_TrackerMuonProbes', 'NUM_TightID_DEN_GlobalMuonProbes',
+                      'NUM_HighPtID_DEN_GlobalMuonProbes', 'NUM_probe_TightRelTkIso_DEN_HighPtProbes' ]
+    ])
+    from Corrections.pu import puWeightProducer
+    writeCorrectionSet(os.path.join(payload_dir, 'POG', 'LUM', period, 'puWeights.json.gz'), [
+        makeCorrection(puWeightProducer.golden_json_dict[period], [ ('NumTrueInteractions', real), ('weights', string) ],
+                       'NumTrueInteractions', [ float(n) for n in range(100) ]),
+    ])
+    writeCorrectionSet(os.path.join(payload_dir, 'POG', 'JME', period, 'jmar.json.gz'), [
+        makeCorrection('PUJetID_eff', [ ('eta', real), ('pt', real), ('systematic', string), ('workingpoint', string) ],
+                       'eta', jet_eta_edges),
+    ])
+    btag_inputs = [ ('systematic', string), ('working_point', string), ('flavor', integer), ('abseta', real), ('pt', real) ]
+    wp_values = { 'data': { 'nodetype': 'category', 'input': 'working_point',
+                            'content': [ { 'key': 'L', 'value': 0.049 }, { 'key': 'M', 'value': 0.2783 },
+                                         { 'key': 'T', 'value': 0.71 } ] } }
+    wp_values.update({ 'name': 'deepJet_wp_values', 'version': 1, 'inputs': [ { 'name': 'working_point', 'type': string } ],
+                       'output': { 'name': 'wp', 'type': real } })
+    writeCorrectionSet(os.path.join(payload_dir, 'POG', 'BTV', period, 'btagging.json.gz'), [
+        makeCorrection('deepJet_incl', btag_inputs, 'pt', pt_edges[1:]),
+        makeCorrection('deepJet_comb', btag_inputs, 'pt', pt_edges[1:]),
+        wp_values,
+        makeCorrection('deepJet_shape', [ ('systematic', string), ('flavor', integer), ('abseta', real), ('pt', real),
+                                          ('discriminant', real) ], 'discriminant', [ 0., 0.05, 0.1, 0.2, 0.3, 0.5, 0.7, 0.9, 1. ]),
+    ])
+
+def writeHist2D(file, name, x_edges, y_edges, value, error):
+    hist = ROOT.TH2D(name, name, len(x_edges) - 1, array('d', x_edges), len(y_edges) - 1, array('d', y_edges))
+    for x_bin in range(1, len(x_edges)):
+        for y_bin in range(1, len(y_edges)):
+            hist.SetBinContent(x_bin, y_bin, value(x_bin, y_bin))
+            hist.SetBinError(x_bin, y_bin, error)
+    file.WriteObject(hist, name)
+
+def writeRootStubs(payload_dir, period):
+    from Corrections.triggers import TrigCorrProducer, year_singleElefile, year_singleMufile, year_xTrg_eTaufile, year_xTrg_muTaufile
+    sf_value = lambda x_bin, y_bin: 0.9 + 0.01 * ((x_bin + y_bin) % 8)
+    trg_dir = os.path.join(payload_dir, 'Corrections', 'data', 'TRG', period)
+    os.makedirs(trg_dir, exist_ok=True)
+    # single electron: (eta, pt), cross triggers: (pt, eta), single muon: (|eta|, pt)
+    root_files = {
+        year_singleElefile[period]: [ ('SF2D', eta_edges, pt_edges) ],
+        year_xTrg_eTaufile[period]: [ ('SF2D', pt_edges, eta_edges) ],
+        year_xTrg_muTaufile[period]: [ ('SF2D', pt_edges, abs_eta_edges) ],
+        year_singleMufile[period]: [ (name, abs_eta_edges, pt_edges) for name in TrigCorrProducer.muon_trgHistNames_dict[period] ],
+    }
+    for file_name, hists in root_files.items():
+        file = ROOT.TFile.Open(os.path.join(trg_dir, file_name), 'UPDATE')
+        for name, x_edges, y_edges in hists:
+            writeHist2D(file, name, x_edges, y_edges, sf_value, 0.01)
+        file.Close()
+
+    btv_dir = os.path.join(payload_dir, 'Corrections', 'data', 'BTV', period)
+    os.makedirs(btv_dir, exist_ok=True)
+    file = ROOT.TFile.Open(os.path.join(btv_dir, 'btagEff.root'), 'RECREATE')
+    for flavour in [ 0, 4, 5 ]:
+        writeHist2D(file, f'jet_pt_eta_{flavour}', pt_edges[1:], eta_edges, lambda x_bin, y_bin: 100., 10.)
+        for wp, eff in [ ('Loose', 0.9), ('Medium', 0.7), ('Tight', 0.5) ]:
+            eff_flavour = eff if flavour == 5 else eff / (4 if flavour == 4 else 20)
+            writeHist2D(file, f'jet_pt_eta_{flavour}_{wp}', pt_edges[1:], eta_edges, lambda x_bin, y_bin: 100. * eff_flavour, 1.)
+    file.Close()
+
+def writeJMEStubs(payload_dir, period):
+    from Corrections.jet import directories_JER, directories_JEC, regrouped_files_names
+    jer_dir = os.path.join(payload_dir, 'Corrections', 'data', 'JRDatabase', 'textFiles', f'{directories_JER[period]}_MC')
+    jec_dir = os.path.join(payload_dir, 'Corrections', 'data', 'JECDatabase', 'textFiles', directories_JEC[period])
+    os.makedirs(jer_dir, exist_ok=True)
+    os.makedirs(jec_dir, exist_ok=True)
+    eta_bins = list(zip(jet_eta_edges[:-1], jet_eta_edges[1:]))
+    for suffix in [ 'AK4PFchs', 'AK8PFPuppi' ]:
+        with open(os.path.join(jer_dir, f'{directories_JER[period]}_MC_SF_{suffix}.txt'), 'w') as f:
+            f.write('{1 JetEta 0 None ScaleFactor}\n')
+            for eta_min, eta_max in eta_bins:
+                f.write(f'{eta_min} {eta_max} 3 1.1 1.05 1.15\n')
+        with open(os.path.join(jer_dir, f'{directories_JER[period]}_MC_PtResolution_{suffix}.txt'), 'w') as f:
+            f.write('{2 JetEta Rho 1 JetPt sqrt([0]*abs([0])/(x*x)+[1]*[1]*pow(x,[3])+[2]*[2]) Resolution}\n')
+            for eta_min, eta_max in eta_bins:
+                for rho_min, rho_max in [ (0, 20), (20, 40), (40, 100) ]:
+                    f.write(f'{eta_min} {eta_max} {rho_min} {rho_max} 6 15 6500 {2. + rho_min / 10.} 1.0 0.04 -0.9\n')
+    year = periods[period]
+    jes_sources = [ 'FlavorQCD', 'RelativeBal', 'HF', 'BBEC1', 'EC2', 'Absolute', 'Total' ] \
+                  + [ f'{source}_{year}' for source in [ 'BBEC1', 'Absolute', 'EC2', 'HF', 'RelativeSample' ] ]
+    jes_pt = [ 9., 20., 40., 100., 300., 1000., 6500. ]
+    with open(os.path.join(jec_dir, regrouped_files_names[period]), 'w') as f:
+        for source_idx, source in enumerate(jes_sources):
+            f.write(f'[{source}]\n{{1 JetEta 1 JetPt "" Correction JECSource}}\n')
+            for eta_min, eta_max in eta_bins:
+                unc = [ f'{pt} {0.005 * (source_idx + 1) / (1 + pt / 100.):.5f} {0.005 * (source_idx + 1) / (1 + pt / 100.):.5f}'
+                        for pt in jes_pt ]
+                f.write(f'{eta_min} {eta_max} {3 * len(jes_pt)} {" ".join(unc)}\n')
+
+def writeStubPayloads(payload_dir, period):
+    writeJsonStubs(payload_dir, period)
+    writeRootStubs(payload_dir, period)
+    writeJMEStubs(payload_dir, period)
+
+def redirectPayloads(payload_dir):
+    # paths given relative to ANALYSIS_PATH are resolved in the stub directory, absolute ones are overridden
+    from Corrections.tau import TauCorrProducer
+    from Corrections.electron import EleCorrProducer
+    from Corrections.mu import MuCorrProducer
+    from Corrections.pu import puWeightProducer
+    from Corrections.puJetID import puJetIDCorrProducer
+    from Corrections.btag import bTagCorrProducer
+    from Corrections.jet import JetCorrProducer
+    from Corrections.triggers import TrigCorrProducer
+    os.environ['ANALYSIS_PATH'] = payload_dir
+    pog = lambda *path: os.path.join(payload_dir, 'POG', *path)
+    TauCorrProducer.jsonPath = pog('TAU', '{}', 'tau.json.gz')
+    TrigCorrProducer.TauTRG_jsonPath = pog('TAU', '{}', 'tau.json.gz')
+    EleCorrProducer.EleID_JsonPath = pog('EGM', '{}', 'electron.json.gz')
+    MuCorrProducer.muIDEff_JsonPath = pog('MUO', '{}', 'muon_Z.json.gz')
+    MuCorrProducer.HighPtmuIDEff_JsonPath = pog('MUO', '{}', 'muon_HighPt.json.gz')
+    puWeightProducer.jsonPath = pog('LUM', '{}', 'puWeights.json.gz')
+    puJetIDCorrProducer.PUJetID_JsonPath = pog('JME', '{}', 'jmar.json.gz')
+    bTagCorrProducer.jsonPath = pog('BTV', '{}', 'btagging.json.gz')
+    JetCorrProducer.jsonPath_btag = pog('BTV', '{}', 'btagging.json.gz')
+
+def writeSyntheticNanoAOD(path, n_events):
+    ROOT.gInterpreter.Declare(generator_code)
+    df = ROOT.RDataFrame(n_events)
+    df = df.Define('event', 'static_cast<ULong64_t>(rdfentry_ + 1)')
+    df = df.Define('Rho_fixedGridRhoFastjetAll', 'static_cast<float>(5. + 45. * bench::uniform(event, 0, 1))')
+    df = df.Define('Pileup_nTrueInt', 'static_cast<float>(70. * bench::uniform(event, 0, 2))')
+    df = df.Define('MET_pt', 'static_cast<float>(150. * bench::uniform(event, 0, 3))')
+    df = df.Define('MET_phi', 'static_cast<float>(M_PI * (2 * bench::uniform(event, 0, 4) - 1))')
+    # collection: multiplicity range, pt spectrum, |eta| range, mass range, salt
+    collections = {
+        'Jet': ((2, 10), (20., 40.), 4.7, (2., 20.), 10),
+        'FatJet': ((0, 2), (200., 100.), 2.4, (50., 200.), 20),
+        'SubJet': (None, (30., 60.), 2.4, (2., 30.), 30),
+        'Tau': ((2, 4), (20., 30.), 2.3, (0.14, 1.5), 40),
+        'Muon': ((1, 3), (15., 40.), 2.4, (0.105, 0.106), 50),
+        'Electron': ((1, 3), (15., 40.), 2.5, (0., 0.001), 60),
+    }
+    for name, (n_range, (pt_min, pt_slope), max_eta, (min_mass, max_mass), salt) in collections.items():
+        n_expr = f'bench::multiplicity(event, {salt}, {n_range[0]}, {n_range[1]})' if n_range is not None else '2 * nFatJet'
+        df = df.Define(f'n{name}', n_expr)
+        df = df.Define(f'{name}_pt', f'bench::ptVec(event, n{name}, {salt + 1}, {pt_min}, {pt_slope})')
+        df = df.Define(f'{name}_eta', f'bench::uniformVec(event, n{name}, {salt + 2}, {-max_eta}, {max_eta})')
+        df = df.Define(f'{name}_phi', f'bench::uniformVec(event, n{name}, {salt + 3}, -M_PI, M_PI)')
+        df = df.Define(f'{name}_mass', f'bench::uniformVec(event, n{name}, {salt + 4}, {min_mass}, {max_mass})')
+    for name in [ 'Jet', 'FatJet' ]:
+        df = df.Define(f'{name}_rawFactor', f'bench::uniformVec(event, n{name}, 100, 0., 0.3)')
+        df = df.Define(f'{name}_jetId', f'bench::choiceVec<int>(event, n{name}, 101, {{ 2, 6 }})')
+    df = df.Define('Jet_area', 'bench::uniformVec(event, nJet, 102, 0.4, 0.6)')
+    df = df.Define('Jet_partonFlavour', 'bench::choiceVec<int>(event, nJet, 103, { 0, 1, -1, 2, 3, 4, -4, 5, -5, 21, 21 })')
+    df = df.Define('Jet_hadronFlavour', 'bench::choiceVec<int>(event, nJet, 104, { 0, 0, 0, 4, 5, 5 })')
+    df = df.Define('Jet_btagDeepFlavB', 'bench::uniformVec(event, nJet, 105, 0., 1.)')
+    df = df.Define('FatJet_area', 'bench::uniformVec(event, nFatJet, 106, 1.8, 2.1)')
+    df = df.Define('FatJet_msoftdrop', 'FatJet_mass * bench::uniformVec(event, nFatJet, 107, 0.6, 1.)')
+    df = df.Define('FatJet_subJetIdx1', 'bench::subJetIdx(nFatJet, 0)')
+    df = df.Define('FatJet_subJetIdx2', 'bench::subJetIdx(nFatJet, 1)')
+    for reco, gen in [ ('Jet', 'GenJet'), ('FatJet', 'GenJetAK8'), ('SubJet', 'SubGenJetAK8') ]:
+        df = df.Define(f'{gen}_pt', f'bench::smearVec({reco}_pt, event, 110, 0.15, true)')
+        df = df.Define(f'{gen}_eta', f'bench::smearVec({reco}_eta, event, 111, 0.05, false)')
+        df = df.Define(f'{gen}_phi', f'bench::smearVec({reco}_phi, event, 112, 0.05, false)')
+        df = df.Define(f'{gen}_mass', f'bench::smearVec({reco}_mass, event, 113, 0.1, true)')
+    df = df.Define('Tau_decayMode', 'bench::choiceVec<int>(event, nTau, 120, { 0, 1, 1, 10, 11 })')
+    df = df.Define('Tau_genMatch', 'bench::choiceVec<int>(event, nTau, 121, { 1, 2, 3, 4, 5, 5, 5, 6 })')
+    df = df.Define('Electron_genMatch', 'bench::choiceVec<int>(event, nElectron, 122, { 1, 1, 3, 5, 6 })')
+    df = df.Define('Muon_pfRelIso04_all', 'bench::uniformVec(event, nMuon, 130, 0., 0.3)')
+    df = df.Define('Muon_tkRelIso', 'bench::uniformVec(event, nMuon, 131, 0., 0.2)')
+    df = df.Define('Muon_tightId', 'bench::flagVec(event, nMuon, 132, 0.9)')
+    df = df.Define('Muon_highPtId', 'bench::choiceVec<UChar_t>(event, nMuon, 133, { 0, 1, 2, 2 })')
+    for trg_idx, trg_name in enumerate(trigger_names):
+        df = df.Define(f'HLT_{trg_name}', f'bench::uniform(event, 0, {140 + trg_idx}) < 0.8')
+        for leg_idx, leg_name in enumerate(lepton_legs):
+            df = df.Define(f'{leg_name}_HasMatching_{trg_name}', f'bench::uniform(event, {leg_idx + 1}, {140 + trg_idx}) < 0.9')
+    df.Snapshot('Events', path)
+
+def defineAnalysisColumns(df):
+    # columns that the analysis framework defines before applying the corrections
+    for name in [ 'Jet', 'FatJet', 'Tau', 'Muon', 'Electron' ]:
+        df = df.Define(f'{name}_p4_{nano}', f'bench::p4Vec({name}_pt, {name}_eta, {name}_phi, {name}_mass)')
+    df = df.Define('Jet_p4', f'Jet_p4_{nano}')
+    df = df.Define('Jet_bCand', 'bench::leadingMask(Jet_btagDeepFlavB, 2)')
+    df = df.Define(f'MET_p4_{nano}', 'LorentzVectorM(MET_pt, 0., MET_phi, 0.)')
+    df = df.Define('HttCandidate', f'bench::makeCandidate(event, Tau_p4_{nano}, Muon_p4_{nano}, Electron_p4_{nano})')
+    return df
+
+def p4Columns(source_dict, objects):
+    return [ f'{obj}_p4_{getSystName(source, scale)}' for source, source_objs in source_dict.items()
+             for obj in source_objs if obj in objects for scale in getScales(source) ]
+
+def benchP4Variations(obj, extra_columns=(), obj_mask=None):
+    def run(producer, df):
+        if obj_mask is None:
+            df, source_dict = producer.getP4Variations(df, { central: [] })
+        else:
+            df, source_dict = producer.getP4Variations(df, { central: [] }, None, obj_mask)
+        columns = p4Columns(source_dict, [ obj ])
+        for column in extra_columns:
+            columns += [ p4_column.replace('_p4_', f'_{column}_') for p4_column in p4Columns(source_dict, [ obj ]) ]
+        return df, columns
+    return run
+
+def benchTauES(producer, df):
+    df, source_dict = producer.getES(df, { central: [] })
+    return df, p4Columns(source_dict, [ 'Tau' ])
+
+def benchPFMET(producer, df):
+    # shifted tau and jet p4 are replaced by synthetic deltas, so that only the MET propagation is measured
+    from Corrections.tau import TauCorrProducer
+    from Corrections.jet import JetCorrProducer
+    year = period_names[Corrections.getGlobal().period].split('_')[0]
+    source_dict = { central: [] }
+    for source in TauCorrProducer.energyScaleSources_tau + TauCorrProducer.energyScaleSources_lep:
+        source_dict[source] = [ 'Tau' ]
+    for source in JetCorrProducer.uncSources_extended:
+        if source != 'JER':
+            source = f'JES_{source}{year if source.endswith("_") else ""}'
+        source_dict[source] = [ 'Jet' ]
+    salt = 1000
+    for source, source_objs in source_dict.items():
+        for obj in source_objs:
+            for scale in getScales(source):
+                df = df.Define(f'{obj}_p4_{getSystName(source, scale)}_delta', f'bench::p4Delta({obj}_p4_{nano}, event, {salt})')
+                salt += 1
+    df, source_dict = producer.getPFMET(df, source_dict)
+    return df, p4Columns(source_dict, [ 'MET' ])
+
+def benchWeight(producer, df):
+    df, weights = producer.getWeight(df)
+    return df, [ weight for syst_weights in weights.values() for weight in syst_weights ]
+
+def benchBtagShape(producer, df):
+    df, sf_branches, sf_jes = producer.getBtagShapeSFs(df, central, True, True)
+    return df, sf_branches + ([ sf_jes ] if len(sf_jes) > 0 else [])
+
+# method name -> (Corrections property of the producer, function that applies the method and returns the output columns)
+methods = {
+    'input': (None, lambda producer, df: (df, [ f'Jet_p4_{nano}', f'Tau_p4_{nano}', f'MET_p4_{nano}' ])),
+    'tau.getES': ('tau', benchTauES),
+    'tau.getSF': ('tau', lambda producer, df: producer.getSF(df, lepton_legs, True, True)),
+    'mu.getMuonIDSF': ('mu', lambda producer, df: producer.getMuonIDSF(df, lepton_legs, True, True)),
+    'mu.getHighPtMuonIDSF': ('mu', lambda producer, df: producer.getHighPtMuonIDSF(df, lepton_legs, True, True)),
+    'ele.getIDSF': ('ele', lambda producer, df: producer.getIDSF(df, lepton_legs, True, True)),
+    'trg.getTrgSF': ('trg', lambda producer, df: producer.getTrgSF(df, trigger_names, lepton_legs, True, True)),
+    'pu.getWeight': ('pu', benchWeight),
+    'puJetID.getPUJetIDEff': ('puJetID', lambda producer, df: producer.getPUJetIDEff(df, True, True)),
+    'btag.getSF': ('btag', lambda producer, df: producer.getSF(df, True, True)),
+    'met.getPFMET': ('met', benchPFMET),
+    'jet.getP4Variations': ('jet', benchP4Variations('Jet')),
+    'jet.getP4Variations.preselected': ('jet', benchP4Variations('Jet', obj_mask='Jet_pt > 20')),
+    'jet.getBtagShapeSFs': ('jet', benchBtagShape),
+    'fatjet.getP4Variations': ('fatjet', benchP4Variations('FatJet', [ 'msoftdrop' ])),
+    'fatjet.getP4Variations.preselected': ('fatjet', benchP4Variations('FatJet', [ 'msoftdrop' ], 'FatJet_pt > 200')),
+}
+
+def runMethod(method, args):
+    if args.threads > 1:
+        ROOT.EnableImplicitMT(args.threads)
+    config = {
+        'era': args.era,
+        'precompiledDefines': args.precompiledDefines,
+        'deepTauVersion': '2p1',
+        'deepTauWPs': { ch: { 'VSe': 'VVLoose', 'VSmu': 'Tight', 'VSjet': 'Medium' } for ch in [ 'eTau', 'muTau', 'tauTau' ] },
+        'genuineTau_SFtype': { 'eTau': 'dm', 'muTau': 'dm', 'tauTau': 'dm' },
+    }
+    Corrections.initializeGlobal(config, isData=False)
+    redirectPayloads(os.path.join(args.workDir, 'payloads'))
+    producer_name, apply_method = methods[method]
+
+    start = time.perf_counter()
+    producer = getattr(Corrections.getGlobal(), producer_name) if producer_name is not None else None
+    if producer is None:
+        headers_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        ROOT.gInterpreter.Declare(f'#include "{os.path.join(headers_dir, "defines.h")}"')
+    ROOT.gInterpreter.Declare(generator_code)
+    ROOT.gInterpreter.Declare(analysis_code)
+    init_time = time.perf_counter() - start
+
+    df = defineAnalysisColumns(ROOT.RDataFrame('Events', os.path.join(args.workDir, 'nano.root')))
+    start = time.perf_counter()
+    df, columns = apply_method(producer, df)
+    df = df.Define('bench_checksum', ' + '.join([ f'bench::checksum({column})' for column in columns ]))
+    define_time = time.perf_counter() - start
+
+    # the first event loop includes the JIT compilation of the graph, the next ones reuse it
+    start = time.perf_counter()
+    df.Sum['double']('bench_checksum').GetValue()
+    first_run_time = time.perf_counter() - start
+    run_time = None
+    for _ in range(args.repeat):
+        result = df.Sum['double']('bench_checksum')
+        start = time.perf_counter()
+        result.GetValue()
+        elapsed = time.perf_counter() - start
+        run_time = elapsed if run_time is None else min(run_time, elapsed)
+
+    return {
+        'method': method,
+        'n_columns': len(columns),
+        'init_s': init_time,
+        'define_s': define_time,
+        'first_run_s': first_run_time,
+        'run_s': run_time,
+        'jit_s': max(first_run_time - run_time, 0.),
+        'events_per_s': args.nEvents / run_time,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.,
+    }
+
+def runAll(args, method_names):
+    results = []
+    for method in method_names:
+        cmd = [ sys.executable, os.path.abspath(__file__), '--worker', method, '--workDir', args.workDir,
+                '--era', args.era, '--nEvents', str(args.nEvents), '--threads', str(args.threads), '--repeat', str(args.repeat) ]
+        if args.precompiledDefines:
+            cmd.append('--precompiledDefines')
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        lines = proc.stdout.strip().split('\n')
+        if proc.returncode == 0 and len(lines) > 0 and lines[-1].startswith('{'):
+            result = json.loads(lines[-1])
+            print(f'{method:>24} {result["events_per_s"]:>12.0f} ev/s {result["jit_s"]:>8.2f} s JIT'
+                  f' {result["peak_rss_mb"]:>8.0f} MB', file=sys.stderr)
+        else:
+            result = { 'method': method, 'error': proc.stderr.strip().split('\n')[-20:] }
+            print(f'{method:>24} failed', file=sys.stderr)
+        results.append(result)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Throughput of the correction producers on synthetic NanoAOD input.')
+    parser.add_argument('--era', required=False, type=str, default='Run2_2018')
+    parser.add_argument('--nEvents', required=False, type=int, default=200000)
+    parser.add_argument('--threads', required=False, type=int, default=1)
+    parser.add_argument('--repeat', required=False, type=int, default=3)
+    parser.add_argument('--methods', required=False, type=str, default=','.join(methods.keys()))
+    parser.add_argument('--precompiledDefines', action='store_true')
+    parser.add_argument('--workDir', required=False, type=str, default=None,
+                        help='directory with the stub payloads and the synthetic input, created if not given')
+    parser.add_argument('--output', required=False, type=str, default=None)
+    parser.add_argument('--worker', required=False, type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    ROOT.gROOT.SetBatch(True)
+    if args.worker is not None:
+        print(json.dumps(runMethod(args.worker, args)))
+        sys.exit(0)
+
+    method_names = [ m for m in args.methods.split(',') if len(m) > 0 ]
+    for method in method_names:
+        if method not in methods:
+            raise RuntimeError(f'Unknown method: {method}')
+    if args.workDir is None:
+        args.workDir = tempfile.mkdtemp(prefix='corrections_bench_')
+    period = period_names[args.era]
+    input_path = os.path.join(args.workDir, 'nano.root')
+    if not os.path.exists(input_path):
+        writeStubPayloads(os.path.join(args.workDir, 'payloads'), period)
+        writeSyntheticNanoAOD(input_path, args.nEvents)
+
+    report = {
+        'era': args.era,
+        'n_events': args.nEvents,
+        'threads': args.threads,
+        'precompiledDefines': args.precompiledDefines,
+        'root_version': ROOT.gROOT.GetVersion(),
+        'results': runAll(args, method_names),
+    }
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
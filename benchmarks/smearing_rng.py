@@ -0,0 +1,92 @@
+import argparse
+import os
+import sys
+import time
+
+import ROOT
+
+# Compares the jet smearing obtained with the counter-based Philox generator to the one obtained
+# with the reference std::mt19937_64 generator (JMERandom.h) on synthetic jets, and reports the time per jet.
+# The smeared pt is computed as in the stochastic smearing of jets without a matched generator-level jet:
+# pt * (1 + N(0, ptRes) * sqrt(sf^2 - 1)).
+
+def declareGenerators():
+    headers_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    ROOT.gInterpreter.Declare(f'#include "{os.path.join(headers_dir, "JMERandom.h")}"')
+
+def makeSyntheticJets(n_jets, jets_per_event, sf):
+    df = ROOT.RDataFrame(n_jets)
+    df = df.Define('event', f'static_cast<int>(rdfentry_ / {jets_per_event})')
+    df = df.Define('pt', '20. + 0.25 * ((rdfentry_ * 7919) % 4000)')
+    df = df.Define('eta', '-4.7 + 9.4 * ((rdfentry_ * 104729) % 10007) / 10007.')
+    df = df.Define('phi', '-M_PI + 2. * M_PI * ((rdfentry_ * 1299709) % 10009) / 10009.')
+    df = df.Define('ptRes', '0.05 + 1. / std::sqrt(pt)')
+    df = df.Define('seed', 'jmerandom::jetSeed(event, pt, eta, phi)')
+    df = df.Define('rand_mt19937', 'jmerandom::mt19937Normal(seed, ptRes)')
+    df = df.Define('rand_philox', 'jmerandom::philoxNormal(seed) * ptRes')
+    for generator in [ 'mt19937', 'philox' ]:
+        df = df.Define(f'pt_{generator}', f'pt * (1. + rand_{generator} * std::sqrt({sf} * {sf} - 1.))')
+        df = df.Define(f'response_{generator}', f'pt_{generator} / pt')
+        df = df.Define(f'pull_{generator}', f'rand_{generator} / ptRes')
+    return df
+
+def timeGenerator(n_jets, jets_per_event, sf, generator, repeat):
+    best = None
+    for _ in range(repeat):
+        result = makeSyntheticJets(n_jets, jets_per_event, sf).Sum(f'rand_{generator}')
+        start = time.perf_counter()
+        result.GetValue()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / n_jets * 1e9
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Validation of the counter-based random number generator for the jet smearing.')
+    parser.add_argument('--nJets', required=False, type=int, default=5000000)
+    parser.add_argument('--jetsPerEvent', required=False, type=int, default=4)
+    parser.add_argument('--sf', required=False, type=float, default=1.15)
+    parser.add_argument('--repeat', required=False, type=int, default=3)
+    parser.add_argument('--minProb', required=False, type=float, default=1e-3)
+    parser.add_argument('--output', required=False, type=str, default=None)
+    args = parser.parse_args()
+
+    ROOT.gROOT.SetBatch(True)
+    ROOT.DisableImplicitMT()
+    declareGenerators()
+
+    df = makeSyntheticJets(args.nJets, args.jetsPerEvent, args.sf)
+    hist_models = {
+        'pt': ROOT.RDF.TH1DModel('pt', 'smeared p_{T}', 200, 0., 1200.),
+        'response': ROOT.RDF.TH1DModel('response', 'smeared p_{T} / p_{T}', 200, 0.5, 1.5),
+        'pull': ROOT.RDF.TH1DModel('pull', 'random number / p_{T} resolution', 200, -5., 5.),
+    }
+    hists = {}
+    for var, model in hist_models.items():
+        for generator in [ 'mt19937', 'philox' ]:
+            hists[(var, generator)] = df.Histo1D(model, f'{var}_{generator}')
+    ROOT.RDF.RunGraphs(list(hists.values()))
+
+    passed = True
+    print(f'{"variable":>10} {"mean mt19937":>14} {"mean philox":>14} {"rms mt19937":>14} {"rms philox":>14} {"KS prob":>10} {"chi2 prob":>10}')
+    for var in hist_models:
+        h_ref = hists[(var, 'mt19937')].GetPtr()
+        h_new = hists[(var, 'philox')].GetPtr()
+        ks_prob = h_ref.KolmogorovTest(h_new)
+        chi2_prob = h_ref.Chi2Test(h_new, 'UU')
+        passed = passed and ks_prob >= args.minProb and chi2_prob >= args.minProb
+        print(f'{var:>10} {h_ref.GetMean():>14.6f} {h_new.GetMean():>14.6f} {h_ref.GetRMS():>14.6f} {h_new.GetRMS():>14.6f}'
+              f' {ks_prob:>10.4f} {chi2_prob:>10.4f}')
+
+    print(f'{"generator":>10} {"ns/jet":>10}')
+    for generator in [ 'mt19937', 'philox' ]:
+        print(f'{generator:>10} {timeGenerator(args.nJets, args.jetsPerEvent, args.sf, generator, args.repeat):>10.1f}')
+
+    if args.output is not None:
+        output = ROOT.TFile.Open(args.output, 'RECREATE')
+        for (var, generator), hist in hists.items():
+            output.WriteObject(hist.GetPtr(), f'{var}_{generator}')
+        output.Close()
+
+    print('PASSED' if passed else 'FAILED')
+    if not passed:
+        sys.exit(1)
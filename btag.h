@@ -1,7 +1,9 @@
 #pragma once
 
 #include "correction.h"
+#include "cachedCorrection.h"
 #include "corrections.h"
+#include "defines.h"
 
 namespace correction {
 class bTagCorrProvider : public CorrectionsBase<bTagCorrProvider> {
@@ -13,6 +15,9 @@ public:
         btagSFbc_correlated = 2,
         btagSFlight_correlated = 3,
     };
+    using SFVariations = ::correction::SFVariations<UncSource, 5>;
+    static constexpr size_t nWPs = 3;
+    using AllWPSFVariations = std::array<SFVariations, nWPs>;
 
     static const std::map<WorkingPointsbTag, std::pair<std::string, std::string>>& getWPNames()
     {
@@ -24,6 +29,23 @@ public:
         return names;
     };
 
+    static const std::array<WorkingPointsbTag, nWPs>& getWPs()
+    {
+        static const std::array<WorkingPointsbTag, nWPs> wps = {
+            WorkingPointsbTag::Loose, WorkingPointsbTag::Medium, WorkingPointsbTag::Tight
+        };
+        return wps;
+    }
+
+    static size_t getWPIdx(WorkingPointsbTag wp)
+    {
+        const auto& wps = getWPs();
+        const auto iter = std::find(wps.begin(), wps.end(), wp);
+        if(iter == wps.end())
+            throw std::runtime_error("bTagCorrProvider: unknown working point.");
+        return static_cast<size_t>(iter - wps.begin());
+    }
+
     static std::string getScaleStr(UncScale scale, UncSource source)
     {
         static const std::map<UncScale, std::string> scale_names = {
@@ -50,7 +72,23 @@ public:
         return false;
     }
 
-    using histEffmap= std::map<std::pair<WorkingPointsbTag, int>, std::shared_ptr<TH2>> ;
+    // Scale strings of the deepJet SFs, indexed like SFVariations.
+    static const std::array<std::string, SFVariations::size>& getScaleStrTable()
+    {
+        static const std::array<std::string, SFVariations::size> table = [] {
+            std::array<std::string, SFVariations::size> result;
+            result.fill("central");
+            for(UncSource source : { UncSource::btagSFbc_uncorrelated, UncSource::btagSFlight_uncorrelated,
+                                     UncSource::btagSFbc_correlated, UncSource::btagSFlight_correlated }) {
+                for(UncScale scale : { UncScale::Up, UncScale::Down })
+                    result[SFVariations::index(source, scale)] = getScaleStr(scale, source);
+            }
+            return result;
+        }();
+        return table;
+    }
+
+    using histEffmap= std::map<std::pair<WorkingPointsbTag, int>, Grid2D> ;
     bTagCorrProvider(const std::string& fileName, const std::string& efficiencyFileName) :
         corrections_(CorrectionSet::from_file(fileName)),
         deepJet_incl_(corrections_->at("deepJet_incl")),
@@ -60,19 +98,25 @@ public:
         if(efficiencyFileName.size()>0){
             auto efficiencyFile = root_ext::OpenRootFile(efficiencyFileName);
             static const std::vector<std::string> WpNames = {"Loose", "Medium", "Tight"};
-            static const std::vector<int> Flavours = {0, 4, 5};
             for(const auto & flav : Flavours){
-                auto denum = root_ext::ReadCloneObject<TH2>(*efficiencyFile, "jet_pt_eta_"+std::to_string(flav), "", true);
+                std::unique_ptr<TH2> denum(root_ext::ReadCloneObject<TH2>(*efficiencyFile, "jet_pt_eta_"+std::to_string(flav), "", true));
                 for (const auto &wp_entry : getWPNames()){
-                    auto num = root_ext::ReadCloneObject<TH2>(*efficiencyFile,  "jet_pt_eta_"+std::to_string(flav)+"_"+wp_entry.second.second,"", true);
-                    num->Divide(denum);
-                    histMapEfficiency[std::make_pair(wp_entry.first, flav)] = std::shared_ptr<TH2>(num);
+                    std::unique_ptr<TH2> num(root_ext::ReadCloneObject<TH2>(*efficiencyFile,  "jet_pt_eta_"+std::to_string(flav)+"_"+wp_entry.second.second,"", true));
+                    num->Divide(denum.get());
+                    histMapEfficiency[std::make_pair(wp_entry.first, flav)] = Grid2D(*num);
                 }
             }
         }
         for (const auto &wp_entry : getWPNames()) {
             wp_thrs[wp_entry.first] = deepJet_wp_values_->evaluate({wp_entry.second.first});
         }
+        for(size_t wp_idx = 0; wp_idx < nWPs; ++wp_idx) {
+            wp_thr_values_[wp_idx] = wp_thrs.at(getWPs()[wp_idx]);
+            for(size_t flav_idx = 0; flav_idx < Flavours.size(); ++flav_idx) {
+                const auto iter = histMapEfficiency.find(std::make_pair(getWPs()[wp_idx], Flavours[flav_idx]));
+                efficiencies_[wp_idx][flav_idx] = iter != histMapEfficiency.end() ? &iter->second : nullptr;
+            }
+        }
     }
 
     float getWPvalue(WorkingPointsbTag wp) const { return wp_thrs.at(wp); }
@@ -109,29 +153,143 @@ public:
 
         return eff_MC_tot!=0 ? eff_data_tot/eff_MC_tot : 0.;
     }
+    // Same as getSF, but computes the central value and the up/down variations of the given sources in a single loop over jets.
+    SFVariations getSFVariations(const RVecLV& Jet_p4, const RVecB& pre_sel, const RVecI& Jet_Flavour,const RVecF& Jet_bTag_score, WorkingPointsbTag btag_wp, const std::vector<UncSource>& sources, bool need_variations) const
+    {
+        const size_t wp_idx = getWPIdx(btag_wp);
+        float eff_MC_tot = 1.;
+        SFVariations eff_data_tot;
+        for(size_t jet_idx = 0; jet_idx < Jet_p4.size(); jet_idx++){
+            if(!pre_sel[jet_idx]) continue;
+            addJetEfficiencies(Jet_p4[jet_idx], Jet_Flavour[jet_idx], Jet_bTag_score[jet_idx], wp_idx, sources, need_variations,
+                               eff_MC_tot, eff_data_tot);
+        }
+        return getSFFromEfficiencies(eff_MC_tot, eff_data_tot);
+    }
+
+    // SFs of all working points with the central value and the up/down variations of the given sources,
+    // in a single loop over jets.
+    AllWPSFVariations getAllWPSFVariations(const RVecLV& Jet_p4, const RVecB& pre_sel, const RVecI& Jet_Flavour,
+                                           const RVecF& Jet_bTag_score, const std::vector<UncSource>& sources,
+                                           bool need_variations) const
+    {
+        std::array<float, nWPs> eff_MC_tot;
+        eff_MC_tot.fill(1.);
+        AllWPSFVariations eff_data_tot;
+        for(size_t jet_idx = 0; jet_idx < Jet_p4.size(); jet_idx++){
+            if(!pre_sel[jet_idx]) continue;
+            for(size_t wp_idx = 0; wp_idx < nWPs; ++wp_idx) {
+                addJetEfficiencies(Jet_p4[jet_idx], Jet_Flavour[jet_idx], Jet_bTag_score[jet_idx], wp_idx, sources,
+                                   need_variations, eff_MC_tot[wp_idx], eff_data_tot[wp_idx]);
+            }
+        }
+        AllWPSFVariations sf;
+        for(size_t wp_idx = 0; wp_idx < nWPs; ++wp_idx)
+            sf[wp_idx] = getSFFromEfficiencies(eff_MC_tot[wp_idx], eff_data_tot[wp_idx]);
+        return sf;
+    }
+
+    // Precompiled counterpart of the getAllWPSFVariations column expression.
+    struct AllWPSFVariationsFunctor {
+        AllWPSFVariationsFunctor(const std::vector<UncSource>& _sources, bool _need_variations) :
+            sources(_sources), need_variations(_need_variations)
+        {
+        }
+
+        AllWPSFVariations operator()(const RVecLV& Jet_p4, const RVecB& pre_sel, const RVecI& Jet_Flavour,
+                                     const RVecF& Jet_bTag_score) const
+        {
+            return getGlobal().getAllWPSFVariations(Jet_p4, pre_sel, Jet_Flavour, Jet_bTag_score, sources, need_variations);
+        }
+
+        std::vector<UncSource> sources;
+        bool need_variations;
+    };
+
+    // SFs of one working point from the getAllWPSFVariations column.
+    struct WPSFVariations {
+        explicit WPSFVariations(WorkingPointsbTag btag_wp) : wp_idx(getWPIdx(btag_wp)) {}
+        SFVariations operator()(const AllWPSFVariations& sf) const { return sf[wp_idx]; }
+
+        size_t wp_idx;
+    };
+
+    // Precompiled counterpart of the getSFVariations column expression.
+    struct SFVariationsFunctor {
+        SFVariationsFunctor(WorkingPointsbTag _btag_wp, const std::vector<UncSource>& _sources, bool _need_variations) :
+            btag_wp(_btag_wp), sources(_sources), need_variations(_need_variations)
+        {
+        }
+
+        SFVariations operator()(const RVecLV& Jet_p4, const RVecB& pre_sel, const RVecI& Jet_Flavour,
+                                const RVecF& Jet_bTag_score) const
+        {
+            return getGlobal().getSFVariations(Jet_p4, pre_sel, Jet_Flavour, Jet_bTag_score, btag_wp, sources, need_variations);
+        }
+
+        WorkingPointsbTag btag_wp;
+        std::vector<UncSource> sources;
+        bool need_variations;
+    };
+
 private:
+    // Multiplies the MC efficiency and the data efficiencies of all variations of the working point wp_idx
+    // by the probabilities of the tagging outcome of one jet.
+    void addJetEfficiencies(const LorentzVectorM& p4, int flavour, float bTag_score, size_t wp_idx,
+                            const std::vector<UncSource>& sources, bool need_variations,
+                            float& eff_MC_tot, SFVariations& eff_data_tot) const
+    {
+        const auto& scale_strs = getScaleStrTable();
+        const auto& wp_name = getWPNames().at(getWPs()[wp_idx]).first;
+        const auto& sf_source = flavour == 0 ? deepJet_incl_ : deepJet_comb_;
+        const bool is_tagged = bTag_score > wp_thr_values_[wp_idx];
+        const float eff_MC = GetNormalisedEfficiency(GetBtagEfficiency(p4.pt(), std::abs(p4.eta()), flavour, wp_idx));
+        const auto get_eff_data = [&](size_t idx) {
+            const float SF = sf_source->evaluate({scale_strs[idx], wp_name, flavour, std::abs(p4.eta()), p4.pt()});
+            const float eff_data = GetNormalisedEfficiency(eff_MC*SF);
+            return is_tagged ? eff_data : 1 - eff_data;
+        };
+        eff_MC_tot *= is_tagged ? eff_MC : 1 - eff_MC;
+        SFVariations jet_eff_data(get_eff_data(0));
+        if(need_variations) {
+            for(UncSource source : sources) {
+                if(!sourceApplies(source, flavour)) continue;
+                for(UncScale scale : { UncScale::Up, UncScale::Down }) {
+                    const size_t idx = SFVariations::index(source, scale);
+                    jet_eff_data[idx] = get_eff_data(idx);
+                }
+            }
+        }
+        for(size_t idx = 0; idx < SFVariations::size; ++idx)
+            eff_data_tot[idx] *= jet_eff_data[idx];
+    }
+
+    static SFVariations getSFFromEfficiencies(float eff_MC_tot, const SFVariations& eff_data_tot)
+    {
+        SFVariations sf(0.);
+        if(eff_MC_tot != 0) {
+            for(size_t idx = 0; idx < SFVariations::size; ++idx)
+                sf[idx] = eff_data_tot[idx] / eff_MC_tot;
+        }
+        return sf;
+    }
+
     float GetBtagEfficiency(float pt, float eta, int flavour, WorkingPointsbTag wp) const {
         const auto key = std::make_pair(wp, flavour);
         auto iter = histMapEfficiency.find(key);
         if(iter == histMapEfficiency.end())
             throw analysis::exception("ERROR: bTagEfficiency not found in the map! Flavour= %1% VS WP = %2%")
             % flavour % getWPNames().at(wp).second;
-        const auto& hist = iter->second;
-        const auto x_axis = hist->GetXaxis();
-        int x_bin = x_axis->FindFixBin(pt);
-        if(x_bin < 1)
-            x_bin =1;
-        if( x_bin > x_axis->GetNbins() )
-            x_bin = x_axis->GetNbins();
-        const auto y_axis = hist->GetYaxis();
-
-        int y_bin = y_axis->FindFixBin(eta);
-        if(y_bin < 1)
-            y_bin =1;
-        if( y_bin > y_axis->GetNbins() )
-            y_bin = y_axis->GetNbins();
-
-        return hist->GetBinContent(x_bin,y_bin) ;
+        return iter->second.getContent(pt, eta);
+    }
+
+    float GetBtagEfficiency(float pt, float eta, int flavour, size_t wp_idx) const {
+        const auto flav_iter = std::find(Flavours.begin(), Flavours.end(), flavour);
+        const Grid2D* efficiency = flav_iter != Flavours.end() ? efficiencies_[wp_idx][flav_iter - Flavours.begin()] : nullptr;
+        if(!efficiency)
+            throw analysis::exception("ERROR: bTagEfficiency not found in the map! Flavour= %1% VS WP = %2%")
+            % flavour % getWPNames().at(getWPs()[wp_idx]).second;
+        return efficiency->getContent(pt, eta);
     }
 
     static float GetNormalisedEfficiency(float eff){
@@ -141,9 +299,12 @@ private:
     }
 private:
     std::unique_ptr<CorrectionSet> corrections_;
-    Correction::Ref deepJet_incl_, deepJet_comb_,deepJet_wp_values_;
+    CachedCorrection deepJet_incl_, deepJet_comb_,deepJet_wp_values_;
     histEffmap histMapEfficiency;
     std::map<WorkingPointsbTag, float> wp_thrs;
+    static constexpr std::array<int, 3> Flavours = { 0, 4, 5 };
+    std::array<std::array<const Grid2D*, Flavours.size()>, nWPs> efficiencies_{};
+    std::array<float, nWPs> wp_thr_values_{};
 
 };
 
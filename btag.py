@@ -30,7 +30,8 @@ class bTagCorrProducer:
         if not bTagCorrProducer.initialized:
             headers_dir = os.path.dirname(os.path.abspath(__file__))
             header_path = os.path.join(headers_dir, "btag.h")
-            ROOT.gInterpreter.Declare(f'#include "{header_path}"')
+            declareHeaders(header_path, dependencies=[ common_headers ])
+            registerCorrectionLayouts(jsonFile)
             ROOT.gInterpreter.ProcessLine(f'::correction::bTagCorrProvider::Initialize("{jsonFile}", "{jsonFile_eff}")')
             bTagCorrProducer.initialized = True
 
@@ -50,6 +51,24 @@ class bTagCorrProducer:
         sf_sources = bTagCorrProducer.SFSources
         SF_branches = []
         sf_scales = [up, down] if return_variations else []
+        need_variations = 'true' if isCentral and return_variations else 'false'
+        sf_sources_cpp = createUncSourceList('bTagCorrProvider', sf_sources)
+        if PrecompiledDefines.enabled:
+            functor = ROOT.correction.bTagCorrProvider.AllWPSFVariationsFunctor(createUncSourceVector('bTagCorrProvider', sf_sources),
+                                                                                need_variations == 'true')
+            df = defineColumn(df, "bTagSF_variations", functor, [ 'Jet_p4', 'Jet_bCand', 'Jet_hadronFlavour', 'Jet_btagDeepFlavB' ])
+        else:
+            df = df.Define("bTagSF_variations",
+                        f''' ::correction::bTagCorrProvider::getGlobal().getAllWPSFVariations(
+                        Jet_p4, Jet_bCand, Jet_hadronFlavour, Jet_btagDeepFlavB,
+                        {sf_sources_cpp}, {need_variations}) ''')
+        for wp in WorkingPointsbTag:
+            if PrecompiledDefines.enabled:
+                functor = ROOT.correction.bTagCorrProvider.WPSFVariations(getattr(ROOT.WorkingPointsbTag, wp.name))
+                df = defineColumn(df, f"bTagSF_{wp.name}_variations", functor, [ "bTagSF_variations" ])
+                continue
+            df = df.Define(f"bTagSF_{wp.name}_variations",
+                           f"bTagSF_variations[::correction::bTagCorrProvider::getWPIdx(WorkingPointsbTag::{wp.name})]")
         for source in [ central ] + sf_sources:
             for scale in [ central ] + sf_scales:
                 if source == central and scale != central: continue
@@ -61,19 +80,16 @@ class bTagCorrProducer:
                     #print(branch_name)
                     branch_central = f"""weight_bTagSF_{wp.name}_{source+central}"""
                     #branch_central = f"""weight_bTagSF_{wp.name}_{getSystName(central, central)}"""
-                    df = df.Define(f"{branch_name}_double",
-                                f''' ::correction::bTagCorrProvider::getGlobal().getSF(
-                                Jet_p4, Jet_bCand, Jet_hadronFlavour, Jet_btagDeepFlavB, WorkingPointsbTag::{wp.name},
-                            ::correction::bTagCorrProvider::UncSource::{source}, ::correction::UncScale::{scale}) ''')
+                    df = defineSFVariation(df, f"{branch_name}_double", f"bTagSF_{wp.name}_variations", 'bTagCorrProvider', source, scale)
                     if scale != central:
                         branch_name_final = branch_name + '_rel'
-                        df = df.Define(branch_name_final, f"static_cast<float>({branch_name}_double/{branch_central})")
+                        df = defineRelative(df, branch_name_final, f"{branch_name}_double", branch_central)
                     else:
                         if source == central:
                             branch_name_final = f"""weight_bTagSF_{wp.name}_{central}"""
                         else:
                             branch_name_final = branch_name
-                        df = df.Define(branch_name_final, f"static_cast<float>({branch_name}_double)")
+                        df = defineFloat(df, branch_name_final, f"{branch_name}_double")
                     SF_branches.append(branch_name_final)
         return df,SF_branches
 
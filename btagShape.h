@@ -1,5 +1,6 @@
 #pragma once
 
+#include "cachedCorrection.h"
 #include "corrections.h"
 #include "jet.h"
 
@@ -29,6 +30,10 @@ public:
         jesRelativeSample_year = 18
 
     };
+    static constexpr size_t nSources = 20;
+    // Central and the b-tag shape sources that are not correlated with the JES (lf ... cferr2).
+    using SFVariations = ::correction::SFVariations<UncSource, 9>;
+
     static bool needYear(UncSource source){
         if (source == UncSource::jesBBEC1_year || source==UncSource::jesAbsolute_year ||
         source==UncSource::jesEC2_year || source == UncSource::jesHF_year ||
@@ -85,29 +90,53 @@ public:
     // Note the flavor convention: hadronFlavor is b = 5, c = 4, f = 0
 
 
+    // Jets to which a source applies: light and b jets (hadronFlavour 0 or 5) or c jets (hadronFlavour 4).
+    enum class FlavourGroup : int { None = 0, LightOrB = 1, C = 2 };
+
+    static FlavourGroup getFlavourGroup(int Jet_Flavour)
+    {
+        static const std::array<FlavourGroup, 6> groups = {
+            FlavourGroup::LightOrB, FlavourGroup::None, FlavourGroup::None, FlavourGroup::None,
+            FlavourGroup::C, FlavourGroup::LightOrB
+        };
+        if(Jet_Flavour < 0 || Jet_Flavour >= static_cast<int>(groups.size())) return FlavourGroup::None;
+        return groups[Jet_Flavour];
+    }
+
+    // Flavour group and JES variation of the jets for which each source applies, indexed by source + 1.
+    static const std::array<std::pair<FlavourGroup, ::correction::JetCorrProvider::UncSource>, nSources>& getSourceRequirements()
+    {
+        using JetSource = ::correction::JetCorrProvider::UncSource;
+        static const std::array<std::pair<FlavourGroup, JetSource>, nSources> requirements = {{
+            { FlavourGroup::None, JetSource::Central }, // Central
+            { FlavourGroup::LightOrB, JetSource::Central }, // lf
+            { FlavourGroup::LightOrB, JetSource::Central }, // hf
+            { FlavourGroup::LightOrB, JetSource::Central }, // lfstats1
+            { FlavourGroup::LightOrB, JetSource::Central }, // lfstats2
+            { FlavourGroup::LightOrB, JetSource::Central }, // hfstats1
+            { FlavourGroup::LightOrB, JetSource::Central }, // hfstats2
+            { FlavourGroup::C, JetSource::Central }, // cferr1
+            { FlavourGroup::C, JetSource::Central }, // cferr2
+            { FlavourGroup::LightOrB, JetSource::RelativeBal },
+            { FlavourGroup::LightOrB, JetSource::HF },
+            { FlavourGroup::LightOrB, JetSource::BBEC1 },
+            { FlavourGroup::LightOrB, JetSource::EC2 },
+            { FlavourGroup::LightOrB, JetSource::Absolute },
+            { FlavourGroup::LightOrB, JetSource::FlavorQCD },
+            { FlavourGroup::LightOrB, JetSource::BBEC1_year },
+            { FlavourGroup::LightOrB, JetSource::Absolute_year },
+            { FlavourGroup::LightOrB, JetSource::EC2_year },
+            { FlavourGroup::LightOrB, JetSource::HF_year },
+            { FlavourGroup::LightOrB, JetSource::RelativeSample_year },
+        }};
+        return requirements;
+    }
+
     static bool sourceApplies(UncSource source, int Jet_Flavour, ::correction::JetCorrProvider::UncSource jet_source)
     {
-        if(source == UncSource::lf && (Jet_Flavour == 5 || Jet_Flavour==0) && jet_source==::correction::JetCorrProvider::UncSource::Central) return true;
-        if(source == UncSource::hf && (Jet_Flavour == 5 || Jet_Flavour==0) && jet_source==::correction::JetCorrProvider::UncSource::Central) return true;
-        if(source == UncSource::lfstats1 && (Jet_Flavour == 5 || Jet_Flavour==0) && jet_source==::correction::JetCorrProvider::UncSource::Central) return true;
-        if(source == UncSource::lfstats2 && (Jet_Flavour == 5 || Jet_Flavour==0) && jet_source==::correction::JetCorrProvider::UncSource::Central) return true;
-        if(source == UncSource::hfstats1 && (Jet_Flavour == 5 || Jet_Flavour==0) && jet_source==::correction::JetCorrProvider::UncSource::Central) return true;
-        if(source == UncSource::hfstats2 && (Jet_Flavour == 5 || Jet_Flavour==0) && jet_source==::correction::JetCorrProvider::UncSource::Central) return true;
-        if(source == UncSource::cferr1 && Jet_Flavour == 4 && jet_source==::correction::JetCorrProvider::UncSource::Central) return true;
-        if(source == UncSource::cferr2 && Jet_Flavour == 4 && jet_source==::correction::JetCorrProvider::UncSource::Central)  return true;
-
-        if (source==UncSource::jesRelativeBal && (Jet_Flavour == 5 || Jet_Flavour==0) && jet_source==::correction::JetCorrProvider::UncSource::RelativeBal ) return true;
-        if (source==UncSource::jesHF && (Jet_Flavour == 5 || Jet_Flavour==0) && jet_source==::correction::JetCorrProvider::UncSource::HF ) return true;
-        if (source==UncSource::jesBBEC1 && (Jet_Flavour == 5 || Jet_Flavour==0) && jet_source==::correction::JetCorrProvider::UncSource::BBEC1 ) return true;
-        if (source==UncSource::jesEC2 && (Jet_Flavour == 5 || Jet_Flavour==0) && jet_source==::correction::JetCorrProvider::UncSource::EC2 ) return true;
-        if (source==UncSource::jesAbsolute && (Jet_Flavour == 5 || Jet_Flavour==0) && jet_source==::correction::JetCorrProvider::UncSource::Absolute ) return true;
-        if (source==UncSource::jesFlavorQCD && (Jet_Flavour == 5 || Jet_Flavour==0) && jet_source==::correction::JetCorrProvider::UncSource::FlavorQCD ) return true;
-        if (source==UncSource::jesBBEC1_year && (Jet_Flavour == 5 || Jet_Flavour==0) && jet_source==::correction::JetCorrProvider::UncSource::BBEC1_year ) return true;
-        if (source==UncSource::jesAbsolute_year && (Jet_Flavour == 5 || Jet_Flavour==0) && jet_source==::correction::JetCorrProvider::UncSource::Absolute_year ) return true;
-        if (source==UncSource::jesEC2_year && (Jet_Flavour == 5 || Jet_Flavour==0) && jet_source==::correction::JetCorrProvider::UncSource::EC2_year ) return true;
-        if (source==UncSource::jesHF_year && (Jet_Flavour == 5 || Jet_Flavour==0) && jet_source==::correction::JetCorrProvider::UncSource::HF_year ) return true;
-        if (source==UncSource::jesRelativeSample_year && (Jet_Flavour == 5 || Jet_Flavour==0) && jet_source==::correction::JetCorrProvider::UncSource::RelativeSample_year) return true;
-        return false;
+        const auto& requirement = getSourceRequirements().at(static_cast<int>(source) + 1);
+        return requirement.first != FlavourGroup::None && requirement.first == getFlavourGroup(Jet_Flavour)
+               && requirement.second == jet_source;
     }
 
     bTagShapeCorrProvider(const std::string& fileName, const std::string& year)  :
@@ -115,6 +144,14 @@ public:
     deepJet_shape_(corrections_->at("deepJet_shape")),
     _year(year)
     {
+        for(const auto& [source, source_name] : getUncName()) {
+            const size_t source_idx = static_cast<size_t>(static_cast<int>(source) + 1);
+            for(UncScale scale : { UncScale::Central, UncScale::Up, UncScale::Down }) {
+                const bool isCentral = scale == UncScale::Central;
+                unc_names_[source_idx][getScaleIdx(scale)] = getFullNameUnc(getScaleStr(scale), source_name, _year,
+                                                                            needYear(source), isCentral);
+            }
+        }
     }
 
 
@@ -122,28 +159,83 @@ public:
     ::correction::JetCorrProvider::UncSource jet_source) const
     {
         double sf_product = 1.;
-        std::string source_str = getUncName().at(source);
+        const auto& source_names = unc_names_.at(static_cast<int>(source) + 1);
         for(size_t jet_idx = 0; jet_idx < Jet_p4.size(); jet_idx++){
             if(!pre_sel[jet_idx]) continue;
             const UncScale jet_tag_scale = sourceApplies(source, Jet_Flavour[jet_idx],jet_source)
                                            ? scale : UncScale::Central;
-            const std::string& scale_str = getScaleStr(jet_tag_scale);
-            bool isCentral = jet_tag_scale == UncScale::Central;
-            bool need_year = needYear(source);
-            const std::string& unc_name = getFullNameUnc(scale_str, source_str,_year, need_year, isCentral);
+            const std::string& unc_name = source_names[getScaleIdx(jet_tag_scale)];
             const auto sf = deepJet_shape_->evaluate({unc_name, Jet_Flavour[jet_idx], std::abs(Jet_p4[jet_idx].eta()),Jet_p4[jet_idx].pt(),Jet_bTag_score[jet_idx]});
             sf_product*=sf;
         }
         return sf_product;
     }
 
-private:
+    // Central value and up/down variations of the b-tag shape sources that are not correlated with the JES,
+    // in a single loop over jets. For jets to which a source does not apply, the central SF is reused.
+    SFVariations getBTagShapeSFVariations(const RVecLV& Jet_p4, const RVecB& pre_sel, const RVecI& Jet_Flavour,
+                                          const RVecF& Jet_bTag_score, bool need_variations) const
+    {
+        static const std::array<UncSource, 8> shape_sources = {
+            UncSource::lf, UncSource::hf, UncSource::lfstats1, UncSource::lfstats2,
+            UncSource::hfstats1, UncSource::hfstats2, UncSource::cferr1, UncSource::cferr2
+        };
+        std::array<double, SFVariations::size> sf_products;
+        sf_products.fill(1.);
+        for(size_t jet_idx = 0; jet_idx < Jet_p4.size(); jet_idx++){
+            if(!pre_sel[jet_idx]) continue;
+            const int flavour = Jet_Flavour[jet_idx];
+            const double abs_eta = std::abs(Jet_p4[jet_idx].eta());
+            const double pt = Jet_p4[jet_idx].pt();
+            const auto evaluate = [&](const std::string& unc_name) {
+                return deepJet_shape_->evaluate({unc_name, flavour, abs_eta, pt, Jet_bTag_score[jet_idx]});
+            };
+            const double sf_central = evaluate(unc_names_[0][0]);
+            std::array<double, SFVariations::size> jet_sf;
+            jet_sf.fill(sf_central);
+            if(need_variations) {
+                const FlavourGroup flavour_group = getFlavourGroup(flavour);
+                for(UncSource source : shape_sources) {
+                    const size_t source_idx = static_cast<size_t>(static_cast<int>(source) + 1);
+                    if(flavour_group == FlavourGroup::None || getSourceRequirements()[source_idx].first != flavour_group)
+                        continue;
+                    for(UncScale scale : { UncScale::Up, UncScale::Down })
+                        jet_sf[SFVariations::index(source, scale)] = evaluate(unc_names_[source_idx][getScaleIdx(scale)]);
+                }
+            }
+            for(size_t idx = 0; idx < SFVariations::size; ++idx)
+                sf_products[idx] *= jet_sf[idx];
+        }
+        SFVariations sf;
+        for(size_t idx = 0; idx < SFVariations::size; ++idx)
+            sf[idx] = static_cast<float>(sf_products[idx]);
+        return sf;
+    }
+
+    // Precompiled counterpart of the getBTagShapeSFVariations column expression.
+    struct BTagShapeSFVariationsFunctor {
+        explicit BTagShapeSFVariationsFunctor(bool _need_variations) : need_variations(_need_variations) {}
 
+        SFVariations operator()(const RVecLV& Jet_p4, const RVecB& pre_sel, const RVecI& Jet_Flavour,
+                                const RVecF& Jet_bTag_score) const
+        {
+            return getGlobal().getBTagShapeSFVariations(Jet_p4, pre_sel, Jet_Flavour, Jet_bTag_score, need_variations);
+        }
+
+        bool need_variations;
+    };
+
+private:
+    static size_t getScaleIdx(UncScale scale)
+    {
+        return scale == UncScale::Central ? 0 : (scale == UncScale::Up ? 1 : 2);
+    }
 
 private:
     std::unique_ptr<CorrectionSet> corrections_;
-    Correction::Ref deepJet_shape_;
+    CachedCorrection deepJet_shape_;
     std::string _year;
+    std::array<std::array<std::string, 3>, nSources> unc_names_;
 
 
 };
@@ -0,0 +1,528 @@
+#pragma once
+
+#include <algorithm>
+#include <array>
+#include <atomic>
+#include <cmath>
+#include <iomanip>
+#include <iostream>
+#include <limits>
+#include <map>
+#include <memory>
+#include <mutex>
+#include <unordered_map>
+
+#include "correction.h"
+#include "sharedTable.h"
+
+namespace correction {
+
+// Number of edges that are <= x, i.e. std::upper_bound(edges, edges + n_edges, x) - edges,
+// computed without data-dependent branches.
+inline size_t branchlessUpperBound(const double* edges, size_t n_edges, double x)
+{
+    if(n_edges == 0) return 0;
+    const double* base = edges;
+    size_t n = n_edges;
+    while(n > 1) {
+        const size_t half = n / 2;
+        base += (base[half - 1] <= x) ? half : 0;
+        n -= half;
+    }
+    return static_cast<size_t>(base - edges) + (*base <= x);
+}
+
+// Binning structure of a correction, used to map the input values to the cell of the correction they fall in.
+// Inputs are either unused, binned (union of the edges of all binnings of that input) or categories.
+// The layout is computed from the correction JSON on the python side (see CorrectionCache.py) and
+// registered only for corrections that consist exclusively of binnings, categories and constants.
+class CorrectionLayout {
+public:
+    enum class InputMode { Unused = 0, Binned = 1, Category = 2 };
+    static constexpr size_t MaxInputs = 8;
+
+    void addUnused() { addInput(InputMode::Unused, {}, {}); }
+    void addBinned(const std::vector<double>& edges) { addInput(InputMode::Binned, edges, {}); }
+    void addCategory(const std::vector<std::string>& string_keys, const std::vector<int>& int_keys = {})
+    {
+        addInput(InputMode::Category, {}, string_keys);
+        int_keys_.back() = int_keys;
+        std::sort(int_keys_.back().begin(), int_keys_.back().end());
+    }
+
+    size_t size() const { return modes_.size(); }
+    InputMode mode(size_t n) const { return modes_.at(n); }
+    const std::vector<double>& edges(size_t n) const { return edges_.at(n); }
+    const std::map<std::string, int64_t>& stringKeys(size_t n) const { return string_keys_.at(n); }
+    const std::vector<int>& intKeys(size_t n) const { return int_keys_.at(n); }
+
+    // FNV-1a hash of the layout, used to check that a shared table was built for the same layout.
+    uint64_t hash() const
+    {
+        uint64_t h = 14695981039346656037ULL;
+        auto update = [&h](const void* data, size_t size) {
+            const unsigned char* bytes = static_cast<const unsigned char*>(data);
+            for(size_t n = 0; n < size; ++n)
+                h = (h ^ bytes[n]) * 1099511628211ULL;
+        };
+        for(size_t n = 0; n < modes_.size(); ++n) {
+            const int mode = static_cast<int>(modes_[n]);
+            update(&mode, sizeof(mode));
+            update(edges_[n].data(), edges_[n].size() * sizeof(double));
+            for(const auto& [key, idx] : string_keys_[n])
+                update(key.data(), key.size() + 1);
+            update(int_keys_[n].data(), int_keys_[n].size() * sizeof(int));
+        }
+        return h;
+    }
+
+    using Key = std::array<int64_t, MaxInputs>;
+
+    // Returns false if the cell cannot be resolved, e.g. for an unknown string category or a NaN binned input.
+    bool makeKey(const std::vector<Variable::Type>& values, Key& key) const
+    {
+        if(values.size() != modes_.size()) return false;
+        key.fill(0);
+        for(size_t n = 0; n < values.size(); ++n) {
+            const auto& value = values[n];
+            if(modes_[n] == InputMode::Unused) continue;
+            if(modes_[n] == InputMode::Binned) {
+                double x;
+                if(const double* x_real = std::get_if<double>(&value)) x = *x_real;
+                else if(const int* x_int = std::get_if<int>(&value)) x = *x_int;
+                else return false;
+                if(std::isnan(x)) return false;
+                key[n] = branchlessUpperBound(edges_[n].data(), edges_[n].size(), x);
+            } else if(const int* x_int = std::get_if<int>(&value)) {
+                key[n] = *x_int;
+            } else if(const std::string* x_str = std::get_if<std::string>(&value)) {
+                const auto iter = string_keys_[n].find(*x_str);
+                if(iter == string_keys_[n].end()) return false;
+                key[n] = iter->second;
+            } else {
+                return false;
+            }
+        }
+        return true;
+    }
+
+private:
+    void addInput(InputMode mode, const std::vector<double>& edges, const std::vector<std::string>& string_keys)
+    {
+        if(modes_.size() >= MaxInputs)
+            throw std::runtime_error("CorrectionLayout: too many inputs.");
+        modes_.push_back(mode);
+        edges_.push_back(edges);
+        std::map<std::string, int64_t> keys;
+        for(const auto& key : string_keys)
+            keys.emplace(key, static_cast<int64_t>(keys.size()));
+        string_keys_.push_back(keys);
+        int_keys_.emplace_back();
+    }
+
+private:
+    std::vector<InputMode> modes_;
+    std::vector<std::vector<double>> edges_;
+    std::vector<std::map<std::string, int64_t>> string_keys_;
+    std::vector<std::vector<int>> int_keys_;
+};
+
+// Correction flattened into a dense table with one value per cell of its layout.
+// Binned inputs have n_edges + 1 cells (the first and the last one are the under- and overflow),
+// categories have one cell per key and unused inputs a single cell. The table is filled by evaluating
+// the correction once in each cell. Cells for which the evaluation fails, as well as unknown category keys
+// and NaN inputs, are not served from the table: lookup returns false and the caller falls back to evaluate.
+// If table_path is given, the table is attached read-only from that file when it exists and matches the layout;
+// otherwise it is built and written to the file, so that other processes on the node can attach to it.
+class DenseCorrection {
+public:
+    static constexpr size_t NoCell = std::numeric_limits<size_t>::max();
+
+    // Returns nullptr if the table would have more than max_cells cells.
+    static std::shared_ptr<const DenseCorrection> build(const Correction& corr, const CorrectionLayout& layout,
+                                                        size_t max_cells, const std::string& table_path = "")
+    {
+        const auto& inputs = corr.inputs();
+        if(inputs.size() != layout.size()) return nullptr;
+        auto dense = std::shared_ptr<DenseCorrection>(new DenseCorrection(layout));
+        size_t n_cells = 1;
+        for(size_t n = 0; n < layout.size(); ++n) {
+            dense->strides_.push_back(n_cells);
+            if(dense->nCells(n) > max_cells / n_cells) return nullptr;
+            n_cells *= dense->nCells(n);
+        }
+        dense->n_cells_ = n_cells;
+        const uint64_t tag = layout.hash();
+        // The first process evaluates and writes the table while holding the lock of the file,
+        // the others wait for the lock and then attach to the written table.
+        std::unique_ptr<FileLock> lock;
+        if(!table_path.empty()) {
+            if(dense->attach(table_path, tag)) return dense;
+            lock = std::make_unique<FileLock>(table_path);
+            if(dense->attach(table_path, tag)) return dense;
+        }
+        auto& table = dense->owned_table_;
+        table.resize(n_cells);
+        std::vector<Variable::Type> values(inputs.size());
+        for(size_t flat_idx = 0; flat_idx < n_cells; ++flat_idx) {
+            for(size_t n = 0; n < inputs.size(); ++n) {
+                const size_t cell = (flat_idx / dense->strides_[n]) % dense->nCells(n);
+                values[n] = dense->cellValue(n, cell, inputs[n].type());
+            }
+            try {
+                table[flat_idx] = corr.evaluate(values);
+            } catch(std::exception&) {
+                table[flat_idx] = std::numeric_limits<double>::quiet_NaN();
+            }
+        }
+        if(lock && lock->locked() && SharedTable::write(table_path, table, tag) && dense->attach(table_path, tag)) {
+            table.clear();
+            table.shrink_to_fit();
+            return dense;
+        }
+        dense->table_ = table.data();
+        return dense;
+    }
+
+    DenseCorrection(const DenseCorrection&) = delete;
+    DenseCorrection& operator=(const DenseCorrection&) = delete;
+
+    size_t nInputs() const { return layout_.size(); }
+    size_t nCells() const { return n_cells_; }
+    bool isShared() const { return shared_table_ != nullptr; }
+
+    size_t binCell(size_t input_idx, double x) const
+    {
+        const auto mode = layout_.mode(input_idx);
+        if(mode == CorrectionLayout::InputMode::Unused) return 0;
+        if(mode != CorrectionLayout::InputMode::Binned || std::isnan(x)) return NoCell;
+        const auto& edges = layout_.edges(input_idx);
+        return branchlessUpperBound(edges.data(), edges.size(), x);
+    }
+
+    size_t categoryCell(size_t input_idx, const std::string& key) const
+    {
+        const auto mode = layout_.mode(input_idx);
+        if(mode == CorrectionLayout::InputMode::Unused) return 0;
+        if(mode != CorrectionLayout::InputMode::Category) return NoCell;
+        const auto& keys = layout_.stringKeys(input_idx);
+        const auto iter = keys.find(key);
+        return iter == keys.end() ? NoCell : static_cast<size_t>(iter->second);
+    }
+
+    size_t categoryCell(size_t input_idx, int key) const
+    {
+        const auto mode = layout_.mode(input_idx);
+        if(mode == CorrectionLayout::InputMode::Unused) return 0;
+        if(mode == CorrectionLayout::InputMode::Binned) return binCell(input_idx, key);
+        const auto& keys = layout_.intKeys(input_idx);
+        const auto iter = std::lower_bound(keys.begin(), keys.end(), key);
+        if(iter == keys.end() || *iter != key) return NoCell;
+        return layout_.stringKeys(input_idx).size() + static_cast<size_t>(iter - keys.begin());
+    }
+
+    size_t cell(size_t input_idx, const Variable::Type& value) const
+    {
+        if(const double* x = std::get_if<double>(&value)) return binCell(input_idx, *x);
+        if(const int* x = std::get_if<int>(&value)) return categoryCell(input_idx, *x);
+        return categoryCell(input_idx, std::get<std::string>(value));
+    }
+
+    template <size_t N>
+    bool lookup(const std::array<size_t, N>& cells, double& value) const
+    {
+        size_t flat_idx = 0;
+        for(size_t n = 0; n < N; ++n) {
+            if(cells[n] == NoCell) return false;
+            flat_idx += cells[n] * strides_[n];
+        }
+        value = table_[flat_idx];
+        return !std::isnan(value);
+    }
+
+    bool lookup(const std::vector<Variable::Type>& values, double& value) const
+    {
+        if(values.size() != nInputs()) return false;
+        size_t flat_idx = 0;
+        for(size_t n = 0; n < values.size(); ++n) {
+            const size_t c = cell(n, values[n]);
+            if(c == NoCell) return false;
+            flat_idx += c * strides_[n];
+        }
+        value = table_[flat_idx];
+        return !std::isnan(value);
+    }
+
+private:
+    explicit DenseCorrection(const CorrectionLayout& layout) : layout_(layout) {}
+
+    bool attach(const std::string& table_path, uint64_t tag)
+    {
+        shared_table_ = SharedTable::open(table_path, n_cells_, tag);
+        if(!shared_table_) return false;
+        table_ = shared_table_->data();
+        return true;
+    }
+
+    size_t nCells(size_t n) const
+    {
+        switch(layout_.mode(n)) {
+            case CorrectionLayout::InputMode::Binned: return layout_.edges(n).size() + 1;
+            case CorrectionLayout::InputMode::Category: return layout_.stringKeys(n).size() + layout_.intKeys(n).size();
+            default: return 1;
+        }
+    }
+
+    // Representative input value of a cell.
+    Variable::Type cellValue(size_t n, size_t cell, Variable::VarType type) const
+    {
+        if(layout_.mode(n) == CorrectionLayout::InputMode::Category) {
+            const auto& string_keys = layout_.stringKeys(n);
+            if(cell >= string_keys.size()) return layout_.intKeys(n).at(cell - string_keys.size());
+            for(const auto& [key, idx] : string_keys) {
+                if(static_cast<size_t>(idx) == cell) return key;
+            }
+        }
+        double x = 0;
+        if(layout_.mode(n) == CorrectionLayout::InputMode::Binned) {
+            const auto& edges = layout_.edges(n);
+            if(edges.empty()) x = 0;
+            else if(cell == 0) x = std::nextafter(edges.front(), -std::numeric_limits<double>::infinity());
+            else if(cell == edges.size()) x = edges.back();
+            else x = edges[cell - 1] + (edges[cell] - edges[cell - 1]) / 2;
+            if(type == Variable::VarType::integer)
+                x = cell == 0 ? std::floor(x) : std::ceil(edges[std::min(cell, edges.size()) - 1]);
+        }
+        if(type == Variable::VarType::string) return std::string();
+        if(type == Variable::VarType::integer) return static_cast<int>(x);
+        return x;
+    }
+
+private:
+    CorrectionLayout layout_;
+    std::vector<size_t> strides_;
+    size_t n_cells_{0};
+    std::vector<double> owned_table_;
+    std::shared_ptr<const SharedTable> shared_table_;
+    const double* table_{nullptr};
+};
+
+// Wrapper around Correction::Ref that, if a layout has been registered for the correction name before
+// the wrapper is created, either flattens the correction into a DenseCorrection (if flattening is enabled
+// and the table is small enough) or keeps a per-thread bounded cache of the evaluated values, keyed on the
+// resolved cell of the inputs (if caching is enabled). Otherwise evaluate is forwarded as is.
+class CachedCorrection {
+public:
+    struct Stats {
+        uint64_t hits, misses, bypassed;
+    };
+
+    CachedCorrection() = default;
+    CachedCorrection(Correction::Ref ref) : ref_(ref)
+    {
+        if(!ref_) return;
+        LayoutEntry entry;
+        {
+            std::lock_guard<std::mutex> lock(getMutex());
+            const auto& layouts = getLayouts();
+            const auto iter = layouts.find(ref_->name());
+            if(iter == layouts.end()) return;
+            entry = iter->second;
+        }
+        const auto& layout = entry.layout;
+        if(flattenEnabled())
+            dense_ = DenseCorrection::build(*ref_, *layout, maxCells(), entry.table_path);
+        if(dense_ || !cacheEnabled()) return;
+        state_ = std::make_shared<State>();
+        state_->name = ref_->name();
+        state_->layout = layout;
+        state_->id = nextId()++;
+        std::lock_guard<std::mutex> lock(getMutex());
+        getStates().push_back(state_);
+    }
+
+    const CachedCorrection* operator->() const { return this; }
+    const Correction::Ref& ref() const { return ref_; }
+    bool isCached() const { return state_ != nullptr; }
+    const DenseCorrection* dense() const { return dense_.get(); }
+
+    double evaluate(const std::vector<Variable::Type>& values) const
+    {
+        if(dense_) {
+            double result;
+            if(dense_->lookup(values, result)) return result;
+            return ref_->evaluate(values);
+        }
+        if(!state_) return ref_->evaluate(values);
+        CorrectionLayout::Key key;
+        ThreadState& thread_state = getThreadState(*state_);
+        if(!state_->layout->makeKey(values, key)) {
+            increment(thread_state.bypassed);
+            return ref_->evaluate(values);
+        }
+        auto& cache = thread_state.cache;
+        const auto iter = cache.find(key);
+        if(iter != cache.end()) {
+            increment(thread_state.hits);
+            return iter->second;
+        }
+        increment(thread_state.misses);
+        const double result = ref_->evaluate(values);
+        if(cache.size() >= maxEntries())
+            cache.clear();
+        cache.emplace(key, result);
+        return result;
+    }
+
+    Stats stats() const
+    {
+        if(!state_) return Stats{0, 0, 0};
+        std::lock_guard<std::mutex> lock(getMutex());
+        return collectStats(*state_);
+    }
+
+    // If table_path is not empty, the flattened table is shared between processes through that file.
+    static void registerLayout(const std::string& name, const CorrectionLayout& layout, const std::string& table_path = "")
+    {
+        std::lock_guard<std::mutex> lock(getMutex());
+        getLayouts()[name] = LayoutEntry{std::make_shared<const CorrectionLayout>(layout), table_path};
+    }
+
+    // Maximal number of cached cells per correction and per thread. The cache is reset when it is full.
+    static size_t maxEntries() { return _maxEntries(); }
+    static void setMaxEntries(size_t max_entries) { _maxEntries() = max_entries; }
+
+    static bool cacheEnabled() { return _cacheEnabled(); }
+    static void setCacheEnabled(bool enabled) { _cacheEnabled() = enabled; }
+
+    // Maximal number of cells of a flattened correction.
+    static bool flattenEnabled() { return _flattenEnabled(); }
+    static size_t maxCells() { return _maxCells(); }
+    static void setFlatten(bool enabled, size_t max_cells) { _flattenEnabled() = enabled; _maxCells() = max_cells; }
+
+    static void printStats(std::ostream& os = std::cout)
+    {
+        std::lock_guard<std::mutex> lock(getMutex());
+        for(const auto& state : getStates()) {
+            const Stats stats = collectStats(*state);
+            const uint64_t total = stats.hits + stats.misses;
+            os << state->name << ": hits=" << stats.hits << " misses=" << stats.misses << " bypassed=" << stats.bypassed
+               << " hit rate=" << std::setprecision(4) << (total > 0 ? double(stats.hits) / total : 0.) << std::endl;
+        }
+    }
+
+private:
+    struct KeyHash {
+        size_t operator()(const CorrectionLayout::Key& key) const
+        {
+            size_t h = 0;
+            for(int64_t v : key)
+                h ^= std::hash<int64_t>()(v) + 0x9e3779b97f4a7c15ULL + (h << 6) + (h >> 2);
+            return h;
+        }
+    };
+    using Cache = std::unordered_map<CorrectionLayout::Key, double, KeyHash>;
+
+    // Cache and counters of one correction owned by one thread. The counters have a single writer,
+    // so they are updated without read-modify-write operations and each thread works on its own cache line.
+    struct alignas(64) ThreadState {
+        Cache cache;
+        std::atomic<uint64_t> hits{0}, misses{0}, bypassed{0};
+    };
+
+    struct State {
+        std::string name;
+        std::shared_ptr<const CorrectionLayout> layout;
+        size_t id;
+        std::vector<std::shared_ptr<const ThreadState>> threads; // guarded by getMutex()
+    };
+
+    static void increment(std::atomic<uint64_t>& counter)
+    {
+        counter.store(counter.load(std::memory_order_relaxed) + 1, std::memory_order_relaxed);
+    }
+
+    static Stats collectStats(const State& state)
+    {
+        Stats stats{0, 0, 0};
+        for(const auto& thread_state : state.threads) {
+            stats.hits += thread_state->hits.load(std::memory_order_relaxed);
+            stats.misses += thread_state->misses.load(std::memory_order_relaxed);
+            stats.bypassed += thread_state->bypassed.load(std::memory_order_relaxed);
+        }
+        return stats;
+    }
+
+    static size_t& _maxEntries()
+    {
+        static size_t max_entries = 1 << 16;
+        return max_entries;
+    }
+
+    static bool& _cacheEnabled()
+    {
+        static bool enabled = false;
+        return enabled;
+    }
+
+    static bool& _flattenEnabled()
+    {
+        static bool enabled = false;
+        return enabled;
+    }
+
+    static size_t& _maxCells()
+    {
+        static size_t max_cells = 1 << 20;
+        return max_cells;
+    }
+
+    static ThreadState& getThreadState(State& state)
+    {
+        thread_local std::vector<std::shared_ptr<ThreadState>> thread_states;
+        if(state.id >= thread_states.size())
+            thread_states.resize(state.id + 1);
+        if(!thread_states[state.id]) {
+            thread_states[state.id] = std::make_shared<ThreadState>();
+            std::lock_guard<std::mutex> lock(getMutex());
+            state.threads.push_back(thread_states[state.id]);
+        }
+        return *thread_states[state.id];
+    }
+
+    struct LayoutEntry {
+        std::shared_ptr<const CorrectionLayout> layout;
+        std::string table_path;
+    };
+
+    static std::map<std::string, LayoutEntry>& getLayouts()
+    {
+        static std::map<std::string, LayoutEntry> layouts;
+        return layouts;
+    }
+
+    static std::vector<std::shared_ptr<State>>& getStates()
+    {
+        static std::vector<std::shared_ptr<State>> states;
+        return states;
+    }
+
+    static std::mutex& getMutex()
+    {
+        static std::mutex m;
+        return m;
+    }
+
+    static std::atomic<size_t>& nextId()
+    {
+        static std::atomic<size_t> id{0};
+        return id;
+    }
+
+private:
+    Correction::Ref ref_;
+    std::shared_ptr<const DenseCorrection> dense_;
+    std::shared_ptr<State> state_;
+};
+
+} // namespace correction
@@ -21,6 +21,191 @@ enum class UncScale : int {
 };
 
 
+// Collection of shifted p4 for all variations stored in a single contiguous buffer.
+// Row var_idx holds the p4 of all objects for the variation var_idx.
+class ShiftedP4Collection {
+public:
+    ShiftedP4Collection() : nVariations_(0), nObjects_(0) {}
+    ShiftedP4Collection(size_t nVariations, size_t nObjects) :
+        nVariations_(nVariations), nObjects_(nObjects), p4_(nVariations * nObjects)
+    {
+    }
+
+    size_t nVariations() const { return nVariations_; }
+    size_t nObjects() const { return nObjects_; }
+
+    LorentzVectorM& at(size_t var_idx, size_t obj_idx) { return p4_[var_idx * nObjects_ + obj_idx]; }
+    const LorentzVectorM& at(size_t var_idx, size_t obj_idx) const { return p4_[var_idx * nObjects_ + obj_idx]; }
+
+    // Non-owning view of the row var_idx. It stays valid as long as the collection is alive.
+    RVecLV view(size_t var_idx) const
+    {
+        if(var_idx >= nVariations_)
+            throw std::out_of_range("ShiftedP4Collection: variation index " + std::to_string(var_idx)
+                                    + " is out of range.");
+        if(nObjects_ == 0)
+            return RVecLV();
+        return RVecLV(const_cast<LorentzVectorM*>(p4_.data()) + var_idx * nObjects_, nObjects_);
+    }
+
+    // Sets the same p4 of the object obj_idx for all variations.
+    void fill(size_t obj_idx, const LorentzVectorM& p4)
+    {
+        for(size_t var_idx = 0; var_idx < nVariations_; ++var_idx)
+            at(var_idx, obj_idx) = p4;
+    }
+
+    // Copies the p4 of a subset of the objects, evaluated separately, to the rows of all objects.
+    // obj_indices[k] is the index of the k-th object of the subset.
+    void scatter(const ShiftedP4Collection& subset, const RVecS& obj_indices)
+    {
+        for(size_t var_idx = 0; var_idx < nVariations_; ++var_idx) {
+            for(size_t k = 0; k < obj_indices.size(); ++k)
+                at(var_idx, obj_indices[k]) = subset.at(var_idx, k);
+        }
+    }
+
+private:
+    size_t nVariations_, nObjects_;
+    RVecLV p4_;
+};
+
+// Shifted p4 of all variations together with their difference to the unshifted p4, in two collections
+// with the same layout.
+class ShiftedP4WithDelta {
+public:
+    ShiftedP4WithDelta() = default;
+    ShiftedP4WithDelta(size_t nVariations, size_t nObjects) : p4_(nVariations, nObjects), delta_(nVariations, nObjects) {}
+
+    size_t nVariations() const { return p4_.nVariations(); }
+    size_t nObjects() const { return p4_.nObjects(); }
+
+    void set(size_t var_idx, size_t obj_idx, const LorentzVectorM& p4, const LorentzVectorM& p4_orig)
+    {
+        p4_.at(var_idx, obj_idx) = p4;
+        delta_.at(var_idx, obj_idx) = p4 - p4_orig;
+    }
+
+    // Non-owning views of the row var_idx. They stay valid as long as the collection is alive.
+    RVecLV p4(size_t var_idx) const { return p4_.view(var_idx); }
+    RVecLV delta(size_t var_idx) const { return delta_.view(var_idx); }
+
+private:
+    ShiftedP4Collection p4_, delta_;
+};
+
+// Indices of the objects that pass the per-object selection mask, none if the event fails the event selection.
+// The mask must have one entry per object of the collection, whose size column is named in the error.
+template <typename Mask>
+RVecS selectedIndices(bool event_pass, const Mask& mask, size_t n_objects, const std::string& size_column)
+{
+    if(mask.size() != n_objects)
+        throw std::runtime_error("selectedIndices: the selection mask has " + std::to_string(mask.size())
+                                 + " entries, but " + size_column + " has " + std::to_string(n_objects) + ".");
+    RVecS indices;
+    if(!event_pass)
+        return indices;
+    indices.reserve(mask.size());
+    for(size_t obj_idx = 0; obj_idx < mask.size(); ++obj_idx) {
+        if(mask[obj_idx])
+            indices.push_back(obj_idx);
+    }
+    return indices;
+}
+
+// Scale factor values for all variations of a single object: central, up and down for each uncertainty source.
+// Sources are indexed by the value of the provider UncSource enum, which starts from Central = -1.
+template <typename UncSource, size_t NSources>
+class SFVariations {
+public:
+    using UncSourceType = UncSource;
+    static constexpr size_t size = 3 * NSources;
+
+    explicit SFVariations(float value = 1.f) { values_.fill(value); }
+
+    static size_t index(UncSource source, UncScale scale)
+    {
+        const int source_idx = static_cast<int>(source) + 1;
+        if(source_idx < 0 || source_idx >= static_cast<int>(NSources))
+            throw std::out_of_range("SFVariations: uncertainty source " + std::to_string(static_cast<int>(source))
+                                    + " is out of range.");
+        const size_t scale_idx = scale == UncScale::Central ? 0 : (scale == UncScale::Up ? 1 : 2);
+        return 3 * static_cast<size_t>(source_idx) + scale_idx;
+    }
+
+    float get(UncSource source, UncScale scale) const { return values_[index(source, scale)]; }
+    void set(UncSource source, UncScale scale, float value) { values_[index(source, scale)] = value; }
+
+    float& operator[](size_t idx) { return values_[idx]; }
+    float operator[](size_t idx) const { return values_[idx]; }
+
+private:
+    std::array<float, size> values_;
+};
+
+// Read-only copy of the binning, contents and errors of a 2D histogram stored in flat arrays.
+// Lookups clamp the coordinates to the first/last bin of each axis, as done with FindFixBin on the TH2
+// before, but do not involve ROOT objects, so the grid can be shared between threads.
+class Grid2D {
+public:
+    Grid2D() = default;
+
+    template <typename Hist>
+    explicit Grid2D(const Hist& hist) :
+        x_edges_(getEdges(*hist.GetXaxis())), y_edges_(getEdges(*hist.GetYaxis()))
+    {
+        const size_t n_x = nBinsX(), n_y = nBinsY();
+        contents_.resize(n_x * n_y);
+        errors_.resize(n_x * n_y);
+        for(size_t x_bin = 0; x_bin < n_x; ++x_bin) {
+            for(size_t y_bin = 0; y_bin < n_y; ++y_bin) {
+                contents_[x_bin * n_y + y_bin] = hist.GetBinContent(x_bin + 1, y_bin + 1);
+                errors_[x_bin * n_y + y_bin] = hist.GetBinError(x_bin + 1, y_bin + 1);
+            }
+        }
+    }
+
+    bool empty() const { return contents_.empty(); }
+    size_t nBinsX() const { return x_edges_.empty() ? 0 : x_edges_.size() - 1; }
+    size_t nBinsY() const { return y_edges_.empty() ? 0 : y_edges_.size() - 1; }
+
+    size_t findBinX(double x) const { return findBin(x_edges_, x); }
+    size_t findBinY(double y) const { return findBin(y_edges_, y); }
+
+    float getContent(double x, double y) const { return contents_.at(findBinX(x) * nBinsY() + findBinY(y)); }
+    float getError(double x, double y) const { return errors_.at(findBinX(x) * nBinsY() + findBinY(y)); }
+
+    // Content shifted by the bin error in the direction of the scale.
+    float getValue(double x, double y, UncScale scale) const
+    {
+        const size_t idx = findBinX(x) * nBinsY() + findBinY(y);
+        return contents_.at(idx) + static_cast<int>(scale) * errors_.at(idx);
+    }
+
+private:
+    template <typename Axis>
+    static std::vector<double> getEdges(const Axis& axis)
+    {
+        std::vector<double> edges(axis.GetNbins() + 1);
+        for(int bin = 1; bin <= axis.GetNbins(); ++bin)
+            edges[bin - 1] = axis.GetBinLowEdge(bin);
+        edges.back() = axis.GetBinUpEdge(axis.GetNbins());
+        return edges;
+    }
+
+    // Zero-based index of the bin that contains value, clamped to [0, n_bins - 1].
+    static size_t findBin(const std::vector<double>& edges, double value)
+    {
+        const size_t n_bins = edges.size() - 1;
+        const size_t n_below = std::upper_bound(edges.begin(), edges.end(), value) - edges.begin();
+        if(n_below <= 1) return 0;
+        return std::min(n_below - 1, n_bins - 1);
+    }
+
+private:
+    std::vector<double> x_edges_, y_edges_;
+    std::vector<float> contents_, errors_;
+};
 
 template <typename CorrectionClass>
 class CorrectionsBase {
@@ -0,0 +1,249 @@
+#pragma once
+
+#include <ROOT/RDataFrame.hxx>
+
+#include "corrections.h"
+
+// Precompiled functors used to define correction columns without JIT-compiling an expression for each column.
+// Each functor is bound to its input columns with DefineColumn.
+
+namespace correction {
+
+template <typename Functor>
+ROOT::RDF::RNode DefineColumn(ROOT::RDF::RNode df, const std::string& name, Functor functor,
+                              const std::vector<std::string>& columns)
+{
+    return df.Define(name, std::move(functor), columns);
+}
+
+// Quantities of one leg of the HttCandidate used by the lepton and trigger SFs.
+// decayMode is set for tau legs. genMatch is set for tau and electron legs if the gen-match columns are available
+// (has_genMatch), the SFs that depend on it check has_genMatch.
+struct LegFeatures {
+    LorentzVectorM p4;
+    double pt{0}, eta{0}, abs_eta{0};
+    int decayMode{-1};
+    int genMatch{0};
+    bool has_genMatch{false};
+    Leg leg_type{};
+    int index{-1};
+};
+
+// Legs of the HttCandidate, packed once per event (column HttCandidate_legs) so that the SF expressions
+// neither look up the leg collections again nor check their bounds.
+struct CandidateLegs {
+    static constexpr size_t n_legs = 2;
+
+    const LegFeatures& operator[](size_t leg_idx) const { return legs[leg_idx]; }
+
+    std::array<LegFeatures, n_legs> legs;
+    Channel channel{};
+};
+
+template <typename HttCand>
+CandidateLegs makeCandidateLegs(const HttCand& cand, const RVecI& Tau_decayMode)
+{
+    CandidateLegs result;
+    result.channel = cand.channel();
+    for(size_t leg_idx = 0; leg_idx < CandidateLegs::n_legs; ++leg_idx) {
+        LegFeatures& leg = result.legs[leg_idx];
+        leg.p4 = cand.leg_p4[leg_idx];
+        leg.pt = leg.p4.pt();
+        leg.eta = leg.p4.eta();
+        leg.abs_eta = std::abs(leg.eta);
+        leg.leg_type = cand.leg_type[leg_idx];
+        leg.index = cand.leg_index[leg_idx];
+        if(leg.leg_type == Leg::tau)
+            leg.decayMode = Tau_decayMode.at(leg.index);
+    }
+    return result;
+}
+
+template <typename HttCand>
+CandidateLegs makeCandidateLegs(const HttCand& cand, const RVecI& Tau_decayMode, const RVecI& Tau_genMatch,
+                                const RVecI& Electron_genMatch)
+{
+    CandidateLegs result = makeCandidateLegs(cand, Tau_decayMode);
+    for(LegFeatures& leg : result.legs) {
+        if(leg.leg_type == Leg::tau) {
+            leg.genMatch = Tau_genMatch.at(leg.index);
+            leg.has_genMatch = true;
+        } else if(leg.leg_type == Leg::e) {
+            leg.genMatch = Electron_genMatch.at(leg.index);
+            leg.has_genMatch = true;
+        }
+    }
+    return result;
+}
+
+// Used when the gen-match columns are not available (data).
+template <typename HttCand>
+struct RecoCandidateLegsFunctor {
+    CandidateLegs operator()(const HttCand& cand, const RVecI& Tau_decayMode) const
+    {
+        return makeCandidateLegs(cand, Tau_decayMode);
+    }
+};
+
+template <typename HttCand>
+struct CandidateLegsFunctor {
+    CandidateLegs operator()(const HttCand& cand, const RVecI& Tau_decayMode, const RVecI& Tau_genMatch,
+                             const RVecI& Electron_genMatch) const
+    {
+        return makeCandidateLegs(cand, Tau_decayMode, Tau_genMatch, Electron_genMatch);
+    }
+};
+
+// Selection of one leg of the HttCandidate. A negative leg_type accepts legs of any type.
+struct LegSelection {
+    LegSelection(size_t _leg_idx, int _leg_type = -1) : leg_idx(_leg_idx), leg_type(_leg_type) {}
+
+    template <typename HttCand>
+    bool pass(const HttCand& cand) const
+    {
+        return leg_type < 0 || static_cast<int>(cand.leg_type[leg_idx]) == leg_type;
+    }
+
+    bool pass(const CandidateLegs& legs) const
+    {
+        return leg_type < 0 || static_cast<int>(legs[leg_idx].leg_type) == leg_type;
+    }
+
+    const LegFeatures& get(const CandidateLegs& legs) const { return legs[leg_idx]; }
+
+    size_t leg_idx;
+    int leg_type;
+};
+
+template <typename SFVariations>
+struct SFVariationElement {
+    using UncSource = typename SFVariations::UncSourceType;
+
+    SFVariationElement(UncSource source, UncScale scale) : idx(SFVariations::index(source, scale)) {}
+    float operator()(const SFVariations& sf) const { return sf[idx]; }
+
+    size_t idx;
+};
+
+// Ratio of a variation to the central value of the same source, as defineRelative on the two float columns.
+template <typename SFVariations>
+struct SFVariationRelative {
+    using UncSource = typename SFVariations::UncSourceType;
+
+    SFVariationRelative(UncSource source, UncScale scale) :
+        idx(SFVariations::index(source, scale)), central_idx(SFVariations::index(source, UncScale::Central))
+    {
+    }
+    float operator()(const SFVariations& sf) const { return sf[idx] / sf[central_idx]; }
+
+    size_t idx, central_idx;
+};
+
+struct ShiftedP4View {
+    explicit ShiftedP4View(size_t _var_idx) : var_idx(_var_idx) {}
+    RVecLV operator()(const ShiftedP4WithDelta& shifted) const { return shifted.p4(var_idx); }
+
+    size_t var_idx;
+};
+
+struct ShiftedP4DeltaView {
+    explicit ShiftedP4DeltaView(size_t _var_idx) : var_idx(_var_idx) {}
+    RVecLV operator()(const ShiftedP4WithDelta& shifted) const { return shifted.delta(var_idx); }
+
+    size_t var_idx;
+};
+
+template <typename T>
+struct ToFloat {
+    float operator()(const T& value) const { return static_cast<float>(value); }
+};
+
+template <typename T>
+struct Identity {
+    T operator()(const T& value) const { return value; }
+};
+
+struct RelativeWeight {
+    float operator()(float value, float central) const { return static_cast<float>(value / central); }
+};
+
+struct RelativeWeightVec {
+    RVecF operator()(const RVecF& values, const RVecF& central) const
+    {
+        RVecF weights_rel(values.size(), 1);
+        for(size_t weight_idx = 0; weight_idx < values.size(); weight_idx++)
+            weights_rel[weight_idx] = values[weight_idx] / central[weight_idx];
+        return weights_rel;
+    }
+};
+
+struct P4Delta {
+    RVecLV operator()(const RVecLV& p4_shifted, const RVecLV& p4) const { return p4_shifted - p4; }
+};
+
+template <typename T>
+struct GenWeightSign {
+    double operator()(T genWeight) const { return std::copysign<double>(1., genWeight); }
+};
+
+struct ConstantWeight {
+    explicit ConstantWeight(float _value) : value(_value) {}
+    float operator()() const { return value; }
+
+    float value;
+};
+
+template <typename T>
+struct DYStitchingWeight {
+    float operator()(T LHE_Vpt) const
+    {
+        if(LHE_Vpt == 0.) return 1 / 2.f;
+        return 1 / 3.f;
+    }
+};
+
+template <typename NJets, typename HT>
+struct WStitchingWeight {
+    float operator()(NJets LHE_Njets, HT LHE_HT) const
+    {
+        if(LHE_Njets == 0) return 1.f;
+        if(LHE_HT < 70) return 1 / 2.f;
+        return 1 / 3.f;
+    }
+};
+
+// genWeightD * lumi * xs_stitching * stitching_weight * xs_ratio [* puWeight] / denominator,
+// evaluated in the same order as the string expression.
+struct NormalisationWeight {
+    NormalisationWeight(double _lumi, double _xs_stitching, double _xs_ratio, double _denominator) :
+        lumi(_lumi), xs_stitching(_xs_stitching), xs_ratio(_xs_ratio), denominator(_denominator)
+    {
+    }
+
+    double weight(double genWeightD, float stitching_weight) const
+    {
+        return genWeightD * lumi * xs_stitching * stitching_weight * xs_ratio;
+    }
+
+    float operator()(double genWeightD, float stitching_weight) const
+    {
+        return static_cast<float>(weight(genWeightD, stitching_weight) / denominator);
+    }
+
+    double lumi, xs_stitching, xs_ratio, denominator;
+};
+
+struct NormalisationWeightWithPU : NormalisationWeight {
+    using NormalisationWeight::NormalisationWeight;
+
+    float operator()(double genWeightD, float stitching_weight, float puWeight) const
+    {
+        return static_cast<float>(weight(genWeightD, stitching_weight) * puWeight / denominator);
+    }
+};
+
+struct WeightProduct {
+    double operator()(double weight, float factor) const { return weight * factor; }
+};
+
+} // namespace correction
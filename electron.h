@@ -1,7 +1,9 @@
 #pragma once
 
 #include "correction.h"
+#include "cachedCorrection.h"
 #include "corrections.h"
+#include "defines.h"
 
 namespace correction {
 class EleCorrProvider : public CorrectionsBase<EleCorrProvider> {
@@ -12,6 +14,7 @@ public:
         EleES = 1,
         Ele_dEsigma = 2,
     };
+    using SFVariations = ::correction::SFVariations<UncSource, 4>;
 
     static std::string getESScaleStr(UncScale scale)
     {
@@ -58,6 +61,46 @@ public:
         return EleIDSF_->evaluate({period, getIDScaleStr(jet_scale), working_point, Electron_p4.eta(), Electron_p4.pt()});
 
     }
+    // Same as getID_SF, but evaluates the central value and the up/down variations of the given sources in one call.
+    SFVariations getID_SFVariations(const LorentzVectorM& Electron_p4, int TauEle_genMatch, std::string working_point, std::string period, const std::vector<UncSource>& sources, bool need_variations) const
+    {
+        SFVariations sf(getID_SF(Electron_p4, TauEle_genMatch, working_point, period, UncSource::Central, UncScale::Central));
+        if(!need_variations) return sf;
+        for(UncSource source : sources) {
+            if(!sourceApplies(source)) continue;
+            for(UncScale scale : { UncScale::Up, UncScale::Down })
+                sf.set(source, scale, getID_SF(Electron_p4, TauEle_genMatch, working_point, period, source, scale));
+        }
+        return sf;
+    }
+
+    SFVariations getID_SFVariations(const LegFeatures& leg, const std::string& working_point, const std::string& period,
+                                    const std::vector<UncSource>& sources, bool need_variations) const
+    {
+        if(!leg.has_genMatch)
+            throw std::runtime_error("EleCorrProvider: the electron ID SFs need Electron_genMatch.");
+        return getID_SFVariations(leg.p4, leg.genMatch, working_point, period, sources, need_variations);
+    }
+
+    // Precompiled counterpart of the getID_SFVariations column expression.
+    struct ID_SFVariationsFunctor {
+        ID_SFVariationsFunctor(const LegSelection& _leg, const std::string& _working_point, const std::string& _period,
+                               const std::vector<UncSource>& _sources, bool _need_variations) :
+            leg(_leg), working_point(_working_point), period(_period), sources(_sources), need_variations(_need_variations)
+        {
+        }
+
+        SFVariations operator()(const CandidateLegs& legs) const
+        {
+            if(!leg.pass(legs)) return SFVariations();
+            return getGlobal().getID_SFVariations(leg.get(legs), working_point, period, sources, need_variations);
+        }
+
+        LegSelection leg;
+        std::string working_point, period;
+        std::vector<UncSource> sources;
+        bool need_variations;
+    };
     /*
      RVecLV getES(const RVecLV& Electron_p4, std::string period, UncSource source, UncScale scale) const
     {
@@ -81,7 +124,7 @@ public:
 
 private:
     std::unique_ptr<CorrectionSet> corrections_, correctionsES_;
-    Correction::Ref EleIDSF_, EleES_;
+    CachedCorrection EleIDSF_, EleES_;
 };
 
 } //namespace correction
\ No newline at end of file
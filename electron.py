@@ -26,7 +26,9 @@ class EleCorrProducer:
         if not EleCorrProducer.initialized:
             headers_dir = os.path.dirname(os.path.abspath(__file__))
             header_path = os.path.join(headers_dir, "electron.h")
-            ROOT.gInterpreter.Declare(f'#include "{header_path}"')
+            declareHeaders(header_path, dependencies=[ common_headers ])
+            registerCorrectionLayouts(EleID_JsonFile)
+            registerCorrectionLayouts(EleES_JsonFile)
             ROOT.gInterpreter.ProcessLine(f'::correction::EleCorrProvider::Initialize("{EleID_JsonFile}", "{EleES_JsonFile}")')
             EleCorrProducer.year = period.split("_")[0]
             EleCorrProducer.initialized = True
@@ -37,6 +39,20 @@ class EleCorrProducer:
         sf_sources =EleCorrProducer.ID_sources
         SF_branches = []
         sf_scales = [up, down] if return_variations else []
+        need_variations = 'true' if isCentral and return_variations else 'false'
+        sf_sources_cpp = createUncSourceList('EleCorrProvider', sf_sources)
+        df = defineCandidateLegs(df)
+        for leg_idx, leg_name in enumerate(lepton_legs):
+            if PrecompiledDefines.enabled:
+                functor = ROOT.correction.EleCorrProvider.ID_SFVariationsFunctor(getLegSelection(leg_idx, 'e'),
+                                        EleCorrProducer.working_point, EleCorrProducer.year,
+                                        createUncSourceVector('EleCorrProvider', sf_sources), need_variations == 'true')
+                df = defineColumn(df, f"{leg_name}_EleSF_variations", functor, [ 'HttCandidate_legs' ])
+                continue
+            df = df.Define(f"{leg_name}_EleSF_variations",
+                        f'''HttCandidate_legs[{leg_idx}].leg_type == Leg::e ? ::correction::EleCorrProvider::getGlobal().getID_SFVariations(
+                        HttCandidate_legs[{leg_idx}], "{EleCorrProducer.working_point}",
+                        "{EleCorrProducer.year}", {sf_sources_cpp}, {need_variations}) : ::correction::EleCorrProvider::SFVariations()''')
         for source in sf_sources:
             for scale in [central]+sf_scales:
                 if not isCentral and scale!= central: continue
@@ -46,18 +62,15 @@ class EleCorrProducer:
                     branch_central = f"""weight_{leg_name}_EleSF_{source+central}"""
                     #print(branch_name)
                     #print(branch_central)
-                    df = df.Define(f"{branch_name}_double",
-                                f'''HttCandidate.leg_type[{leg_idx}] == Leg::e ? ::correction::EleCorrProvider::getGlobal().getID_SF(
-                               HttCandidate.leg_p4[{leg_idx}], Electron_genMatch.at(HttCandidate.leg_index[{leg_idx}]), "{EleCorrProducer.working_point}",
-                               "{EleCorrProducer.year}",::correction::EleCorrProvider::UncSource::{source}, ::correction::UncScale::{scale}) : 1.;''')
+                    df = defineSFVariation(df, f"{branch_name}_double", f"{leg_name}_EleSF_variations", 'EleCorrProvider', source, scale)
                     if scale != central:
                         branch_name_final = branch_name + '_rel'
-                        df = df.Define(branch_name_final, f"static_cast<float>({branch_name}_double/{branch_central})")
+                        df = defineRelative(df, branch_name_final, f"{branch_name}_double", branch_central)
                     else:
                         if source == central:
                             branch_name_final = f"""weight_{leg_name}_EleSF_{central}"""
                         else:
                             branch_name_final = branch_name
-                        df = df.Define(branch_name_final, f"static_cast<float>({branch_name}_double)")
+                        df = defineFloat(df, branch_name_final, f"{branch_name}_double")
                     SF_branches.append(branch_name_final)
         return df,SF_branches
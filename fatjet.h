@@ -1,9 +1,64 @@
 #pragma once
 
+#include <algorithm>
+
 #include "correction.h"
 #include "corrections.h"
 
 namespace correction {
+
+// Shifted p4 and soft-drop mass of the fat jets for all variations, stored in contiguous buffers
+// with the same (variation, fat jet) layout as ShiftedP4Collection.
+class ShiftedFatJetCollection {
+public:
+    ShiftedFatJetCollection() = default;
+    ShiftedFatJetCollection(size_t nVariations, size_t nObjects) :
+        p4_(nVariations, nObjects), msoftdrop_(nVariations * nObjects)
+    {
+    }
+
+    size_t nVariations() const { return p4_.nVariations(); }
+    size_t nObjects() const { return p4_.nObjects(); }
+
+    LorentzVectorM& p4At(size_t var_idx, size_t obj_idx) { return p4_.at(var_idx, obj_idx); }
+    float& msoftdropAt(size_t var_idx, size_t obj_idx) { return msoftdrop_[var_idx * nObjects() + obj_idx]; }
+    float msoftdropAt(size_t var_idx, size_t obj_idx) const { return msoftdrop_[var_idx * nObjects() + obj_idx]; }
+
+    // Sets the same p4 and soft-drop mass of the object obj_idx for all variations.
+    void fill(size_t obj_idx, const LorentzVectorM& p4, float msoftdrop)
+    {
+        p4_.fill(obj_idx, p4);
+        for(size_t var_idx = 0; var_idx < nVariations(); ++var_idx)
+            msoftdropAt(var_idx, obj_idx) = msoftdrop;
+    }
+
+    // Copies the variations of a subset of the objects, evaluated separately, to the rows of all objects.
+    void scatter(const ShiftedFatJetCollection& subset, const RVecS& obj_indices)
+    {
+        p4_.scatter(subset.p4_, obj_indices);
+        for(size_t var_idx = 0; var_idx < nVariations(); ++var_idx) {
+            for(size_t k = 0; k < obj_indices.size(); ++k)
+                msoftdropAt(var_idx, obj_indices[k]) = subset.msoftdropAt(var_idx, k);
+        }
+    }
+
+    // Non-owning views of the row var_idx. They stay valid as long as the collection is alive.
+    RVecLV p4(size_t var_idx) const { return p4_.view(var_idx); }
+    RVecF msoftdrop(size_t var_idx) const
+    {
+        if(var_idx >= nVariations())
+            throw std::out_of_range("ShiftedFatJetCollection: variation index " + std::to_string(var_idx)
+                                    + " is out of range.");
+        if(nObjects() == 0)
+            return RVecF();
+        return RVecF(const_cast<float*>(msoftdrop_.data()) + var_idx * nObjects(), nObjects());
+    }
+
+private:
+    ShiftedP4Collection p4_;
+    RVecF msoftdrop_;
+};
+
 class FatJetCorrProvider : public CorrectionsBase<FatJetCorrProvider> {
 public:
      enum class UncSource : int {
@@ -43,10 +98,6 @@ public:
         };
         return scale_indexes.at(scale);
     }
-    static const int GetJesIdx(UncSource source, UncScale scale){
-        int index = static_cast<int>(source) * 2 + GetScaleIdx(scale);
-        return std::max(index, 0);
-    }
     static const std::map<UncSource,std::tuple<std::string,bool,bool>> getUncMap (){
         static const std::map<UncSource,std::tuple<std::string,bool,bool>> UncMap = {
             {UncSource::Central, {"Central", false,false}},
@@ -67,6 +118,32 @@ public:
         return UncMap;
     }
 
+    static constexpr size_t nVariations = 27;
+    // Row of a variation in the ShiftedFatJetCollection returned by getShiftedP4:
+    // 0 for central, then up and down for each uncertainty source in the enum order.
+    static size_t GetVariationIdx(UncSource source, UncScale scale){
+        if((source == UncSource::Central) != (scale == UncScale::Central))
+            throw std::runtime_error("FatJetCorrProvider: invalid combination of uncertainty source and scale.");
+        if(source == UncSource::Central)
+            return 0;
+        return 1 + static_cast<size_t>(source) * 2 + (scale == UncScale::Up ? 0 : 1);
+    }
+    static const std::vector<std::pair<UncSource, UncScale>>& getVariations(){
+        static const std::vector<std::pair<UncSource, UncScale>> variations = [] {
+            std::vector<std::pair<UncSource, UncScale>> result;
+            for (const auto& [unc_source, unc_features] : getUncMap()){
+                if(unc_source == UncSource::Central) {
+                    result.emplace_back(unc_source, UncScale::Central);
+                } else {
+                    result.emplace_back(unc_source, UncScale::Up);
+                    result.emplace_back(unc_source, UncScale::Down);
+                }
+            }
+            return result;
+        }();
+        return variations;
+    }
+
     FatJetCorrProvider(const std::string& ptResolution,const std::string& ptResolutionSF, const std::string& JesTxtFile, const std::string& year)
     {
         // THIS HAS BEEN TAKEN FROM https://bamboo-hep.readthedocs.io/en/latest/_modules/bamboo/analysisutils.html
@@ -83,45 +160,85 @@ public:
             std::string jes_name = getFullNameUnc(std::get<0>(unc_features), year, std::get<2>(unc_features));
             fjvc_total.addJESUncertainty(jes_name,JetCorrectorParameters{JesTxtFile,jes_name});
         }
+        initRows(year);
     }
 
 
-    std::map<std::pair<UncSource,UncScale>, RVecLV> getShiftedP4( const RVecF& FatJet_pt, const RVecF& FatJet_eta, const RVecF& FatJet_phi, const RVecF& FatJet_mass, const RVecF& FatJet_rawFactor, const RVecF& FatJet_area, const RVecF& FatJet_msoftdrop, const RVecShort& FatJet_subJetIdx1, const RVecShort& FatJet_subJetIdx2, const RVecF& SubJet_pt,const RVecF& SubJet_eta, const RVecF& SubJet_phi, const RVecF& SubJet_mass, const RVecI& FatJet_jetId, const float  Rho_fixedGridRhoFastjetAll, std::uint32_t seed, const RVecF& GenJetAK8_pt, const RVecF& GenJetAK8_eta, const RVecF& GenJetAK8_phi, const RVecF& GenJetAK8_mass, const RVecF& SubGenJetAK8_pt, const RVecF& SubGenJetAK8_eta, const RVecF& SubGenJetAK8_phi, const RVecF& SubGenJetAK8_mass, int event) const {
-        std::map<std::pair<UncSource,UncScale>, RVecLV> all_shifted_p4;
-        //std::cout << FatJet_pt.size() << std::endl;
-        //std::cout << event << std::endl;
-        auto result = fjvc_total.produce(FatJet_pt,  FatJet_eta,  FatJet_phi,  FatJet_mass,  FatJet_rawFactor,  FatJet_area,  FatJet_msoftdrop,  FatJet_subJetIdx1,  FatJet_subJetIdx2,  SubJet_pt, SubJet_eta,  SubJet_phi,  SubJet_mass,  FatJet_jetId,  Rho_fixedGridRhoFastjetAll, seed,  GenJetAK8_pt,  GenJetAK8_eta,  GenJetAK8_phi,  GenJetAK8_mass,  SubGenJetAK8_pt,  SubGenJetAK8_eta,  SubGenJetAK8_phi,  SubGenJetAK8_mass, event);
-        std::vector<UncScale> uncScales={UncScale::Central, UncScale::Up, UncScale::Down};
-        for (auto& uncScale : uncScales){
-            for (auto & [unc_source ,unc_features] : getUncMap()){
-                //if (FatJet_pt.size() > 0 ){
-                    RVecLV shifted_p4(FatJet_pt.size());
-                    if(unc_source != UncSource::Central && uncScale == UncScale::Central) continue;
-                    if(unc_source == UncSource::Central && uncScale != UncScale::Central) continue;
-                    int scale_idx = GetJesIdx(unc_source, uncScale);
-
-                    for (int fatjet_idx= 0 ; fatjet_idx < FatJet_pt.size(); ++fatjet_idx){
-                        shifted_p4[fatjet_idx] = LorentzVectorM(result.pt(scale_idx)[fatjet_idx], FatJet_eta[fatjet_idx],
-                        FatJet_phi[fatjet_idx], result.mass(scale_idx)[fatjet_idx]);
-                    }
-
-                    all_shifted_p4.insert({{unc_source, uncScale}, shifted_p4});
-                    //std::cout << all_shifted_p4.at({unc_source, uncScale});
-                //}
-                //else{
-                //    all_shifted_p4.insert({{unc_source, uncScale},{LorentzVectorM(0.,0.,0.,0.)}});
-                //}
+    ShiftedFatJetCollection getShiftedP4( const RVecF& FatJet_pt, const RVecF& FatJet_eta, const RVecF& FatJet_phi, const RVecF& FatJet_mass, const RVecF& FatJet_rawFactor, const RVecF& FatJet_area, const RVecF& FatJet_msoftdrop, const RVecShort& FatJet_subJetIdx1, const RVecShort& FatJet_subJetIdx2, const RVecF& SubJet_pt,const RVecF& SubJet_eta, const RVecF& SubJet_phi, const RVecF& SubJet_mass, const RVecI& FatJet_jetId, const float  Rho_fixedGridRhoFastjetAll, std::uint32_t seed, const RVecF& GenJetAK8_pt, const RVecF& GenJetAK8_eta, const RVecF& GenJetAK8_phi, const RVecF& GenJetAK8_mass, const RVecF& SubGenJetAK8_pt, const RVecF& SubGenJetAK8_eta, const RVecF& SubGenJetAK8_phi, const RVecF& SubGenJetAK8_mass, int event) const {
+        if (FatJet_pt.empty())
+            return ShiftedFatJetCollection(nVariations, 0);
+        // the calculator output is reused between the events processed by the same thread
+        static thread_local FatJetVariationsCalculator::flat_result_t result;
+        fjvc_total.produce(FatJet_pt,  FatJet_eta,  FatJet_phi,  FatJet_mass,  FatJet_rawFactor,  FatJet_area,  FatJet_msoftdrop,  FatJet_subJetIdx1,  FatJet_subJetIdx2,  SubJet_pt, SubJet_eta,  SubJet_phi,  SubJet_mass,  FatJet_jetId,  Rho_fixedGridRhoFastjetAll, seed,  GenJetAK8_pt,  GenJetAK8_eta,  GenJetAK8_phi,  GenJetAK8_mass,  SubGenJetAK8_pt,  SubGenJetAK8_eta,  SubGenJetAK8_phi,  SubGenJetAK8_mass, event, result);
+        if (result.size() != nPtRows_ || result.sizeM() != nMassRows_)
+            throw std::runtime_error("FatJetCorrProvider: unexpected number of variations in the calculator output.");
+        // the returned collection owns its buffers and is allocated for each event, only the calculator output is reused
+        ShiftedFatJetCollection all_shifted(nVariations, FatJet_pt.size());
+        for (const auto& [unc_source, unc_scale] : getVariations()){
+            const size_t var_idx = GetVariationIdx(unc_source, unc_scale);
+            const size_t row = rows_[var_idx];
+            for (size_t fatjet_idx = 0; fatjet_idx < FatJet_pt.size(); ++fatjet_idx){
+                all_shifted.p4At(var_idx, fatjet_idx) = LorentzVectorM(result.pt(row, fatjet_idx), FatJet_eta[fatjet_idx],
+                                                                       FatJet_phi[fatjet_idx], result.mass(row, fatjet_idx));
+                all_shifted.msoftdropAt(var_idx, fatjet_idx) = result.msoftdrop(row, fatjet_idx);
             }
         }
-        //std::cout << FatJet_pt.size() << std::endl;
-        //std::cout << event << std::endl;
-        return all_shifted_p4;
+        return all_shifted;
+    }
+    // Same as getShiftedP4, with the variations evaluated only for the fat jets that pass fatjet_pass in the events
+    // that pass event_pass. The other fat jets keep their NanoAOD p4 and soft-drop mass in all variations.
+    // The mass smearing of the selected fat jets without a generator-level match draws from a per-event random
+    // sequence, so it depends on which fat jets are selected.
+    template <typename FatJetMask>
+    ShiftedFatJetCollection getShiftedP4Selected(bool event_pass, const FatJetMask& fatjet_pass, const RVecF& FatJet_pt, const RVecF& FatJet_eta, const RVecF& FatJet_phi, const RVecF& FatJet_mass, const RVecF& FatJet_rawFactor, const RVecF& FatJet_area, const RVecF& FatJet_msoftdrop, const RVecShort& FatJet_subJetIdx1, const RVecShort& FatJet_subJetIdx2, const RVecF& SubJet_pt,const RVecF& SubJet_eta, const RVecF& SubJet_phi, const RVecF& SubJet_mass, const RVecI& FatJet_jetId, const float  Rho_fixedGridRhoFastjetAll, std::uint32_t seed, const RVecF& GenJetAK8_pt, const RVecF& GenJetAK8_eta, const RVecF& GenJetAK8_phi, const RVecF& GenJetAK8_mass, const RVecF& SubGenJetAK8_pt, const RVecF& SubGenJetAK8_eta, const RVecF& SubGenJetAK8_phi, const RVecF& SubGenJetAK8_mass, int event) const {
+        const RVecS selected = selectedIndices(event_pass, fatjet_pass, FatJet_pt.size(), "FatJet_pt");
+        if (selected.size() == FatJet_pt.size())
+            return getShiftedP4(FatJet_pt, FatJet_eta, FatJet_phi, FatJet_mass, FatJet_rawFactor, FatJet_area, FatJet_msoftdrop, FatJet_subJetIdx1, FatJet_subJetIdx2, SubJet_pt, SubJet_eta, SubJet_phi, SubJet_mass, FatJet_jetId, Rho_fixedGridRhoFastjetAll, seed, GenJetAK8_pt, GenJetAK8_eta, GenJetAK8_phi, GenJetAK8_mass, SubGenJetAK8_pt, SubGenJetAK8_eta, SubGenJetAK8_phi, SubGenJetAK8_mass, event);
+        ShiftedFatJetCollection all_shifted(nVariations, FatJet_pt.size());
+        for (size_t fatjet_idx = 0; fatjet_idx < FatJet_pt.size(); ++fatjet_idx)
+            all_shifted.fill(fatjet_idx, LorentzVectorM(FatJet_pt[fatjet_idx], FatJet_eta[fatjet_idx], FatJet_phi[fatjet_idx],
+                                                        FatJet_mass[fatjet_idx]), FatJet_msoftdrop[fatjet_idx]);
+        if (!selected.empty()) {
+            using ROOT::VecOps::Take;
+            all_shifted.scatter(getShiftedP4(Take(FatJet_pt, selected), Take(FatJet_eta, selected), Take(FatJet_phi, selected),
+                                             Take(FatJet_mass, selected), Take(FatJet_rawFactor, selected), Take(FatJet_area, selected),
+                                             Take(FatJet_msoftdrop, selected), Take(FatJet_subJetIdx1, selected), Take(FatJet_subJetIdx2, selected),
+                                             SubJet_pt, SubJet_eta, SubJet_phi, SubJet_mass, Take(FatJet_jetId, selected),
+                                             Rho_fixedGridRhoFastjetAll, seed, GenJetAK8_pt, GenJetAK8_eta, GenJetAK8_phi, GenJetAK8_mass,
+                                             SubGenJetAK8_pt, SubGenJetAK8_eta, SubGenJetAK8_phi, SubGenJetAK8_mass, event), selected);
+        }
+        return all_shifted;
     }
     RVecF getResolution(const RVecF& FatJet_pt, const RVecF& FatJet_eta, const float rho) const {
         return fjvc_total.getResolution(FatJet_pt, FatJet_eta, rho);
     }
 
 private:
+    // Finds the row of each variation in the calculator output from the names of its variations. The JES rows follow
+    // the order of the calculator's uncertainty sources, which is not the order of UncSource.
+    void initRows(const std::string& year)
+    {
+        const std::vector<std::string> pt_names = fjvc_total.available();
+        const std::vector<std::string> mass_names = fjvc_total.available("mass");
+        nPtRows_ = pt_names.size();
+        nMassRows_ = mass_names.size();
+        for (const auto& [unc_source, unc_scale] : getVariations()){
+            std::string name = "nominal";
+            if(unc_source != UncSource::Central) {
+                const auto& unc_features = getUncMap().at(unc_source);
+                const std::string jes_name = getFullNameUnc(std::get<0>(unc_features), year, std::get<2>(unc_features));
+                name = (std::get<1>(unc_features) ? "jes" + jes_name : std::string("jer"))
+                       + (unc_scale == UncScale::Up ? "up" : "down");
+            }
+            const auto iter = std::find(pt_names.begin(), pt_names.end(), name);
+            if(iter == pt_names.end() || mass_names.at(iter - pt_names.begin()) != name)
+                throw std::runtime_error("FatJetCorrProvider: variation " + name + " is not provided by the calculator.");
+            rows_[GetVariationIdx(unc_source, unc_scale)] = iter - pt_names.begin();
+        }
+    }
+
     FatJetVariationsCalculator fjvc_total ;
+    std::array<size_t, nVariations> rows_{};
+    size_t nPtRows_{0}, nMassRows_{0};
 };
 } // namespace correction
\ No newline at end of file
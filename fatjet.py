@@ -112,11 +112,8 @@ class FatJetCorrProducer:
 
 
             header_path = os.path.join(headers_dir, "fatjet.h")
-            JME_calc_base = os.path.join(headers_dir, "JMECalculatorBase.cc")
             JME_calc_path = os.path.join(headers_dir, "FatJetSystematicCalculator.cc")
-            ROOT.gInterpreter.Declare(f'#include "{JME_calc_base}"')
-            ROOT.gInterpreter.Declare(f'#include "{JME_calc_path}"')
-            ROOT.gInterpreter.Declare(f'#include "{header_path}"')
+            declareHeaders(JME_calc_path, header_path, dependencies=[ common_headers, jme_common_headers ])
 
             ROOT.gInterpreter.ProcessLine(f"""::correction::FatJetCorrProvider::Initialize("{ptResolution}", "{ptResolutionSF}","{JEC_Regrouped}", "{periods[period]}")""")
             #ROOT.gInterpreter.ProcessLine(f"""::correction::bTagShapeCorrProvider::Initialize("{jsonFile_btag}", "{periods[period]}")""")
@@ -142,19 +139,21 @@ class FatJetCorrProducer:
 
 
 
-    def getP4Variations(self, df, source_dict):
-        df = df.Define(f'FatJet_p4_shifted_map', f'''::correction::FatJetCorrProvider::getGlobal().getShiftedP4(
-                                FatJet_pt, FatJet_eta, FatJet_phi, FatJet_mass, FatJet_rawFactor, FatJet_area,
+    def getP4Variations(self, df, source_dict, event_mask=None, fatjet_mask=None):
+        # event_mask and fatjet_mask are optional event-level and per-fat-jet boolean expressions: the variations are
+        # evaluated only for the fat jets that pass both, the other fat jets keep their NanoAOD p4 in all variations.
+        shifted_p4_args = '''FatJet_pt, FatJet_eta, FatJet_phi, FatJet_mass, FatJet_rawFactor, FatJet_area,
                                 FatJet_msoftdrop, FatJet_subJetIdx1, FatJet_subJetIdx2, SubJet_pt,SubJet_eta, SubJet_phi, SubJet_mass, FatJet_jetId, Rho_fixedGridRhoFastjetAll, 0, GenJetAK8_pt, GenJetAK8_eta,
                                 GenJetAK8_phi, GenJetAK8_mass, SubGenJetAK8_pt, SubGenJetAK8_eta,
-                                SubGenJetAK8_phi, SubGenJetAK8_mass, event)''')
-
-        #print("size")
-        #df = df.Define("map_size", "FatJet_p4_shifted_map.size()")
-        #df.Display({"map_size"}).Print()
-        #df = df.Define("nano_size", f"FatJet_p4_{nano}.size()")
-        #df.Display("nano_size").Print()
-
+                                SubGenJetAK8_phi, SubGenJetAK8_mass, event'''
+        if event_mask is None and fatjet_mask is None:
+            df = df.Define(f'FatJet_p4_shifted', f'''::correction::FatJetCorrProvider::getGlobal().getShiftedP4(
+                                {shifted_p4_args})''')
+        else:
+            event_mask = event_mask if event_mask is not None else 'true'
+            fatjet_mask = fatjet_mask if fatjet_mask is not None else 'ROOT::VecOps::RVec<int>(FatJet_pt.size(), 1)'
+            df = df.Define(f'FatJet_p4_shifted', f'''::correction::FatJetCorrProvider::getGlobal().getShiftedP4Selected(
+                                ({event_mask}), ({fatjet_mask}), {shifted_p4_args})''')
         for source in [ central] + FatJetCorrProducer.uncSources_extended:
             source_eff = source
             if source!=central and source != "JER":
@@ -165,9 +164,11 @@ class FatJetCorrProducer:
             updateSourceDict(source_dict, source_eff, 'FatJet')
             for scale in getScales(source):
                 syst_name = getSystName(source_eff, scale)
-                df = df.Define(f'FatJet_p4_{syst_name}', f'''FatJet_p4_shifted_map.at({{::correction::FatJetCorrProvider::UncSource::{source}, ::correction::UncScale::{scale}}})''')
-                #df = df.Define(f'FatJet_p4_{syst_name}_delta', f' FatJet_pt.size()>0?FatJet_p4_{syst_name} - FatJet_p4_{nano}:FatJet_p4_{syst_name}')
-                df = df.Define(f'FatJet_p4_{syst_name}_delta', f'  FatJet_p4_{syst_name} - FatJet_p4_{nano}')
+                var_idx = f'''::correction::FatJetCorrProvider::GetVariationIdx(
+                                    ::correction::FatJetCorrProvider::UncSource::{source}, ::correction::UncScale::{scale})'''
+                df = df.Define(f'FatJet_p4_{syst_name}', f'FatJet_p4_shifted.p4({var_idx})')
+                df = df.Define(f'FatJet_msoftdrop_{syst_name}', f'FatJet_p4_shifted.msoftdrop({var_idx})')
+                df = df.Define(f'FatJet_p4_{syst_name}_delta', f'FatJet_p4_{syst_name} - FatJet_p4_{nano}')
         return df,source_dict
 
     def getEnergyResolution(self, df):
@@ -66,10 +66,37 @@ public:
         };
         return UncMap;
     }
+    static constexpr size_t nVariations = 27;
+    // Row of a variation in the ShiftedP4Collection returned by getShiftedP4:
+    // 0 for central, then up and down for each uncertainty source in the enum order.
+    static size_t GetVariationIdx(UncSource source, UncScale scale){
+        if((source == UncSource::Central) != (scale == UncScale::Central))
+            throw std::runtime_error("JetCorrProvider: invalid combination of uncertainty source and scale.");
+        if(source == UncSource::Central)
+            return 0;
+        return 1 + static_cast<size_t>(source) * 2 + (scale == UncScale::Up ? 0 : 1);
+    }
+    static const std::vector<std::pair<UncSource, UncScale>>& getVariations(){
+        static const std::vector<std::pair<UncSource, UncScale>> variations = [] {
+            std::vector<std::pair<UncSource, UncScale>> result;
+            for (const auto& [unc_source, unc_features] : getUncMap()){
+                if(unc_source == UncSource::Central) {
+                    result.emplace_back(unc_source, UncScale::Central);
+                } else {
+                    result.emplace_back(unc_source, UncScale::Up);
+                    result.emplace_back(unc_source, UncScale::Down);
+                }
+            }
+            return result;
+        }();
+        return variations;
+    }
 
-    JetCorrProvider(const std::string& ptResolution,const std::string& ptResolutionSF, const std::string& JesTxtFile, const std::string& year)
+    JetCorrProvider(const std::string& ptResolution,const std::string& ptResolutionSF, const std::string& JesTxtFile, const std::string& year,
+                    bool counterBasedRNG = false)
     {
         jvc_total.setSmearing(ptResolution, ptResolutionSF, false, true, 0.2, 3);
+        jvc_total.setSmearingGenerator(counterBasedRNG ? jmerandom::Generator::Philox : jmerandom::Generator::MT19937);
         jvc_total.setAddHEM2018Issue(year=="2018");
         for (auto& [unc_source ,unc_features] : getUncMap()){
             if(! std::get<1>(unc_features) ) continue;
@@ -79,31 +106,54 @@ public:
     }
 
 
-    std::map<std::pair<UncSource,UncScale>, RVecLV> getShiftedP4(const RVecF& Jet_pt, const RVecF& Jet_eta, const RVecF& Jet_phi,
+    ShiftedP4Collection getShiftedP4(const RVecF& Jet_pt, const RVecF& Jet_eta, const RVecF& Jet_phi,
                     const RVecF& Jet_mass, const RVecF& Jet_rawFactor, const RVecF& Jet_area,
                     const RVecI& Jet_jetId, const float rho, const RVecI& Jet_partonFlavour,
                     std::uint32_t seed, const RVecF& GenJet_pt, const RVecF& GenJet_eta,
                     const RVecF& GenJet_phi, const RVecF& GenJet_mass, int event) const {
-        std::map<std::pair<UncSource,UncScale>, RVecLV> all_shifted_p4;
+        if (Jet_pt.empty())
+            return ShiftedP4Collection(nVariations, 0);
         auto result = jvc_total.produce(Jet_pt, Jet_eta, Jet_phi, Jet_mass, Jet_rawFactor,
                                     Jet_area, Jet_jetId, rho, Jet_partonFlavour, seed,
                                     GenJet_pt, GenJet_eta, GenJet_phi, GenJet_mass, event);
-        std::vector<UncScale> uncScales={UncScale::Central, UncScale::Up, UncScale::Down};
-        for (auto& uncScale : uncScales){
-            for (auto & [unc_source ,unc_features] : getUncMap()){
-                RVecLV shifted_p4(Jet_pt.size());
-                if(unc_source != UncSource::Central && uncScale == UncScale::Central) continue;
-                if(unc_source == UncSource::Central && uncScale != UncScale::Central) continue;
-                int scale_idx = GetJesIdx(unc_source, uncScale);
-                for (int jet_idx= 0 ; jet_idx < Jet_pt.size(); ++jet_idx){
-                    shifted_p4[jet_idx] = LorentzVectorM(result.pt(scale_idx)[jet_idx], Jet_eta[jet_idx],
-                    Jet_phi[jet_idx], result.mass(scale_idx)[jet_idx]);
-                }
-            all_shifted_p4.insert({{unc_source, uncScale}, shifted_p4});
+        ShiftedP4Collection all_shifted_p4(nVariations, Jet_pt.size());
+        for (const auto& [unc_source, unc_scale] : getVariations()){
+            const size_t var_idx = GetVariationIdx(unc_source, unc_scale);
+            const int scale_idx = GetJesIdx(unc_source, unc_scale);
+            const auto& pt = result.pt(scale_idx);
+            const auto& mass = result.mass(scale_idx);
+            for (size_t jet_idx = 0; jet_idx < Jet_pt.size(); ++jet_idx){
+                all_shifted_p4.at(var_idx, jet_idx) = LorentzVectorM(pt[jet_idx], Jet_eta[jet_idx],
+                                                                     Jet_phi[jet_idx], mass[jet_idx]);
             }
         }
         return all_shifted_p4;
     }
+    // Same as getShiftedP4, with the variations evaluated only for the jets that pass jet_pass in the events
+    // that pass event_pass. The other jets keep their NanoAOD p4 in all variations.
+    template <typename JetMask>
+    ShiftedP4Collection getShiftedP4Selected(bool event_pass, const JetMask& jet_pass,
+                    const RVecF& Jet_pt, const RVecF& Jet_eta, const RVecF& Jet_phi,
+                    const RVecF& Jet_mass, const RVecF& Jet_rawFactor, const RVecF& Jet_area,
+                    const RVecI& Jet_jetId, const float rho, const RVecI& Jet_partonFlavour,
+                    std::uint32_t seed, const RVecF& GenJet_pt, const RVecF& GenJet_eta,
+                    const RVecF& GenJet_phi, const RVecF& GenJet_mass, int event) const {
+        const RVecS selected = selectedIndices(event_pass, jet_pass, Jet_pt.size(), "Jet_pt");
+        if (selected.size() == Jet_pt.size())
+            return getShiftedP4(Jet_pt, Jet_eta, Jet_phi, Jet_mass, Jet_rawFactor, Jet_area, Jet_jetId, rho,
+                                Jet_partonFlavour, seed, GenJet_pt, GenJet_eta, GenJet_phi, GenJet_mass, event);
+        ShiftedP4Collection all_shifted_p4(nVariations, Jet_pt.size());
+        for (size_t jet_idx = 0; jet_idx < Jet_pt.size(); ++jet_idx)
+            all_shifted_p4.fill(jet_idx, LorentzVectorM(Jet_pt[jet_idx], Jet_eta[jet_idx], Jet_phi[jet_idx], Jet_mass[jet_idx]));
+        if (!selected.empty()) {
+            using ROOT::VecOps::Take;
+            all_shifted_p4.scatter(getShiftedP4(Take(Jet_pt, selected), Take(Jet_eta, selected), Take(Jet_phi, selected),
+                                                Take(Jet_mass, selected), Take(Jet_rawFactor, selected), Take(Jet_area, selected),
+                                                Take(Jet_jetId, selected), rho, Take(Jet_partonFlavour, selected), seed,
+                                                GenJet_pt, GenJet_eta, GenJet_phi, GenJet_mass, event), selected);
+        }
+        return all_shifted_p4;
+    }
     RVecF getResolution(const RVecF& Jet_pt, const RVecF& Jet_eta, const float rho) const {
         return jvc_total.getResolution(Jet_pt, Jet_eta, rho);
     }
@@ -60,7 +60,7 @@ class JetCorrProducer:
 
     #Sources = []
     period = None
-    def __init__(self, period,isData):
+    def __init__(self, period,isData, smearing_rng='mt19937'):
         JEC_SF_path_period = JetCorrProducer.JEC_SF_path.format(period)
         JEC_dir = directories_JEC[period]
         JEC_SF_db = "Corrections/data/JECDatabase/textFiles/"
@@ -95,26 +95,31 @@ class JetCorrProducer:
             headers_dir = os.path.dirname(os.path.abspath(__file__))
             header_path = os.path.join(headers_dir, "jet.h")
             headershape_path = os.path.join(headers_dir, "btagShape.h")
-            JME_calc_base = os.path.join(headers_dir, "JMECalculatorBase.cc")
             JME_calc_path = os.path.join(headers_dir, "JMESystematicsCalculators.cc")
-            ROOT.gInterpreter.Declare(f'#include "{JME_calc_base}"')
-            ROOT.gInterpreter.Declare(f'#include "{JME_calc_path}"')
-            ROOT.gInterpreter.Declare(f'#include "{header_path}"')
-            ROOT.gInterpreter.Declare(f'#include "{headershape_path}"')
-            ROOT.gInterpreter.ProcessLine(f"""::correction::JetCorrProvider::Initialize("{ptResolution}", "{ptResolutionSF}","{JEC_Regrouped}", "{periods[period]}")""")
+            declareHeaders(JME_calc_path, header_path, headershape_path,
+                           dependencies=[ common_headers, jme_common_headers ])
+            if smearing_rng not in [ 'mt19937', 'philox' ]:
+                raise RuntimeError(f'Unknown random number generator for the jet smearing: {smearing_rng}')
+            counter_based_rng = 'true' if smearing_rng == 'philox' else 'false'
+            ROOT.gInterpreter.ProcessLine(f"""::correction::JetCorrProvider::Initialize("{ptResolution}", "{ptResolutionSF}","{JEC_Regrouped}", "{periods[period]}", {counter_based_rng})""")
+            registerCorrectionLayouts(jsonFile_btag)
             ROOT.gInterpreter.ProcessLine(f"""::correction::bTagShapeCorrProvider::Initialize("{jsonFile_btag}", "{periods[period]}")""")
             JetCorrProducer.period = period
             JetCorrProducer.initialized = True
 
-    def addtbTagShapeSFInDf(df, bTagShapeSource, SF_branches, source, scale, syst_name, want_rel = True):
+    def addtbTagShapeSFInDf(df, bTagShapeSource, SF_branches, source, scale, syst_name, want_rel = True, variations_column = None):
         bTagShape_branch_name = f"weight_bTagShapeSF_{syst_name}"
         bTagShape_branch_central = f"""weight_bTagShapeSF_{getSystName(central, central)}"""
-        df = df.Define(f"{bTagShape_branch_name}_double",
-                    f''' ::correction::bTagShapeCorrProvider::getGlobal().getBTagShapeSF(
-                    Jet_p4, Jet_bCand, Jet_hadronFlavour, Jet_btagDeepFlavB,
-                    ::correction::bTagShapeCorrProvider::UncSource::{bTagShapeSource},
-                    ::correction::UncScale::{scale},
-                    ::correction::JetCorrProvider::UncSource::{source}) ''')
+        if variations_column is not None:
+            df = defineSFVariation(df, f"{bTagShape_branch_name}_double", variations_column, 'bTagShapeCorrProvider',
+                                   bTagShapeSource, scale)
+        else:
+            df = df.Define(f"{bTagShape_branch_name}_double",
+                        f''' ::correction::bTagShapeCorrProvider::getGlobal().getBTagShapeSF(
+                        Jet_p4, Jet_bCand, Jet_hadronFlavour, Jet_btagDeepFlavB,
+                        ::correction::bTagShapeCorrProvider::UncSource::{bTagShapeSource},
+                        ::correction::UncScale::{scale},
+                        ::correction::JetCorrProvider::UncSource::{source}) ''')
         if want_rel:
             df = df.Define(f"{bTagShape_branch_name}_rel", f"static_cast<float>({bTagShape_branch_name}_double/{bTagShape_branch_central})")
             bTagShape_branch_name += '_rel'
@@ -124,11 +129,20 @@ class JetCorrProducer:
         return df, SF_branches
 
 
-    def getP4Variations(self, df, source_dict):
-        df = df.Define(f'Jet_p4_shifted_map', f'''::correction::JetCorrProvider::getGlobal().getShiftedP4(
-                                Jet_pt, Jet_eta, Jet_phi, Jet_mass, Jet_rawFactor, Jet_area,
+    def getP4Variations(self, df, source_dict, event_mask=None, jet_mask=None):
+        # event_mask and jet_mask are optional event-level and per-jet boolean expressions: the variations are evaluated
+        # only for the jets that pass both, the other jets keep their NanoAOD p4 in all variations.
+        shifted_p4_args = '''Jet_pt, Jet_eta, Jet_phi, Jet_mass, Jet_rawFactor, Jet_area,
                                 Jet_jetId, Rho_fixedGridRhoFastjetAll, Jet_partonFlavour, 0, GenJet_pt, GenJet_eta,
-                                GenJet_phi, GenJet_mass, event)''')
+                                GenJet_phi, GenJet_mass, event'''
+        if event_mask is None and jet_mask is None:
+            df = df.Define(f'Jet_p4_shifted', f'''::correction::JetCorrProvider::getGlobal().getShiftedP4(
+                                {shifted_p4_args})''')
+        else:
+            event_mask = event_mask if event_mask is not None else 'true'
+            jet_mask = jet_mask if jet_mask is not None else 'ROOT::VecOps::RVec<int>(Jet_pt.size(), 1)'
+            df = df.Define(f'Jet_p4_shifted', f'''::correction::JetCorrProvider::getGlobal().getShiftedP4Selected(
+                                ({event_mask}), ({jet_mask}), {shifted_p4_args})''')
         for source in [ central] + JetCorrProducer.uncSources_extended:
             source_eff = source
             if source!=central and source != "JER":
@@ -139,7 +153,8 @@ class JetCorrProducer:
             updateSourceDict(source_dict, source_eff, 'Jet')
             for scale in getScales(source):
                 syst_name = getSystName(source_eff, scale)
-                df = df.Define(f'Jet_p4_{syst_name}', f'''Jet_p4_shifted_map.at({{::correction::JetCorrProvider::UncSource::{source}, ::correction::UncScale::{scale}}})''')
+                df = df.Define(f'Jet_p4_{syst_name}', f'''Jet_p4_shifted.view(::correction::JetCorrProvider::GetVariationIdx(
+                                    ::correction::JetCorrProvider::UncSource::{source}, ::correction::UncScale::{scale}))''')
                 df = df.Define(f'Jet_p4_{syst_name}_delta', f'Jet_p4_{syst_name} - Jet_p4_{nano}')
         return df,source_dict
 
@@ -148,12 +163,22 @@ class JetCorrProducer:
         SF_branches_jes = []
         sf_scales = [up, down] if return_variations else []
         bTagShapeSource_jesCentral_syst_name = getSystName(central, central)
-        df, SF_branches_core= JetCorrProducer.addtbTagShapeSFInDf(df, central,SF_branches_core, central, central, bTagShapeSource_jesCentral_syst_name, False)
+        variations_column = None
+        if isCentral and return_variations:
+            # all shape variations are evaluated in a single loop over jets
+            variations_column = "bTagShapeSF_variations"
+            if PrecompiledDefines.enabled:
+                functor = ROOT.correction.bTagShapeCorrProvider.BTagShapeSFVariationsFunctor(True)
+                df = defineColumn(df, variations_column, functor, [ 'Jet_p4', 'Jet_bCand', 'Jet_hadronFlavour', 'Jet_btagDeepFlavB' ])
+            else:
+                df = df.Define(variations_column, f''' ::correction::bTagShapeCorrProvider::getGlobal().getBTagShapeSFVariations(
+                                Jet_p4, Jet_bCand, Jet_hadronFlavour, Jet_btagDeepFlavB, true) ''')
+        df, SF_branches_core= JetCorrProducer.addtbTagShapeSFInDf(df, central,SF_branches_core, central, central, bTagShapeSource_jesCentral_syst_name, False, variations_column)
         if isCentral and return_variations:
             for bTagShapeSource_jesCentral in ["lf", "hf", "lfstats1", "lfstats2", "hfstats1", "hfstats2", "cferr1", "cferr2"]:
                 for scale in getScales(bTagShapeSource_jesCentral):
                     bTagShapeSource_jesCentral_syst_name = getSystName(bTagShapeSource_jesCentral, scale)
-                    df, SF_branches_core= JetCorrProducer.addtbTagShapeSFInDf(df, bTagShapeSource_jesCentral,SF_branches_core, central, scale, bTagShapeSource_jesCentral_syst_name, True)
+                    df, SF_branches_core= JetCorrProducer.addtbTagShapeSFInDf(df, bTagShapeSource_jesCentral,SF_branches_core, central, scale, bTagShapeSource_jesCentral_syst_name, True, variations_column)
         else:
             if return_variations:
                 for jes_source in JetCorrProducer.uncSources_core:
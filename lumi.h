@@ -2,10 +2,26 @@
 
 #include <set>
 #include <map>
+#include <atomic>
+#include <cstdint>
+#include <cstdio>
+#include <cstring>
+#include <fstream>
+#include <limits>
 
+#include <sys/stat.h>
+#include <unistd.h>
+
+#include <ROOT/RDataFrame.hxx>
 #include <boost/json/src.hpp>
 #include "corrections.h"
 
+// Certified luminosity blocks of the golden JSON, stored in flat arrays: the sorted list of runs and,
+// for each run, its sorted and non-overlapping lumi ranges. Pass finds the run and the range by binary search.
+// Events of a file are ordered by run, so the position of the last run seen by each thread is kept to skip
+// the run search. With the binary cache enabled, the arrays are stored in <json>.bin and reused as long as
+// the modification time and the size of the JSON file are unchanged.
+
 class LumiFilter : public correction::CorrectionsBase<LumiFilter> {
 public:
     using RunType = unsigned int;
@@ -37,8 +53,95 @@ public:
         return field;
     }
 
-    LumiFilter(const std::string& lumiJsonFile)
+    LumiFilter(const std::string& lumiJsonFile, bool useBinaryCache = false) :
+        id_(nextId()++)
+    {
+        const std::string cachePath = lumiJsonFile + ".bin";
+        const auto signature = GetSignature(lumiJsonFile);
+        if(useBinaryCache && ReadBinaryCache(cachePath, signature))
+            return;
+        const LumiMap lumiMap = ParseLumiMap(lumiJsonFile);
+        runs_.reserve(lumiMap.size());
+        runOffsets_.reserve(lumiMap.size() + 1);
+        runOffsets_.push_back(0);
+        for(const auto& [run, lumiRangeList] : lumiMap) {
+            if(lumiRangeList.empty()) continue;
+            runs_.push_back(run);
+            for(const LumiRange& range : lumiRangeList) {
+                // adjacent ranges are merged
+                if(ranges_.size() > runOffsets_.back() && ranges_.back().second + 1 == range.first)
+                    ranges_.back().second = range.second;
+                else
+                    ranges_.push_back(range);
+            }
+            runOffsets_.push_back(static_cast<uint32_t>(ranges_.size()));
+        }
+        if(useBinaryCache)
+            WriteBinaryCache(cachePath, signature);
+    }
+
+    size_t NumberOfRuns() const { return runs_.size(); }
+    size_t NumberOfRanges() const { return ranges_.size(); }
+
+    // Run-level check, e.g. to skip clusters or files that contain only runs absent from the JSON.
+    bool PassRun(RunType run) const { return FindRun(run) != NoRun; }
+
+    bool Pass(RunType run, LumiType luminosityBlock) const
+    {
+        return PassLumi(FindRunCached(run), luminosityBlock);
+    }
+
+    // Classifies n consecutive (run, lumi) pairs. The run is searched for again only when it changes.
+    void PassBatch(const RunType* runs, const LumiType* lumis, size_t n, bool* pass) const
+    {
+        size_t runIdx = NoRun;
+        for(size_t i = 0; i < n; ++i) {
+            if(i == 0 || runs[i] != runs[i - 1])
+                runIdx = FindRun(runs[i]);
+            pass[i] = PassLumi(runIdx, lumis[i]);
+        }
+    }
+
+    template<typename RunVec, typename LumiVec>
+    correction::RVecB PassBatch(const RunVec& runs, const LumiVec& lumis) const
+    {
+        if(runs.size() != lumis.size())
+            throw std::invalid_argument("LumiFilter: run and lumi vectors have different sizes.");
+        correction::RVecB pass(runs.size());
+        size_t runIdx = NoRun;
+        for(size_t i = 0; i < runs.size(); ++i) {
+            if(i == 0 || runs[i] != runs[i - 1])
+                runIdx = FindRun(runs[i]);
+            pass[i] = PassLumi(runIdx, lumis[i]);
+        }
+        return pass;
+    }
+
+    struct PassFunctor {
+        bool operator()(RunType run, LumiType luminosityBlock) const { return getGlobal().Pass(run, luminosityBlock); }
+    };
+
+    static ROOT::RDF::RNode Filter(ROOT::RDF::RNode df, const std::string& runColumn, const std::string& lumiColumn)
+    {
+        return df.Filter(PassFunctor(), { runColumn, lumiColumn });
+    }
+
+private:
+    using Signature = std::pair<uint64_t, int64_t>; // size and modification time (ns) of the JSON file
+    static constexpr size_t NoRun = std::numeric_limits<size_t>::max();
+    static constexpr char Magic[8] = { 'L', 'U', 'M', 'I', 'M', 'S', 'K', '1' };
+
+    struct CacheHeader {
+        char magic[8];
+        uint64_t jsonSize;
+        int64_t jsonMTime;
+        uint64_t nRuns;
+        uint64_t nRanges;
+    };
+
+    LumiMap ParseLumiMap(const std::string& lumiJsonFile)
     {
+        LumiMap lumiMap;
         const auto lumiJson = ParseFile(lumiJsonFile);
         if(!lumiJson.is_object())
             throw std::invalid_argument("LumiFilter: Invalid lumi json file = '" + lumiJsonFile
@@ -63,10 +166,10 @@ public:
                 LumiRange lumiRange;
                 lumiRange.first = lumiRangeArray.at(0).as_int64();
                 lumiRange.second = lumiRangeArray.at(1).as_int64();
-                lumiMap_[run].push_back(lumiRange);
+                lumiMap[run].push_back(lumiRange);
             }
         }
-        for(auto& [run, lumiRangeList] : lumiMap_) {
+        for(auto& [run, lumiRangeList] : lumiMap) {
             if(lumiRangeList.size() > 0) {
                 std::sort(lumiRangeList.begin(), lumiRangeList.end());
                 for(size_t n = 0; n < lumiRangeList.size() - 1; ++n) {
@@ -80,22 +183,110 @@ public:
                 }
             }
         }
+        return lumiMap;
     }
 
-    bool Pass(RunType run, LumiType luminosityBlock) const
+    size_t FindRun(RunType run) const
+    {
+        if(runs_.empty() || run < runs_.front() || run > runs_.back())
+            return NoRun;
+        const auto iter = std::lower_bound(runs_.begin(), runs_.end(), run);
+        return *iter == run ? static_cast<size_t>(iter - runs_.begin()) : NoRun;
+    }
+
+    size_t FindRunCached(RunType run) const
     {
-        const auto iter = lumiMap_.find(run);
-        if(iter == lumiMap_.end())
+        struct LastRun {
+            size_t filterId{std::numeric_limits<size_t>::max()};
+            RunType run{0};
+            size_t runIdx{NoRun};
+        };
+        thread_local LastRun lastRun;
+        if(lastRun.filterId != id_ || lastRun.run != run) {
+            lastRun.filterId = id_;
+            lastRun.run = run;
+            lastRun.runIdx = FindRun(run);
+        }
+        return lastRun.runIdx;
+    }
+
+    bool PassLumi(size_t runIdx, LumiType luminosityBlock) const
+    {
+        if(runIdx == NoRun)
             return false;
-        for (const LumiRange& range : iter->second) {
-            if(luminosityBlock < range.first)
-                return false;
-            if(luminosityBlock <= range.second)
-                return true;
+        const auto begin = ranges_.begin() + runOffsets_[runIdx];
+        const auto end = ranges_.begin() + runOffsets_[runIdx + 1];
+        // first range that starts after the lumi block, the previous one is the only candidate
+        const auto iter = std::upper_bound(begin, end, luminosityBlock,
+                                           [](LumiType lumi, const LumiRange& range) { return lumi < range.first; });
+        return iter != begin && luminosityBlock <= (iter - 1)->second;
+    }
+
+    static Signature GetSignature(const std::string& path)
+    {
+        struct stat st;
+        if(stat(path.c_str(), &st) != 0)
+            return Signature(0, 0);
+        return Signature(st.st_size, static_cast<int64_t>(st.st_mtim.tv_sec) * 1000000000 + st.st_mtim.tv_nsec);
+    }
+
+    bool ReadBinaryCache(const std::string& cachePath, const Signature& signature)
+    {
+        std::ifstream f(cachePath, std::ios::binary);
+        if(!f) return false;
+        CacheHeader header;
+        if(!f.read(reinterpret_cast<char*>(&header), sizeof(header))
+                || std::memcmp(header.magic, Magic, sizeof(header.magic)) != 0
+                || header.jsonSize != signature.first || header.jsonMTime != signature.second)
+            return false;
+        std::vector<RunType> runs(header.nRuns);
+        std::vector<uint32_t> runOffsets(header.nRuns + 1);
+        std::vector<LumiRange> ranges(header.nRanges);
+        if(!f.read(reinterpret_cast<char*>(runs.data()), runs.size() * sizeof(RunType))
+                || !f.read(reinterpret_cast<char*>(runOffsets.data()), runOffsets.size() * sizeof(uint32_t))
+                || !f.read(reinterpret_cast<char*>(ranges.data()), ranges.size() * sizeof(LumiRange))
+                || f.peek() != std::ifstream::traits_type::eof()
+                || runOffsets.front() != 0 || runOffsets.back() != ranges.size())
+            return false;
+        runs_ = std::move(runs);
+        runOffsets_ = std::move(runOffsets);
+        ranges_ = std::move(ranges);
+        return true;
+    }
+
+    // Written to a temporary file that is then renamed, so that readers never see a partial file.
+    // Failures, e.g. for a JSON in a read-only area, are ignored.
+    void WriteBinaryCache(const std::string& cachePath, const Signature& signature) const
+    {
+        CacheHeader header;
+        std::memcpy(header.magic, Magic, sizeof(header.magic));
+        header.jsonSize = signature.first;
+        header.jsonMTime = signature.second;
+        header.nRuns = runs_.size();
+        header.nRanges = ranges_.size();
+        const std::string tmpPath = cachePath + ".tmp." + std::to_string(getpid());
+        bool ok;
+        {
+            std::ofstream f(tmpPath, std::ios::binary | std::ios::trunc);
+            ok = static_cast<bool>(f);
+            ok = ok && f.write(reinterpret_cast<const char*>(&header), sizeof(header))
+                    && f.write(reinterpret_cast<const char*>(runs_.data()), runs_.size() * sizeof(RunType))
+                    && f.write(reinterpret_cast<const char*>(runOffsets_.data()), runOffsets_.size() * sizeof(uint32_t))
+                    && f.write(reinterpret_cast<const char*>(ranges_.data()), ranges_.size() * sizeof(LumiRange));
         }
-        return false;
+        ok = ok && std::rename(tmpPath.c_str(), cachePath.c_str()) == 0;
+        if(!ok) std::remove(tmpPath.c_str());
+    }
+
+    static std::atomic<size_t>& nextId()
+    {
+        static std::atomic<size_t> id{0};
+        return id;
     }
 
 private:
-    LumiMap lumiMap_;
+    size_t id_;
+    std::vector<RunType> runs_;
+    std::vector<uint32_t> runOffsets_; // ranges of runs_[n] are ranges_[runOffsets_[n]:runOffsets_[n+1]]
+    std::vector<LumiRange> ranges_;
 };
\ No newline at end of file
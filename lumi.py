@@ -1,15 +1,21 @@
 import ROOT
 import os
+from .HeaderCache import declareHeaders, common_headers
+from .CorrectionsCore import PrecompiledDefines
+from .LazyDataFrame import LazyDataFrame
 
 class LumiFilter:
     initialized = False
 
-    def __init__(self, lumi_json_file):
+    def __init__(self, lumi_json_file, use_binary_cache=False):
         if not LumiFilter.initialized:
             lumi_filter_header = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lumi.h")
-            ROOT.gInterpreter.Declare(f'#include "{lumi_filter_header}"')
-            ROOT.gInterpreter.ProcessLine(f'LumiFilter::Initialize("{lumi_json_file}");')
+            declareHeaders(lumi_filter_header, dependencies=[ common_headers ])
+            use_binary_cache_cpp = 'true' if use_binary_cache else 'false'
+            ROOT.gInterpreter.ProcessLine(f'LumiFilter::Initialize("{lumi_json_file}", {use_binary_cache_cpp});')
             LumiFilter.initialized = True
 
     def filter(self, df):
-        return df.Filter('LumiFilter::getGlobal().Pass(run, luminosityBlock)')
\ No newline at end of file
+        if PrecompiledDefines.enabled and not isinstance(df, LazyDataFrame):
+            return ROOT.LumiFilter.Filter(ROOT.RDF.AsRNode(df), 'run', 'luminosityBlock')
+        return df.Filter('LumiFilter::getGlobal().Pass(run, luminosityBlock)')
@@ -32,4 +32,37 @@ LorentzVectorM ShiftMet(const LorentzVectorM& met_p4, const std::vector<RVecLV>&
     return LorentzVectorM(met_p4_shifted.pt(), 0., met_p4_shifted.phi(), 0.);
 }
 
+// Same as ShiftMet, but uses the precomputed p4_shifted - p4_original collections of the shifted objects.
+template <typename... Deltas>
+LorentzVectorM ShiftMetDeltas(const LorentzVectorM& met_p4, const Deltas&... p4_deltas)
+{
+    LorentzVectorXYZ met_p4_shifted(met_p4);
+    for(const RVecLV* p4_delta : std::initializer_list<const RVecLV*>{ &p4_deltas... }) {
+        for(const auto& delta_p4 : *p4_delta)
+            met_p4_shifted -= delta_p4;
+    }
+    return LorentzVectorM(met_p4_shifted.pt(), 0., met_p4_shifted.phi(), 0.);
+}
+
+// MET for all variations in one pass. p4_deltas holds the p4_shifted - p4_original collections of all variations
+// one after the other, n_deltas the number of collections that belong to each variation.
+template <typename... Deltas>
+RVecLV ShiftMetVariations(const LorentzVectorM& met_p4, std::initializer_list<size_t> n_deltas, const Deltas&... p4_deltas)
+{
+    const std::array<const RVecLV*, sizeof...(Deltas)> all_deltas = { &p4_deltas... };
+    RVecLV met_p4_shifted(n_deltas.size());
+    size_t var_idx = 0, delta_idx = 0;
+    for(size_t n : n_deltas) {
+        if(delta_idx + n > all_deltas.size())
+            throw std::runtime_error("ShiftMetVariations: inconsistent number of delta collections.");
+        LorentzVectorXYZ met_p4_var(met_p4);
+        for(size_t n_done = 0; n_done < n; ++n_done, ++delta_idx) {
+            for(const auto& delta_p4 : *all_deltas[delta_idx])
+                met_p4_var -= delta_p4;
+        }
+        met_p4_shifted[var_idx++] = LorentzVectorM(met_p4_var.pt(), 0., met_p4_var.phi(), 0.);
+    }
+    return met_p4_shifted;
+}
+
 } // namespace correction
\ No newline at end of file
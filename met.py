@@ -10,27 +10,35 @@ class METCorrProducer:
         if not METCorrProducer.initialized:
             headers_dir = os.path.dirname(os.path.abspath(__file__))
             header_path = os.path.join(headers_dir, "met.h")
-            ROOT.gInterpreter.Declare(f'#include "{header_path}"')
+            declareHeaders(header_path, dependencies=[ common_headers ])
             METCorrProducer.initialized = True
 
     def getPFMET(self, df, source_dict):
         pfMET_objs = { 'Electron', 'Muon', 'Tau', 'Jet' }
         source_dict_upd = copy.deepcopy(source_dict)
+        met_variations = []
         for source, all_source_objs in source_dict.items():
             source_objs = set(all_source_objs).intersection(pfMET_objs)
             if source == central or len(source_objs) > 0:
                 updateSourceDict(source_dict_upd, source, 'MET')
                 for scale in getScales(source):
                     syst_name = getSystName(source, scale)
-                    p4_original_list = [ f'{obj}_p4_{nano}' for obj in source_objs ]
-                    p4_original_str = ', '.join(p4_original_list)
-                    p4_shifted_list = [ f'{obj}_p4_{syst_name}' for obj in source_objs ]
-                    p4_shifted_str = ', '.join(p4_shifted_list)
-
-                    p4_delta_list = [ f'{obj}_p4_{syst_name}_delta' for obj in source_objs ]
-                    p4_delta_str = ', '.join(p4_delta_list)
-                    df = df.Define(f'MET_p4_{syst_name}',
-                                   f'::correction::ShiftMet(MET_p4_{nano}, {{ {p4_original_str} }}, {{ {p4_shifted_str} }}, false)')
-                    df = df.Define(f'MET_p4_{syst_name}_delta', f'MET_p4_{syst_name} - MET_p4_{nano}')
-
+                    p4_delta_list = [ f'{obj}_p4_{syst_name}_delta' for obj in sorted(source_objs) ]
+                    met_variations.append((syst_name, p4_delta_list))
+        if isinstance(df, LazyDataFrame):
+            # each variation is defined separately, so that only the consumed ones are computed
+            for syst_name, p4_delta_list in met_variations:
+                p4_delta_str = ', '.join(p4_delta_list)
+                df = df.Define(f'MET_p4_{syst_name}', f'::correction::ShiftMetDeltas(MET_p4_{nano}, {p4_delta_str})')
+                df = df.Define(f'MET_p4_{syst_name}_delta', f'MET_p4_{syst_name} - MET_p4_{nano}')
+            return df, source_dict_upd
+        if len(met_variations) == 0:
+            return df, source_dict_upd
+        n_deltas_str = ', '.join([ str(len(p4_delta_list)) for _, p4_delta_list in met_variations ])
+        all_deltas_str = ', '.join([ delta for _, p4_delta_list in met_variations for delta in p4_delta_list ])
+        all_deltas_str = f', {all_deltas_str}' if len(all_deltas_str) > 0 else ''
+        df = df.Define('MET_p4_variations', f'::correction::ShiftMetVariations(MET_p4_{nano}, {{ {n_deltas_str} }}{all_deltas_str})')
+        for var_idx, (syst_name, _) in enumerate(met_variations):
+            df = df.Define(f'MET_p4_{syst_name}', f'MET_p4_variations[{var_idx}]')
+            df = df.Define(f'MET_p4_{syst_name}_delta', f'MET_p4_{syst_name} - MET_p4_{nano}')
         return df, source_dict_upd
@@ -1,7 +1,9 @@
 #pragma once
 
 #include "correction.h"
+#include "cachedCorrection.h"
 #include "corrections.h"
+#include "defines.h"
 
 namespace correction {
 
@@ -42,6 +44,8 @@ public:
         NUM_IsoMu24_or_IsoTkMu24_DEN_CutBasedIdTight_and_PFIsoTight = 30,
 
     };
+    static constexpr size_t nUncSources = 31;
+    using SFVariations = ::correction::SFVariations<UncSource, nUncSources + 1>;
     static const std::map<WorkingPointsMuonID, std::string>& getWPID()
     {
         static const std::map<WorkingPointsMuonID, std::string> names = {
@@ -96,45 +100,123 @@ public:
     MuCorrProvider(const std::string& fileName, const int& year) :
     corrections_(CorrectionSet::from_file(fileName))
     {
-        muIDCorrections["NUM_TrackerMuons_DEN_genTracks"]=corrections_->at("NUM_TrackerMuons_DEN_genTracks");
-        muIDCorrections["NUM_TightID_DEN_TrackerMuons"]=corrections_->at("NUM_TightID_DEN_TrackerMuons");
-        muIDCorrections["NUM_TightID_DEN_genTracks"]=corrections_->at("NUM_TightID_DEN_genTracks");
-        muIDCorrections["NUM_HighPtID_DEN_TrackerMuons"]=corrections_->at("NUM_HighPtID_DEN_TrackerMuons");
-        muIDCorrections["NUM_HighPtID_DEN_genTracks"]=corrections_->at("NUM_HighPtID_DEN_genTracks");
-        muIDCorrections["NUM_TightRelIso_DEN_TightIDandIPCut"]=corrections_->at("NUM_TightRelIso_DEN_TightIDandIPCut");
-        muIDCorrections["NUM_TightRelTkIso_DEN_TrkHighPtIDandIPCut"]=corrections_->at("NUM_TightRelTkIso_DEN_TrkHighPtIDandIPCut");
-
+        std::vector<UncSource> sources = {
+            UncSource::NUM_TrackerMuons_DEN_genTracks,
+            UncSource::NUM_TightID_DEN_TrackerMuons,
+            UncSource::NUM_TightID_DEN_genTracks,
+            UncSource::NUM_HighPtID_DEN_TrackerMuons,
+            UncSource::NUM_HighPtID_DEN_genTracks,
+            UncSource::NUM_TightRelIso_DEN_TightIDandIPCut,
+            UncSource::NUM_TightRelTkIso_DEN_TrkHighPtIDandIPCut,
+        };
         if (year==2018){
-            muIDCorrections["NUM_IsoMu24_DEN_CutBasedIdTight_and_PFIsoTight"] = corrections_->at("NUM_IsoMu24_DEN_CutBasedIdTight_and_PFIsoTight");
+            sources.push_back(UncSource::NUM_IsoMu24_DEN_CutBasedIdTight_and_PFIsoTight);
         }
         if(year==2017){
-            muIDCorrections["NUM_IsoMu27_DEN_CutBasedIdTight_and_PFIsoTight"] = corrections_->at("NUM_IsoMu27_DEN_CutBasedIdTight_and_PFIsoTight");
+            sources.push_back(UncSource::NUM_IsoMu27_DEN_CutBasedIdTight_and_PFIsoTight);
         }
         if (year == 2016 ){
-            muIDCorrections["NUM_IsoMu24_or_IsoTkMu24_DEN_CutBasedIdTight_and_PFIsoTight"] = corrections_->at("NUM_IsoMu24_or_IsoTkMu24_DEN_CutBasedIdTight_and_PFIsoTight");
+            sources.push_back(UncSource::NUM_IsoMu24_or_IsoTkMu24_DEN_CutBasedIdTight_and_PFIsoTight);
         }
+        for(UncSource source : sources)
+            muIDCorrections.at(static_cast<size_t>(source)) = corrections_->at(getUncSourceName(source));
     }
 
-    float getMuonSF(const LorentzVectorM & muon_p4, const float Muon_pfRelIso04_all, const bool Muon_TightId, const float Muon_tkRelIso, const bool Muon_highPtId, UncSource source, UncScale scale, std::string year) const {
+    float getMuonSF(const LorentzVectorM & muon_p4, const float Muon_pfRelIso04_all, const bool Muon_TightId, const float Muon_tkRelIso, const bool Muon_highPtId, UncSource source, UncScale scale, const std::string& year) const {
         const UncScale muID_scale = sourceApplies(source, Muon_pfRelIso04_all, Muon_TightId, muon_p4.Pt(), Muon_tkRelIso, Muon_highPtId)
                                            ? scale : UncScale::Central;
-        const std::string& scale_str = getScaleStr(muID_scale);
-        //const UncSource mu_source = muID_scale == UncScale::Central ? UncSource::Central : source ;
-        //if (source != UncSource::Central) std::cout<<getUncSourceName(mu_source) << std::endl;
-        if (source == UncSource::NUM_TrackerMuons_DEN_genTracks) {
-            const std::string& reco_scale_str = scale==UncScale::Central? "nominal" : scale_str;
-            /*if (scale==UncScale::Central){
-                std::cout << "Unc source reco" << std::endl;
-                std::cout << reco_scale_str << std::endl;
-                std::cout << abs(muon_p4.Eta())<< std::endl;
-                std::cout << muon_p4.Pt()<< std::endl;
-            }*/
-            return muIDCorrections.at(getUncSourceName(source))->evaluate({abs(muon_p4.Eta()), 50., reco_scale_str}) ;
+        return evaluateSF(muon_p4, source, muID_scale, year);
+    }
+
+    // Central, up and down values of each given source evaluated in one call.
+    SFVariations getMuonSFVariations(const LorentzVectorM & muon_p4, const float Muon_pfRelIso04_all, const bool Muon_TightId, const float Muon_tkRelIso, const bool Muon_highPtId, const std::vector<UncSource>& sources, bool need_variations, const std::string& year) const {
+        SFVariations sf;
+        fillMuonSFVariations(sf, muon_p4, Muon_pfRelIso04_all, Muon_TightId, Muon_tkRelIso, Muon_highPtId, sources, need_variations, year);
+        return sf;
+    }
+
+    void fillMuonSFVariations(SFVariations& sf, const LorentzVectorM & muon_p4, const float Muon_pfRelIso04_all, const bool Muon_TightId, const float Muon_tkRelIso, const bool Muon_highPtId, const std::vector<UncSource>& sources, bool need_variations, const std::string& year) const {
+        for(UncSource source : sources) {
+            const float sf_central = evaluateSF(muon_p4, source, UncScale::Central, year);
+            sf.set(source, UncScale::Central, sf_central);
+            if(!need_variations) continue;
+            const bool applies = sourceApplies(source, Muon_pfRelIso04_all, Muon_TightId, muon_p4.Pt(), Muon_tkRelIso, Muon_highPtId);
+            for(UncScale scale : { UncScale::Up, UncScale::Down }) {
+                const float value = applies ? evaluateSF(muon_p4, source, scale, year) : sf_central;
+                sf.set(source, scale, value);
+            }
         }
-        return source == UncSource::Central ? 1. : muIDCorrections.at(getUncSourceName(source))->evaluate({year, abs(muon_p4.Eta()), muon_p4.Pt(), scale_str}) ;
     }
 
+    // Reco and ID/iso variations of one muon leg in a single column. Each group of sources is evaluated only
+    // if the leg pt is within the [pt_min, pt_max) range of the group, otherwise its SFs are left at 1.
+    template <typename IsoVec, typename TightIdVec, typename TkIsoVec, typename HighPtIdVec>
+    SFVariations getMuonLegSFVariations(const LegFeatures& mu, const IsoVec& Muon_pfRelIso04_all, const TightIdVec& Muon_tightId,
+                                        const TkIsoVec& Muon_tkRelIso, const HighPtIdVec& Muon_highPtId,
+                                        const std::vector<UncSource>& reco_sources, double reco_pt_min, double reco_pt_max,
+                                        const std::vector<UncSource>& id_iso_sources, double id_iso_pt_min, double id_iso_pt_max,
+                                        bool need_variations, const std::string& year) const
+    {
+        SFVariations sf;
+        if(mu.leg_type != Leg::mu) return sf;
+        const float iso = Muon_pfRelIso04_all[mu.index], tkIso = Muon_tkRelIso[mu.index];
+        const bool tightId = Muon_tightId[mu.index], highPtId = Muon_highPtId[mu.index];
+        if(mu.pt >= reco_pt_min && mu.pt < reco_pt_max)
+            fillMuonSFVariations(sf, mu.p4, iso, tightId, tkIso, highPtId, reco_sources, need_variations, year);
+        if(mu.pt >= id_iso_pt_min && mu.pt < id_iso_pt_max)
+            fillMuonSFVariations(sf, mu.p4, iso, tightId, tkIso, highPtId, id_iso_sources, need_variations, year);
+        return sf;
+    }
+
+    // Precompiled counterpart of the getMuonLegSFVariations column expression.
+    template <typename IsoVec, typename TightIdVec, typename TkIsoVec, typename HighPtIdVec>
+    struct MuonLegSFVariationsFunctor {
+        MuonLegSFVariationsFunctor(size_t _leg_idx, const std::vector<UncSource>& _reco_sources, double _reco_pt_min,
+                                   double _reco_pt_max, const std::vector<UncSource>& _id_iso_sources, double _id_iso_pt_min,
+                                   double _id_iso_pt_max, bool _need_variations, const std::string& _year) :
+            leg_idx(_leg_idx), reco_sources(_reco_sources), reco_pt_min(_reco_pt_min), reco_pt_max(_reco_pt_max),
+            id_iso_sources(_id_iso_sources), id_iso_pt_min(_id_iso_pt_min), id_iso_pt_max(_id_iso_pt_max),
+            need_variations(_need_variations), year(_year)
+        {
+        }
+
+        SFVariations operator()(const CandidateLegs& legs, const IsoVec& Muon_pfRelIso04_all, const TightIdVec& Muon_tightId,
+                                const TkIsoVec& Muon_tkRelIso, const HighPtIdVec& Muon_highPtId) const
+        {
+            return getGlobal().getMuonLegSFVariations(legs[leg_idx], Muon_pfRelIso04_all, Muon_tightId, Muon_tkRelIso,
+                                                      Muon_highPtId, reco_sources, reco_pt_min, reco_pt_max, id_iso_sources,
+                                                      id_iso_pt_min, id_iso_pt_max, need_variations, year);
+        }
+
+        size_t leg_idx;
+        std::vector<UncSource> reco_sources;
+        double reco_pt_min, reco_pt_max;
+        std::vector<UncSource> id_iso_sources;
+        double id_iso_pt_min, id_iso_pt_max;
+        bool need_variations;
+        std::string year;
+    };
+
 private:
+    // Scale already resolved with sourceApplies. The reco SF is evaluated at a fixed pt of 50 GeV.
+    float evaluateSF(const LorentzVectorM & muon_p4, UncSource source, UncScale scale, const std::string& year) const {
+        if (source == UncSource::Central) return 1.;
+        const CachedCorrection& corr = getCorrection(source);
+        if (source == UncSource::NUM_TrackerMuons_DEN_genTracks) {
+            static const std::string reco_central_str = "nominal";
+            const std::string& reco_scale_str = scale==UncScale::Central ? reco_central_str : getScaleStr(scale);
+            return corr->evaluate({abs(muon_p4.Eta()), 50., reco_scale_str}) ;
+        }
+        return corr->evaluate({year, abs(muon_p4.Eta()), muon_p4.Pt(), getScaleStr(scale)}) ;
+    }
+
+    const CachedCorrection& getCorrection(UncSource source) const {
+        const CachedCorrection& corr = muIDCorrections.at(static_cast<size_t>(source));
+        if(!corr.ref())
+            throw std::runtime_error("MuCorrProvider: correction " + getUncSourceName(source) + " is not loaded.");
+        return corr;
+    }
+
     static const std::map<float, std::set<std::pair<float, float>>>& getRecoSFMap()
         {
             static const std::map<float, std::set<std::pair<float, float>>> RecoSFMap = {
@@ -149,42 +231,46 @@ private:
             };
             return RecoSFMap;
         }
-    static std::string& getUncSourceName(UncSource source) {
-        static std::string k = "Central";
-        if (source == UncSource::NUM_GlobalMuons_DEN_genTracks) k = "NUM_GlobalMuons_DEN_genTracks";
-        if (source == UncSource::NUM_HighPtID_DEN_genTracks) k = "NUM_HighPtID_DEN_genTracks";
-        if (source == UncSource::NUM_HighPtID_DEN_TrackerMuons) k = "NUM_HighPtID_DEN_TrackerMuons";
-        if (source == UncSource::NUM_IsoMu24_DEN_CutBasedIdTight_and_PFIsoTight) k = "NUM_IsoMu24_DEN_CutBasedIdTight_and_PFIsoTight";
-        if (source == UncSource::NUM_LooseID_DEN_genTracks) k = "NUM_LooseID_DEN_genTracks";
-        if (source == UncSource::NUM_LooseID_DEN_TrackerMuons) k = "NUM_LooseID_DEN_TrackerMuons";
-        if (source == UncSource::NUM_LooseRelIso_DEN_LooseID) k = "NUM_LooseRelIso_DEN_LooseID";
-        if (source == UncSource::NUM_LooseRelIso_DEN_MediumID) k = "NUM_LooseRelIso_DEN_MediumID";
-        if (source == UncSource::NUM_LooseRelIso_DEN_MediumPromptID) k = "NUM_LooseRelIso_DEN_MediumPromptID";
-        if (source == UncSource::NUM_LooseRelIso_DEN_TightIDandIPCut) k = "NUM_LooseRelIso_DEN_TightIDandIPCut";
-        if (source == UncSource::NUM_LooseRelTkIso_DEN_HighPtIDandIPCut) k = "NUM_LooseRelTkIso_DEN_HighPtIDandIPCut";
-        if (source == UncSource::NUM_LooseRelTkIso_DEN_TrkHighPtIDandIPCut) k = "NUM_LooseRelTkIso_DEN_TrkHighPtIDandIPCut";
-        if (source == UncSource::NUM_MediumID_DEN_genTracks) k = "NUM_MediumID_DEN_genTracks";
-        if (source == UncSource::NUM_MediumID_DEN_TrackerMuons) k = "NUM_MediumID_DEN_TrackerMuons";
-        if (source == UncSource::NUM_MediumPromptID_DEN_genTracks) k = "NUM_MediumPromptID_DEN_genTracks";
-        if (source == UncSource::NUM_MediumPromptID_DEN_TrackerMuons) k = "NUM_MediumPromptID_DEN_TrackerMuons";
-        if (source == UncSource::NUM_Mu50_or_OldMu100_or_TkMu100_DEN_CutBasedIdGlobalHighPt_and_TkIsoLoose) k = "NUM_Mu50_or_OldMu100_or_TkMu100_DEN_CutBasedIdGlobalHighPt_and_TkIsoLoose";
-        if (source == UncSource::NUM_SoftID_DEN_genTracks) k = "NUM_SoftID_DEN_genTracks";
-        if (source == UncSource::NUM_SoftID_DEN_TrackerMuons) k = "NUM_SoftID_DEN_TrackerMuons";
-        if (source == UncSource::NUM_TightID_DEN_genTracks) k = "NUM_TightID_DEN_genTracks";
-        if (source == UncSource::NUM_TightID_DEN_TrackerMuons) k = "NUM_TightID_DEN_TrackerMuons";
-        if (source == UncSource::NUM_TightRelIso_DEN_MediumID) k = "NUM_TightRelIso_DEN_MediumID";
-        if (source == UncSource::NUM_TightRelIso_DEN_MediumPromptID) k = "NUM_TightRelIso_DEN_MediumPromptID";
-        if (source == UncSource::NUM_TightRelIso_DEN_TightIDandIPCut) k = "NUM_TightRelIso_DEN_TightIDandIPCut";
-        if (source == UncSource::NUM_TightRelTkIso_DEN_HighPtIDandIPCut) k = "NUM_TightRelTkIso_DEN_HighPtIDandIPCut";
-        if (source == UncSource::NUM_TightRelTkIso_DEN_TrkHighPtIDandIPCut) k = "NUM_TightRelTkIso_DEN_TrkHighPtIDandIPCut";
-        if (source == UncSource::NUM_TrackerMuons_DEN_genTracks) k = "NUM_TrackerMuons_DEN_genTracks";
-        if (source == UncSource::NUM_TrkHighPtID_DEN_genTracks) k = "NUM_TrkHighPtID_DEN_genTracks";
-        if (source == UncSource::NUM_TrkHighPtID_DEN_TrackerMuons) k = "NUM_TrkHighPtID_DEN_TrackerMuons";
-        return k;
+    static const std::string& getUncSourceName(UncSource source) {
+        static const std::map<UncSource, std::string> names = {
+            { UncSource::Central, "Central" },
+            { UncSource::NUM_GlobalMuons_DEN_genTracks, "NUM_GlobalMuons_DEN_genTracks" },
+            { UncSource::NUM_HighPtID_DEN_genTracks, "NUM_HighPtID_DEN_genTracks" },
+            { UncSource::NUM_HighPtID_DEN_TrackerMuons, "NUM_HighPtID_DEN_TrackerMuons" },
+            { UncSource::NUM_IsoMu24_DEN_CutBasedIdTight_and_PFIsoTight, "NUM_IsoMu24_DEN_CutBasedIdTight_and_PFIsoTight" },
+            { UncSource::NUM_IsoMu27_DEN_CutBasedIdTight_and_PFIsoTight, "NUM_IsoMu27_DEN_CutBasedIdTight_and_PFIsoTight" },
+            { UncSource::NUM_IsoMu24_or_IsoTkMu24_DEN_CutBasedIdTight_and_PFIsoTight, "NUM_IsoMu24_or_IsoTkMu24_DEN_CutBasedIdTight_and_PFIsoTight" },
+            { UncSource::NUM_LooseID_DEN_genTracks, "NUM_LooseID_DEN_genTracks" },
+            { UncSource::NUM_LooseID_DEN_TrackerMuons, "NUM_LooseID_DEN_TrackerMuons" },
+            { UncSource::NUM_LooseRelIso_DEN_LooseID, "NUM_LooseRelIso_DEN_LooseID" },
+            { UncSource::NUM_LooseRelIso_DEN_MediumID, "NUM_LooseRelIso_DEN_MediumID" },
+            { UncSource::NUM_LooseRelIso_DEN_MediumPromptID, "NUM_LooseRelIso_DEN_MediumPromptID" },
+            { UncSource::NUM_LooseRelIso_DEN_TightIDandIPCut, "NUM_LooseRelIso_DEN_TightIDandIPCut" },
+            { UncSource::NUM_LooseRelTkIso_DEN_HighPtIDandIPCut, "NUM_LooseRelTkIso_DEN_HighPtIDandIPCut" },
+            { UncSource::NUM_LooseRelTkIso_DEN_TrkHighPtIDandIPCut, "NUM_LooseRelTkIso_DEN_TrkHighPtIDandIPCut" },
+            { UncSource::NUM_MediumID_DEN_genTracks, "NUM_MediumID_DEN_genTracks" },
+            { UncSource::NUM_MediumID_DEN_TrackerMuons, "NUM_MediumID_DEN_TrackerMuons" },
+            { UncSource::NUM_MediumPromptID_DEN_genTracks, "NUM_MediumPromptID_DEN_genTracks" },
+            { UncSource::NUM_MediumPromptID_DEN_TrackerMuons, "NUM_MediumPromptID_DEN_TrackerMuons" },
+            { UncSource::NUM_Mu50_or_OldMu100_or_TkMu100_DEN_CutBasedIdGlobalHighPt_and_TkIsoLoose, "NUM_Mu50_or_OldMu100_or_TkMu100_DEN_CutBasedIdGlobalHighPt_and_TkIsoLoose" },
+            { UncSource::NUM_SoftID_DEN_genTracks, "NUM_SoftID_DEN_genTracks" },
+            { UncSource::NUM_SoftID_DEN_TrackerMuons, "NUM_SoftID_DEN_TrackerMuons" },
+            { UncSource::NUM_TightID_DEN_genTracks, "NUM_TightID_DEN_genTracks" },
+            { UncSource::NUM_TightID_DEN_TrackerMuons, "NUM_TightID_DEN_TrackerMuons" },
+            { UncSource::NUM_TightRelIso_DEN_MediumID, "NUM_TightRelIso_DEN_MediumID" },
+            { UncSource::NUM_TightRelIso_DEN_MediumPromptID, "NUM_TightRelIso_DEN_MediumPromptID" },
+            { UncSource::NUM_TightRelIso_DEN_TightIDandIPCut, "NUM_TightRelIso_DEN_TightIDandIPCut" },
+            { UncSource::NUM_TightRelTkIso_DEN_HighPtIDandIPCut, "NUM_TightRelTkIso_DEN_HighPtIDandIPCut" },
+            { UncSource::NUM_TightRelTkIso_DEN_TrkHighPtIDandIPCut, "NUM_TightRelTkIso_DEN_TrkHighPtIDandIPCut" },
+            { UncSource::NUM_TrackerMuons_DEN_genTracks, "NUM_TrackerMuons_DEN_genTracks" },
+            { UncSource::NUM_TrkHighPtID_DEN_genTracks, "NUM_TrkHighPtID_DEN_genTracks" },
+            { UncSource::NUM_TrkHighPtID_DEN_TrackerMuons, "NUM_TrkHighPtID_DEN_TrackerMuons" },
+        };
+        return names.at(source);
     }
 private:
     std::unique_ptr<CorrectionSet> corrections_;
-    std::map<std::string, Correction::Ref> muIDCorrections;
+    std::array<CachedCorrection, nUncSources> muIDCorrections;
 
 };
 
@@ -212,6 +298,8 @@ public:
         NUM_HLT_DEN_MediumIDTightRelIsoProbes = 15,
         NUM_HLT_DEN_MediumIDLooseRelIsoProbes = 16,
     };
+    static constexpr size_t nUncSources = 17;
+    using SFVariations = ::correction::SFVariations<UncSource, nUncSources + 1>;
 
     static const std::string& getScaleStr(UncScale scale)
     {
@@ -241,54 +329,112 @@ public:
     HighPtMuCorrProvider(const std::string& fileName) :
     corrections_(CorrectionSet::from_file(fileName))
     {
-        highPtmuCorrections["NUM_GlobalMuons_DEN_TrackerMuonProbes"]=corrections_->at("NUM_GlobalMuons_DEN_TrackerMuonProbes");
-        highPtmuCorrections["NUM_TightID_DEN_GlobalMuonProbes"]=corrections_->at("NUM_TightID_DEN_GlobalMuonProbes");
-        highPtmuCorrections["NUM_HighPtID_DEN_GlobalMuonProbes"]=corrections_->at("NUM_HighPtID_DEN_GlobalMuonProbes");
-        highPtmuCorrections["NUM_probe_TightRelTkIso_DEN_HighPtProbes"]=corrections_->at("NUM_probe_TightRelTkIso_DEN_HighPtProbes");
-
+        for(UncSource source : { UncSource::NUM_GlobalMuons_DEN_TrackerMuonProbes, UncSource::NUM_TightID_DEN_GlobalMuonProbes,
+                                 UncSource::NUM_HighPtID_DEN_GlobalMuonProbes, UncSource::NUM_probe_TightRelTkIso_DEN_HighPtProbes })
+            highPtmuCorrections.at(static_cast<size_t>(source)) = corrections_->at(getUncSourceName(source));
     }
 
     float getHighPtMuonSF(const LorentzVectorM & muon_p4, const float Muon_pfRelIso04_all, const bool Muon_TightId, const float Muon_tkRelIso, const bool Muon_highPtId, UncSource source, UncScale scale) const {
         const UncScale muID_scale = sourceApplies(source, Muon_pfRelIso04_all, Muon_TightId, muon_p4.Pt(), Muon_tkRelIso, Muon_highPtId) ? scale : UncScale::Central;
-        const std::string& scale_str = getScaleStr(muID_scale);
-        const auto mu_p = std::sqrt(muon_p4.Pt()*muon_p4.Pt()+muon_p4.Eta()*muon_p4.Eta()+muon_p4.Phi()*muon_p4.Phi()+muon_p4.M()*muon_p4.M());
-        if (source == UncSource::NUM_GlobalMuons_DEN_TrackerMuonProbes) {
-            //std::cout << mu_p <<std::endl;
-            //std::cout << abs(muon_p4.Eta()) <<std::endl;
-            //std::cout << scale_str << std::endl;
-            //const std::string& reco_scale_str = scale==UncScale::Central? "nominal" : scale_str;
-            //std::cout << reco_scale_str << std::endl;
-            return highPtmuCorrections.at(getUncSourceName(source))->evaluate({abs(muon_p4.Eta()), mu_p, scale_str}) ;
+        return evaluateSF(muon_p4, source, muID_scale);
+    }
+
+    // Central, up and down values of each given source evaluated in one call.
+    SFVariations getHighPtMuonSFVariations(const LorentzVectorM & muon_p4, const float Muon_pfRelIso04_all, const bool Muon_TightId, const float Muon_tkRelIso, const bool Muon_highPtId, const std::vector<UncSource>& sources, bool need_variations) const {
+        SFVariations sf;
+        for(UncSource source : sources) {
+            const float sf_central = evaluateSF(muon_p4, source, UncScale::Central);
+            sf.set(source, UncScale::Central, sf_central);
+            if(!need_variations) continue;
+            const bool applies = sourceApplies(source, Muon_pfRelIso04_all, Muon_TightId, muon_p4.Pt(), Muon_tkRelIso, Muon_highPtId);
+            for(UncScale scale : { UncScale::Up, UncScale::Down }) {
+                const float value = applies ? evaluateSF(muon_p4, source, scale) : sf_central;
+                sf.set(source, scale, value);
+            }
         }
-        return source == UncSource::Central ? 1. : highPtmuCorrections.at(getUncSourceName(source))->evaluate({abs(muon_p4.Eta()),muon_p4.Pt(), scale_str}) ;
+        return sf;
     }
 
+    // Reco, ID and iso variations of one muon leg with pt >= pt_min in a single column.
+    // The tkRelIso and highPtId values are passed in the same order as in the former per-source expressions.
+    template <typename IsoVec, typename TightIdVec, typename TkIsoVec, typename HighPtIdVec>
+    SFVariations getHighPtMuonLegSFVariations(const LegFeatures& mu, const IsoVec& Muon_pfRelIso04_all, const TightIdVec& Muon_tightId,
+                                              const TkIsoVec& Muon_tkRelIso, const HighPtIdVec& Muon_highPtId, double pt_min,
+                                              const std::vector<UncSource>& sources, bool need_variations) const
+    {
+        if(mu.leg_type != Leg::mu || !(mu.pt >= pt_min)) return SFVariations();
+        return getHighPtMuonSFVariations(mu.p4, Muon_pfRelIso04_all[mu.index], Muon_tightId[mu.index],
+                                         Muon_highPtId[mu.index], Muon_tkRelIso[mu.index], sources, need_variations);
+    }
+
+    // Precompiled counterpart of the getHighPtMuonLegSFVariations column expression.
+    template <typename IsoVec, typename TightIdVec, typename TkIsoVec, typename HighPtIdVec>
+    struct HighPtMuonLegSFVariationsFunctor {
+        HighPtMuonLegSFVariationsFunctor(size_t _leg_idx, double _pt_min, const std::vector<UncSource>& _sources,
+                                         bool _need_variations) :
+            leg_idx(_leg_idx), pt_min(_pt_min), sources(_sources), need_variations(_need_variations)
+        {
+        }
+
+        SFVariations operator()(const CandidateLegs& legs, const IsoVec& Muon_pfRelIso04_all, const TightIdVec& Muon_tightId,
+                                const TkIsoVec& Muon_tkRelIso, const HighPtIdVec& Muon_highPtId) const
+        {
+            return getGlobal().getHighPtMuonLegSFVariations(legs[leg_idx], Muon_pfRelIso04_all, Muon_tightId, Muon_tkRelIso,
+                                                            Muon_highPtId, pt_min, sources, need_variations);
+        }
+
+        size_t leg_idx;
+        double pt_min;
+        std::vector<UncSource> sources;
+        bool need_variations;
+    };
+
 private:
+    // Scale already resolved with sourceApplies. The reco SF is binned in the muon momentum.
+    float evaluateSF(const LorentzVectorM & muon_p4, UncSource source, UncScale scale) const {
+        if (source == UncSource::Central) return 1.;
+        const CachedCorrection& corr = getCorrection(source);
+        const std::string& scale_str = getScaleStr(scale);
+        if (source == UncSource::NUM_GlobalMuons_DEN_TrackerMuonProbes) {
+            const auto mu_p = std::sqrt(muon_p4.Pt()*muon_p4.Pt()+muon_p4.Eta()*muon_p4.Eta()+muon_p4.Phi()*muon_p4.Phi()+muon_p4.M()*muon_p4.M());
+            return corr->evaluate({abs(muon_p4.Eta()), mu_p, scale_str}) ;
+        }
+        return corr->evaluate({abs(muon_p4.Eta()),muon_p4.Pt(), scale_str}) ;
+    }
 
-    static std::string& getUncSourceName(UncSource source) {
-        static std::string sourcename = "Central";
-        if (source == UncSource::NUM_GlobalMuons_DEN_TrackerMuonProbes) sourcename =  "NUM_GlobalMuons_DEN_TrackerMuonProbes";
-        if (source == UncSource::NUM_HighPtID_DEN_GlobalMuonProbes) sourcename =  "NUM_HighPtID_DEN_GlobalMuonProbes";
-        if (source == UncSource::NUM_TrkHighPtID_DEN_GlobalMuonProbes) sourcename =  "NUM_TrkHighPtID_DEN_GlobalMuonProbes";
-        if (source == UncSource::NUM_probe_LooseRelTkIso_DEN_HighPtProbes) sourcename =  "NUM_probe_LooseRelTkIso_DEN_HighPtProbes";
-        if (source == UncSource::NUM_probe_TightRelTkIso_DEN_HighPtProbes) sourcename =  "NUM_probe_TightRelTkIso_DEN_HighPtProbes";
-        if (source == UncSource::NUM_probe_LooseRelTkIso_DEN_TrkHighPtProbes) sourcename =  "NUM_probe_LooseRelTkIso_DEN_TrkHighPtProbes";
-        if (source == UncSource::NUM_probe_TightRelTkIso_DEN_TrkHighPtProbes) sourcename =  "NUM_probe_TightRelTkIso_DEN_TrkHighPtProbes";
-        if (source == UncSource::NUM_TightID_DEN_GlobalMuonProbes) sourcename =  "NUM_TightID_DEN_GlobalMuonProbes";
-        if (source == UncSource::NUM_MediumID_DEN_GlobalMuonProbes) sourcename =  "NUM_MediumID_DEN_GlobalMuonProbes";
-        if (source == UncSource::NUM_probe_LooseRelTkIso_DEN_MediumIDProbes) sourcename =  "NUM_probe_LooseRelTkIso_DEN_MediumIDProbes";
-        if (source == UncSource::NUM_probe_TightRelTkIso_DEN_MediumIDProbes) sourcename =  "NUM_probe_TightRelTkIso_DEN_MediumIDProbes";
-        if (source == UncSource::NUM_HLT_DEN_TrkHighPtTightRelIsoProbes) sourcename =  "NUM_HLT_DEN_TrkHighPtTightRelIsoProbes";
-        if (source == UncSource::NUM_HLT_DEN_TrkHighPtLooseRelIsoProbes) sourcename =  "NUM_HLT_DEN_TrkHighPtLooseRelIsoProbes";
-        if (source == UncSource::NUM_HLT_DEN_HighPtTightRelIsoProbes) sourcename =  "NUM_HLT_DEN_HighPtTightRelIsoProbes";
-        if (source == UncSource::NUM_HLT_DEN_HighPtLooseRelIsoProbes) sourcename =  "NUM_HLT_DEN_HighPtLooseRelIsoProbes";
-        if (source == UncSource::NUM_HLT_DEN_MediumIDTightRelIsoProbes) sourcename =  "NUM_HLT_DEN_MediumIDTightRelIsoProbes";
-        if (source == UncSource::NUM_HLT_DEN_MediumIDLooseRelIsoProbes) sourcename =  "NUM_HLT_DEN_MediumIDLooseRelIsoProbes";
-        return sourcename;
+    const CachedCorrection& getCorrection(UncSource source) const {
+        const CachedCorrection& corr = highPtmuCorrections.at(static_cast<size_t>(source));
+        if(!corr.ref())
+            throw std::runtime_error("HighPtMuCorrProvider: correction " + getUncSourceName(source) + " is not loaded.");
+        return corr;
+    }
+
+    static const std::string& getUncSourceName(UncSource source) {
+        static const std::map<UncSource, std::string> names = {
+            { UncSource::Central, "Central" },
+            { UncSource::NUM_GlobalMuons_DEN_TrackerMuonProbes, "NUM_GlobalMuons_DEN_TrackerMuonProbes" },
+            { UncSource::NUM_HighPtID_DEN_GlobalMuonProbes, "NUM_HighPtID_DEN_GlobalMuonProbes" },
+            { UncSource::NUM_TrkHighPtID_DEN_GlobalMuonProbes, "NUM_TrkHighPtID_DEN_GlobalMuonProbes" },
+            { UncSource::NUM_probe_LooseRelTkIso_DEN_HighPtProbes, "NUM_probe_LooseRelTkIso_DEN_HighPtProbes" },
+            { UncSource::NUM_probe_TightRelTkIso_DEN_HighPtProbes, "NUM_probe_TightRelTkIso_DEN_HighPtProbes" },
+            { UncSource::NUM_probe_LooseRelTkIso_DEN_TrkHighPtProbes, "NUM_probe_LooseRelTkIso_DEN_TrkHighPtProbes" },
+            { UncSource::NUM_probe_TightRelTkIso_DEN_TrkHighPtProbes, "NUM_probe_TightRelTkIso_DEN_TrkHighPtProbes" },
+            { UncSource::NUM_TightID_DEN_GlobalMuonProbes, "NUM_TightID_DEN_GlobalMuonProbes" },
+            { UncSource::NUM_MediumID_DEN_GlobalMuonProbes, "NUM_MediumID_DEN_GlobalMuonProbes" },
+            { UncSource::NUM_probe_LooseRelTkIso_DEN_MediumIDProbes, "NUM_probe_LooseRelTkIso_DEN_MediumIDProbes" },
+            { UncSource::NUM_probe_TightRelTkIso_DEN_MediumIDProbes, "NUM_probe_TightRelTkIso_DEN_MediumIDProbes" },
+            { UncSource::NUM_HLT_DEN_TrkHighPtTightRelIsoProbes, "NUM_HLT_DEN_TrkHighPtTightRelIsoProbes" },
+            { UncSource::NUM_HLT_DEN_TrkHighPtLooseRelIsoProbes, "NUM_HLT_DEN_TrkHighPtLooseRelIsoProbes" },
+            { UncSource::NUM_HLT_DEN_HighPtTightRelIsoProbes, "NUM_HLT_DEN_HighPtTightRelIsoProbes" },
+            { UncSource::NUM_HLT_DEN_HighPtLooseRelIsoProbes, "NUM_HLT_DEN_HighPtLooseRelIsoProbes" },
+            { UncSource::NUM_HLT_DEN_MediumIDTightRelIsoProbes, "NUM_HLT_DEN_MediumIDTightRelIsoProbes" },
+            { UncSource::NUM_HLT_DEN_MediumIDLooseRelIsoProbes, "NUM_HLT_DEN_MediumIDLooseRelIsoProbes" },
+        };
+        return names.at(source);
     }
 private:
     std::unique_ptr<CorrectionSet> corrections_;
-    std::map<std::string, Correction::Ref> highPtmuCorrections;
+    std::array<CachedCorrection, nUncSources> highPtmuCorrections;
 
 };
 
@@ -71,8 +71,10 @@ class MuCorrProducer:
         if not MuCorrProducer.initialized:
             headers_dir = os.path.dirname(os.path.abspath(__file__))
             header_path = os.path.join(headers_dir, "mu.h")
-            ROOT.gInterpreter.Declare(f'#include "{header_path}"')
+            declareHeaders(header_path, dependencies=[ common_headers ])
+            registerCorrectionLayouts(jsonFile_eff)
             ROOT.gInterpreter.ProcessLine(f'::correction::MuCorrProvider::Initialize("{jsonFile_eff}", static_cast<int>({periods[period]}))')
+            registerCorrectionLayouts(jsonFile_eff_highPt)
             ROOT.gInterpreter.ProcessLine(f'::correction::HighPtMuCorrProvider::Initialize("{jsonFile_eff_highPt}")')
             MuCorrProducer.period = period
             MuCorrProducer.initialized = True
@@ -81,6 +83,21 @@ class MuCorrProducer:
         SF_branches = []
         sf_sources = MuCorrProducer.muID_SF_Sources + MuCorrProducer.muReco_SF_sources + MuCorrProducer.muIso_SF_Sources
         sf_scales = [central, up, down] if return_variations else [central]
+        need_variations = 'true' if isCentral and return_variations else 'false'
+        muReco_sources_cpp = createUncSourceList('MuCorrProvider', MuCorrProducer.muReco_SF_sources)
+        muIDIso_sources_cpp = createUncSourceList('MuCorrProvider', MuCorrProducer.muID_SF_Sources + MuCorrProducer.muIso_SF_Sources)
+        muon_columns = [ 'HttCandidate_legs', 'Muon_pfRelIso04_all', 'Muon_tightId', 'Muon_tkRelIso', 'Muon_highPtId' ]
+        df = defineCandidateLegs(df)
+        # reco SFs for 10 <= pt < 200 and ID/iso SFs for 15 <= pt < 120, all in one column per leg
+        for leg_idx, leg_name in enumerate(lepton_legs):
+            if PrecompiledDefines.enabled:
+                functor_class = ROOT.correction.MuCorrProvider.MuonLegSFVariationsFunctor[tuple(df.GetColumnType(c) for c in muon_columns[1:])]
+                functor = functor_class(leg_idx, createUncSourceVector('MuCorrProvider', MuCorrProducer.muReco_SF_sources), 10., 200.,
+                                        createUncSourceVector('MuCorrProvider', MuCorrProducer.muID_SF_Sources + MuCorrProducer.muIso_SF_Sources),
+                                        15., 120., need_variations == 'true', MuCorrProducer.period)
+                df = defineColumn(df, f"{leg_name}_MuonID_SF_variations", functor, muon_columns)
+                continue
+            df = df.Define(f"{leg_name}_MuonID_SF_variations", f'''::correction::MuCorrProvider::getGlobal().getMuonLegSFVariations(HttCandidate_legs[{leg_idx}], Muon_pfRelIso04_all, Muon_tightId, Muon_tkRelIso, Muon_highPtId, {muReco_sources_cpp}, 10., 200., {muIDIso_sources_cpp}, 15., 120., {need_variations}, "{MuCorrProducer.period}")''')
         for source in sf_sources :
             for scale in sf_scales:
                 if source == central and scale != central: continue
@@ -89,24 +106,16 @@ class MuCorrProducer:
                 syst_name = source_name+scale if source != central else 'Central'
                 for leg_idx, leg_name in enumerate(lepton_legs):
                     branch_name = f"weight_{leg_name}_MuonID_SF_{syst_name}"
-                    #print(branch_name)
-                    branch_central = f"""weight_{leg_name}_MuonID_SF_{source_name+central}"""
-                    if source in MuCorrProducer.muReco_SF_sources:
-                        df = df.Define(f"{branch_name}_double",f'''HttCandidate.leg_type[{leg_idx}] == Leg::mu && HttCandidate.leg_p4[{leg_idx}].pt() >= 10 && HttCandidate.leg_p4[{leg_idx}].pt() < 200 ? ::correction::MuCorrProvider::getGlobal().getMuonSF( HttCandidate.leg_p4[{leg_idx}], Muon_pfRelIso04_all.at(HttCandidate.leg_index[{leg_idx}]), Muon_tightId.at(HttCandidate.leg_index[{leg_idx}]),Muon_tkRelIso.at(HttCandidate.leg_index[{leg_idx}]),Muon_highPtId.at(HttCandidate.leg_index[{leg_idx}]),::correction::MuCorrProvider::UncSource::{source}, ::correction::UncScale::{scale}, "{MuCorrProducer.period}") : 1.''')
-                    else:
-                        df = df.Define(f"{branch_name}_double", f'''HttCandidate.leg_type[{leg_idx}] == Leg::mu && HttCandidate.leg_p4[{leg_idx}].pt() >= 15 && HttCandidate.leg_p4[{leg_idx}].pt() < 120 ? ::correction::MuCorrProvider::getGlobal().getMuonSF(HttCandidate.leg_p4[{leg_idx}], Muon_pfRelIso04_all.at(HttCandidate.leg_index[{leg_idx}]), Muon_tightId.at(HttCandidate.leg_index[{leg_idx}]),Muon_tkRelIso.at(HttCandidate.leg_index[{leg_idx}]),Muon_highPtId.at(HttCandidate.leg_index[{leg_idx}]),::correction::MuCorrProvider::UncSource::{source}, ::correction::UncScale::{scale}, "{MuCorrProducer.period}") : 1.''')
-                    #print(f"{branch_name}_double")
-                    #if scale==central:
-                    #    df.Filter(f"{branch_name}_double!=1.").Display({f"{branch_name}_double"}).Print()
+                    variations_branch = f"{leg_name}_MuonID_SF_variations"
                     if scale != central:
                         branch_name_final = branch_name + '_rel'
-                        df = df.Define(branch_name_final, f"static_cast<float>({branch_name}_double/{branch_central})")
+                        df = defineSFVariationRelative(df, branch_name_final, variations_branch, 'MuCorrProvider', source, scale)
                     else:
                         if source == central:
                             branch_name_final = f"""weight_{leg_name}_MuonID_SF_{central}"""
                         else:
                             branch_name_final = branch_name
-                        df = df.Define(branch_name_final, f"static_cast<float>({branch_name}_double)")
+                        df = defineSFVariation(df, branch_name_final, variations_branch, 'MuCorrProvider', source, scale)
                     SF_branches.append(branch_name_final)
         return df,SF_branches
 
@@ -116,6 +125,17 @@ class MuCorrProducer:
         highPtMuSF_branches = []
         sf_sources =  MuCorrProducer.highPtmuReco_SF_sources + MuCorrProducer.highPtmuID_SF_Sources + MuCorrProducer.highPtmuIso_SF_Sources
         sf_scales = [up, down] if return_variations else []
+        need_variations = 'true' if isCentral and return_variations else 'false'
+        sf_sources_cpp = createUncSourceList('HighPtMuCorrProvider', sf_sources)
+        muon_columns = [ 'HttCandidate_legs', 'Muon_pfRelIso04_all', 'Muon_tightId', 'Muon_tkRelIso', 'Muon_highPtId' ]
+        df = defineCandidateLegs(df)
+        for leg_idx, leg_name in enumerate(lepton_legs):
+            if PrecompiledDefines.enabled:
+                functor_class = ROOT.correction.HighPtMuCorrProvider.HighPtMuonLegSFVariationsFunctor[tuple(df.GetColumnType(c) for c in muon_columns[1:])]
+                functor = functor_class(leg_idx, 120., createUncSourceVector('HighPtMuCorrProvider', sf_sources), need_variations == 'true')
+                df = defineColumn(df, f"{leg_name}_HighPt_MuonID_SF_variations", functor, muon_columns)
+                continue
+            df = df.Define(f"{leg_name}_HighPt_MuonID_SF_variations", f'''::correction::HighPtMuCorrProvider::getGlobal().getHighPtMuonLegSFVariations(HttCandidate_legs[{leg_idx}], Muon_pfRelIso04_all, Muon_tightId, Muon_tkRelIso, Muon_highPtId, 120., {sf_sources_cpp}, {need_variations})''')
         for source in sf_sources :
             for scale in [ central ] + sf_scales:
                 if source == central and scale != central: continue
@@ -124,25 +144,15 @@ class MuCorrProducer:
                 syst_name = source_name+scale if source != central else 'Central'
                 for leg_idx, leg_name in enumerate(lepton_legs):
                     branch_name = f"weight_{leg_name}_HighPt_MuonID_SF_{syst_name}"
-                    #print(branch_name)
-                    branch_central = f"""weight_{leg_name}_HighPt_MuonID_SF_{source_name+central}"""
-                    df = df.Define(f"{branch_name}_double",f'''HttCandidate.leg_type[{leg_idx}] == Leg::mu && HttCandidate.leg_p4[{leg_idx}].pt() >= 120 ? ::correction::HighPtMuCorrProvider::getGlobal().getHighPtMuonSF( HttCandidate.leg_p4[{leg_idx}], Muon_pfRelIso04_all.at(HttCandidate.leg_index[{leg_idx}]), Muon_tightId.at(HttCandidate.leg_index[{leg_idx}]), Muon_highPtId.at(HttCandidate.leg_index[{leg_idx}]), Muon_tkRelIso.at(HttCandidate.leg_index[{leg_idx}]),::correction::HighPtMuCorrProvider::UncSource::{source}, ::correction::UncScale::{scale}) : 1.''')
-                    #df.Display({f"""{branch_name}_double"""}).Print()
-                    #if source in MuCorrProducer.muReco_SF_sources:
-                    #    df = df.Define(f"{branch_name}_double",f'''HttCandidate.leg_type[{leg_idx}] == Leg::mu && HttCandidate.leg_p4[{leg_idx}].pt() >= 10 && HttCandidate.leg_p4[{leg_idx}].pt() < 200 ? ::correction::MuCorrProvider::getGlobal().getMuonSF( HttCandidate.leg_p4[{leg_idx}], Muon_pfRelIso04_all.at(HttCandidate.leg_index[{leg_idx}]), Muon_tightId.at(HttCandidate.leg_index[{leg_idx}]),Muon_tkRelIso.at(HttCandidate.leg_index[{leg_idx}]),Muon_highPtId.at(HttCandidate.leg_index[{leg_idx}]),::correction::MuCorrProvider::UncSource::{source}, ::correction::UncScale::{scale}, "{MuCorrProducer.period}") : 1.''')
-                    #else:
-                    #    df = df.Define(f"{branch_name}_double", f'''HttCandidate.leg_type[{leg_idx}] == Leg::mu && HttCandidate.leg_p4[{leg_idx}].pt() >= 15 && HttCandidate.leg_p4[{leg_idx}].pt() < 120 ? ::correction::MuCorrProvider::getGlobal().getMuonSF(HttCandidate.leg_p4[{leg_idx}], Muon_pfRelIso04_all.at(HttCandidate.leg_index[{leg_idx}]), Muon_tightId.at(HttCandidate.leg_index[{leg_idx}]),Muon_tkRelIso.at(HttCandidate.leg_index[{leg_idx}]),Muon_highPtId.at(HttCandidate.leg_index[{leg_idx}]),::correction::MuCorrProvider::UncSource::{source}, ::correction::UncScale::{scale}, "{MuCorrProducer.period}") : 1.''')
-                    #print(f"{branch_name}_double")
-                    #if scale==central:
-                    #    df.Filter(f"{branch_name}_double!=1.").Display({f"{branch_name}_double"}).Print()
+                    variations_branch = f"{leg_name}_HighPt_MuonID_SF_variations"
                     if scale != central:
                         branch_name_final = branch_name + '_rel'
-                        df = df.Define(branch_name_final, f"static_cast<float>({branch_name}_double/{branch_central})")
+                        df = defineSFVariationRelative(df, branch_name_final, variations_branch, 'HighPtMuCorrProvider', source, scale)
                     else:
                         if source == central:
                             branch_name_final = f"""weight_{leg_name}_HighPt_MuonID_SF_{central}"""
                         else:
                             branch_name_final = branch_name
-                        df = df.Define(branch_name_final, f"static_cast<float>({branch_name}_double)")
+                        df = defineSFVariation(df, branch_name_final, variations_branch, 'HighPtMuCorrProvider', source, scale)
                     highPtMuSF_branches.append(branch_name_final)
         return df,highPtMuSF_branches
@@ -1,6 +1,8 @@
 #pragma once
 #include "correction.h"
+#include "cachedCorrection.h"
 #include "corrections.h"
+#include "defines.h"
 
 namespace correction {
 
@@ -19,16 +21,38 @@ public:
         corrections_(CorrectionSet::from_file(fileName)),
         puweight(corrections_->at(jsonName))
     {
+        if(const DenseCorrection* dense = puweight.dense()) {
+            for(UncScale scale : { UncScale::Down, UncScale::Central, UncScale::Up })
+                scale_cells_[getScaleIdx(scale)] = dense->categoryCell(1, getScaleStr(scale));
+        }
     }
 
     float getWeight(UncScale scale, float Pileup_nTrueInt) const
     {
+        if(const DenseCorrection* dense = puweight.dense()) {
+            double weight;
+            const std::array<size_t, 2> cells = { dense->binCell(0, Pileup_nTrueInt), scale_cells_[getScaleIdx(scale)] };
+            if(dense->lookup(cells, weight)) return weight;
+        }
         const std::string& scale_str = getScaleStr(scale);
         return puweight->evaluate({Pileup_nTrueInt, scale_str});
     }
+
+    // Precompiled counterpart of the getWeight column expression.
+    struct WeightFunctor {
+        explicit WeightFunctor(UncScale _scale) : scale(_scale) {}
+        float operator()(float Pileup_nTrueInt) const { return getGlobal().getWeight(scale, Pileup_nTrueInt); }
+
+        UncScale scale;
+    };
+
+private:
+    static size_t getScaleIdx(UncScale scale) { return static_cast<size_t>(static_cast<int>(scale) + 1); }
+
 private:
     std::unique_ptr<CorrectionSet> corrections_;
-    Correction::Ref puweight;
+    CachedCorrection puweight;
+    std::array<size_t, 3> scale_cells_;
 };
 
 } // namespace correction
\ No newline at end of file
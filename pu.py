@@ -22,7 +22,8 @@ class puWeightProducer:
         if not puWeightProducer.initialized:
             headers_dir = os.path.dirname(os.path.abspath(__file__))
             header_path = os.path.join(headers_dir, "pu.h")
-            ROOT.gInterpreter.Declare(f'#include "{header_path}"')
+            declareHeaders(header_path, dependencies=[ common_headers ])
+            registerCorrectionLayouts(jsonFile)
             ROOT.gInterpreter.ProcessLine(f'::correction::puCorrProvider::Initialize("{jsonFile}", "{self.golden_json_dict[period]}")')
             puWeightProducer.initialized = True
 
@@ -34,8 +35,12 @@ class puWeightProducer:
                 if not isCentral and scale!= central: continue
                 syst_name = getSystName(source, scale)
                 weights[syst_name] = []
-                df = df.Define(f'puWeight_{scale}', f'''::correction::puCorrProvider::getGlobal().getWeight(
-                                ::correction::UncScale::{scale}, Pileup_nTrueInt)''')
+                if PrecompiledDefines.enabled:
+                    functor = ROOT.correction.puCorrProvider.WeightFunctor(getattr(ROOT.correction.UncScale, scale))
+                    df = defineColumn(df, f'puWeight_{scale}', functor, [ 'Pileup_nTrueInt' ])
+                else:
+                    df = df.Define(f'puWeight_{scale}', f'''::correction::puCorrProvider::getGlobal().getWeight(
+                                    ::correction::UncScale::{scale}, Pileup_nTrueInt)''')
                 weights[syst_name].append(f'puWeight_{scale}')
         return df,weights
 
@@ -1,7 +1,9 @@
 #pragma once
 
 #include "correction.h"
+#include "cachedCorrection.h"
 #include "corrections.h"
+#include "defines.h"
 
 namespace correction {
 
@@ -32,25 +34,57 @@ public:
     corrections_(CorrectionSet::from_file(fileName)),
     puJetEff_(corrections_->at("PUJetID_eff"))
     {
+        if(const DenseCorrection* dense = puJetEff_.dense()) {
+            for(UncScale scale : { UncScale::Down, UncScale::Central, UncScale::Up })
+                scale_cells_[getScaleIdx(scale)] = dense->categoryCell(2, getScaleStr(scale));
+        }
     }
     RVecF getPUJetID_eff(const RVecF & Jet_pt, const RVecF & Jet_eta, const std::string working_point, UncSource source, UncScale scale) const {
         RVecF weights(Jet_pt.size(), 1.);
         const UncScale PUJetID_scale = sourceApplies(source) ? scale : UncScale::Central;
         const std::string& scale_str = getScaleStr(PUJetID_scale);
+        const DenseCorrection* dense = puJetEff_.dense();
+        const size_t scale_cell = dense ? scale_cells_[getScaleIdx(PUJetID_scale)] : DenseCorrection::NoCell;
+        const size_t wp_cell = dense ? dense->categoryCell(3, working_point) : DenseCorrection::NoCell;
         for(size_t jet_idx = 0 ; jet_idx < Jet_pt.size(); jet_idx++)
         {
             if(Jet_pt[jet_idx] > 20 && Jet_pt[jet_idx] <= 50. && std::abs(Jet_eta[jet_idx]) < 5 ){
+                double weight;
+                if(dense && dense->lookup(std::array<size_t, 4>{ dense->binCell(0, Jet_eta[jet_idx]),
+                                          dense->binCell(1, Jet_pt[jet_idx]), scale_cell, wp_cell }, weight)) {
+                    weights[jet_idx] = static_cast<float>(weight);
+                    continue;
+                }
                 weights[jet_idx] = static_cast<float>(puJetEff_->evaluate({Jet_eta[jet_idx], Jet_pt[jet_idx], scale_str, working_point}));
             }
         }
         return weights;
     }
 
+    // Precompiled counterpart of the getPUJetID_eff column expression.
+    struct PUJetID_effFunctor {
+        PUJetID_effFunctor(const std::string& _working_point, UncSource _source, UncScale _scale) :
+            working_point(_working_point), source(_source), scale(_scale)
+        {
+        }
+
+        RVecF operator()(const RVecF& Jet_pt, const RVecF& Jet_eta) const
+        {
+            return getGlobal().getPUJetID_eff(Jet_pt, Jet_eta, working_point, source, scale);
+        }
+
+        std::string working_point;
+        UncSource source;
+        UncScale scale;
+    };
+
 private:
+    static size_t getScaleIdx(UncScale scale) { return static_cast<size_t>(static_cast<int>(scale) + 1); }
 
 private:
     std::unique_ptr<CorrectionSet> corrections_;
-    Correction::Ref puJetEff_;
+    CachedCorrection puJetEff_;
+    std::array<size_t, 3> scale_cells_;
 
 };
 
@@ -17,7 +17,8 @@ class puJetIDCorrProducer:
         if not puJetIDCorrProducer.initialized:
             headers_dir = os.path.dirname(os.path.abspath(__file__))
             header_path = os.path.join(headers_dir, "puJetID.h")
-            ROOT.gInterpreter.Declare(f'#include "{header_path}"')
+            declareHeaders(header_path, dependencies=[ common_headers ])
+            registerCorrectionLayouts(jsonFile_eff)
             ROOT.gInterpreter.ProcessLine(f'::correction::PUJetIDCorrProvider::Initialize("{jsonFile_eff}")')
             puJetIDCorrProducer.period = period
             puJetIDCorrProducer.initialized = True
@@ -33,6 +34,19 @@ class puJetIDCorrProducer:
                     syst_name = "PUJetID_Central"
                 branch_name_jets = f"weight_Jet_{syst_name}_"
                 branch_central_jets = f"""weight_Jet_PUJetID_Central_"""
+                if PrecompiledDefines.enabled:
+                    functor = ROOT.correction.PUJetIDCorrProvider.PUJetID_effFunctor(puJetIDCorrProducer.puJetID,
+                                getattr(ROOT.correction.PUJetIDCorrProvider.UncSource, source), getattr(ROOT.correction.UncScale, scale))
+                    df = defineColumn(df, branch_name_jets, functor, [ 'Jet_pt', 'Jet_eta' ])
+                    if source != central:
+                        branch_name_jet_rel = f"{branch_name_jets}rel_tmp"
+                        df = defineColumn(df, branch_name_jet_rel, ROOT.correction.RelativeWeightVec(),
+                                          [ branch_name_jets, branch_central_jets ])
+                    else:
+                        branch_name_jet_rel = f"{branch_central_jets}tmp"
+                        df = defineColumn(df, branch_name_jet_rel, ROOT.correction.Identity['ROOT::VecOps::RVec<float>'](), [ branch_central_jets ])
+                    puJetID_SF_branches.append(branch_name_jet_rel)
+                    continue
                 df = df.Define(f"{branch_name_jets}", f"""::correction::PUJetIDCorrProvider::getGlobal().getPUJetID_eff(
                                         Jet_pt, Jet_eta, "{puJetIDCorrProducer.puJetID}",
                                         ::correction::PUJetIDCorrProvider::UncSource::{source}, ::correction::UncScale::{scale});""")
@@ -0,0 +1,134 @@
+#pragma once
+
+#include <cerrno>
+#include <cstdint>
+#include <cstdio>
+#include <cstring>
+#include <memory>
+#include <string>
+#include <vector>
+
+#include <fcntl.h>
+#include <sys/file.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+namespace correction {
+
+// Exclusive lock on path + ".lock", held until the object is destroyed. The constructor blocks while another
+// process holds the lock. flock locks are released by the kernel when the holder exits, so a process that
+// crashes while holding the lock does not block the others.
+class FileLock {
+public:
+    explicit FileLock(const std::string& path) :
+        fd_(::open((path + ".lock").c_str(), O_CREAT | O_RDWR | O_CLOEXEC, 0644))
+    {
+        if(fd_ < 0) return;
+        int status;
+        while((status = flock(fd_, LOCK_EX)) != 0 && errno == EINTR) {}
+        if(status != 0) {
+            ::close(fd_);
+            fd_ = -1;
+        }
+    }
+
+    ~FileLock()
+    {
+        if(fd_ >= 0) ::close(fd_);
+    }
+
+    FileLock(const FileLock&) = delete;
+    FileLock& operator=(const FileLock&) = delete;
+
+    bool locked() const { return fd_ >= 0; }
+
+private:
+    int fd_;
+};
+
+// Read-only memory mapping of a table of doubles stored in a file, e.g. under /dev/shm, so that
+// all processes running on the same node share a single copy of the table.
+// The file starts with a header that holds the number of values and a tag that identifies the content.
+class SharedTable {
+public:
+    // Returns nullptr if the file does not exist or does not match the expected size and tag.
+    static std::shared_ptr<const SharedTable> open(const std::string& path, uint64_t n_values, uint64_t tag)
+    {
+        const int fd = ::open(path.c_str(), O_RDONLY);
+        if(fd < 0) return nullptr;
+        struct stat st;
+        const size_t size = sizeof(Header) + n_values * sizeof(double);
+        if(fstat(fd, &st) != 0 || static_cast<size_t>(st.st_size) != size) {
+            ::close(fd);
+            return nullptr;
+        }
+        void* addr = mmap(nullptr, size, PROT_READ, MAP_SHARED, fd, 0);
+        ::close(fd);
+        if(addr == MAP_FAILED) return nullptr;
+        std::shared_ptr<SharedTable> table(new SharedTable(addr, size));
+        const Header* header = static_cast<const Header*>(addr);
+        if(std::memcmp(header->magic, Magic, sizeof(header->magic)) != 0 || header->n_values != n_values
+                || header->tag != tag)
+            return nullptr;
+        return table;
+    }
+
+    // Writes the table to a temporary file that is then renamed to path, so that readers never see a partial file.
+    // The caller holds the FileLock of path. Returns false if the file cannot be written.
+    static bool write(const std::string& path, const std::vector<double>& values, uint64_t tag)
+    {
+        const std::string tmp_path = path + ".tmp." + std::to_string(getpid());
+        bool ok = false;
+        const int fd = ::open(tmp_path.c_str(), O_CREAT | O_TRUNC | O_WRONLY, 0644);
+        if(fd >= 0) {
+            Header header;
+            std::memcpy(header.magic, Magic, sizeof(header.magic));
+            header.n_values = values.size();
+            header.tag = tag;
+            ok = writeAll(fd, &header, sizeof(header)) && writeAll(fd, values.data(), values.size() * sizeof(double));
+            ::close(fd);
+            ok = ok && std::rename(tmp_path.c_str(), path.c_str()) == 0;
+            if(!ok) std::remove(tmp_path.c_str());
+        }
+        return ok;
+    }
+
+    ~SharedTable() { munmap(addr_, size_); }
+    SharedTable(const SharedTable&) = delete;
+    SharedTable& operator=(const SharedTable&) = delete;
+
+    const double* data() const
+    {
+        return reinterpret_cast<const double*>(static_cast<const char*>(addr_) + sizeof(Header));
+    }
+
+private:
+    static constexpr char Magic[8] = { 'C', 'O', 'R', 'R', 'T', 'B', 'L', '1' };
+
+    struct Header {
+        char magic[8];
+        uint64_t n_values;
+        uint64_t tag;
+    };
+
+    SharedTable(void* addr, size_t size) : addr_(addr), size_(size) {}
+
+    static bool writeAll(int fd, const void* data, size_t size)
+    {
+        const char* ptr = static_cast<const char*>(data);
+        while(size > 0) {
+            const ssize_t n = ::write(fd, ptr, size);
+            if(n <= 0) return false;
+            ptr += n;
+            size -= static_cast<size_t>(n);
+        }
+        return true;
+    }
+
+private:
+    void* addr_;
+    size_t size_;
+};
+
+} // namespace correction
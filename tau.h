@@ -1,7 +1,9 @@
 #pragma once
 
 #include "correction.h"
+#include "cachedCorrection.h"
 #include "corrections.h"
+#include "defines.h"
 
 namespace correction {
 
@@ -56,6 +58,7 @@ public:
     };
 
     using wpsMapType = std::map<Channel, std::vector<std::pair<std::string, int> > >;
+    using SFVariations = ::correction::SFVariations<UncSource, 34>;
 
     static bool isTwoProngDM(int dm)
     {
@@ -152,6 +155,29 @@ public:
         return names.at(std::make_pair(source,scale));
     }
 
+    // Energy scale sources, evaluated together by getESVariations.
+    static const std::vector<UncSource>& getESSources()
+    {
+        static const std::vector<UncSource> sources = {
+            UncSource::TauES_DM0, UncSource::TauES_DM1, UncSource::TauES_3prong,
+            UncSource::EleFakingTauES_DM0, UncSource::EleFakingTauES_DM1, UncSource::MuFakingTauES,
+        };
+        return sources;
+    }
+    static constexpr size_t nESVariations = 13;
+    // Row of a variation in the collection returned by getESVariations:
+    // 0 for central, then up and down for each energy scale source in the enum order.
+    static size_t GetESVariationIdx(UncSource source, UncScale scale)
+    {
+        if((source == UncSource::Central) != (scale == UncScale::Central))
+            throw std::runtime_error("TauCorrProvider: invalid combination of uncertainty source and scale.");
+        if(source == UncSource::Central)
+            return 0;
+        if(static_cast<int>(source) > static_cast<int>(UncSource::MuFakingTauES))
+            throw std::runtime_error("TauCorrProvider: not an energy scale uncertainty source.");
+        return 1 + static_cast<size_t>(source) * 2 + (scale == UncScale::Up ? 0 : 1);
+    }
+
     static bool sourceApplies(UncSource source, const LorentzVectorM& p4, int decayMode, GenLeptonMatch genMatch)
     {
         if(genMatch == GenLeptonMatch::Tau) {
@@ -210,20 +236,19 @@ public:
         tau_vs_mu_(corrections_->at(deepTauVersion + "VSmu")),
         tau_vs_jet_(corrections_->at(deepTauVersion + "VSjet")),
         deepTauVersion_(deepTauVersion),
+        es_inputs_(getESInputs(deepTauVersion)),
         wps_map_(wps_map),
         tauType_map_(tauType_map),
         year_(year)
     {
     }
 
-    RVecLV getES(const RVecLV& Tau_p4, const RVecI& Tau_decayMode, const RVecI& Tau_genMatch,
+    template <typename DecayModeVec, typename GenMatchVec>
+    RVecLV getES(const RVecLV& Tau_p4, const DecayModeVec& Tau_decayMode, const GenMatchVec& Tau_genMatch,
                  UncSource source, UncScale scale) const
     {
         RVecLV final_p4 = Tau_p4;
 
-        const auto wpVSe = "VVLoose";
-        const auto wpVSmu = "Tight";
-        const auto wpVSjet = "Medium";
         for(size_t n = 0; n < Tau_p4.size(); ++n) {
             if(!isTwoProngDM(Tau_decayMode.at(n))) {
                 const GenLeptonMatch genMatch = static_cast<GenLeptonMatch>(Tau_genMatch.at(n));
@@ -231,22 +256,56 @@ public:
                                            ? scale : UncScale::Central;
                 const UncSource tau_source = tau_scale == UncScale::Central ? UncSource::Central : source ;
                 const std::string& scale_str =  getScaleStr(tau_source, tau_scale, year_);
-                double sf = 1;
-                if (deepTauVersion_ == "DeepTau2017v2p1"){
-                    sf = tau_es_->evaluate({Tau_p4[n].pt(), Tau_p4[n].eta(), Tau_decayMode.at(n),
-                    static_cast<int>(genMatch), deepTauVersion_, scale_str});
-                    }
-                else if (deepTauVersion_ == "DeepTau2018v2p5"){
-                    sf = tau_es_->evaluate({Tau_p4[n].pt(), Tau_p4[n].eta(), Tau_decayMode.at(n),
-                    static_cast<int>(genMatch), deepTauVersion_, wpVSjet, wpVSe,scale_str});
-                    }
-
-                final_p4[n] *= sf;
+                final_p4[n] *= getESValue(Tau_p4[n], Tau_decayMode.at(n), genMatch, scale_str);
             }
         }
         return final_p4;
     }
 
+    // Same as getES for the central value and all energy scale variations: the nominal, up and down energy scales
+    // of each tau are evaluated once, and the variations of the sources that do not apply use the nominal one.
+    template <typename DecayModeVec, typename GenMatchVec>
+    ShiftedP4WithDelta getESVariations(const RVecLV& Tau_p4, const DecayModeVec& Tau_decayMode,
+                                       const GenMatchVec& Tau_genMatch) const
+    {
+        // all energy scale sources share the same up and down scale strings
+        const std::string& scale_nom = getScaleStr(UncSource::Central, UncScale::Central, year_);
+        const std::string& scale_up = getScaleStr(UncSource::TauES_DM0, UncScale::Up, year_);
+        const std::string& scale_down = getScaleStr(UncSource::TauES_DM0, UncScale::Down, year_);
+        const auto& sources = getESSources();
+        ShiftedP4WithDelta shifted(nESVariations, Tau_p4.size());
+        for(size_t n = 0; n < Tau_p4.size(); ++n) {
+            const int decayMode = Tau_decayMode.at(n);
+            if(isTwoProngDM(decayMode)) {
+                for(size_t var_idx = 0; var_idx < nESVariations; ++var_idx)
+                    shifted.set(var_idx, n, Tau_p4[n], Tau_p4[n]);
+                continue;
+            }
+            const GenLeptonMatch genMatch = static_cast<GenLeptonMatch>(Tau_genMatch.at(n));
+            LorentzVectorM p4_nom = Tau_p4[n];
+            p4_nom *= getESValue(Tau_p4[n], decayMode, genMatch, scale_nom);
+            shifted.set(0, n, p4_nom, Tau_p4[n]);
+            bool any_applies = false;
+            std::array<bool, nESVariations / 2> applies;
+            for(size_t source_idx = 0; source_idx < sources.size(); ++source_idx) {
+                applies[source_idx] = sourceApplies(sources[source_idx], Tau_p4[n], decayMode, genMatch);
+                any_applies = any_applies || applies[source_idx];
+            }
+            LorentzVectorM p4_up = p4_nom, p4_down = p4_nom;
+            if(any_applies) {
+                p4_up = Tau_p4[n];
+                p4_up *= getESValue(Tau_p4[n], decayMode, genMatch, scale_up);
+                p4_down = Tau_p4[n];
+                p4_down *= getESValue(Tau_p4[n], decayMode, genMatch, scale_down);
+            }
+            for(size_t source_idx = 0; source_idx < sources.size(); ++source_idx) {
+                const size_t var_idx = GetESVariationIdx(sources[source_idx], UncScale::Up);
+                shifted.set(var_idx, n, applies[source_idx] ? p4_up : p4_nom, Tau_p4[n]);
+                shifted.set(var_idx + 1, n, applies[source_idx] ? p4_down : p4_nom, Tau_p4[n]);
+            }
+        }
+        return shifted;
+    }
 
     float getSF(const LorentzVectorM& Tau_p4, int Tau_decayMode, int Tau_genMatch,const std::string& wpVSjet, Channel ch, UncSource source, UncScale scale) const
     {
@@ -287,6 +346,76 @@ public:
         return 1.;
     }
 
+    // Same as getSF, but evaluates the central value and the up/down variations of the given sources in one call.
+    SFVariations getSFVariations(const LorentzVectorM& Tau_p4, int Tau_decayMode, int Tau_genMatch, const std::string& wpVSjet,
+                                 Channel ch, const std::vector<UncSource>& sources, bool need_variations) const
+    {
+        SFVariations sf(getSF(Tau_p4, Tau_decayMode, Tau_genMatch, wpVSjet, ch, UncSource::Central, UncScale::Central));
+        if(!need_variations) return sf;
+        // for genuine taus, variations of sources that do not apply are evaluated with "nom" instead of "default"
+        const float sf_not_applied = getSF(Tau_p4, Tau_decayMode, Tau_genMatch, wpVSjet, ch, UncSource::Central, UncScale::Up);
+        const GenLeptonMatch genMatch = static_cast<GenLeptonMatch>(Tau_genMatch);
+        for(UncSource source : sources) {
+            const bool applies = sourceApplies(source, Tau_p4, Tau_decayMode, genMatch);
+            for(UncScale scale : { UncScale::Up, UncScale::Down }) {
+                const float value = applies ? getSF(Tau_p4, Tau_decayMode, Tau_genMatch, wpVSjet, ch, source, scale)
+                                            : sf_not_applied;
+                sf.set(source, scale, value);
+            }
+        }
+        return sf;
+    }
+
+    SFVariations getSFVariations(const LegFeatures& leg, const std::string& wpVSjet, Channel ch,
+                                 const std::vector<UncSource>& sources, bool need_variations) const
+    {
+        if(!leg.has_genMatch)
+            throw std::runtime_error("TauCorrProvider: the tau ID SFs need Tau_genMatch.");
+        return getSFVariations(leg.p4, leg.decayMode, leg.genMatch, wpVSjet, ch, sources, need_variations);
+    }
+
+    // Precompiled counterparts of the getES, getESVariations and getSFVariations column expressions.
+    // The ES functors are instantiated with the types of the Tau_decayMode and Tau_genMatch columns.
+    template <typename DecayModeVec, typename GenMatchVec>
+    struct ESVariationsFunctor {
+        ShiftedP4WithDelta operator()(const RVecLV& Tau_p4, const DecayModeVec& Tau_decayMode,
+                                      const GenMatchVec& Tau_genMatch) const
+        {
+            return getGlobal().getESVariations(Tau_p4, Tau_decayMode, Tau_genMatch);
+        }
+    };
+
+    template <typename DecayModeVec, typename GenMatchVec>
+    struct ESFunctor {
+        ESFunctor(UncSource _source, UncScale _scale) : source(_source), scale(_scale) {}
+        RVecLV operator()(const RVecLV& Tau_p4, const DecayModeVec& Tau_decayMode, const GenMatchVec& Tau_genMatch) const
+        {
+            return getGlobal().getES(Tau_p4, Tau_decayMode, Tau_genMatch, source, scale);
+        }
+
+        UncSource source;
+        UncScale scale;
+    };
+
+    struct SFVariationsFunctor {
+        SFVariationsFunctor(const LegSelection& _leg, const std::string& _wpVSjet, const std::vector<UncSource>& _sources,
+                            bool _need_variations) :
+            leg(_leg), wpVSjet(_wpVSjet), sources(_sources), need_variations(_need_variations)
+        {
+        }
+
+        SFVariations operator()(const CandidateLegs& legs) const
+        {
+            if(!leg.pass(legs)) return SFVariations();
+            return getGlobal().getSFVariations(leg.get(legs), wpVSjet, legs.channel, sources, need_variations);
+        }
+
+        LegSelection leg;
+        std::string wpVSjet;
+        std::vector<UncSource> sources;
+        bool need_variations;
+    };
+
     float getSF_WPStrings(const float tau_pt, const float tau_eta, int Tau_decayMode, int Tau_genMatch,std::string wpVSjet_string) const
     {
         const auto wpVSe = "VVLoose";
@@ -320,9 +449,35 @@ public:
 
 
 private:
+    // Inputs of the energy scale correction, which depend on the deepTau version.
+    enum class ESInputs { Unknown, DeepTau2017v2p1, DeepTau2018v2p5 };
+
+    static ESInputs getESInputs(const std::string& deepTauVersion)
+    {
+        if(deepTauVersion == "DeepTau2017v2p1") return ESInputs::DeepTau2017v2p1;
+        if(deepTauVersion == "DeepTau2018v2p5") return ESInputs::DeepTau2018v2p5;
+        return ESInputs::Unknown;
+    }
+
+    double getESValue(const LorentzVectorM& p4, int decayMode, GenLeptonMatch genMatch, const std::string& scale_str) const
+    {
+        const auto wpVSe = "VVLoose";
+        const auto wpVSjet = "Medium";
+        switch(es_inputs_) {
+            case ESInputs::DeepTau2017v2p1:
+                return tau_es_->evaluate({p4.pt(), p4.eta(), decayMode, static_cast<int>(genMatch), deepTauVersion_, scale_str});
+            case ESInputs::DeepTau2018v2p5:
+                return tau_es_->evaluate({p4.pt(), p4.eta(), decayMode, static_cast<int>(genMatch), deepTauVersion_, wpVSjet,
+                                          wpVSe, scale_str});
+            default:
+                return 1;
+        }
+    }
+
     std::unique_ptr<CorrectionSet> corrections_;
-    Correction::Ref tau_es_, tau_vs_e_, tau_vs_mu_, tau_vs_jet_;
+    CachedCorrection tau_es_, tau_vs_e_, tau_vs_mu_, tau_vs_jet_;
     std::string deepTauVersion_;
+    ESInputs es_inputs_;
     const wpsMapType wps_map_;
     const std::map<Channel, std::string> tauType_map_;
     const std::string year_;
@@ -30,29 +30,58 @@ class TauCorrProducer:
         if not TauCorrProducer.initialized:
             headers_dir = os.path.dirname(os.path.abspath(__file__))
             header_path = os.path.join(headers_dir, "tau.h")
-            ROOT.gInterpreter.Declare(f'#include "{header_path}"')
+            declareHeaders(header_path, dependencies=[ common_headers ])
             wp_map_cpp = createWPChannelMap(config["deepTauWPs"])
             tauType_map = createTauSFTypeMap(config["genuineTau_SFtype"])
+            registerCorrectionLayouts(jsonFile)
             ROOT.gInterpreter.ProcessLine(f'::correction::TauCorrProvider::Initialize("{jsonFile}", "{self.deepTauVersion}", {wp_map_cpp}, {tauType_map} , "{period.split("_")[0]}")')
             TauCorrProducer.initialized = True
             #deepTauVersion = f"""DeepTau{deepTauVersions[config["deepTauVersion"]]}{config["deepTauVersion"]}"""
 
     def getES(self, df, source_dict):
+        # the central value and all variations are evaluated together, the shifted p4 and their deltas are views
+        es_columns = [ f'Tau_p4_{nano}', 'Tau_decayMode', 'Tau_genMatch' ]
+        if PrecompiledDefines.enabled:
+            functor_class = ROOT.correction.TauCorrProvider.ESVariationsFunctor[tuple(df.GetColumnType(c) for c in es_columns[1:])]
+            df = defineColumn(df, 'Tau_p4_shifted', functor_class(), es_columns)
+        else:
+            df = df.Define('Tau_p4_shifted', f'::correction::TauCorrProvider::getGlobal().getESVariations({", ".join(es_columns)})')
         for source in [ central ] + TauCorrProducer.energyScaleSources_tau + TauCorrProducer.energyScaleSources_lep:
             updateSourceDict(source_dict, source, 'Tau')
             for scale in getScales(source):
                 syst_name = getSystName(source, scale)
-                df = df.Define(f'Tau_p4_{syst_name}', f'''::correction::TauCorrProvider::getGlobal().getES(
-                               Tau_p4_{nano}, Tau_decayMode, Tau_genMatch,
-                               ::correction::TauCorrProvider::UncSource::{source}, ::correction::UncScale::{scale})''')
-                df = df.Define(f'Tau_p4_{syst_name}_delta', f'Tau_p4_{syst_name} - Tau_p4_{nano}')
+                if PrecompiledDefines.enabled:
+                    var_idx = ROOT.correction.TauCorrProvider.GetESVariationIdx(getattr(ROOT.correction.TauCorrProvider.UncSource, source),
+                                                                                getattr(ROOT.correction.UncScale, scale))
+                    df = defineColumn(df, f'Tau_p4_{syst_name}', ROOT.correction.ShiftedP4View(var_idx), [ 'Tau_p4_shifted' ])
+                    df = defineColumn(df, f'Tau_p4_{syst_name}_delta', ROOT.correction.ShiftedP4DeltaView(var_idx),
+                                      [ 'Tau_p4_shifted' ])
+                    continue
+                var_idx = f'''::correction::TauCorrProvider::GetESVariationIdx(
+                               ::correction::TauCorrProvider::UncSource::{source}, ::correction::UncScale::{scale})'''
+                df = df.Define(f'Tau_p4_{syst_name}', f'Tau_p4_shifted.p4({var_idx})')
+                df = df.Define(f'Tau_p4_{syst_name}_delta', f'Tau_p4_shifted.delta({var_idx})')
 
         return df, source_dict
 
     def getSF(self, df, lepton_legs, isCentral, return_variations):
         sf_sources =TauCorrProducer.SFSources_tau+TauCorrProducer.SFSources_genuineLep
         sf_scales = [up, down] if return_variations else []
+        sf_sources_cpp = createUncSourceList('TauCorrProvider', sf_sources)
+        need_variations = 'true' if isCentral and return_variations else 'false'
         SF_branches = []
+        df = defineCandidateLegs(df)
+        for leg_idx, leg_name in enumerate(lepton_legs):
+            for wp in [ 'Loose', 'Medium' ]:
+                if PrecompiledDefines.enabled:
+                    functor = ROOT.correction.TauCorrProvider.SFVariationsFunctor(getLegSelection(leg_idx, 'tau'), wp,
+                                            createUncSourceVector('TauCorrProvider', sf_sources), need_variations == 'true')
+                    df = defineColumn(df, f"{leg_name}_TauID_SF_{wp}_variations", functor, [ 'HttCandidate_legs' ])
+                    continue
+                df = df.Define(f"{leg_name}_TauID_SF_{wp}_variations",
+                            f'''HttCandidate_legs[{leg_idx}].leg_type == Leg::tau ? ::correction::TauCorrProvider::getGlobal().getSFVariations(
+                            HttCandidate_legs[{leg_idx}], "{wp}", HttCandidate_legs.channel,
+                            {sf_sources_cpp}, {need_variations}) : ::correction::TauCorrProvider::SFVariations()''')
         for source in [ central ] + sf_sources:
             for scale in [ central ] + sf_scales:
                 if source == central and scale != central: continue
@@ -63,21 +92,15 @@ class TauCorrProducer:
                     branch_Medium_name = f"weight_{leg_name}_TauID_SF_Medium_{syst_name}"
                     branch_Loose_central = f"""weight_{leg_name}_TauID_SF_Loose_{source+central}"""
                     branch_Medium_central = f"""weight_{leg_name}_TauID_SF_Medium_{source+central}"""
-                    df = df.Define(f"{branch_Medium_name}_double",
-                                f'''HttCandidate.leg_type[{leg_idx}] == Leg::tau ? ::correction::TauCorrProvider::getGlobal().getSF(
-                               HttCandidate.leg_p4[{leg_idx}], Tau_decayMode.at(HttCandidate.leg_index[{leg_idx}]),
-                               Tau_genMatch.at(HttCandidate.leg_index[{leg_idx}]),"Medium", HttCandidate.channel(),
-                               ::correction::TauCorrProvider::UncSource::{source}, ::correction::UncScale::{scale}) : 1.;''')
-                    df = df.Define(f"{branch_Loose_name}_double",
-                                f'''HttCandidate.leg_type[{leg_idx}] == Leg::tau ? ::correction::TauCorrProvider::getGlobal().getSF(
-                               HttCandidate.leg_p4[{leg_idx}], Tau_decayMode.at(HttCandidate.leg_index[{leg_idx}]),
-                               Tau_genMatch.at(HttCandidate.leg_index[{leg_idx}]), "Loose", HttCandidate.channel(),
-                               ::correction::TauCorrProvider::UncSource::{source}, ::correction::UncScale::{scale}) : 1.;''')
+                    df = defineSFVariation(df, f"{branch_Medium_name}_double", f"{leg_name}_TauID_SF_Medium_variations",
+                                           'TauCorrProvider', source, scale)
+                    df = defineSFVariation(df, f"{branch_Loose_name}_double", f"{leg_name}_TauID_SF_Loose_variations",
+                                           'TauCorrProvider', source, scale)
                     if scale != central:
                         branch_name_Loose_final = branch_Loose_name + '_rel'
                         branch_name_Medium_final = branch_Medium_name + '_rel'
-                        df = df.Define(branch_name_Loose_final, f"static_cast<float>({branch_Loose_name}_double/{branch_Loose_central})")
-                        df = df.Define(branch_name_Medium_final, f"static_cast<float>({branch_Medium_name}_double/{branch_Medium_central})")
+                        df = defineRelative(df, branch_name_Loose_final, f"{branch_Loose_name}_double", branch_Loose_central)
+                        df = defineRelative(df, branch_name_Medium_final, f"{branch_Medium_name}_double", branch_Medium_central)
                     else:
                         if source == central:
                             branch_name_Loose_final = f"""weight_{leg_name}_TauID_SF_Loose_{central}"""
@@ -86,8 +109,8 @@ class TauCorrProducer:
                             branch_name_Loose_final = branch_Loose_name
                             branch_name_Medium_final = branch_Medium_name
 
-                        df = df.Define(branch_name_Loose_final, f"static_cast<float>({branch_Loose_name}_double)")
-                        df = df.Define(branch_name_Medium_final, f"static_cast<float>({branch_Medium_name}_double)")
+                        df = defineFloat(df, branch_name_Loose_final, f"{branch_Loose_name}_double")
+                        df = defineFloat(df, branch_name_Medium_final, f"{branch_Medium_name}_double")
                     SF_branches.append(branch_name_Loose_final)
                     SF_branches.append(branch_name_Medium_final)
 
@@ -1,7 +1,9 @@
 #pragma once
 
 #include "correction.h"
+#include "cachedCorrection.h"
 #include "corrections.h"
+#include "defines.h"
 
 namespace correction {
 
@@ -26,6 +28,7 @@ public:
         mutau_3Prong = 14,
     };
     using wpsMapType = std::map<Channel, std::vector<std::pair<std::string, int> > >;
+    using SFVariations = ::correction::SFVariations<UncSource, 16>;
     static bool isTwoProngDM(int dm)
     {
         static const std::set<int> twoProngDMs = { 5, 6 };
@@ -81,18 +84,18 @@ public:
     {
 
         auto eTauFile = root_ext::OpenRootFile(eTauFileName);
-        histo_eTau_ele_SF.reset(root_ext::ReadCloneObject<TH2>(*eTauFile, "SF2D", "SF2D", true));
+        histo_eTau_ele_SF = readGrid(*eTauFile, "SF2D");
 
         auto muTauFile = root_ext::OpenRootFile(muTauFileName);
-        histo_muTau_mu_SF.reset(root_ext::ReadCloneObject<TH2>(*muTauFile, "SF2D", "SF2D", true));
+        histo_muTau_mu_SF = readGrid(*muTauFile, "SF2D");
 
         auto eleFile = root_ext::OpenRootFile(eleFileName);
-        histo_ele_SF.reset(root_ext::ReadCloneObject<TH2>(*eleFile, "SF2D", "SF2D", true));
+        histo_ele_SF = readGrid(*eleFile, "SF2D");
 
         auto muFile = root_ext::OpenRootFile(muFileName);
-        histo_mu_SF_24.reset(root_ext::ReadCloneObject<TH2>(*muFile, hist_mu_name[0].c_str(), hist_mu_name[0].c_str(), true));
-        histo_mu_SF_50or24.reset(root_ext::ReadCloneObject<TH2>(*muFile, hist_mu_name[1].c_str(), hist_mu_name[1].c_str(), true));
-        histo_mu_SF_50.reset(root_ext::ReadCloneObject<TH2>(*muFile, hist_mu_name[2].c_str(), hist_mu_name[2].c_str(), true));
+        histo_mu_SF_24 = readGrid(*muFile, hist_mu_name[0]);
+        histo_mu_SF_50or24 = readGrid(*muFile, hist_mu_name[1]);
+        histo_mu_SF_50 = readGrid(*muFile, hist_mu_name[2]);
 
     }
 
@@ -105,6 +108,19 @@ public:
         const std::string& scale_str = getTauScaleStr(tau_scale);
         return tau_trg_->evaluate({Tau_p4.pt(), Tau_decayMode, trg_type, wpVSjet,"sf", scale_str});
     }
+    // Same as getTauSF_fromCorrLib, but evaluates the central value and the up/down variations of the given sources in one call.
+    SFVariations getTauSFVariations_fromCorrLib(const LorentzVectorM& Tau_p4, int Tau_decayMode, const std::string& trg_type, Channel ch,
+                                                const std::vector<UncSource>& sources, bool need_variations) const
+    {
+        SFVariations sf(getTauSF_fromCorrLib(Tau_p4, Tau_decayMode, trg_type, ch, UncSource::Central, UncScale::Central));
+        if(!need_variations) return sf;
+        for(UncSource source : sources) {
+            if(!sourceApplies_tau_fromCorrLib(source, Tau_decayMode, trg_type)) continue;
+            for(UncScale scale : { UncScale::Up, UncScale::Down })
+                sf.set(source, scale, getTauSF_fromCorrLib(Tau_p4, Tau_decayMode, trg_type, ch, source, scale));
+        }
+        return sf;
+    }
     /*
     float getMuSF_fromCorrLib(const LorentzVectorM& Mu_p4, UncSource source, UncScale scale) const
     {
@@ -116,24 +132,10 @@ public:
     //float getEfficiencyFrom2DHist(std::unique_ptr<TH2> hist2d, float bin1center, float bin2center, UncScale scale ){
     //}
 
-    float getSFsFromHisto(const std::unique_ptr<TH2>& histo, const LorentzVectorM& part_p4, UncScale scale, bool wantAbsEta) const
+    float getSFsFromHisto(const Grid2D& histo, const LorentzVectorM& part_p4, UncScale scale, bool wantAbsEta) const
     {
-        const auto x_axis = histo->GetXaxis();
         const auto eta = wantAbsEta ? std::abs(part_p4.Eta()) : part_p4.Eta();
-        int x_bin = x_axis->FindFixBin(eta);
-        if(x_bin < 1)
-            x_bin =1;
-        if( x_bin > x_axis->GetNbins() )
-            x_bin = x_axis->GetNbins();
-        const auto y_axis = histo->GetYaxis();
-
-        int y_bin = y_axis->FindFixBin(part_p4.Pt());
-        if(y_bin < 1)
-            y_bin =1;
-        if( y_bin > y_axis->GetNbins() )
-            y_bin = y_axis->GetNbins();
-
-        return histo->GetBinContent(x_bin,y_bin) + static_cast<int>(scale) * histo->GetBinError(x_bin,y_bin);
+        return histo.getValue(eta, part_p4.Pt(), scale);
     }
 
     float getSF_fromRootFile(const LorentzVectorM& part_p4, UncSource source, UncScale scale, bool isMuTau=false) const {
@@ -170,24 +172,96 @@ public:
         return sf;
     }
 
+    // Same as getSF_fromRootFile, but evaluates the central value and the up/down variations of the given sources in one call.
+    SFVariations getSFVariations_fromRootFile(const LorentzVectorM& part_p4, const std::vector<UncSource>& sources,
+                                              bool need_variations, bool isMuTau=false) const
+    {
+        SFVariations sf(getSF_fromRootFile(part_p4, UncSource::Central, UncScale::Central, isMuTau));
+        if(!need_variations) return sf;
+        for(UncSource source : sources) {
+            for(UncScale scale : { UncScale::Up, UncScale::Down })
+                sf.set(source, scale, getSF_fromRootFile(part_p4, source, scale, isMuTau));
+        }
+        return sf;
+    }
+
+    // Precompiled counterparts of the trigger SF column expressions.
+    template <typename HLTType, typename MatchingType>
+    struct ApplyTrgSFFunctor {
+        explicit ApplyTrgSFFunctor(const LegSelection& _leg) : leg(_leg) {}
+
+        bool operator()(const CandidateLegs& legs, HLTType hlt_fired, MatchingType has_matching) const
+        {
+            return leg.pass(legs) && hlt_fired && has_matching;
+        }
+
+        LegSelection leg;
+    };
+
+    // Trigger SF table: one entry for each leg of each trigger, with the backend used to look up its SF.
+    enum class TrgSFBackend : int { Tau = 0, RootFile = 1 };
+
+    struct TrgSFLeg {
+        TrgSFLeg(TrgSFBackend _backend, const std::string& _trg_type, const LegSelection& _leg,
+                 const std::vector<UncSource>& _sources, bool _isMuTau) :
+            backend(_backend), trg_type(_trg_type), leg(_leg), sources(_sources), isMuTau(_isMuTau)
+        {
+        }
+
+        TrgSFBackend backend;
+        std::string trg_type;
+        LegSelection leg;
+        std::vector<UncSource> sources;
+        bool isMuTau;
+    };
+
+    using TrgSFTableVariations = std::vector<SFVariations>;
+
+    // SFs with the central value and the up/down variations of all entries of the trigger SF table in one call.
+    // apply[i] tells whether the trigger of the i-th entry is fired and matched to its leg.
+    TrgSFTableVariations getTrgSFTableVariations(const CandidateLegs& legs, const RVecB& apply,
+                                                 const std::vector<TrgSFLeg>& table, bool need_variations) const
+    {
+        TrgSFTableVariations sf(table.size());
+        for(size_t n = 0; n < table.size(); ++n) {
+            const TrgSFLeg& entry = table[n];
+            if(!(apply[n] && entry.leg.pass(legs))) continue;
+            const LegFeatures& leg = entry.leg.get(legs);
+            if(entry.backend == TrgSFBackend::Tau)
+                sf[n] = getTauSFVariations_fromCorrLib(leg.p4, leg.decayMode, entry.trg_type, legs.channel, entry.sources,
+                                                       need_variations);
+            else
+                sf[n] = getSFVariations_fromRootFile(leg.p4, entry.sources, need_variations, entry.isMuTau);
+        }
+        return sf;
+    }
+
+    struct TrgSFTableFunctor {
+        TrgSFTableFunctor(const std::vector<TrgSFLeg>& _table, bool _need_variations) :
+            table(_table), need_variations(_need_variations)
+        {
+        }
+
+        TrgSFTableVariations operator()(const CandidateLegs& legs, const RVecB& apply) const
+        {
+            return getGlobal().getTrgSFTableVariations(legs, apply, table, need_variations);
+        }
+
+        std::vector<TrgSFLeg> table;
+        bool need_variations;
+    };
+
+    struct TrgSFTableElement {
+        explicit TrgSFTableElement(size_t _idx) : idx(_idx) {}
+        SFVariations operator()(const TrgSFTableVariations& sf) const { return sf[idx]; }
+
+        size_t idx;
+    };
+
     float getEleSF_fromRootFile(const LorentzVectorM& Ele_p4, UncSource source, UncScale scale) const
     {
         const UncScale ele_scale = source== UncSource::singleEle ? scale : UncScale::Central;
-        const auto x_axis = histo_ele_SF->GetXaxis();
-        int x_bin = x_axis->FindFixBin(Ele_p4.Eta());
-        if(x_bin < 1)
-            x_bin =1;
-        if( x_bin > x_axis->GetNbins() )
-            x_bin = x_axis->GetNbins();
-        const auto y_axis = histo_ele_SF->GetYaxis();
-
-        int y_bin = y_axis->FindFixBin(Ele_p4.Pt());
-        if(y_bin < 1)
-            y_bin =1;
-        if( y_bin > y_axis->GetNbins() )
-            y_bin = y_axis->GetNbins();
-
-        return histo_ele_SF->GetBinContent(x_bin,y_bin) + static_cast<int>(ele_scale) * histo_ele_SF->GetBinError(x_bin,y_bin);
+        return histo_ele_SF.getValue(Ele_p4.Eta(), Ele_p4.Pt(), ele_scale);
     }
 
     float getXTrgSF_fromRootFile(const LorentzVectorM& leg_p4, UncSource source, UncScale scale, bool isMuTau) const
@@ -195,52 +269,35 @@ public:
         UncScale xTrg_scale = UncScale::Central;
         if(source == UncSource::mutau_mu && isMuTau) {xTrg_scale = scale;}
         if(source == UncSource::etau_ele && !isMuTau) {xTrg_scale = scale;}
-        const TH2* hist_xTrg = nullptr;
-
-        if (isMuTau) {
-            if (histo_muTau_mu_SF) {
-                hist_xTrg = histo_muTau_mu_SF.get();
-            }
-        } else {
-            if (histo_eTau_ele_SF) {
-                hist_xTrg = histo_eTau_ele_SF.get();
-            }
-        }
-        if (!hist_xTrg) {
+        const Grid2D& hist_xTrg = isMuTau ? histo_muTau_mu_SF : histo_eTau_ele_SF;
+        if (hist_xTrg.empty()) {
             return 1.0;
         }
-        const auto x_axis = hist_xTrg->GetXaxis();
-        int x_bin = x_axis->FindFixBin(leg_p4.Pt());
-        if(x_bin < 1)
-            x_bin =1;
-        if( x_bin > x_axis->GetNbins() )
-            x_bin = x_axis->GetNbins();
-        const auto y_axis = hist_xTrg->GetYaxis();
-
         auto eta_value = isMuTau ? std::abs(leg_p4.Eta()) : leg_p4.Eta();
-        int y_bin = y_axis->FindFixBin(eta_value);
-        if(y_bin < 1)
-            y_bin =1;
-        if( y_bin > y_axis->GetNbins() )
-            y_bin = y_axis->GetNbins();
+        return hist_xTrg.getValue(leg_p4.Pt(), eta_value, xTrg_scale);
+    }
 
-        return hist_xTrg->GetBinContent(x_bin,y_bin) + static_cast<int>(xTrg_scale) * hist_xTrg->GetBinError(x_bin,y_bin);
+private:
+    static Grid2D readGrid(TFile& file, const std::string& name)
+    {
+        std::unique_ptr<TH2> hist(root_ext::ReadCloneObject<TH2>(file, name, name, true));
+        return Grid2D(*hist);
     }
 
 private:
     std::unique_ptr<CorrectionSet> tau_corrections_;
-    Correction::Ref tau_trg_;
+    CachedCorrection tau_trg_;
     const std::string deepTauVersion_;
     const wpsMapType wps_map_;
     //std::unique_ptr<CorrectionSet> mu_corrections_;
-    Correction::Ref mu_trg_;
+    CachedCorrection mu_trg_;
     const std::string period_;
-    std::unique_ptr<TH2> histo_ele_SF;
-    std::unique_ptr<TH2> histo_eTau_ele_SF;
-    std::unique_ptr<TH2> histo_muTau_mu_SF;
-    std::unique_ptr<TH2> histo_mu_SF_24;
-    std::unique_ptr<TH2> histo_mu_SF_50or24;
-    std::unique_ptr<TH2> histo_mu_SF_50;
+    Grid2D histo_ele_SF;
+    Grid2D histo_eTau_ele_SF;
+    Grid2D histo_muTau_mu_SF;
+    Grid2D histo_mu_SF_24;
+    Grid2D histo_mu_SF_50or24;
+    Grid2D histo_mu_SF_50;
 
 } ;
 
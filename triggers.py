@@ -55,6 +55,26 @@ class TrigCorrProducer:
     deepTauVersion = 'DeepTau2017v2p1'
     SFSources = { 'ditau': [ "ditau_DM0","ditau_DM1", "ditau_3Prong"], 'singleMu':['singleMu24'], 'singleMu50':['singleMu50or24','singleMu50'],'singleTau':['singleTau'], 'singleEle':['singleEle'],'etau':['etau_ele',"etau_DM0","etau_DM1", "etau_3Prong",],'mutau':['mutau_mu',"mutau_DM0","mutau_DM1", "mutau_3Prong"]}
 
+    # Trigger SF table.
+    # apply_leg_type: leg type required to apply the SF of the trigger (any leg type if not given)
+    # apply_branch: name of the column that tells whether the SF is applied to the leg
+    # legs: for each leg, the backend used to look up the SF ('Tau': tau trigger SFs from correctionlib,
+    #       'RootFile': e/mu SFs from ROOT files, 'Constant': SFs from the dictionary given by 'values'),
+    #       the leg type required by the lookup and the isMuTau flag of the ROOT file lookup.
+    TrgSFTable = {
+        'ditau': { 'apply_leg_type': 'tau', 'apply_branch': '{trg}_tau{leg_num}_ApplyTrgSF',
+                   'legs': [ { 'backend': 'Tau' }, { 'backend': 'Tau' } ] },
+        'singleMu': { 'apply_leg_type': 'mu', 'legs': [ { 'backend': 'RootFile' }, { 'backend': 'RootFile' } ] },
+        'singleMu50': { 'apply_leg_type': 'mu', 'legs': [ { 'backend': 'RootFile' }, { 'backend': 'RootFile' } ] },
+        'singleEle': { 'apply_leg_type': 'e', 'legs': [ { 'backend': 'RootFile' }, { 'backend': 'RootFile' } ] },
+        'mutau': { 'legs': [ { 'backend': 'RootFile', 'leg_type': 'mu', 'isMuTau': True },
+                             { 'backend': 'Tau', 'leg_type': 'tau' } ] },
+        'etau': { 'legs': [ { 'backend': 'RootFile', 'leg_type': 'e', 'isMuTau': True },
+                            { 'backend': 'Tau', 'leg_type': 'tau' } ] },
+        'singleTau': { 'legs': [ { 'backend': 'Constant', 'leg_type': 'tau', 'values': 'singleTau_SF_dict' },
+                                 { 'backend': 'Constant', 'leg_type': 'tau', 'values': 'singleTau_SF_dict' } ] },
+    }
+
     muon_trg_dict = {
         "2018_UL": ROOT.std.vector('std::string')({"NUM_IsoMu24_DEN_CutBasedIdTight_and_PFIsoTight","NUM_IsoMu24_or_Mu50_DEN_CutBasedIdTight_and_PFIsoTight", "NUM_Mu50_or_OldMu100_or_TkMu100_DEN_CutBasedIdGlobalHighPt_and_TkIsoLoose"}),
 
@@ -106,7 +126,7 @@ class TrigCorrProducer:
         if not TrigCorrProducer.initialized:
             headers_dir = os.path.dirname(os.path.abspath(__file__))
             header_path = os.path.join(headers_dir, "triggers.h")
-            ROOT.gInterpreter.Declare(f'#include "{header_path}"')
+            declareHeaders(header_path, dependencies=[ common_headers ])
             wp_map_cpp = createWPChannelMap(config["deepTauWPs"])
             #print(wp_map_cpp)
             # "{self.muon_trg_dict[period]}",
@@ -115,220 +135,100 @@ class TrigCorrProducer:
             trigNames_mu_vec += """\", \"""".join(path for path in self.muon_trgHistNames_dict[period])
             trigNames_mu_vec += """\" } """
             #print(trigNames_mu_vec)
+            registerCorrectionLayouts(jsonFile_Tau)
             ROOT.gInterpreter.ProcessLine(f"""::correction::TrigCorrProvider::Initialize("{jsonFile_Tau}", "{self.deepTauVersion}", {wp_map_cpp}, "{jsonFile_Mu}", "{year}", {trigNames_mu_vec},"{jsonFile_e}","{jsonFile_e_XTrg}","{jsonFile_mu_XTrg}")""")
             TrigCorrProducer.initialized = True
 
+    def defineApplyTrgSF(self, df, applyTrgBranch_name, trg_name, leg_idx, leg_name, leg_type=None):
+        if PrecompiledDefines.enabled:
+            columns = [ 'HttCandidate_legs', f'HLT_{trg_name}', f'{leg_name}_HasMatching_{trg_name}' ]
+            functor_class = ROOT.correction.TrigCorrProvider.ApplyTrgSFFunctor[tuple(df.GetColumnType(c) for c in columns[1:])]
+            return defineColumn(df, applyTrgBranch_name, functor_class(getLegSelection(leg_idx, leg_type)), columns)
+        leg_cond = f"HttCandidate_legs[{leg_idx}].leg_type == Leg::{leg_type} && " if leg_type is not None else ""
+        return df.Define(applyTrgBranch_name, f"""{leg_cond}HLT_{trg_name} && {leg_name}_HasMatching_{trg_name}""")
+
+    def defineTrgSFTable(self, df, table_legs, need_variations):
+        table = ROOT.std.vector['::correction::TrigCorrProvider::TrgSFLeg']()
+        for trg_name, leg_idx, leg_name, leg_def, applyTrgBranch_name, sf_sources in table_legs:
+            backend = getattr(ROOT.correction.TrigCorrProvider.TrgSFBackend, leg_def['backend'])
+            table.push_back(ROOT.correction.TrigCorrProvider.TrgSFLeg(backend, trg_name,
+                            getLegSelection(leg_idx, leg_def.get('leg_type')),
+                            createUncSourceVector('TrigCorrProvider', sf_sources), leg_def.get('isMuTau', False)))
+        # the table columns are named after the legs they describe, so that getTrgSF can be called more than once
+        table_name = 'TrgSF_' + '_'.join(f'{leg_name}_{trg_name}' for trg_name, leg_idx, leg_name, *_ in table_legs)
+        apply_branches = [ table_leg[4] for table_leg in table_legs ]
+        df = df.Define(f'{table_name}_apply', f"RVecB({{ {', '.join(apply_branches)} }})")
+        df = defineColumn(df, f'{table_name}_variations',
+                          ROOT.correction.TrigCorrProvider.TrgSFTableFunctor(table, need_variations),
+                          [ 'HttCandidate_legs', f'{table_name}_apply' ])
+        for n, (trg_name, leg_idx, leg_name, leg_def, applyTrgBranch_name, sf_sources) in enumerate(table_legs):
+            variations_branch = f"{leg_name}_TrgSF_{trg_name}_variations"
+            if PrecompiledDefines.enabled:
+                df = defineColumn(df, variations_branch, ROOT.correction.TrigCorrProvider.TrgSFTableElement(n),
+                                  [ f'{table_name}_variations' ])
+            else:
+                df = df.Define(variations_branch, f"{table_name}_variations[{n}]")
+        return df
+
+    def defineConstantSF(self, df, branch_name, applyTrgBranch_name, leg_idx, leg_def, scale):
+        leg_cond = f" && HttCandidate_legs[{leg_idx}].leg_type == Leg::{leg_def['leg_type']}" if 'leg_type' in leg_def else ""
+        value_shifted = getattr(self, leg_def['values'])[self.period][scale]
+        return df.Define(branch_name,
+                f"""
+                if({applyTrgBranch_name}{leg_cond})
+                {{
+                    return {value_shifted};
+                }}
+                return 1.;""")
+
+    # All trigger SFs are described by TrgSFTable and the SFs of the legs that are looked up in correctionlib ('Tau')
+    # or in ROOT files ('RootFile') are evaluated together for each event by TrigCorrProvider::getTrgSFTableVariations.
+    # The SFs of the 'Constant' legs are taken from the dictionary given by 'values'.
     def getTrgSF(self, df, trigger_names, lepton_legs, return_variations, isCentral):
         SF_branches = []
-        trg_name = 'ditau'
-        if trg_name in trigger_names:
-            sf_sources = TrigCorrProducer.SFSources[trg_name] if return_variations else []
-            for leg_idx, leg_name in enumerate(lepton_legs):
-                applyTrgBranch_name = f"{trg_name}_tau{leg_idx+1}_ApplyTrgSF"
-                df = df.Define(applyTrgBranch_name, f"""HttCandidate.leg_type[{leg_idx}] == Leg::tau && HLT_{trg_name} && {leg_name}_HasMatching_{trg_name}""")
-                for source in [ central ] + sf_sources:
-                    for scale in getScales(source):
-                        if not isCentral and scale!= central: continue
-                        syst_name = getSystName(source, scale)
-                        suffix = syst_name
-                        if scale == central:
-                            suffix = f"{trg_name}_{syst_name}"
-                        branch_name = f"weight_{leg_name}_TrgSF_{suffix}"
-                        branch_central = f"weight_{leg_name}_TrgSF_{trg_name}_{getSystName(central,central)}"
-                        df = df.Define(f"{branch_name}_double",
-                                    f'''{applyTrgBranch_name} ? ::correction::TrigCorrProvider::getGlobal().getTauSF_fromCorrLib(
-                                 HttCandidate.leg_p4[{leg_idx}], Tau_decayMode.at(HttCandidate.leg_index[{leg_idx}]), "{trg_name}", HttCandidate.channel(),
-                                ::correction::TrigCorrProvider::UncSource::{source}, ::correction::UncScale::{scale} ) : 1.f''')
-                        if scale != central:
-                            df = df.Define(f"{branch_name}_rel", f"static_cast<float>({branch_name}_double/{branch_central})")
-                            branch_name += '_rel'
-                        else:
-                            df = df.Define(f"{branch_name}", f"static_cast<float>({branch_name}_double)")
-                        SF_branches.append(f"{branch_name}")
-
-        trg_name = 'singleMu'
-        if trg_name in trigger_names:
-            sf_sources = TrigCorrProducer.SFSources[trg_name] if return_variations else []
-            for leg_idx, leg_name in enumerate(lepton_legs):
-                applyTrgBranch_name = f"{trg_name}_{leg_name}_ApplyTrgSF"
-                df = df.Define(applyTrgBranch_name, f"""HttCandidate.leg_type[{leg_idx}] == Leg::mu && HLT_{trg_name} && {leg_name}_HasMatching_{trg_name}""")
-                for source in [ central ] + sf_sources:
-                    for scale in getScales(source):
-                        if not isCentral and scale!= central: continue
-                        syst_name = getSystName(source, scale)
-                        suffix = syst_name
-                        if scale == central:
-                            suffix = f"{trg_name}_{syst_name}"
-                        branch_name = f"weight_{leg_name}_TrgSF_{suffix}"
-                        branch_central = f"weight_{leg_name}_TrgSF_{trg_name}_{getSystName(central,central)}"
-                        df = df.Define(f"{branch_name}_double",
-                                    f'''{applyTrgBranch_name} ? ::correction::TrigCorrProvider::getGlobal().getSF_fromRootFile(
-                                 HttCandidate.leg_p4[{leg_idx}],::correction::TrigCorrProvider::UncSource::{source}, ::correction::UncScale::{scale} ) : 1.f''')
-                        if scale != central:
-                            df = df.Define(f"{branch_name}_rel", f"static_cast<float>({branch_name}_double/{branch_central})")
-                            branch_name += '_rel'
-                        else:
-                            df = df.Define(f"{branch_name}", f"static_cast<float>({branch_name}_double)")
-                        SF_branches.append(f"{branch_name}")
-
-        trg_name = 'singleMu50'
-        if trg_name in trigger_names:
-            sf_sources = TrigCorrProducer.SFSources[trg_name] if return_variations else []
-            for leg_idx, leg_name in enumerate(lepton_legs):
-                applyTrgBranch_name = f"{trg_name}_{leg_name}_ApplyTrgSF"
-                df = df.Define(applyTrgBranch_name, f"""HttCandidate.leg_type[{leg_idx}] == Leg::mu && HLT_{trg_name} && {leg_name}_HasMatching_{trg_name}""")
-                for source in [ central ] + sf_sources:
-                    for scale in getScales(source):
-                        if not isCentral and scale!= central: continue
-                        syst_name = getSystName(source, scale)
-                        suffix = syst_name
-                        if scale == central:
-                            suffix = f"{trg_name}_{syst_name}"
-                        branch_name = f"weight_{leg_name}_TrgSF_{suffix}"
-                        branch_central = f"weight_{leg_name}_TrgSF_{trg_name}_{getSystName(central,central)}"
-                        df = df.Define(f"{branch_name}_double",
-                                    f'''{applyTrgBranch_name} ? ::correction::TrigCorrProvider::getGlobal().getSF_fromRootFile(
-                                 HttCandidate.leg_p4[{leg_idx}],::correction::TrigCorrProvider::UncSource::{source}, ::correction::UncScale::{scale} ) : 1.f''')
-                        if scale != central:
-                            df = df.Define(f"{branch_name}_rel", f"static_cast<float>({branch_name}_double/{branch_central})")
-                            branch_name += '_rel'
-                        else:
-                            df = df.Define(f"{branch_name}", f"static_cast<float>({branch_name}_double)")
-                        SF_branches.append(f"{branch_name}")
-        trg_name = 'singleEle'
-        if trg_name in trigger_names:
-            sf_sources = TrigCorrProducer.SFSources[trg_name] if return_variations else []
-            for leg_idx, leg_name in enumerate(lepton_legs):
-                applyTrgBranch_name = f"{trg_name}_{leg_name}_ApplyTrgSF"
-                df = df.Define(applyTrgBranch_name, f"""HttCandidate.leg_type[{leg_idx}] == Leg::e && HLT_{trg_name} && {leg_name}_HasMatching_{trg_name}""")
-                for source in [ central ] + sf_sources:
-                    for scale in getScales(source):
-                        if not isCentral and scale!= central: continue
-                        syst_name = getSystName(source, scale)
-                        suffix = syst_name
-                        if scale == central:
-                            suffix = f"{trg_name}_{syst_name}"
-                        branch_name = f"weight_{leg_name}_TrgSF_{suffix}"
-                        branch_central = f"weight_{leg_name}_TrgSF_{trg_name}_{getSystName(central,central)}"
-                        df = df.Define(f"{branch_name}_double",
-                                    f'''{applyTrgBranch_name} ? ::correction::TrigCorrProvider::getGlobal().getSF_fromRootFile(
-                                 HttCandidate.leg_p4[{leg_idx}],::correction::TrigCorrProvider::UncSource::{source}, ::correction::UncScale::{scale} ) : 1.f''')
-                        if scale != central:
-                            df = df.Define(f"{branch_name}_rel", f"static_cast<float>({branch_name}_double/{branch_central})")
-                            branch_name += '_rel'
-                        else:
-                            df = df.Define(f"{branch_name}", f"static_cast<float>({branch_name}_double)")
-                        SF_branches.append(f"{branch_name}")
-
-        trg_name = 'mutau'
-        if trg_name in trigger_names:
-            sf_sources = TrigCorrProducer.SFSources[trg_name] if return_variations else []
-            for leg_idx, leg_name in enumerate(lepton_legs):
-                applyTrgBranch_name = f"{trg_name}_{leg_name}_ApplyTrgSF"
-                df = df.Define(applyTrgBranch_name, f"""HLT_{trg_name} && {leg_name}_HasMatching_{trg_name}""")
-                for source in [ central ] + sf_sources:
-                    for scale in getScales(source):
-                        if not isCentral and scale!= central: continue
-                        syst_name = getSystName(source, scale)
-                        suffix = syst_name
-                        if scale == central:
-                            suffix = f"{trg_name}_{syst_name}"
-                        branch_name = f"weight_{leg_name}_TrgSF_{suffix}"
-                        branch_central = f"weight_{leg_name}_TrgSF_{trg_name}_{getSystName(central,central)}"
-                        if leg_idx == 0:
-                            df = df.Define(f"{branch_name}_double",
-                                    f'''
-                                    if({applyTrgBranch_name} && HttCandidate.leg_type[{leg_idx}] == Leg::mu)
-                                    {{
-                                        return ::correction::TrigCorrProvider::getGlobal().getSF_fromRootFile(HttCandidate.leg_p4[{leg_idx}], ::correction::TrigCorrProvider::UncSource::{source},::correction::UncScale::{scale}, true);
-                                    }}
-                                    return 1.f;''')
-                        elif leg_idx ==1:
-                            df = df.Define(f"{branch_name}_double",
-                                f'''
-                                if({applyTrgBranch_name} && HttCandidate.leg_type[{leg_idx}] == Leg::tau)
-                                {{
-                                    return ::correction::TrigCorrProvider::getGlobal().getTauSF_fromCorrLib(
-                                    HttCandidate.leg_p4[{leg_idx}], Tau_decayMode.at(HttCandidate.leg_index[{leg_idx}]), "{trg_name}", HttCandidate.channel(), ::correction::TrigCorrProvider::UncSource::{source}, ::correction::UncScale::{scale} );
-                                }}
-                                return 1.f;''')
-                        else:
-                            print("not known leg")
-                        if scale != central:
-                            df = df.Define(f"{branch_name}_rel", f"static_cast<float>({branch_name}_double/{branch_central})")
-                            branch_name += '_rel'
-                        else:
-                            df = df.Define(f"{branch_name}", f"static_cast<float>({branch_name}_double)")
-                        SF_branches.append(f"{branch_name}")
-
-        trg_name = 'etau'
-        if trg_name in trigger_names:
-            sf_sources = TrigCorrProducer.SFSources[trg_name] if return_variations else []
-            for leg_idx, leg_name in enumerate(lepton_legs):
-                applyTrgBranch_name = f"{trg_name}_{leg_name}_ApplyTrgSF"
-                df = df.Define(applyTrgBranch_name, f"""HLT_{trg_name} && {leg_name}_HasMatching_{trg_name}""")
-                for source in [ central ] + sf_sources:
-                    for scale in getScales(source):
-                        if not isCentral and scale!= central: continue
-                        syst_name = getSystName(source, scale)
-                        suffix = syst_name
-                        if scale == central:
-                            suffix = f"{trg_name}_{syst_name}"
-                        branch_name = f"weight_{leg_name}_TrgSF_{suffix}"
-                        branch_central = f"weight_{leg_name}_TrgSF_{trg_name}_{getSystName(central,central)}"
-                        if leg_idx == 0:
-                            df = df.Define(f"{branch_name}_double",
-                                    f'''
-                                    if({applyTrgBranch_name} && HttCandidate.leg_type[{leg_idx}] == Leg::e)
-                                    {{
-                                        return ::correction::TrigCorrProvider::getGlobal().getSF_fromRootFile(HttCandidate.leg_p4[{leg_idx}], ::correction::TrigCorrProvider::UncSource::{source},::correction::UncScale::{scale}, true);
-                                    }}
-                                    return 1.f;''')
-                        elif leg_idx ==1:
-                            df = df.Define(f"{branch_name}_double",
-                                f'''
-                                if({applyTrgBranch_name} && HttCandidate.leg_type[{leg_idx}] == Leg::tau)
-                                {{
-                                    return ::correction::TrigCorrProvider::getGlobal().getTauSF_fromCorrLib(
-                                    HttCandidate.leg_p4[{leg_idx}], Tau_decayMode.at(HttCandidate.leg_index[{leg_idx}]), "{trg_name}", HttCandidate.channel(), ::correction::TrigCorrProvider::UncSource::{source}, ::correction::UncScale::{scale} );
-                                }}
-                                return 1.f;''')
-                        else:
-                            print("not known leg")
-                        if scale != central:
-                            df = df.Define(f"{branch_name}_rel", f"static_cast<float>({branch_name}_double/{branch_central})")
-                            branch_name += '_rel'
-                        else:
-                            df = df.Define(f"{branch_name}", f"static_cast<float>({branch_name}_double)")
-                        SF_branches.append(f"{branch_name}")
-
-        trg_name = 'singleTau'
-        if trg_name in trigger_names:
+        need_variations = isCentral and return_variations
+        table_legs = []
+        df = defineCandidateLegs(df)
+        for trg_name, trg_def in TrigCorrProducer.TrgSFTable.items():
+            if trg_name not in trigger_names: continue
             sf_sources = TrigCorrProducer.SFSources[trg_name] if return_variations else []
             for leg_idx, leg_name in enumerate(lepton_legs):
-                applyTrgBranch_name = f"{trg_name}_{leg_name}_ApplyTrgSF"
-                df = df.Define(applyTrgBranch_name, f"""HLT_{trg_name} && {leg_name}_HasMatching_{trg_name}""")
-                for source in [ central ] + sf_sources:
-                    for scale in getScales(source):
-                        if not isCentral and scale!= central: continue
-                        syst_name = getSystName(source, scale)
-                        suffix = syst_name
-                        if scale == central:
-                            suffix = f"{trg_name}_{syst_name}"
-                        branch_name = f"weight_{leg_name}_TrgSF_{suffix}"
-                        branch_central = f"weight_{leg_name}_TrgSF_{trg_name}_{getSystName(central,central)}"
-                        value_shifted = self.singleTau_SF_dict[self.period][scale]
-                        df = df.Define(f"{branch_name}_double",
-                                f"""
-                                if({applyTrgBranch_name} && HttCandidate.leg_type[{leg_idx}] == Leg::tau)
-                                {{
-                                    return {value_shifted};
-                                }}
-                                return 1.;""")
+                applyTrgBranch_name = trg_def.get('apply_branch', '{trg}_{leg}_ApplyTrgSF').format(
+                    trg=trg_name, leg=leg_name, leg_num=leg_idx+1)
+                if leg_idx >= len(trg_def['legs']):
+                    raise RuntimeError(f"getTrgSF: leg {leg_idx} ({leg_name}) is not known for trigger {trg_name}")
+                df = self.defineApplyTrgSF(df, applyTrgBranch_name, trg_name, leg_idx, leg_name, trg_def.get('apply_leg_type'))
+                table_legs.append((trg_name, leg_idx, leg_name, trg_def['legs'][leg_idx], applyTrgBranch_name, sf_sources))
+
+        lookup_legs = [ table_leg for table_leg in table_legs if table_leg[3]['backend'] != 'Constant' ]
+        if len(lookup_legs) > 0:
+            df = self.defineTrgSFTable(df, lookup_legs, need_variations)
+
+        for trg_name, leg_idx, leg_name, leg_def, applyTrgBranch_name, sf_sources in table_legs:
+            variations_branch = f"{leg_name}_TrgSF_{trg_name}_variations"
+            for source in [ central ] + sf_sources:
+                for scale in getScales(source):
+                    if not isCentral and scale!= central: continue
+                    syst_name = getSystName(source, scale)
+                    suffix = syst_name
+                    if scale == central:
+                        suffix = f"{trg_name}_{syst_name}"
+                    branch_name = f"weight_{leg_name}_TrgSF_{suffix}"
+                    branch_central = f"weight_{leg_name}_TrgSF_{trg_name}_{getSystName(central,central)}"
+                    if leg_def['backend'] == 'Constant':
+                        df = self.defineConstantSF(df, f"{branch_name}_double", applyTrgBranch_name, leg_idx, leg_def, scale)
                         if scale != central:
                             df = df.Define(f"{branch_name}_rel", f"static_cast<float>({branch_name}_double/{branch_central})")
                             branch_name += '_rel'
                         else:
                             df = df.Define(f"{branch_name}", f"static_cast<float>({branch_name}_double)")
                         SF_branches.append(f"{branch_name}")
-        return df,SF_branches
\ No newline at end of file
+                        continue
+                    df = defineSFVariation(df, f"{branch_name}_double", variations_branch, 'TrigCorrProvider', source, scale)
+                    if scale != central:
+                        df = defineRelative(df, f"{branch_name}_rel", f"{branch_name}_double", branch_central)
+                        branch_name += '_rel'
+                    else:
+                        df = defineFloat(df, f"{branch_name}", f"{branch_name}_double")
+                    SF_branches.append(f"{branch_name}")
+        return df,SF_branches